@@ -12,6 +12,7 @@ import base64
 import copy
 import datetime
 import gzip
+import hashlib
 import io
 import json
 import math
@@ -22,11 +23,12 @@ import re
 import shutil
 import signal
 import sys
+import tempfile
 import time
 import warnings
 from dataclasses import dataclass, field
 from typing import Any, Iterator
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
@@ -59,7 +61,8 @@ except ImportError:
     DYNESTY_FOUND = False
 
 from wmpl.MetSim.GUI import FragmentationEntry, SimulationResults, loadConstants, saveConstants
-from wmpl.MetSim.MetSimErosion import Constants, runSimulation, zenithAngleAtSimulationBegin
+from wmpl.MetSim.MetSimErosion import Constants, ObservationEnvelope, runSimulation, runSimulationCompiled, \
+    zenithAngleAtSimulationBegin
 from wmpl.MetSim.ML.GenerateSimulations import MetParam, generateErosionSim, saveProcessedList
 from wmpl.Utils.Math import lineFunc, meanAngle, mergeClosePoints
 from wmpl.Utils.Physics import calcMass, dynamicPressure, calcRadiatedEnergy
@@ -788,8 +791,10 @@ def plotSimVsObsResiduals(obs_data, sim_data=None, output_folder='', file_name='
 # ---- globals for worker processes ----
 _GLOBALS = {}
 
-def _init_worker(obs_data, variables, flags_dict, fixed_values, align_height):
+def _init_worker(obs_data, variables, flags_dict, fixed_values, align_height, sim_cache=None):
     # set once per process to avoid re-pickling per task
+    if sim_cache is not None:
+        setSimulationCache(sim_cache)
     _GLOBALS['obs_data'] = obs_data
     _GLOBALS['variables'] = variables
     _GLOBALS['flags_dict'] = flags_dict
@@ -1096,11 +1101,12 @@ def posteriorBandsVsHeightParallel(
     try:
         ctx = multiprocessing.get_context("spawn")  # Windows-safe
         print(f"[{file_name}] Running {S} simulations with {n_workers} workers...", flush=True)
-        with ProcessPoolExecutor(
+        # the observations are shared with the workers as read-only memory-mapped arrays
+        with ObservationBundle(obs_data) as obs_shared, ProcessPoolExecutor(
             max_workers=n_workers,
             mp_context=ctx,
             initializer=_init_worker,
-            initargs=(obs_data, variables, flags_dict, fixed_values, align_height),
+            initargs=(obs_shared, variables, flags_dict, fixed_values, align_height, SIMULATION_CACHE),
         ) as ex:
             # submit and keep a map to their sample index
             future_to_idx = {
@@ -1906,6 +1912,12 @@ def plotDynestyResults(dynesty_run_results, obs_data, flags_dict, fixed_values,
     best_guess_logL = logLikelihoodDynesty(dynesty_run_results_new.samples[sim_num], obs_data, flags_dict, fixed_values, timeout=20)
     print('logL:', best_guess_logL, ' dynesty logL:', dynesty_run_results.logl[sim_num])
 
+    # The likelihood doesn't modify the observations, so set the best fit noise used for the plots here
+    if 'noise_lag' in variables:
+        obs_data.noise_lag = best_guess[variables.index('noise_lag')]
+    if 'noise_lum' in variables:
+        obs_data.noise_lum = best_guess[variables.index('noise_lum')]
+
     real_logL = None
     diff_logL = None
     if hasattr(obs_data, 'const'):
@@ -2212,15 +2224,15 @@ def plotDynestyResults(dynesty_run_results, obs_data, flags_dict, fixed_values,
 
     ### PLOT JSON DATA VS OBS ###
 
-    # check if dynesty_run_results_new.samples[sim_num] or fixed_values have noise_lag or noise_lum
+    # check if best_guess or fixed_values have noise_lag or noise_lum
     if 'noise_lag' in variables:
-        best_noise_lag = dynesty_run_results_new.samples[sim_num][variables.index('noise_lag')]
+        best_noise_lag = best_guess[variables.index('noise_lag')]
     elif 'noise_lag' in fixed_values.keys():
         best_noise_lag = fixed_values['noise_lag']
     else:
         print('No noise_lag found in variables or fixed_values')
     if 'noise_lum' in variables:
-        best_noise_lum = dynesty_run_results_new.samples[sim_num][variables.index('noise_lum')]
+        best_noise_lum = best_guess[variables.index('noise_lum')]
     elif 'noise_lum' in fixed_values.keys():
         best_noise_lum = fixed_values['noise_lum']
     else:
@@ -4672,6 +4684,118 @@ class ObservationData:
 
 
 
+class ObservationBundle(object):
+    """ Read-only copy of the observation data which is shared between worker processes without copying.
+
+    The numeric arrays of the observation object are written once to .npy files (in /dev/shm if available,
+    i.e. in memory) and all processes memory-map them read-only, so the OS shares the same pages between
+    the workers. When the bundle is pickled (e.g. sent to a worker pool), only the directory path and the
+    scalar attributes are sent. All attributes are accessed the same way as on the ObservationData object.
+
+    The directory is removed by the process which created the bundle when close() is called (or at the end
+    of the with block). Because the data is in the local file system, the bundle can't be used to share data
+    between MPI nodes.
+
+    Arguments:
+        obs_data: [object] Observation object (e.g. ObservationData).
+
+    Keyword arguments:
+        dir_path: [str] Directory in which the shared directory will be created. None by default, in which
+            case /dev/shm is used if available, otherwise the system temporary directory.
+
+    """
+
+    def __init__(self, obs_data, dir_path=None):
+
+        # Use memory backed storage if it's available
+        if dir_path is None:
+            if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+                dir_path = '/dev/shm'
+
+        object.__setattr__(self, 'dir_path', tempfile.mkdtemp(prefix='wmpl_obs_', dir=dir_path))
+        object.__setattr__(self, 'owner_pid', os.getpid())
+
+        array_names = []
+        scalars = {}
+
+        for name, value in obs_data.__dict__.items():
+
+            # Store numeric arrays in shared files, everything else is sent with the bundle
+            if isinstance(value, np.ndarray) and (value.dtype.kind in 'biufc') and (value.size > 0):
+                np.save(os.path.join(self.dir_path, name + '.npy'), np.ascontiguousarray(value))
+                array_names.append(name)
+            else:
+                scalars[name] = value
+
+        object.__setattr__(self, 'array_names', array_names)
+        object.__setattr__(self, 'scalars', scalars)
+
+        self._attach()
+
+
+    def _attach(self):
+        """ Memory-map the shared arrays (read-only). """
+
+        arrays = {}
+        for name in self.array_names:
+            arrays[name] = np.load(os.path.join(self.dir_path, name + '.npy'), mmap_mode='r')
+
+        object.__setattr__(self, 'arrays', arrays)
+
+
+    def __getattr__(self, name):
+
+        # Only called if the attribute was not found in the usual places
+        arrays = self.__dict__.get('arrays', {})
+        if name in arrays:
+            return arrays[name]
+
+        scalars = self.__dict__.get('scalars', {})
+        if name in scalars:
+            return scalars[name]
+
+        raise AttributeError("'ObservationBundle' object has no attribute '{:s}'".format(name))
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ObservationBundle is read-only, can't set '{:s}'".format(name))
+
+
+    def __getstate__(self):
+
+        # Only send the location of the arrays, not the data
+        return {'dir_path': self.dir_path, 'owner_pid': self.owner_pid, 'array_names': self.array_names,
+            'scalars': self.scalars}
+
+
+    def __setstate__(self, state):
+
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+        self._attach()
+
+
+    def close(self):
+        """ Remove the shared files (only done by the process which created the bundle). """
+
+        if os.getpid() != self.owner_pid:
+            return None
+
+        object.__setattr__(self, 'arrays', {})
+        shutil.rmtree(self.dir_path, ignore_errors=True)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+
+
 ###############################################################################
 # find dynestyfile and priors
 ###############################################################################
@@ -5844,7 +5968,241 @@ def constructConstants(parameter_guess, real_event, var_names, fix_var, dir_path
 
     return const_nominal
 
-def runSimulationDynesty(parameter_guess, real_event, var_names, fix_var):
+class SimulationCache(object):
+    def __init__(self, max_entries=0, disk_dir=None, precision=10, max_disk_bytes=1024**3):
+        """ Content-addressed cache of MetSim simulations run by runSimulationDynesty. The simulations are 
+            keyed by the rounded parameter vector, the fixed values and a hash of the observation properties
+            used to build the constants. The results are optionally kept in memory with LRU eviction, and 
+            optionally stored on disk so they can be shared between processes and runs. The disk store is 
+            limited in size, the least recently used simulations are removed when it grows over the limit.
+
+        Keyword arguments:
+            max_entries: [int] Maximum number of simulations kept in memory. 0 by default, in which case the 
+                memory cache is disabled. During the nested sampling the parameters are almost never repeated,
+                so the memory cache only pays off when the same simulations are rerun (e.g. for plotting).
+            disk_dir: [str] Directory where the simulations are stored. None by default, in which case only
+                the memory cache is used.
+            precision: [int] Number of significant digits of the parameters used in the key. 10 by default.
+            max_disk_bytes: [int] Maximum size of the disk store in bytes. 1 GB by default.
+        """
+
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.precision = precision
+        self.max_disk_bytes = max_disk_bytes
+
+        # Bytes written to the disk store since it was last pruned. The store is pruned on the first write and
+        #   then every time a tenth of the limit is written, so the directory isn't scanned on every write
+        self.disk_bytes_written = None
+
+        # Set when a write to the disk store fails, so the warning is only printed once
+        self.disk_write_failed = False
+
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        if self.disk_dir is not None:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+
+    def __getstate__(self):
+        """ Don't send the memory cache to other processes. """
+
+        state = self.__dict__.copy()
+        state['entries'] = OrderedDict()
+
+        return state
+
+
+    def key(self, parameter_guess, real_event, var_names, fix_var):
+        """ Compute the cache key for the given simulation inputs (see runSimulationDynesty). """
+
+        # Hash the observation properties which are used to construct the constants
+        obs_hash = hashlib.sha1(np.asarray(real_event.dens_co, dtype=np.float64).tobytes())
+        obs_hash.update(repr([real_event.dt, real_event.P_0m, real_event.disruption_on, real_event.lum_eff_type,
+            real_event.h_kill, real_event.v_kill]).encode())
+
+        params = ["{:.{:d}e}".format(float(value), self.precision - 1) for value in parameter_guess]
+        fixed = sorted((name, repr(fix_var[name])) for name in fix_var)
+
+        return hashlib.sha1(repr((list(var_names), params, fixed, obs_hash.hexdigest())).encode()).hexdigest()
+
+
+    def diskPath(self, key):
+        return os.path.join(self.disk_dir, key + ".pickle")
+
+
+    def get(self, key):
+        """ Return the cached (const, frag_main, results) or None if the simulation is not in the cache. """
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if (self.disk_dir is not None) and os.path.isfile(self.diskPath(key)):
+            try:
+                with open(self.diskPath(key), 'rb') as f:
+                    entry = pickle.load(f)
+
+            # The file might be incomplete or written by an incompatible version
+            except Exception:
+                entry = None
+
+            if entry is not None:
+                self.hits += 1
+                self.putMemory(key, entry)
+
+                # Mark the file as recently used, the store is pruned by the modification time
+                try:
+                    os.utime(self.diskPath(key))
+                except OSError:
+                    pass
+
+                return entry
+
+        self.misses += 1
+
+        return None
+
+
+    def putMemory(self, key, entry):
+
+        if self.max_entries <= 0:
+            return
+
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+    def put(self, key, simulation_results):
+        """ Store the simulation (a SimulationResults object) in the cache. """
+
+        results = np.c_[simulation_results.time_arr, simulation_results.luminosity_arr, 
+            simulation_results.luminosity_main_arr, simulation_results.luminosity_eroded_arr, 
+            simulation_results.electron_density_total_arr, simulation_results.tau_total_arr, 
+            simulation_results.tau_main_arr, simulation_results.tau_eroded_arr, 
+            simulation_results.brightest_height_arr, simulation_results.brightest_length_arr, 
+            simulation_results.brightest_vel_arr, simulation_results.leading_frag_height_arr, 
+            simulation_results.leading_frag_length_arr, simulation_results.leading_frag_vel_arr, 
+            simulation_results.leading_frag_dyn_press_arr, simulation_results.mass_total_active_arr, 
+            simulation_results.main_mass_arr, simulation_results.main_height_arr, 
+            simulation_results.main_length_arr, simulation_results.main_vel_arr, 
+            simulation_results.main_dyn_press_arr]
+
+        # Copy the constants and the main fragment, so later changes of the results don't change the cache
+        if self.max_entries > 0:
+            entry = (copy.deepcopy(simulation_results.const), copy.deepcopy(simulation_results.frag_main), 
+                results)
+            self.putMemory(key, entry)
+
+        else:
+            entry = (simulation_results.const, simulation_results.frag_main, results)
+
+        # Write the file atomically, so other processes never read an incomplete file
+        if self.disk_dir is not None:
+
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.diskPath(key))
+
+            # The cache is only an optimization, so a full or read-only disk doesn't stop the run
+            except OSError as e:
+
+                if (tmp_path is not None) and os.path.isfile(tmp_path):
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+
+                if not self.disk_write_failed:
+                    print("Warning: the simulation could not be stored in the cache directory {:s}: {:s}".format(
+                        self.disk_dir, str(e)))
+                    self.disk_write_failed = True
+
+                return
+
+            # Prune the store when enough data was written
+            file_size = os.path.getsize(self.diskPath(key)) if os.path.isfile(self.diskPath(key)) else 0
+            if (self.disk_bytes_written is None) or (self.disk_bytes_written + file_size 
+                    > self.max_disk_bytes/10):
+                self.pruneDisk()
+            else:
+                self.disk_bytes_written += file_size
+
+
+    def pruneDisk(self, stale_tmp_age=3600):
+        """ Remove the least recently used simulations from the disk store until it is under 90% of the size
+            limit. Temporary files left behind by interrupted writes are removed as well.
+
+        Keyword arguments:
+            stale_tmp_age: [float] Age in seconds after which temporary files are removed. 1 hour by default.
+        """
+
+        self.disk_bytes_written = 0
+
+        files = []
+        total_size = 0
+        for dir_entry in os.scandir(self.disk_dir):
+
+            try:
+                stat = dir_entry.stat()
+            except OSError:
+                continue
+
+            if dir_entry.name.endswith(".tmp"):
+                if time.time() - stat.st_mtime > stale_tmp_age:
+                    try:
+                        os.remove(dir_entry.path)
+                    except OSError:
+                        pass
+                continue
+
+            if not dir_entry.name.endswith(".pickle"):
+                continue
+
+            files.append((stat.st_mtime, stat.st_size, dir_entry.path))
+            total_size += stat.st_size
+
+        if total_size <= self.max_disk_bytes:
+            return
+
+        # Remove the oldest files first. Other processes sharing the store might remove the same files
+        for _, file_size, file_path in sorted(files):
+
+            if total_size <= 0.9*self.max_disk_bytes:
+                break
+
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+            total_size -= file_size
+
+
+
+# Cache used by runSimulationDynesty, disabled by default (see setSimulationCache)
+SIMULATION_CACHE = None
+
+
+def setSimulationCache(cache):
+    """ Set the simulation cache used by runSimulationDynesty (None disables caching). """
+
+    global SIMULATION_CACHE
+    SIMULATION_CACHE = cache
+
+
+
+def runSimulationDynesty(parameter_guess, real_event, var_names, fix_var, terminate=None):
     """ Run the MetSim simulation with the given parameters.
 
     Arguments:
@@ -5853,17 +6211,46 @@ def runSimulationDynesty(parameter_guess, real_event, var_names, fix_var):
         var_names: [list] List of variable names corresponding to `parameter_guess`.
         fix_var: [dict] Dictionary of fixed variables.
 
+    Keyword arguments:
+        terminate: [callable] Termination predicate passed to the simulation (e.g. ObservationEnvelope). If
+            the simulation is stopped early, the reason is in const.abort_reason of the results. None by 
+            default.
+
+    If a cache is set with setSimulationCache, simulations which ran to the end are stored in it and reused 
+    when the same parameters are simulated again.
+
     Return:
         simulation_MetSim_object: [object] SimulationResults object containing the simulation results.
 
     """
 
+    # Check if this simulation was already run
+    cache_key = None
+    if SIMULATION_CACHE is not None:
+        cache_key = SIMULATION_CACHE.key(parameter_guess, real_event, var_names, fix_var)
+        cache_entry = SIMULATION_CACHE.get(cache_key)
+
+        if cache_entry is not None:
+            const_cached, frag_main, results = cache_entry
+            simulation_MetSim_object = SimulationResults(const_cached, frag_main, results, [None]*len(results))
+
+            # Apply the termination predicate to the cached results
+            if terminate is not None:
+                for i, results_row in enumerate(results):
+                    simulation_MetSim_object.const.abort_reason = terminate(results_row, \
+                        int(i < len(results) - 1))
+                    if simulation_MetSim_object.const.abort_reason is not None:
+                        break
+
+            return simulation_MetSim_object
+
     # build the const to run the 
     const_nominal = constructConstants(parameter_guess, real_event, var_names, fix_var)
 
     try:
-        # Run the simulation
-        frag_main, results_list, wake_results = runSimulation(const_nominal, compute_wake=False)
+        # Run the simulation (with the compiled kernel, falls back to Python if it is not available)
+        frag_main, results_list, wake_results = runSimulationCompiled(const_nominal, compute_wake=False, \
+            terminate=terminate)
         simulation_MetSim_object = SimulationResults(const_nominal, frag_main, results_list, wake_results)
     except ZeroDivisionError as e:
         print(f"Error during simulation: {e}")
@@ -5873,6 +6260,10 @@ def runSimulationDynesty(parameter_guess, real_event, var_names, fix_var):
         frag_main, results_list, wake_results = runSimulation(const_nominal, compute_wake=False)
         simulation_MetSim_object = SimulationResults(const_nominal, frag_main, results_list, wake_results)
 
+    # Only store simulations which ran to the end
+    if (cache_key is not None) and (getattr(simulation_MetSim_object.const, 'abort_reason', None) is None):
+        SIMULATION_CACHE.put(cache_key, simulation_MetSim_object)
+
     return simulation_MetSim_object
 
 def addFragToConst(const_nominal, var_frag_dic):
@@ -6053,7 +6444,7 @@ def addFragToConst(const_nominal, var_frag_dic):
 # Function: dynesty
 ###############################################################################
 
-def logLikelihoodDynesty(guess_var, obs_metsim_obj, flags_dict, fix_var, timeout=20):
+def logLikelihoodDynesty(guess_var, obs_metsim_obj, flags_dict, fix_var, timeout=20, lum_envelope_factor=1000):
     """ Calculate the log-likelihood for Dynesty.
 
     Arguments:
@@ -6064,6 +6455,8 @@ def logLikelihoodDynesty(guess_var, obs_metsim_obj, flags_dict, fix_var, timeout
 
     Keyword arguments:
         timeout: [int] Timeout in seconds for the simulation. 20 by default.
+        lum_envelope_factor: [float] Simulations brighter than the brightest observed point times this 
+            factor are stopped early and rejected. 1000 by default.
 
     Return:
         log_likelihood: [float] Calculated log-likelihood (or -np.inf if invalid/timeout).
@@ -6071,14 +6464,21 @@ def logLikelihoodDynesty(guess_var, obs_metsim_obj, flags_dict, fix_var, timeout
     """
 
     var_names = list(flags_dict.keys())
+
+    # Work on a copy of the sample and keep the noise locally, the observation object is shared between all
+    #   calls (and worker processes) and must not be modified
+    guess_var = np.array(guess_var, dtype=np.float64)
+    noise_lag = obs_metsim_obj.noise_lag
+    noise_lum = obs_metsim_obj.noise_lum
+
     # check for each var_name in flags_dict if there is "log" in the flags_dict
     for i, var_name in enumerate(var_names):
         if 'log' in flags_dict[var_name]:
             guess_var[i] = 10 ** guess_var[i]
         if var_name == 'noise_lag':
-            obs_metsim_obj.noise_lag = guess_var[i]
+            noise_lag = guess_var[i]
         if var_name == 'noise_lum':
-            obs_metsim_obj.noise_lum = guess_var[i]
+            noise_lum = guess_var[i]
 
     # check if among the var_names there is a "erosion_mass_max" and if there is a "erosion_mass_min"
     if 'erosion_mass_max' in var_names and 'erosion_mass_min' in var_names:
@@ -6107,24 +6507,36 @@ def logLikelihoodDynesty(guess_var, obs_metsim_obj, flags_dict, fix_var, timeout
         if guess_var[var_names.index('rho')] > guess_var[var_names.index('erosion_rho_change')]:
             return -np.inf
 
+    # Stop simulations early if they can't match the observations (too bright, ending above the lowest 
+    #   observed point, or running longer than the timeout)
+    envelope = ObservationEnvelope(np.nanmin(np.concatenate([obs_metsim_obj.height_lum, \
+        obs_metsim_obj.height_lag])), lum_max=lum_envelope_factor*np.nanmax(obs_metsim_obj.luminosity), \
+        wall_time_max=timeout)
+
     ### ONLY on LINUX ###
 
     # check if the OS is not Linux
     if os.name != 'posix':
         # If not Linux, run the simulation without timeout
-        simulation_results = runSimulationDynesty(guess_var, obs_metsim_obj, var_names, fix_var)
+        simulation_results = runSimulationDynesty(guess_var, obs_metsim_obj, var_names, fix_var, \
+            terminate=envelope)
     else:
         # Set timeout handler
         signal.signal(signal.SIGALRM, timeout_handler)
         signal.alarm(timeout)  # Start the timer for timeout
         # get simulated LC intensity onthe object
         try: # try to run the simulation
-            simulation_results = runSimulationDynesty(guess_var, obs_metsim_obj, var_names, fix_var)
+            simulation_results = runSimulationDynesty(guess_var, obs_metsim_obj, var_names, fix_var, \
+                terminate=envelope)
         except TimeoutException:
             print('timeout')
             return -np.inf  # immediately return -np.inf if times out
         finally:
             signal.alarm(0)  # Cancel alarm
+
+    # The simulation was stopped because it can't match the observations
+    if getattr(simulation_results.const, 'abort_reason', None) is not None:
+        return -np.inf
         
     ### LUM CALC ###
 
@@ -6185,9 +6597,9 @@ def logLikelihoodDynesty(guess_var, obs_metsim_obj, flags_dict, fix_var, timeout
 
     ### Log Likelihood ###
 
-    log_likelihood_lum = np.nansum(-0.5*np.log(2*np.pi*obs_metsim_obj.noise_lum**2) - 0.5/(obs_metsim_obj.noise_lum**2)*(obs_metsim_obj.luminosity - simulated_lc_intensity) ** 2)
+    log_likelihood_lum = np.nansum(-0.5*np.log(2*np.pi*noise_lum**2) - 0.5/(noise_lum**2)*(obs_metsim_obj.luminosity - simulated_lc_intensity) ** 2)
     # print("log_likelihood_lum:", log_likelihood_lum)
-    log_likelihood_lag = np.nansum(-0.5*np.log(2*np.pi*obs_metsim_obj.noise_lag**2) - 0.5/(obs_metsim_obj.noise_lag**2)*(obs_metsim_obj.lag - lag_sim) ** 2)
+    log_likelihood_lag = np.nansum(-0.5*np.log(2*np.pi*noise_lag**2) - 0.5/(noise_lag**2)*(obs_metsim_obj.lag - lag_sim) ** 2)
     # print("log_likelihood_lag:", log_likelihood_lag)
 
     log_likelihood_tot = log_likelihood_lum + log_likelihood_lag
@@ -6310,31 +6722,35 @@ def dynestyMainRun(dynesty_file, obs_data, bounds, flags_dict, fixed_values, n_c
     else:
         # =========== Normal multiprocessing ========== 
 
-        # check if file exists
-        if not os.path.exists(dynesty_file):
-            print("Starting new run:")
-            # Start new run
-            with dynesty.pool.Pool(n_core, logLikelihoodDynesty, priorDynesty,
-                                logl_args=(obs_data, flags_dict, fixed_values, 20),
-                                ptform_args=(bounds, flags_dict)) as pool:
-                ### NEW RUN
-                dsampler = dynesty.DynamicNestedSampler(pool.loglike, 
-                                                        pool.prior_transform, ndim,
-                                                        sample='rslice', # nlive=1000,
-                                                        pool = pool)
-                dsampler.run_nested(print_progress=True, checkpoint_file=dynesty_file) #  dlogz_init=0.001,
+        # Share the observations with the workers as read-only memory-mapped arrays instead of sending a copy
+        #   to every process
+        with ObservationBundle(obs_data) as obs_shared:
+
+            # check if file exists
+            if not os.path.exists(dynesty_file):
+                print("Starting new run:")
+                # Start new run
+                with dynesty.pool.Pool(n_core, logLikelihoodDynesty, priorDynesty,
+                                    logl_args=(obs_shared, flags_dict, fixed_values, 20),
+                                    ptform_args=(bounds, flags_dict)) as pool:
+                    ### NEW RUN
+                    dsampler = dynesty.DynamicNestedSampler(pool.loglike, 
+                                                            pool.prior_transform, ndim,
+                                                            sample='rslice', # nlive=1000,
+                                                            pool = pool)
+                    dsampler.run_nested(print_progress=True, checkpoint_file=dynesty_file) #  dlogz_init=0.001,
 
-        else:
-            print("Resuming previous run:")
-            print('Warning: make sure the number of parameters and the bounds are the same as the previous run!')
-            # Resume previous run
-            with dynesty.pool.Pool(n_core, logLikelihoodDynesty, priorDynesty,
-                                logl_args=(obs_data, flags_dict, fixed_values, 20),
-                                ptform_args=(bounds, flags_dict)) as pool:
-                ### RESUME:
-                dsampler = dynesty.DynamicNestedSampler.restore(dynesty_file,
-                                                                pool = pool)
-                dsampler.run_nested(resume=True, print_progress=True, checkpoint_file=dynesty_file) # dlogz_init=0.001,
+            else:
+                print("Resuming previous run:")
+                print('Warning: make sure the number of parameters and the bounds are the same as the previous run!')
+                # Resume previous run
+                with dynesty.pool.Pool(n_core, logLikelihoodDynesty, priorDynesty,
+                                    logl_args=(obs_shared, flags_dict, fixed_values, 20),
+                                    ptform_args=(bounds, flags_dict)) as pool:
+                    ### RESUME:
+                    dsampler = dynesty.DynamicNestedSampler.restore(dynesty_file,
+                                                                    pool = pool)
+                    dsampler.run_nested(resume=True, print_progress=True, checkpoint_file=dynesty_file) # dlogz_init=0.001,
 
     print('SUCCESS: dynesty results ready!\n')
 
@@ -6405,6 +6821,17 @@ if __name__ == "__main__":
     arg_parser.add_argument('--cores', metavar='CORES', type=int, default=None,
         help="Number of cores to use. Default = all available.")
 
+    arg_parser.add_argument('--sim_cache_dir', metavar='SIM_CACHE_DIR', type=str, default=None,
+        help="Directory where simulations are cached and shared between worker processes and runs, so the " \
+        "plotting and the post-processing don't have to rerun them. Default = no cache.")
+
+    arg_parser.add_argument('--sim_cache_size', metavar='SIM_CACHE_SIZE', type=float, default=1024,
+        help="Maximum size of the simulation cache directory in MB, the least recently used simulations are " \
+        "removed when it grows larger. Default = 1024 MB.")
+
+    arg_parser.add_argument('--sim_cache_memory', metavar='SIM_CACHE_MEMORY', type=int, default=0,
+        help="Number of the most recent simulations kept in memory by every process. Default = 0 (disabled).")
+
     # Optional: suppress warnings
     # warnings.filterwarnings('ignore')
 
@@ -6415,6 +6842,11 @@ if __name__ == "__main__":
     if cml_args.pick_pos < 0 or cml_args.pick_pos > 1:
         raise ValueError("pick_position must be between 0 and 1, 0 leading edge, 0.5 centroid full meteor, 1 trailing edge.")
 
+    # Cache the simulations in memory and/or on disk
+    if (cml_args.sim_cache_dir is not None) or (cml_args.sim_cache_memory > 0):
+        setSimulationCache(SimulationCache(max_entries=cml_args.sim_cache_memory, 
+            disk_dir=cml_args.sim_cache_dir, max_disk_bytes=int(cml_args.sim_cache_size*1024**2)))
+
     setupDirAndRunDynesty(cml_args.input_dir, output_dir=cml_args.output_dir, prior=cml_args.prior, resume=cml_args.new_dynesty, use_all_cameras=cml_args.all_cameras, only_plot=cml_args.only_plot, cores=cml_args.cores, pick_position=cml_args.pick_pos, extraprior_file=cml_args.extraprior, save_backup=cml_args.save_backup)
 
     print("\nDONE: Completed processing of all files in the input directory.\n")
@@ -9,6 +9,7 @@ import time
 import datetime
 import json
 import glob
+import traceback
 import multiprocessing as mp
 import importlib.machinery
 
@@ -23,7 +24,7 @@ import matplotlib.lines as mlines
 
 import PyQt5.QtCore
 from PyQt5.QtGui import QFont, QFontDatabase
-from PyQt5.QtWidgets import QApplication, QMainWindow, QMessageBox, QFileDialog
+from PyQt5.QtWidgets import QApplication, QMainWindow, QMessageBox, QFileDialog, QLineEdit
 from PyQt5.uic import loadUi
 
 from wmpl.Formats.Met import loadMet
@@ -32,7 +33,7 @@ from wmpl.MetSim.GUITools import MatplotlibPopupWindow
 from wmpl.MetSim.MetSimErosion import runSimulation, Constants, zenithAngleAtSimulationBegin
 from wmpl.Trajectory.Trajectory import Trajectory, ObservedPoints, PlaneIntersection
 from wmpl.Trajectory.Orbit import calcOrbit, Orbit
-from wmpl.Utils.AtmosphereDensity import fitAtmPoly, getAtmDensity, atmDensPoly
+from wmpl.Utils.AtmosphereDensity import fitAtmPoly, getAtmDensityBatch, atmDensPoly
 from wmpl.Utils.Math import mergeClosePoints, findClosestPoints, vectMag, vectNorm, lineFunc, meanAngle
 from wmpl.Utils.Physics import calcMass, dynamicPressure, calcRadiatedEnergy
 from wmpl.Utils.Pickling import loadPickle, savePickle
@@ -61,6 +62,12 @@ FRAG_FILE_NAME = "metsim_fragmentation.txt"
 # Simulation output file name
 SIM_RESULTS_CSV = "metsim_results.csv"
 
+# Delay after the last change of an input box before the simulation is automatically re-run (ms)
+AUTO_RUN_DELAY = 500
+
+# Minimum time between partial results sent from a background simulation or a fit to the plots (s)
+PARTIAL_RESULTS_INTERVAL = 1.0
+
 ### ###
 
 
@@ -1323,7 +1330,11 @@ def extractConstantParams(const_original, params, param_string, mini_norm_handle
 
 def fitResiduals(params, fit_input_data, param_string, const_original, traj, mini_norm_handle, 
     mag_weight=10.0, lag_weights=None, lag_weight_ht_change=0.0, verbose=True, gui_handle=None):
-    """ Compute the fit residual. """
+    """ Compute the fit residual. 
+
+    If gui_handle (GUIJob) is given, the simulation is stopped when the job is cancelled, and in the verbose
+    mode the results of every evaluation are passed to gui_handle.showFitProgress.
+    """
 
     if verbose:
         print()
@@ -1340,8 +1351,16 @@ def fitResiduals(params, fit_input_data, param_string, const_original, traj, min
     const = extractConstantParams(const_original, params, param_string, mini_norm_handle)
 
 
+    # Stop the simulation if the fit is cancelled
+    terminate = None
+    if gui_handle is not None:
+        terminate = gui_handle.checkTerminate
+
     # Run the simulation
-    frag_main, results_list, wake_results = runSimulation(const, compute_wake=False)
+    frag_main, results_list, wake_results = runSimulation(const, compute_wake=False, terminate=terminate)
+
+    if gui_handle is not None:
+        gui_handle.checkCancelled()
 
     # Store simulation results
     sr = SimulationResults(const, frag_main, results_list, wake_results)
@@ -1436,10 +1455,7 @@ def fitResiduals(params, fit_input_data, param_string, const_original, traj, min
         if gui_handle is not None:
 
             # Plot the results of the current fit
-            gui_handle.simulation_results = sr
-            gui_handle.const = const
-            gui_handle.showCurrentResults()
-            gui_handle.repaint()
+            gui_handle.showFitProgress(const, sr, total_residual)
 
 
     return total_residual
@@ -2669,6 +2685,296 @@ def plotObsAndSimComparison(traj, sr, ecsv_obs, met_obs, lc_data, plot_dir,
     plt.close(fig)
 
 
+
+class GUIJobCancelled(Exception):
+    """ Raised inside of a background job when the job is cancelled. """
+    pass
+
+
+
+class GUIJob(PyQt5.QtCore.QThread):
+
+    # Signals sent to the GUI thread
+    partial_results = PyQt5.QtCore.pyqtSignal(object)
+    results_ready = PyQt5.QtCore.pyqtSignal(object)
+    job_failed = PyQt5.QtCore.pyqtSignal(str)
+
+    def __init__(self, job_func, *args, **kwargs):
+        """ Runs a simulation or a fit in a background thread so the GUI stays responsive. The job function
+            is called as job_func(job, *args, **kwargs). It should pass the job as the termination predicate
+            to simulations (job.checkTerminate) and call job.checkCancelled() regularly.
+
+        The results are sent to the GUI thread with the results_ready signal, and intermediate results with
+        the partial_results signal (at most every PARTIAL_RESULTS_INTERVAL seconds). Nothing is sent after 
+        the job is cancelled.
+
+        Arguments:
+            job_func: [function] Function which runs the job.
+            *args, **kwargs: Arguments passed to the job function.
+
+        """
+
+        super(GUIJob, self).__init__()
+
+        self.job_func = job_func
+        self.args = args
+        self.kwargs = kwargs
+
+        self.cancelled = False
+
+        # Time when the partial results were last sent
+        self.partial_time = 0
+
+        # Best residual of the fit so far
+        self.best_residual = np.inf
+
+        # Simulation results computed so far
+        self.results_rows = []
+        self.partial_const = None
+
+
+    def cancel(self):
+        """ Cancel the job. The job stops at the next check, its results are discarded. """
+
+        self.cancelled = True
+
+
+    def checkCancelled(self):
+        """ Raise GUIJobCancelled if the job was cancelled. """
+
+        if self.cancelled:
+            raise GUIJobCancelled()
+
+
+    def partialResultsDue(self):
+        """ Check if enough time passed since the last partial results were sent. """
+
+        if (time.time() - self.partial_time) < PARTIAL_RESULTS_INTERVAL:
+            return False
+
+        self.partial_time = time.time()
+
+        return True
+
+
+    def checkTerminate(self, results_row, n_active):
+        """ Termination predicate for runSimulation. Stops the simulation if the job is cancelled and sends
+            the results computed so far to the GUI (see startSimulation).
+        """
+
+        if self.cancelled:
+            return "cancelled"
+
+        if self.partial_const is not None:
+
+            self.results_rows.append(results_row)
+
+            if (len(self.results_rows) > 1) and self.partialResultsDue():
+                self.partial_results.emit((self.partial_const, list(self.results_rows)))
+
+        return None
+
+
+    def startSimulation(self, const):
+        """ Start recording the rows of the results of a new simulation, which will be sent as partial 
+            results.
+
+        Arguments:
+            const: [Constants] Simulation constants.
+
+        """
+
+        self.results_rows = []
+        self.partial_const = copy.copy(const)
+
+        # The individual fragmentation light curves are only complete at the end of the simulation
+        self.partial_const.fragmentation_show_individual_lcs = False
+
+
+    def showFitProgress(self, const, sr, residual):
+        """ Called by fitResiduals after every evaluation. If the fit improved, the results are sent to the
+            GUI.
+
+        Arguments:
+            const: [Constants] Constants of the evaluated parameters.
+            sr: [SimulationResults] Simulation results.
+            residual: [float] Fit residual.
+
+        """
+
+        self.checkCancelled()
+
+        if residual < self.best_residual:
+            self.best_residual = residual
+
+            if self.partialResultsDue():
+                self.partial_results.emit((const, sr, residual))
+
+
+    def run(self):
+
+        try:
+            results = self.job_func(self, *self.args, **self.kwargs)
+
+        except GUIJobCancelled:
+            return None
+
+        except Exception:
+            if not self.cancelled:
+                self.job_failed.emit(traceback.format_exc())
+
+            return None
+
+        if not self.cancelled:
+            self.results_ready.emit(results)
+
+
+
+def simulationJob(job, const, compute_wake):
+    """ Background job which runs the simulation, see MetSimGUI.runSimulationGUI. 
+
+    Arguments:
+        job: [GUIJob] Handle of the job.
+        const: [Constants] Simulation constants.
+        compute_wake: [bool] Compute the wake.
+
+    Return:
+        (const, frag_main, results_list, wake_results, sim_runtime)
+    """
+
+    t1 = time.time()
+
+    # Send the results of long simulations to the plots while they are running
+    job.startSimulation(const)
+
+    # Run the simulation
+    frag_main, results_list, wake_results = runSimulation(const, compute_wake=compute_wake, \
+        terminate=job.checkTerminate)
+
+    job.checkCancelled()
+
+    sim_runtime = time.time() - t1
+
+    return const, frag_main, results_list, wake_results, sim_runtime
+
+
+
+def autoFitJob(job, autofit_method, p0_normed, bounds_normed, fit_input_data, param_string, const, traj, \
+    mini_norm_handle, mag_weight, lag_weights, lag_weight_ht_change, pso_particles, pso_iterations):
+    """ Background job which runs the auto fit, see MetSimGUI.autoFit. 
+
+    Arguments:
+        job: [GUIJob] Handle of the job.
+        autofit_method: [str] "Local", "PSO" or "PSO local".
+        p0_normed: [list] Normalized initial parameters.
+        bounds_normed: [list] Normalized bounds.
+        fit_input_data, param_string, const, traj, mini_norm_handle, mag_weight, lag_weights, 
+            lag_weight_ht_change: See fitResiduals.
+        pso_particles: [int] Number of PSO particles.
+        pso_iterations: [int] Number of PSO iterations.
+
+    Return:
+        (fit_params, cost_history): Fitted normalized parameters and the PSO cost history (None for the 
+            local fit).
+    """
+
+    # Print residual value
+    print("Starting residual value: {:.5f}".format(fitResiduals(p0_normed, fit_input_data, \
+        param_string, const, traj, mini_norm_handle, mag_weight=mag_weight, lag_weights=lag_weights, \
+        lag_weight_ht_change=lag_weight_ht_change, verbose=False)))
+    print()
+
+
+
+    print("Method:", autofit_method)
+
+
+    if autofit_method == "Local":
+
+        ### scipy minimize ###
+
+        # Run the fit (fitResiduals sends the improved fits to the GUI and stops if the job is cancelled)
+        res = scipy.optimize.minimize(fitResiduals, p0_normed, args=(fit_input_data, param_string, \
+            const, traj, mini_norm_handle, mag_weight, lag_weights, lag_weight_ht_change, True, job), \
+            bounds=bounds_normed, tol=0.001)
+
+        print(res)
+
+        fit_params = res.x
+
+        cost_history = None
+
+
+        ### ###
+
+
+    # PSO optimization
+    else:
+
+        print()
+        print("N particles:", pso_particles)
+        print("Iterations:", pso_iterations)
+
+        ### pyswarms ###
+
+        import pyswarms as ps
+
+
+        # Set up hyperparameters
+        #options = {'c1': 0.5, 'c2': 0.7, 'w':0.9}
+        options = {'c1': 0.6, 'c2': 0.3, 'w': 0.9, 'k': 10, 'p': 1}
+
+
+        # Set up bounds (min, max) are (0, 1)
+        pso_bounds = (np.zeros(len(p0_normed)), np.ones(len(p0_normed)))
+
+
+        init_pos = None
+
+
+        # If PSO local optimization is desired, create a tight cluster of particles around the initial
+        #   parameters
+        if autofit_method == "PSO local":
+
+            # Create particles in a tight Gaussian around the initial parameters
+            init_pos = np.random.normal(loc=p0_normed, scale=0.2 + np.zeros_like(p0_normed), \
+                size=(pso_particles - 1, len(p0_normed)))
+            init_pos[init_pos < 0] = abs(init_pos[init_pos < 0])
+            init_pos[init_pos > 1] = 1 - init_pos[init_pos > 1] + 1
+
+            # Add manual fit to initial positions
+            init_pos = np.append(init_pos, np.array([p0_normed]), axis=0)
+
+
+        # Call instance of PSO with bounds argument
+        optimizer = ps.single.LocalBestPSO(n_particles=pso_particles, dimensions=len(p0_normed), \
+            options=options, bounds=pso_bounds, bh_strategy='reflective', vh_strategy='invert', \
+            init_pos=init_pos)
+
+
+        # Run PSO (the particles are evaluated in separate processes, so a cancelled PSO fit is only 
+        #   discarded once the optimizer returns)
+        cost, pos = optimizer.optimize(fitResidualsListArguments, iters=pso_iterations, \
+            n_processes=mp.cpu_count() - 1, fit_input_data=fit_input_data, param_string=param_string, \
+            const_original=const, traj=traj, mini_norm_handle=mini_norm_handle, \
+            mag_weight=mag_weight, lag_weights=lag_weights, \
+            lag_weight_ht_change=lag_weight_ht_change, verbose=False)
+
+        print(cost, pos)
+
+        fit_params = pos
+
+        cost_history = optimizer.cost_history
+
+        ### ###
+
+
+    job.checkCancelled()
+
+    return fit_params, cost_history
+
+
+
 class MetSimGUI(QMainWindow):
     def __init__(self, traj_path, const_json_file=None, ecsv_files=None, met_path=None, lc_path=None, 
                  wid_files=None, usg_input=False):
@@ -2880,6 +3186,24 @@ class MetSimGUI(QMainWindow):
         self.simulation_results_prev = None
 
 
+        ### Background jobs ###
+
+        # Running simulation and auto fit (GUIJob), None if nothing is running
+        self.simulation_job = None
+        self.autofit_job = None
+
+        # All jobs whose threads are still running (including cancelled ones)
+        self.background_jobs = []
+
+        # Results shown as previous when the running simulation is done
+        self.sim_prev_results = (None, None)
+
+        # Parameters and results from before the running auto fit
+        self.autofit_prefit = (None, None)
+
+        ### ###
+
+
         ### ### ### ###
 
 
@@ -3053,8 +3377,17 @@ class MetSimGUI(QMainWindow):
         self.checkBoxDisruptionErosionCoeff.stateChanged.connect(self.checkBoxDisruptionErosionCoeffSignal)
 
 
-        self.runSimButton.clicked.connect(self.runSimulationGUI)
-        self.autoFitButton.clicked.connect(self.autoFit)
+        self.runSimButton.clicked.connect(self.runSimButtonClicked)
+        self.autoFitButton.clicked.connect(self.autoFitButtonClicked)
+
+        # Re-run the simulation when the inputs change (if enabled), after the user stops editing
+        self.auto_run_timer = PyQt5.QtCore.QTimer(self)
+        self.auto_run_timer.setSingleShot(True)
+        self.auto_run_timer.timeout.connect(self.runSimulationGUI)
+
+        for input_box in self.findChildren(QLineEdit):
+            if input_box.objectName().startswith("input"):
+                input_box.editingFinished.connect(self.scheduleAutoRun)
 
 
         self.fragmentationGroup.toggled.connect(self.toggleFragmentation)
@@ -5257,8 +5590,7 @@ class MetSimGUI(QMainWindow):
         height_arr = np.linspace(self.dens_fit_ht_beg, self.dens_fit_ht_end, 200)
 
         # Get atmosphere densities from NRLMSISE-00 (use log values for the fit)
-        atm_densities = np.array([getAtmDensity(lat_mean, lon_mean, ht, self.traj.jdt_ref) \
-            for ht in height_arr])
+        atm_densities = getAtmDensityBatch(lat_mean, lon_mean, height_arr, self.traj.jdt_ref)
 
 
         # Get atmosphere densities from the fitted polynomial
@@ -5575,8 +5907,14 @@ class MetSimGUI(QMainWindow):
 
 
 
-    def runSimulationGUI(self):
-        """ Run the simulation and show the results. """
+    def runSimulationGUI(self, prev_results=None):
+        """ Run the simulation in the background and show the results when it's done. A simulation which is
+            already running is cancelled. 
+
+        Keyword arguments:
+            prev_results: [tuple] (const, simulation_results) which will be shown as the previous results. 
+                None by default, in which case the currently shown results are used.
+        """
 
         # If the fragmentation is turned on and no fragmentation data is given, notify the user
         if self.const.fragmentation_on and (self.fragmentation is None):
@@ -5587,6 +5925,20 @@ class MetSimGUI(QMainWindow):
             return None
 
 
+        # Cancel the simulation which is still running (its inputs are stale). The results shown before it
+        #   was started remain the previous results
+        if self.simulation_job is not None:
+            self.cancelJob(self.simulation_job)
+            self.simulation_job = None
+
+        # Store previous run results
+        elif prev_results is None:
+            prev_results = (copy.deepcopy(self.const), copy.deepcopy(self.simulation_results))
+
+        if prev_results is not None:
+            self.sim_prev_results = prev_results
+
+
         # Load fragmentation entries if fragmentation is enabled
         if self.const.fragmentation_on:
 
@@ -5603,24 +5955,16 @@ class MetSimGUI(QMainWindow):
             self.fragmentation.writeFragmentationFile()
 
 
-
-        # Store previous run results
-        self.const_prev = copy.deepcopy(self.const)
-        self.simulation_results_prev = copy.deepcopy(self.simulation_results)
-
-
         # Read the values from the input boxes
         self.readInputBoxes()
 
 
-        # Disable the simulation button (have to force update by calling "repaint")
+        # Turn the simulation button into a cancel button
+        self.runSimButton.setText("Cancel simulation")
         self.runSimButton.setStyleSheet("background-color: red")
-        self.runSimButton.setDisabled(True)
-        self.repaint()
 
 
         print('Running simulation...')
-        t1 = time.time()
 
         # Pass the observed wake heights to the simulation to speed it up
         if hasattr(self, 'wake_heights') and (self.wake_heights is not None):
@@ -5628,10 +5972,156 @@ class MetSimGUI(QMainWindow):
         else:
             self.const.wake_heights = None
 
-        # Run the simulation
-        frag_main, results_list, wake_results = runSimulation(self.const, compute_wake=self.wake_on)
+        # Run the simulation in the background on a copy of the constants, so the inputs can be changed
+        self.simulation_job = GUIJob(simulationJob, copy.deepcopy(self.const), self.wake_on)
+        self.simulation_job.partial_results.connect(self.showPartialSimulation)
+        self.simulation_job.results_ready.connect(self.simulationFinished)
+        self.simulation_job.job_failed.connect(self.jobFailed)
+        self.startJob(self.simulation_job)
+
+
+
+    def runSimButtonClicked(self):
+        """ Run the simulation, or cancel it if it's running. """
+
+        if self.simulation_job is not None:
+
+            print('Simulation cancelled!')
+
+            self.cancelJob(self.simulation_job)
+            self.simulation_job = None
+
+            self.resetRunSimButton()
+
+            # Show the results before the cancelled simulation
+            self.showCurrentResults()
+
+        else:
+            self.runSimulationGUI()
+
+
+
+    def resetRunSimButton(self):
+        """ Show the simulation button in the idle state. """
+
+        self.runSimButton.setText("Run simulation")
+        self.runSimButton.setStyleSheet("background-color: #b1eea6")
+
+
+
+    def scheduleAutoRun(self):
+        """ Re-run the simulation after an input box is changed, if the auto run is enabled. The simulation
+            is started once the inputs haven't changed for AUTO_RUN_DELAY ms.
+        """
+
+        if not self.checkBoxAutoRun.isChecked():
+            return None
+
+        # Don't change the inputs of a running fit
+        if self.autofit_job is not None:
+            return None
+
+        self.auto_run_timer.start(AUTO_RUN_DELAY)
+
+
+
+    def startJob(self, job):
+        """ Start a background job and keep a reference until its thread finishes. """
+
+        self.background_jobs.append(job)
+        job.finished.connect(self.jobFinished)
+        job.start()
+
+
+
+    def jobFinished(self):
+        """ Release a background job after its thread has finished. """
+
+        job = self.sender()
+
+        if job in self.background_jobs:
+            job.wait()
+            self.background_jobs.remove(job)
+
+
+
+    def cancelJob(self, job):
+        """ Cancel a background job, its results will not be shown. """
+
+        # Disconnect the signals so nothing queued from the job reaches the GUI
+        for signal in [job.partial_results, job.results_ready, job.job_failed]:
+            try:
+                signal.disconnect()
+            except TypeError:
+                pass
+
+        job.cancel()
+
+
+
+    def jobFailed(self, error_traceback):
+        """ Show the error of a failed background job. """
+
+        print(error_traceback)
+
+        if self.sender() is self.simulation_job:
+            self.simulation_job = None
+            self.resetRunSimButton()
+
+        elif self.sender() is self.autofit_job:
+            self.autofit_job = None
+            self.resetAutoFitButton()
+
+        error_message = QMessageBox(QMessageBox.Critical, "Error", "The background job failed!")
+        error_message.setDetailedText(error_traceback)
+        error_message.exec_()
+
+
+
+    def showPartialSimulation(self, partial_results):
+        """ Plot the results of a simulation which is still running. 
+
+        Arguments:
+            partial_results: [tuple] (const, results_list) of the simulation so far.
+        """
+
+        # Skip results of cancelled simulations which were already queued
+        if self.sender() is not self.simulation_job:
+            return None
+
+        const, results_list = partial_results
+
+        # Show the height of the leading fragment on the button
+        self.runSimButton.setText("Cancel simulation ({:.1f} km)".format(results_list[-1][11]/1000))
+
+        # Plot the partial results, the last finished simulation is kept as the current result
+        simulation_results = self.simulation_results
+        self.simulation_results = SimulationResults(const, None, results_list, [None]*len(results_list))
+
+        try:
+            self.updateInterpolations(show_previous=False)
+            self.updateMagnitudePlot(show_previous=False)
+            self.updateVelocityPlot(show_previous=False)
+            self.updateLagPlot(show_previous=False)
+
+        finally:
+            self.simulation_results = simulation_results
+
+
+
+    def simulationFinished(self, results):
+        """ Show the results of a finished background simulation. 
 
-        sim_runtime = time.time() - t1
+        Arguments:
+            results: [tuple] (const, frag_main, results_list, wake_results, sim_runtime), see simulationJob.
+        """
+
+        if self.sender() is not self.simulation_job:
+            return None
+
+        self.simulation_job = None
+
+        const, frag_main, results_list, wake_results, sim_runtime = results
 
         if sim_runtime < 0.5:
             print('Simulation runtime: {:d} ms'.format(int(1000*sim_runtime)))
@@ -5640,6 +6130,12 @@ class MetSimGUI(QMainWindow):
         else:
             print('Simulation runtime: {:.2f} min'.format(sim_runtime/60))
 
+        # The previous results are the ones shown before the simulation was started
+        self.const_prev, self.simulation_results_prev = self.sim_prev_results
+
+        # Take the constants updated by the simulation
+        self.const = const
+
         # Store simulation results
         self.simulation_results = SimulationResults(self.const, frag_main, results_list, wake_results)
 
@@ -5650,8 +6146,9 @@ class MetSimGUI(QMainWindow):
         # Toggle lum eff button to only be available if lum eff was computed
         self.plotLumEffButton.setDisabled(not self.const.fragmentation_show_individual_lcs)
 
-        # Write results in the fragmentation file
+        # Write results in the fragmentation file (the simulation was run on a copy of the entries)
         if self.const.fragmentation_on:
+            self.fragmentation.fragmentation_entries = self.const.fragmentation_entries
             self.fragmentation.writeFragmentationFile()
 
         # Update the plots
@@ -5664,8 +6161,18 @@ class MetSimGUI(QMainWindow):
             print("Could not save latest fit parameters file! Permission error.")
 
         # Enable the simulation button
-        self.runSimButton.setDisabled(False)
-        self.runSimButton.setStyleSheet("background-color: #b1eea6")
+        self.resetRunSimButton()
+
+
+
+    def closeEvent(self, event):
+        """ Stop the background jobs before the window is closed. """
+
+        for job in list(self.background_jobs):
+            self.cancelJob(job)
+            job.wait()
+
+        super(MetSimGUI, self).closeEvent(event)
 
 
 
@@ -5681,17 +6188,51 @@ class MetSimGUI(QMainWindow):
 
 
 
+    def autoFitButtonClicked(self):
+        """ Run the auto fit, or cancel it if it's running. """
+
+        if self.autofit_job is not None:
+
+            print('Auto fit cancelled!')
+
+            self.cancelJob(self.autofit_job)
+            self.autofit_job = None
+
+            self.resetAutoFitButton()
+
+            # Restore the parameters and the results from before the fit
+            self.const, self.simulation_results = self.autofit_prefit
+            self.showCurrentResults()
+
+        else:
+            self.autoFit()
+
+
+
+    def resetAutoFitButton(self):
+        """ Show the auto fit button in the idle state. """
+
+        self.autoFitButton.setText("Auto fit refinement")
+        self.autoFitButton.setStyleSheet("background-color: #efebe7")
+
+
+
     def autoFit(self):
-        """ Run the auto fit procedure. """
+        """ Run the auto fit procedure in the background. The improved fits are shown while it's running. """
+
+        # Stop the simulation which is running, the fit will run a new one at the end
+        if self.simulation_job is not None:
+            self.cancelJob(self.simulation_job)
+            self.simulation_job = None
+            self.resetRunSimButton()
 
         # Read inputs
         self.readInputBoxes()
 
 
-        # Disable the fit button (have to force update by calling "repaint")
+        # Turn the fit button into a cancel button
+        self.autoFitButton.setText("Cancel fit")
         self.autoFitButton.setStyleSheet("background-color: red")
-        self.autoFitButton.setDisabled(True)
-        self.repaint()
 
 
         print()
@@ -5853,116 +6394,84 @@ class MetSimGUI(QMainWindow):
         p0_normed, bounds_normed = mini_norm_handle.normalizeBounds(bounds)
 
 
-        # Print residual value
-        print("Starting residual value: {:.5f}".format(fitResiduals(p0_normed, fit_input_data, \
-            param_string, const, self.traj, mini_norm_handle, mag_weight=self.autofit_mag_weight, \
-            lag_weights=self.autofit_lag_weights, lag_weight_ht_change=self.autofit_lag_weight_ht_change, \
-            verbose=False)))
-        print()
-
-
-
-        print("Method:", self.autofit_method)
-
-
-        if self.autofit_method == "Local":
-
-            ### scipy minimize ###
-
-            # Run the fit
-            res = scipy.optimize.minimize(fitResiduals, p0_normed, args=(fit_input_data, param_string, \
-                const, self.traj, mini_norm_handle, self.autofit_mag_weight, self.autofit_lag_weights, \
-                self.autofit_lag_weight_ht_change, True, self), bounds=bounds_normed, tol=0.001)
-
-            print(res)
-
-            fit_params = res.x
-
-
-            ### ###
-
+        # Keep the parameters and results from before the fit
+        self.autofit_prefit = (const_original, simulation_results_prefit)
+        self.autofit_mini_norm_handle = mini_norm_handle
+        self.autofit_param_string = param_string
 
-        # PSO optimization
-        else:
 
-            print()
-            print("N particles:", self.pso_particles)
-            print("Iterations:", self.pso_iterations)
+        # Run the fit in the background
+        self.autofit_job = GUIJob(autoFitJob, self.autofit_method, p0_normed, bounds_normed, fit_input_data, \
+            param_string, const, self.traj, mini_norm_handle, self.autofit_mag_weight, \
+            self.autofit_lag_weights, self.autofit_lag_weight_ht_change, self.pso_particles, \
+            self.pso_iterations)
+        self.autofit_job.partial_results.connect(self.showFitProgress)
+        self.autofit_job.results_ready.connect(self.autoFitFinished)
+        self.autofit_job.job_failed.connect(self.jobFailed)
+        self.startJob(self.autofit_job)
 
-            ### pyswarms ###
 
-            import pyswarms as ps
-            from pyswarms.utils.plotters import plot_cost_history
 
+    def showFitProgress(self, partial_results):
+        """ Plot the best fit found so far by the running auto fit. 
 
-            # Set up hyperparameters
-            #options = {'c1': 0.5, 'c2': 0.7, 'w':0.9}
-            options = {'c1': 0.6, 'c2': 0.3, 'w': 0.9, 'k': 10, 'p': 1}
+        Arguments:
+            partial_results: [tuple] (const, simulation_results, residual)
+        """
 
+        # Skip results of cancelled fits which were already queued
+        if self.sender() is not self.autofit_job:
+            return None
 
-            # Set up bounds (min, max) are (0, 1)
-            pso_bounds = (np.zeros(len(p0_normed)), np.ones(len(p0_normed)))
+        const, sr, residual = partial_results
 
+        self.autoFitButton.setText("Cancel fit ({:.3e})".format(residual))
 
-            init_pos = None
+        # Plot the results of the current fit
+        self.simulation_results = sr
+        self.const = const
+        self.showCurrentResults()
 
 
-            # If PSO local optimization is desired, create a tight cluster of particles around the initial
-            #   parameters
-            if self.autofit_method == "PSO local":
 
-                # Create particles in a tight Gaussian around the initial parameters
-                init_pos = np.random.normal(loc=p0_normed, scale=0.2 + np.zeros_like(p0_normed), \
-                    size=(self.pso_particles - 1, len(p0_normed)))
-                init_pos[init_pos < 0] = abs(init_pos[init_pos < 0])
-                init_pos[init_pos > 1] = 1 - init_pos[init_pos > 1] + 1
+    def autoFitFinished(self, results):
+        """ Apply the results of a finished auto fit. 
 
-                # Add manual fit to initial positions
-                init_pos = np.append(init_pos, np.array([p0_normed]), axis=0)
+        Arguments:
+            results: [tuple] (fit_params, cost_history), see autoFitJob.
+        """
 
+        if self.sender() is not self.autofit_job:
+            return None
 
-            # Call instance of PSO with bounds argument
-            optimizer = ps.single.LocalBestPSO(n_particles=self.pso_particles, dimensions=len(p0_normed), \
-                options=options, bounds=pso_bounds, bh_strategy='reflective', vh_strategy='invert', \
-                init_pos=init_pos)
+        self.autofit_job = None
 
+        fit_params, cost_history = results
 
-            # Run PSO
-            cost, pos = optimizer.optimize(fitResidualsListArguments, iters=self.pso_iterations, \
-                n_processes=mp.cpu_count() - 1, fit_input_data=fit_input_data, param_string=param_string, \
-                const_original=const, traj=self.traj, mini_norm_handle=mini_norm_handle, \
-                mag_weight=self.autofit_mag_weight, lag_weights=self.autofit_lag_weights, \
-                lag_weight_ht_change=self.autofit_lag_weight_ht_change, verbose=False)
+        # Enable the fit button
+        self.resetAutoFitButton()
 
-            print(cost, pos)
 
-            fit_params = pos
+        # Plot the cost history of the PSO fit
+        if cost_history is not None:
 
+            from pyswarms.utils.plotters import plot_cost_history
 
-            # Plot the cost history
-            plot_cost_history(optimizer.cost_history)
+            plot_cost_history(cost_history)
             plt.show()
 
-            ### ###
-
-
-
-        # Enable the fit button
-        self.autoFitButton.setDisabled(False)
-        self.autoFitButton.setStyleSheet("background-color: #efebe7")
 
+        const_original, simulation_results_prefit = self.autofit_prefit
 
         # Init a Constants instance with fitted parameters
-        const_fit = extractConstantParams(const_original, fit_params, param_string, mini_norm_handle)
+        const_fit = extractConstantParams(const_original, fit_params, self.autofit_param_string, \
+            self.autofit_mini_norm_handle)
 
-        # Assign fitted parameters and run the Simulation
+        # Assign fitted parameters and run the Simulation. Store the simulation results prior to auto fit as
+        #   the previous simulation results
         self.const = const_fit
         self.updateInputBoxes()
-        self.runSimulationGUI()
-
-        # Store the simulation results prior to auto fit as the previous simulation results
-        self.const_prev = const_original
-        self.simulation_results_prev = simulation_results_prefit
+        self.runSimulationGUI(prev_results=(const_original, simulation_results_prefit))
 
 
     def toggleFragmentation(self, event):
@@ -13,17 +13,31 @@ from __future__ import print_function, division, absolute_import
 
 
 import math
+import time
+from collections import OrderedDict
 
 import numpy as np
 import scipy.stats
 import scipy.integrate
+import scipy.signal
 
 
 # Cython init
 import pyximport
 pyximport.install(setup_args={'include_dirs':[np.get_include()]})
 from wmpl.MetSim.MetSimErosionCyTools import massLossRK4, decelerationRK4, luminousEfficiency, \
-    ionizationEfficiency, atmDensityPoly
+    ionizationEfficiency, atmDensityPoly, ablateStep_vect, brightestFragmentIndex
+
+# The compiled simulation kernel might not be available in older builds of the Cython module
+try:
+    from wmpl.MetSim.MetSimErosionCyTools import ConstantsCy, SimulationKernelCy
+except ImportError:
+    ConstantsCy = SimulationKernelCy = None
+
+try:
+    from wmpl.MetSim.MetSimErosionCyTools import AtmDensityTableCy
+except ImportError:
+    AtmDensityTableCy = None
 
 
 ### DEFINE CONSTANTS
@@ -31,9 +45,16 @@ from wmpl.MetSim.MetSimErosionCyTools import massLossRK4, decelerationRK4, lumin
 # Earth acceleration in m/s^2 on the surface
 G0 = 9.81
 
+# Maximum number of atmosphere density lookup tables kept in memory
+ATM_DENS_TABLE_CACHE_SIZE = 16
+
 ###
 
 
+# Atmosphere density lookup tables, shared between all simulations with the same density coefficients
+ATM_DENS_TABLE_CACHE = OrderedDict()
+
+
 class Constants(object):
     def __init__(self):
         """ Constant parameters for the ablation modelling. """
@@ -43,6 +64,17 @@ class Constants(object):
         # Time step
         self.dt = 0.005
 
+        # Adapt the time step to the changes in mass and velocity (only supported by runSimulationCompiled).
+        #   The steps are power of two multiples of dt (up to adaptive_step_max_factor), and the results are
+        #   resampled to dt
+        self.adaptive_step = False
+
+        # Largest allowed relative error in mass or velocity in one adaptive step
+        self.adaptive_step_tol = 1e-6
+
+        # The largest adaptive step as a multiple of dt
+        self.adaptive_step_max_factor = 16
+
         # Time elapsed since the beginning
         self.total_time = 0
 
@@ -71,12 +103,20 @@ class Constants(object):
         # Atmosphere density coefficients
         self.dens_co = np.array([6.96795507e+01, -4.14779163e+03, 9.64506379e+04, -1.16695944e+06, \
             7.62346229e+06, -2.55529460e+07, 3.45163318e+07])
+
+        # Height step of the atmosphere density lookup table (m). The density polynomial is tabulated once
+        #   for the simulation height range and interpolated (relative difference ~1e-9 for 1 m). If 0, the
+        #   polynomial is evaluated directly
+        self.dens_table_step = 1.0
         
         # Radius of the Earth (m)
         self.r_earth = 6_371_008.7714
 
         self.total_fragments = 0
 
+        # Reason why the simulation was stopped early by a termination predicate (None if it ran to the end)
+        self.abort_reason = None
+
         ### ###
 
 
@@ -92,6 +132,13 @@ class Constants(object):
         # Specific heights at which the wake should be simulated (m)
         self.wake_heights = None
 
+        # Method used to evaluate the wake profile:
+        #   'direct' - evaluate the PSF separately for every fragment (slow, the original method)
+        #   'vectorized' - evaluate all fragment PSFs at once (same results as 'direct')
+        #   'fft' - bin fragment luminosities on the length grid and convolve them with the PSF (fastest for
+        #       many grains, the positions of fragments are rounded to the grid spacing)
+        self.wake_method = 'vectorized'
+
         ### ###
 
 
@@ -384,6 +431,184 @@ class Fragment(object):
         return child
 
 
+class FragmentArrays(object):
+
+    # Names of per-fragment state arrays, grouped by type
+    FLOAT_FIELDS = ['K', 'm_init', 'm', 'rho', 'sigma', 'gamma', 'v', 'vv', 'vh', 'h', 'h_grav_drop_total', \
+        'length', 'lum', 'q', 'dyn_press', 'erosion_coeff', 'erosion_mass_index', 'erosion_mass_min', \
+        'erosion_mass_max']
+    INT_FIELDS = ['id', 'n_grains']
+    BOOL_FIELDS = ['erosion_enabled', 'disruption_enabled', 'active', 'main', 'grain']
+
+    def __init__(self, capacity=256):
+        """ Structure-of-arrays container for fragments. Every fragment attribute is stored in a separate 
+            contiguous numpy array, and the index of the fragment is the same in all arrays. The order of
+            fragments is the order in which they were created, the same as in the list of Fragment objects
+            used by ablateAll.
+
+        Keyword arguments:
+            capacity: [int] Initial number of allocated fragment slots. The arrays grow when needed.
+        """
+
+        # Number of used fragment slots
+        self.n = 0
+
+        # Number of allocated fragment slots
+        self.capacity = capacity
+
+        for name in self.FLOAT_FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=np.float64))
+
+        for name in self.INT_FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=np.int64))
+
+        for name in self.BOOL_FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=bool))
+
+
+    def fields(self):
+        """ Return the names of all per-fragment arrays. """
+
+        return self.FLOAT_FIELDS + self.INT_FIELDS + self.BOOL_FIELDS
+
+
+    def reserve(self, n_new):
+        """ Make sure there is space for n_new more fragments. """
+
+        if self.n + n_new <= self.capacity:
+            return
+
+        # Grow the arrays geometrically to keep the appends cheap
+        capacity = max(2*self.capacity, self.n + n_new)
+
+        for name in self.fields():
+            arr = getattr(self, name)
+            arr_new = np.zeros(capacity, dtype=arr.dtype)
+            arr_new[:self.n] = arr[:self.n]
+            setattr(self, name, arr_new)
+
+        self.capacity = capacity
+
+
+    def appendFragment(self, frag):
+        """ Append a Fragment instance and return its index. """
+
+        self.reserve(1)
+
+        i = self.n
+        for name in self.fields():
+            getattr(self, name)[i] = getattr(frag, name)
+
+        self.n += 1
+
+        return i
+
+
+    def spawnChildren(self, const, parent, grain_masses, grain_counts, keep_eroding=False, disruption=False):
+        """ Append daughter fragments of the given parent fragment, one per mass bin. The children inherit
+            the state of the parent and are modified in the same way as in generateFragments.
+
+        Arguments:
+            const: [object] Constants instance.
+            parent: [int] Index of the parent fragment.
+            grain_masses: [list] Mass of a single grain in every bin (kg).
+            grain_counts: [list] Number of grains in every bin.
+
+        Keyword arguments:
+            keep_eroding: [bool] Whether the daughter fragments should keep eroding.
+            disruption: [bool] Indicates that the disruption occured.
+
+        Return:
+            children: [slice] Indices of the new fragments.
+        """
+
+        n_children = len(grain_masses)
+
+        self.reserve(n_children)
+
+        children = slice(self.n, self.n + n_children)
+
+        # Copy the parent state
+        for name in self.fields():
+            arr = getattr(self, name)
+            arr[children] = arr[parent]
+
+        # Assign the number of grains every fragment stands for
+        self.n_grains[children] *= np.array(grain_counts, dtype=np.int64)
+
+        # Assign the grain mass
+        self.m[children] = grain_masses
+        self.m_init[children] = grain_masses
+
+        self.active[children] = True
+        self.main[children] = False
+        self.disruption_enabled[children] = False
+
+        # Indicate that the fragment is a grain
+        if (not keep_eroding) and (not disruption):
+            self.grain[children] = True
+
+        # Set the erosion coefficient value (disable in grain, only larger fragments)
+        if keep_eroding:
+            self.erosion_enabled[children] = True
+
+            # If the disruption occured, use a different erosion coefficient for daguhter fragments
+            if disruption:
+                self.erosion_coeff[children] = const.disruption_erosion_coeff
+            else:
+                self.erosion_coeff[children] = getErosionCoeff(const, self.h[parent])
+
+        else:
+            # Compute the grain density and shape-density coeff
+            self.rho[children] = const.rho_grain
+            self.K[children] = self.gamma[parent]*const.shape_factor*const.rho_grain**(-2/3.0)
+
+            self.erosion_enabled[children] = False
+            self.erosion_coeff[children] = 0
+
+        # Give every fragment a unique ID
+        self.id[children] = np.arange(const.total_fragments, const.total_fragments + n_children)
+        const.total_fragments += n_children
+
+        self.n += n_children
+
+        return children
+
+
+    def compact(self):
+        """ Remove inactive fragments from the arrays, keeping the order of the remaining ones. The main 
+            fragment is always kept so its final state can be returned.
+        """
+
+        keep = np.flatnonzero(self.active[:self.n] | self.main[:self.n])
+
+        n_keep = len(keep)
+        for name in self.fields():
+            arr = getattr(self, name)
+            arr[:n_keep] = arr[keep]
+
+        self.n = n_keep
+
+
+    def toFragment(self, i, const):
+        """ Return a Fragment instance with the state of the fragment at the given index. """
+
+        frag = Fragment()
+        frag.const = const
+        frag.zenith_angle = const.zenith_angle
+
+        for name in self.FLOAT_FIELDS:
+            setattr(frag, name, float(getattr(self, name)[i]))
+
+        for name in self.INT_FIELDS:
+            setattr(frag, name, int(getattr(self, name)[i]))
+
+        for name in self.BOOL_FIELDS:
+            setattr(frag, name, bool(getattr(self, name)[i]))
+
+        return frag
+
+
 class Wake(object):
     def __init__(self, const, frag_list, leading_frag_length, length_array):
         """ Container for the evaluated wake. 
@@ -424,12 +649,228 @@ class Wake(object):
 
         # Normalize the wake weights so they sum to 1
         self.const.wake_psf_weights = self.const.wake_psf_weights/np.sum(self.const.wake_psf_weights)
+
+        # Choose the method of wake evaluation (older constants might not have it)
+        wake_method = getattr(self.const, 'wake_method', 'vectorized')
+
+        if wake_method == 'vectorized':
+            self.wake_luminosity_profile = wakeProfileVectorized(self.length_array, self.length_points, \
+                self.luminosity_points, self.const.wake_psf, self.const.wake_psf_weights)
+
+        elif wake_method == 'fft':
+            self.wake_luminosity_profile = wakeProfileFFT(self.length_array, self.length_points, \
+                self.luminosity_points, self.const.wake_psf, self.const.wake_psf_weights)
+
+        else:
         
-        for frag_lum, frag_len in zip(self.luminosity_points, self.length_points):
+            for frag_lum, frag_len in zip(self.luminosity_points, self.length_points):
+
+                for psf_m, psf_weight in zip(self.const.wake_psf, self.const.wake_psf_weights):
+                    self.wake_luminosity_profile += psf_weight*frag_lum*scipy.stats.norm.pdf(self.length_array, \
+                        loc=frag_len, scale=psf_m)
+
+
+
+def wakeProfileVectorized(length_array, length_points, luminosity_points, psf_list, psf_weights, chunk_size=2000):
+    """ Evaluate the wake profile as a sum of Gaussian PSFs centered at every fragment. All fragment-PSF 
+        Gaussians are evaluated at once, which gives the same result as evaluating them one by one.
+
+    Arguments:
+        length_array: [ndarray] Lengths at which the wake is evaluated (m).
+        length_points: [ndarray] Lengths of fragments (m).
+        luminosity_points: [ndarray] Luminosities of fragments (W).
+        psf_list: [list] Standard deviations of PSF components (m).
+        psf_weights: [list] Weights of PSF components.
+
+    Keyword arguments:
+        chunk_size: [int] Number of fragments evaluated at once, limits the memory use when there are many 
+            grains. 2000 by default.
+
+    Return:
+        wake_luminosity_profile: [ndarray] Luminosity at every length in length_array.
+    """
+
+    length_array = np.asarray(length_array, dtype=np.float64)
+    length_points = np.asarray(length_points, dtype=np.float64)
+    luminosity_points = np.asarray(luminosity_points, dtype=np.float64)
+
+    wake_luminosity_profile = np.zeros_like(length_array)
+
+    for psf_m, psf_weight in zip(psf_list, psf_weights):
+
+        for i in range(0, len(length_points), chunk_size):
+
+            # Evaluate the normal PDF of every fragment in the chunk (n_frags x n_lengths), the same way as 
+            #   scipy.stats.norm.pdf does it
+            x = (length_array[np.newaxis, :] - length_points[i:i + chunk_size, np.newaxis])/psf_m
+            pdf = np.exp(-x**2/2.0)/np.sqrt(2*np.pi)/psf_m
+
+            # Sum up the PSFs weighted by the fragment luminosity
+            wake_luminosity_profile += psf_weight*np.dot(luminosity_points[i:i + chunk_size], pdf)
+
+    return wake_luminosity_profile
+
+
+
+def wakeProfileFFT(length_array, length_points, luminosity_points, psf_list, psf_weights):
+    """ Evaluate the wake profile by binning the fragment luminosities on the length grid and convolving 
+        them with the PSF. The luminosity of every fragment is split between the two neighbouring grid points 
+        (linearly), so the result is accurate as long as the grid spacing is small compared to the PSF.
+
+    Arguments:
+        length_array: [ndarray] Uniformly spaced lengths at which the wake is evaluated (m).
+        length_points: [ndarray] Lengths of fragments (m).
+        luminosity_points: [ndarray] Luminosities of fragments (W).
+        psf_list: [list] Standard deviations of PSF components (m).
+        psf_weights: [list] Weights of PSF components.
+
+    Return:
+        wake_luminosity_profile: [ndarray] Luminosity at every length in length_array.
+    """
+
+    length_array = np.asarray(length_array, dtype=np.float64)
+    length_points = np.asarray(length_points, dtype=np.float64)
+    luminosity_points = np.asarray(luminosity_points, dtype=np.float64)
+
+    n = len(length_array)
+    dl = (length_array[-1] - length_array[0])/(n - 1)
+
+    # Compute the fractional position of every fragment on the grid
+    pos = (length_points - length_array[0])/dl
+    pos_floor = np.floor(pos)
+    frac = pos - pos_floor
+    pos_floor = pos_floor.astype(np.int64)
+
+    # Split the luminosities between the neighbouring grid points (points outside the grid are dropped)
+    lum_binned = np.zeros(n + 1)
+    inside = (pos_floor >= 0) & (pos_floor < n)
+    np.add.at(lum_binned, pos_floor[inside], luminosity_points[inside]*(1 - frac[inside]))
+    np.add.at(lum_binned, pos_floor[inside] + 1, luminosity_points[inside]*frac[inside])
+    lum_binned = lum_binned[:n]
+
+    # Compute the PSF kernel across the whole grid in both directions
+    offsets = dl*np.arange(-(n - 1), n)
+    kernel = np.zeros_like(offsets)
+    for psf_m, psf_weight in zip(psf_list, psf_weights):
+        kernel += psf_weight*np.exp(-(offsets/psf_m)**2/2.0)/np.sqrt(2*np.pi)/psf_m
+
+    # Convolve the binned luminosities with the PSF, keep only the part overlapping the grid
+    wake_luminosity_profile = scipy.signal.fftconvolve(lum_binned, kernel, mode='full')[n - 1:2*n - 1]
+
+    return wake_luminosity_profile
+
+
+class ObservationEnvelope(object):
+    def __init__(self, height_min, lum_max=None, time_max=None, wall_time_max=None):
+        """ Termination predicate which stops simulations that cannot match the observations. An instance 
+            can be passed as the terminate argument to runSimulation, runSimulationArrays and 
+            runSimulationCompiled. A new instance should be used for every simulation.
+
+        Arguments:
+            height_min: [float] The lowest observed height (m). Simulations where all fragments stop ablating 
+                above this height are rejected.
+
+        Keyword arguments:
+            lum_max: [float] The simulation is stopped if the total luminosity exceeds this value (W) while 
+                the leading fragment is above height_min. None by default, in which case it's not checked.
+            time_max: [float] The largest simulated time (s). None by default.
+            wall_time_max: [float] The largest time the simulation is allowed to run (s). None by default.
+        """
+
+        self.height_min = height_min
+        self.lum_max = lum_max
+        self.time_max = time_max
+        self.wall_time_max = wall_time_max
+
+        # The lowest height of the leading fragment so far
+        self.leading_height_min = np.inf
+
+        # Time when the simulation started, set at the first step
+        self.wall_time_start = None
+
+
+    def __call__(self, results_row, n_active):
+        """ Check the results of one simulation step.
+
+        Arguments:
+            results_row: [list] Results of the step, in the same order as the results list of runSimulation.
+            n_active: [int] Number of active fragments after the step.
+
+        Return:
+            abort_reason: [str] The reason why the simulation should be stopped, None if it should continue.
+        """
+
+        if self.wall_time_start is None:
+            self.wall_time_start = time.time()
+
+        total_time, luminosity_total, leading_frag_height = results_row[0], results_row[1], results_row[11]
+
+        # Keep track of the lowest height of the leading fragment (it's None or NaN if there is none)
+        if (leading_frag_height is not None) and not np.isnan(leading_frag_height):
+            self.leading_height_min = min(self.leading_height_min, leading_frag_height)
+
+        if (self.lum_max is not None) and (luminosity_total > self.lum_max) \
+            and (self.leading_height_min >= self.height_min):
+
+            return "luminosity {:.2e} W exceeds the envelope maximum {:.2e} W".format(luminosity_total, \
+                self.lum_max)
+
+        if (self.time_max is not None) and (total_time > self.time_max):
+            return "simulated time exceeds {:.2f} s".format(self.time_max)
+
+        if (self.wall_time_max is not None) and (time.time() - self.wall_time_start > self.wall_time_max):
+            return "simulation took longer than {:.1f} s".format(self.wall_time_max)
+
+        if (n_active == 0) and (self.leading_height_min > self.height_min):
+            return "ablation ended at {:.2f} km, above the lowest observed height {:.2f} km".format(\
+                self.leading_height_min/1000, self.height_min/1000)
+
+        return None
+
+
+
+def atmDensityTable(const):
+    """ Return the atmosphere density lookup table for the given constants. The table covers the simulation
+        height range with the step given in const.dens_table_step. Tables are kept in memory and reused by
+        all simulations with the same density coefficients (e.g. during a fit).
+
+    Arguments:
+        const: [Constants]
+
+    Return:
+        dens_table: [AtmDensityTableCy] Lookup table, or None if it's disabled or the Cython module doesn't 
+            support it.
+    """
+
+    # Older constants might not have the table step
+    ht_step = getattr(const, 'dens_table_step', 0)
+
+    if (not ht_step) or (AtmDensityTableCy is None):
+        return None
+
+    # Cover the simulation height range, rounded to the nearest km so small changes don't need a new table
+    ht_min = max(0.0, 1000*math.floor(const.h_kill/1000) - 1000)
+    ht_max = 1000*math.ceil(const.h_init/1000) + 1000
+
+    dens_co = np.array(const.dens_co, dtype=np.float64)
+    key = (dens_co.tobytes(), ht_min, ht_max, float(ht_step))
+
+    dens_table = ATM_DENS_TABLE_CACHE.get(key)
+
+    if dens_table is None:
+
+        dens_table = AtmDensityTableCy(dens_co, ht_min, ht_max, ht_step)
+        ATM_DENS_TABLE_CACHE[key] = dens_table
+
+        # Remove the least recently used table
+        if len(ATM_DENS_TABLE_CACHE) > ATM_DENS_TABLE_CACHE_SIZE:
+            ATM_DENS_TABLE_CACHE.popitem(last=False)
+
+    else:
+        ATM_DENS_TABLE_CACHE.move_to_end(key)
+
+    return dens_table
 
-            for psf_m, psf_weight in zip(self.const.wake_psf, self.const.wake_psf_weights):
-                self.wake_luminosity_profile += psf_weight*frag_lum*scipy.stats.norm.pdf(self.length_array, loc=frag_len, \
-                    scale=psf_m)
 
 
 def zenithAngleAtSimulationBegin(h0_sim, hb, zc, r_earth):
@@ -467,33 +908,24 @@ def heightCurvature(h0, zc, l, r_earth):
     return np.sqrt((h0 + r_earth)**2 - 2*l*np.cos(zc)*(h0 + r_earth) + l**2) - r_earth
 
 
-def generateFragments(const, frag_parent, eroded_mass, mass_index, mass_min, mass_max, 
-                      keep_eroding=False, disruption=False, mass_model='powerlaw'):
-    """ Given the parent fragment, fragment it into daughter fragments using either:
-        - a power law mass distribution - appropriate for fragmentation of rock;
-        - a gamma distribution - appropriate for spraying of droplets (iron meteoroids).
-
-    Masses are binned and one daughter fragment may represent several fragments/grains, which is specified 
-    with the n_grains atribute.
+def fragmentMassBins(const, eroded_mass, mass_index, mass_min, mass_max, mass_model='powerlaw'):
+    """ Distribute the given mass into mass bins using either a power law or a gamma mass distribution. See
+        generateFragments for details.
 
     Arguments:
         const: [object] Constants instance.
-        frag_parent: [object] Fragment instance, the parent fragment.
         eroded_mass: [float] Mass to be distributed into daughter fragments. 
         mass_index: [float] Mass index to use to distribute the mass.
         mass_min: [float] Minimum mass bin (kg).
         mass_max: [float] Maximum mass bin (kg).
 
     Keyword arguments:
-        keep_eroding: [bool] Whether the daughter fragments should keep eroding.
-        disruption: [bool] Indicates that the disruption occured, uses a separate erosion parameter for
-            disrupted daughter fragments.
-        mass_model: [bool] Fragment mass distribution model to use. Options: 
-            - 'powerlaw' (default) - a power law mass distribution, appropriate for fragmentation of rock.
-            - 'gamma' - a gamma size distribution, appropriate for spraying of droplets (iron meteoroids).
+        mass_model: [bool] Fragment mass distribution model to use, 'powerlaw' (default) or 'gamma'.
 
     Return:
-        frag_children: [list] A list of Fragment instances - these are the generated daughter fragments.
+        (grain_masses, grain_counts): 
+            - grain_masses: [list] Mass of a single grain in every non-empty bin (kg).
+            - grain_counts: [list] Number of grains in every non-empty bin.
 
     """
 
@@ -579,7 +1011,8 @@ def generateFragments(const, frag_parent, eroded_mass, mass_index, mass_min, mas
 
 
     # Go though every mass bin
-    frag_children = []
+    grain_masses = []
+    grain_counts = []
     leftover_mass = 0
     for i in range(0, k):
 
@@ -608,52 +1041,96 @@ def generateFragments(const, frag_parent, eroded_mass, mass_index, mass_min, mas
             # Compute the leftover mass
             leftover_mass = (n_grains_bin - n_grains_bin_round)*m_grain
 
-        # If there are any grains to erode, erode them
+        # Only keep bins with at least one grain
         if n_grains_bin_round > 0:
+            grain_masses.append(m_grain)
+            grain_counts.append(n_grains_bin_round)
 
-            # Init the new fragment with params of the parent
-            frag_child = frag_parent.spawn_child()
 
-            # Assign the number of grains this fragment stands for (make sure to preserve the previous value
-            #   if erosion is done for more fragments)
-            frag_child.n_grains *= n_grains_bin_round
+    return grain_masses, grain_counts
 
-            # Assign the grain mass
-            frag_child.m = m_grain
-            frag_child.m_init = m_grain
 
-            frag_child.active = True
-            frag_child.main = False
-            frag_child.disruption_enabled = False
+def generateFragments(const, frag_parent, eroded_mass, mass_index, mass_min, mass_max, 
+                      keep_eroding=False, disruption=False, mass_model='powerlaw'):
+    """ Given the parent fragment, fragment it into daughter fragments using either:
+        - a power law mass distribution - appropriate for fragmentation of rock;
+        - a gamma distribution - appropriate for spraying of droplets (iron meteoroids).
 
-            # Indicate that the fragment is a grain
-            if (not keep_eroding) and (not disruption):
-                frag_child.grain = True
+    Masses are binned and one daughter fragment may represent several fragments/grains, which is specified 
+    with the n_grains atribute.
 
-            # Set the erosion coefficient value (disable in grain, only larger fragments)
-            if keep_eroding:
-                frag_child.erosion_enabled = True
+    Arguments:
+        const: [object] Constants instance.
+        frag_parent: [object] Fragment instance, the parent fragment.
+        eroded_mass: [float] Mass to be distributed into daughter fragments. 
+        mass_index: [float] Mass index to use to distribute the mass.
+        mass_min: [float] Minimum mass bin (kg).
+        mass_max: [float] Maximum mass bin (kg).
 
-                # If the disruption occured, use a different erosion coefficient for daguhter fragments
-                if disruption:
-                    frag_child.erosion_coeff = const.disruption_erosion_coeff
-                else:
-                    frag_child.erosion_coeff = getErosionCoeff(const, frag_parent.h)
+    Keyword arguments:
+        keep_eroding: [bool] Whether the daughter fragments should keep eroding.
+        disruption: [bool] Indicates that the disruption occured, uses a separate erosion parameter for
+            disrupted daughter fragments.
+        mass_model: [bool] Fragment mass distribution model to use. Options: 
+            - 'powerlaw' (default) - a power law mass distribution, appropriate for fragmentation of rock.
+            - 'gamma' - a gamma size distribution, appropriate for spraying of droplets (iron meteoroids).
+
+    Return:
+        frag_children: [list] A list of Fragment instances - these are the generated daughter fragments.
 
+    """
+
+    # Distribute the mass into bins
+    grain_masses, grain_counts = fragmentMassBins(const, eroded_mass, mass_index, mass_min, mass_max, \
+        mass_model=mass_model)
+
+    # Go though every mass bin
+    frag_children = []
+    for m_grain, n_grains_bin_round in zip(grain_masses, grain_counts):
+
+        # Init the new fragment with params of the parent
+        frag_child = frag_parent.spawn_child()
+
+        # Assign the number of grains this fragment stands for (make sure to preserve the previous value
+        #   if erosion is done for more fragments)
+        frag_child.n_grains *= n_grains_bin_round
+
+        # Assign the grain mass
+        frag_child.m = m_grain
+        frag_child.m_init = m_grain
+
+        frag_child.active = True
+        frag_child.main = False
+        frag_child.disruption_enabled = False
+
+        # Indicate that the fragment is a grain
+        if (not keep_eroding) and (not disruption):
+            frag_child.grain = True
+
+        # Set the erosion coefficient value (disable in grain, only larger fragments)
+        if keep_eroding:
+            frag_child.erosion_enabled = True
+
+            # If the disruption occured, use a different erosion coefficient for daguhter fragments
+            if disruption:
+                frag_child.erosion_coeff = const.disruption_erosion_coeff
             else:
-                # Compute the grain density and shape-density coeff
-                frag_child.rho = const.rho_grain
-                frag_child.updateShapeDensityCoeff()
+                frag_child.erosion_coeff = getErosionCoeff(const, frag_parent.h)
+
+        else:
+            # Compute the grain density and shape-density coeff
+            frag_child.rho = const.rho_grain
+            frag_child.updateShapeDensityCoeff()
 
-                frag_child.erosion_enabled = False
-                frag_child.erosion_coeff = 0
+            frag_child.erosion_enabled = False
+            frag_child.erosion_coeff = 0
 
 
-            # Give every fragment a unique ID
-            frag_child.id = const.total_fragments
-            const.total_fragments += 1
+        # Give every fragment a unique ID
+        frag_child.id = const.total_fragments
+        const.total_fragments += 1
 
-            frag_children.append(frag_child)
+        frag_children.append(frag_child)
 
 
     return frag_children, const
@@ -686,7 +1163,7 @@ def killFragment(const, frag):
         const.main_mass_exhaustion_ht = frag.h
 
 
-def ablateAll(fragments, const, compute_wake=False, wake_heights_queue=None):
+def ablateAll(fragments, const, compute_wake=False, wake_heights_queue=None, dens_table=None):
     """ Perform single body ablation of all fragments using the 4th order Runge-Kutta method. 
 
     Arguments:
@@ -696,6 +1173,8 @@ def ablateAll(fragments, const, compute_wake=False, wake_heights_queue=None):
     Keyword arguments:
         compute_wake: [bool] If True, the wake profile will be computed. False by default.
         wake_heights_queue: [list] A list of heights at which the wake should be computed. None by default.
+        dens_table: [AtmDensityTableCy] Atmosphere density lookup table (see atmDensityTable). None by 
+            default, in which case the density polynomial is evaluated directly.
 
     Return:
         ...
@@ -745,7 +1224,10 @@ def ablateAll(fragments, const, compute_wake=False, wake_heights_queue=None):
             continue
 
         # Get atmosphere density for the given height
-        rho_atm = atmDensityPoly(frag.h, const.dens_co)
+        if dens_table is not None:
+            rho_atm = dens_table.density(frag.h)
+        else:
+            rho_atm = atmDensityPoly(frag.h, const.dens_co)
 
         # Compute the mass loss of the fragment due to ablation
         mass_loss_ablation = massLossRK4(const.dt, frag.K, frag.sigma, frag.m, rho_atm, frag.v)
@@ -1326,8 +1808,21 @@ def ablateAll(fragments, const, compute_wake=False, wake_heights_queue=None):
         mass_total_active, main_mass, main_height, main_length, main_vel, main_dyn_press, wake
 
 
-def runSimulation(const, compute_wake=False):
-    """ Run the ablation simulation. """
+def runSimulation(const, compute_wake=False, terminate=None):
+    """ Run the ablation simulation. 
+    
+    Arguments:
+        const: [Constants]
+
+    Keyword arguments:
+        compute_wake: [bool] If True, the wake profile will be computed. False by default.
+        terminate: [callable] Termination predicate called after every step as terminate(results_row, 
+            n_active) (see ObservationEnvelope). If it returns a reason, the simulation is stopped and the 
+            reason is stored in const.abort_reason. None by default.
+
+    Return:
+        (frag_main, results_list, wake_results)
+    """
 
     # Ensure that the grain mass min is smaller than the grain mass max
     if const.erosion_mass_min > const.erosion_mass_max:
@@ -1369,6 +1864,7 @@ def runSimulation(const, compute_wake=False):
     const.n_active = 1
     const.total_fragments = 1
     const.main_bottom_ht = const.h_init
+    const.abort_reason = None
 
 
     ###
@@ -1386,6 +1882,9 @@ def runSimulation(const, compute_wake=False):
     if (const.wake_heights is not None) and compute_wake:
         wake_heights_queue = sorted(const.wake_heights, reverse=True)
 
+    # Get the atmosphere density lookup table
+    dens_table = atmDensityTable(const)
+
 
     # Run the simulation until all fragments stop ablating
     results_list = []
@@ -1397,7 +1896,8 @@ def runSimulation(const, compute_wake=False):
             tau_total, tau_main, tau_eroded, brightest_height, brightest_length, brightest_vel, \
             leading_frag_height, leading_frag_length, leading_frag_vel, leading_frag_dyn_press, \
             mass_total_active, main_mass, main_height, main_length, main_vel, main_dyn_press, \
-            wake = ablateAll(fragments, const, compute_wake=compute_wake, wake_heights_queue=wake_heights_queue)
+            wake = ablateAll(fragments, const, compute_wake=compute_wake, wake_heights_queue=wake_heights_queue, \
+                dens_table=dens_table)
         
         # Track the bottom height of the main fragment
         if main_height > 0:
@@ -1413,6 +1913,12 @@ def runSimulation(const, compute_wake=False):
             leading_frag_dyn_press, mass_total_active, main_mass, main_height, main_length, main_vel, \
             main_dyn_press])
 
+        # Stop the simulation if it can't match the observations
+        if terminate is not None:
+            const.abort_reason = terminate(results_list[-1], const.n_active)
+            if const.abort_reason is not None:
+                break
+
 
 
     # Find the main fragment and return it with results
@@ -1456,6 +1962,548 @@ def runSimulation(const, compute_wake=False):
     return frag_main, results_list, wake_results
 
 
+def ablateAllArrays(frags, const, compute_wake=False, wake_heights_queue=None, dens_table=None):
+    """ Perform single body ablation of all fragments using the 4th order Runge-Kutta method, with the 
+        fragments stored in a FragmentArrays container. All active fragments are advanced at once, and the
+        physics is exactly the same as in ablateAll. Complex fragmentation is not supported.
+
+    Arguments:
+        frags: [FragmentArrays] Fragments to ablate.
+        const: [object] Constants instance.
+
+    Keyword arguments:
+        compute_wake: [bool] If True, the wake profile will be computed. False by default.
+        wake_heights_queue: [list] A list of heights at which the wake should be computed. None by default.
+        dens_table: [AtmDensityTableCy] Atmosphere density lookup table (see atmDensityTable). None by 
+            default, in which case the density polynomial is evaluated directly.
+
+    Return:
+        Same as ablateAll, with the FragmentArrays instance returned instead of the list of fragments.
+    """
+
+    dt = const.dt
+
+    # Keep track of the luminosity of eroded and disrupted fragments
+    luminosity_eroded = 0.0
+    tau_eroded = 0.0
+
+    # Keep track of parameters of the brightest fragment
+    brightest_height = 0.0
+    brightest_length = 0.0
+    brightest_vel    = 0.0
+
+    # Keep track of the the main fragment parameters
+    luminosity_main = 0.0
+    tau_main = 0.0
+    main_mass = 0.0
+    main_height = 0.0
+    main_length = 0.0
+    main_vel = 0.0
+    main_dyn_press = 0.0
+
+    # Number of fragments before new children are added in this time step
+    n_prev = frags.n
+
+    # Indices of active fragments
+    act = np.flatnonzero(frags.active[:n_prev])
+
+    # Get the state of active fragments
+    m = frags.m[act]
+    v = frags.v[act]
+    vv = frags.vv[act]
+    vh = frags.vh[act]
+    h = frags.h[act]
+    h_grav_drop_total = frags.h_grav_drop_total[act]
+    length = frags.length[act]
+    erosion_coeff = frags.erosion_coeff[act]
+    erosion_enabled = frags.erosion_enabled[act]
+    is_main = frags.main[act]
+
+    # Allocate the outputs of the time step
+    n_act = len(act)
+    mass_loss_ablation = np.zeros(n_act)
+    mass_loss_erosion = np.zeros(n_act)
+    tau = np.zeros(n_act)
+    lum = np.zeros(n_act)
+    frag_lum = np.zeros(n_act)
+    frag_q = np.zeros(n_act)
+    dyn_press = np.zeros(n_act)
+
+    # Advance all active fragments by one time step (the state arrays are updated in place)
+    ablateStep_vect(dt, G0, const.r_earth, const.h_init, np.cos(const.zenith_angle), const.lum_eff_type, \
+        const.lum_eff, const.mu, const.dens_co, frags.K[act], frags.sigma[act], \
+        np.where(erosion_enabled, erosion_coeff, 0.0), frags.n_grains[act], m, v, vv, vh, h, \
+        h_grav_drop_total, length, mass_loss_ablation, mass_loss_erosion, tau, lum, frag_lum, frag_q, \
+        dyn_press, dens_table)
+
+
+    # Sum the totals across all fragments in the same order as ablateAll (cumsum adds sequentially)
+    if len(act):
+        luminosity_total = np.cumsum(frag_lum)[-1]
+        electron_density_total = np.cumsum(frag_q)[-1]
+        tau_total = np.cumsum(tau*frag_lum)[-1]
+    else:
+        luminosity_total = 0.0
+        electron_density_total = 0.0
+        tau_total = 0.0
+
+    # Keep track of the parameters of the main fragment
+    main_i = np.flatnonzero(is_main)
+    if len(main_i):
+        main_i = main_i[0]
+        luminosity_main = frag_lum[main_i]
+        tau_main = tau[main_i]
+        main_mass = m[main_i]
+        main_height = h[main_i]
+        main_length = length[main_i]
+        main_vel = v[main_i]
+        main_dyn_press = dyn_press[main_i]
+    else:
+        main_i = None
+
+
+    # Find fragments which are done
+    killed = (m <= const.m_kill) | (v < const.v_kill) | (h < const.h_kill) | (frag_lum < 0)
+    if const.len_kill > 0:
+        killed |= length > const.len_kill
+
+    const.n_active -= np.count_nonzero(killed)
+    if (main_i is not None) and killed[main_i]:
+        const.main_mass_exhaustion_ht = h[main_i]
+
+    alive = ~killed
+
+
+    # Keep track of the brightest fragment
+    alive_i = np.flatnonzero(alive)
+    brightest_i = brightestFragmentIndex(frag_lum[alive_i], lum[alive_i])
+    if brightest_i >= 0:
+        brightest_i = alive_i[brightest_i]
+        brightest_height = h[brightest_i]
+        brightest_length = length[brightest_i]
+        brightest_vel = v[brightest_i]
+
+    # Keep track of luminosity of eroded and disrupted fragments ejected directly from the main fragment
+    if const.fragmentation_show_individual_lcs:
+        eroded = alive & ~is_main
+        if np.any(eroded):
+            luminosity_eroded = np.cumsum(frag_lum[eroded])[-1]
+            tau_eroded = np.cumsum(tau[eroded]*frag_lum[eroded])[-1]
+
+
+    # Check if the erosion should start, given the height
+    if const.erosion_on:
+        erosion_start = alive & erosion_enabled & (h < const.erosion_height_start)
+        erosion_coeff[erosion_start] = np.where(const.erosion_height_change >= h[erosion_start], \
+            const.erosion_coeff_change, const.erosion_coeff)
+
+
+    # Store the new state of active fragments
+    frags.m[act] = m
+    frags.v[act] = v
+    frags.vv[act] = vv
+    frags.vh[act] = vh
+    frags.h[act] = h
+    frags.h_grav_drop_total[act] = h_grav_drop_total
+    frags.length[act] = length
+    frags.lum[act] = frag_lum
+    frags.q[act] = frag_q
+    frags.dyn_press[act] = dyn_press
+    frags.erosion_coeff[act] = erosion_coeff
+    frags.active[act[killed]] = False
+
+
+    # Update the main fragment physical parameters if it is changed after erosion coefficient change
+    if (main_i is not None) and const.erosion_on and erosion_start[main_i] \
+        and (const.erosion_height_change >= h[main_i]):
+
+        i = act[main_i]
+
+        # Update the density
+        frags.rho[i] = const.erosion_rho_change
+        frags.K[i] = frags.gamma[i]*const.shape_factor*frags.rho[i]**(-2/3.0)
+
+        # Update the ablation coeff
+        frags.sigma[i] = const.erosion_sigma_change
+
+
+    # Find fragments which generate grains or disrupt. These are handled one at a time as there are 
+    #   usually only a few of them
+    grain_parents = alive & erosion_enabled & (np.abs(mass_loss_erosion) > 0)
+    if const.disruption_on:
+        disrupting = alive & frags.disruption_enabled[act] & (dyn_press > const.compressive_strength)
+    else:
+        disrupting = np.zeros_like(alive)
+
+    for j in np.flatnonzero(grain_parents | disrupting):
+
+        i = act[j]
+
+        # Create grains for erosion-enabled fragments
+        if grain_parents[j]:
+
+            grain_masses, grain_counts = fragmentMassBins(const, abs(mass_loss_erosion[j]), \
+                frags.erosion_mass_index[i], frags.erosion_mass_min[i], frags.erosion_mass_max[i], \
+                mass_model=const.erosion_grain_distribution)
+
+            frags.spawnChildren(const, i, grain_masses, grain_counts, keep_eroding=False)
+            const.n_active += len(grain_masses)
+
+            # Record physical parameters at the beginning of erosion for the main fragment
+            if frags.main[i]:
+                if const.erosion_beg_vel is None:
+
+                    const.erosion_beg_vel = frags.v[i]
+                    const.erosion_beg_mass = frags.m[i]
+                    const.erosion_beg_dyn_press = dyn_press[j]
+
+                # Record the mass when erosion is changed
+                elif (const.erosion_height_change >= frags.h[i]) and (const.mass_at_erosion_change is None):
+                    const.mass_at_erosion_change = frags.m[i]
+
+
+        # Disrupt the fragment if the dynamic pressure exceeds its strength
+        if disrupting[j]:
+
+            # Compute the mass that should be disrupted into fragments
+            mass_frag_disruption = frags.m[i]*(1 - const.disruption_mass_grain_ratio)
+
+            fragments_total_mass = 0
+            if mass_frag_disruption > 0:
+
+                # Disrupt the meteoroid into fragments
+                disruption_mass_min = const.disruption_mass_min_ratio*mass_frag_disruption
+                disruption_mass_max = const.disruption_mass_max_ratio*mass_frag_disruption
+
+                # Generate larger fragments, possibly assign them a separate erosion coefficient
+                frag_masses, frag_counts = fragmentMassBins(const, mass_frag_disruption, \
+                    const.disruption_mass_index, disruption_mass_min, disruption_mass_max, \
+                    mass_model=const.erosion_grain_distribution)
+
+                children = frags.spawnChildren(const, i, frag_masses, frag_counts, \
+                    keep_eroding=const.erosion_on, disruption=True)
+                const.n_active += len(frag_masses)
+
+                # Compute the mass that went into fragments
+                fragments_total_mass = sum([n_grains*m_frag for n_grains, m_frag \
+                    in zip(frags.n_grains[children].tolist(), frags.m[children].tolist())])
+
+                # Assign the height of disruption
+                const.disruption_height = frags.h[i]
+
+                print('Disrupting id', frags.id[i])
+                print('Height: {:.3f} km'.format(const.disruption_height/1000))
+                print('Disrupted mass: {:e}'.format(mass_frag_disruption))
+                print('Mass distribution:')
+                for n_grains, m_frag in zip(frags.n_grains[children], frags.m[children]):
+                    print('{:4d}: {:e} kg'.format(n_grains, m_frag))
+                print('Disrupted total mass: {:e}'.format(fragments_total_mass))
+
+            # Disrupt a portion of the leftover mass into grains
+            mass_grain_disruption = frags.m[i] - fragments_total_mass
+            if mass_grain_disruption > 0:
+
+                grain_masses, grain_counts = fragmentMassBins(const, mass_grain_disruption, \
+                    frags.erosion_mass_index[i], frags.erosion_mass_min[i], frags.erosion_mass_max[i], \
+                    mass_model=const.erosion_grain_distribution)
+
+                frags.spawnChildren(const, i, grain_masses, grain_counts, keep_eroding=False)
+                const.n_active += len(grain_masses)
+
+            # Deactive the disrupted fragment. Note that the fragment is counted as killed twice, the same as
+            #   in ablateAll (once after the disruption and once in the final mass check)
+            frags.m[i] = 0
+            frags.active[i] = False
+            const.n_active -= 2
+            if frags.main[i]:
+                const.main_mass_exhaustion_ht = frags.h[i]
+
+
+    # Track the leading fragment length (only fragments which existed at the beginning of the step)
+    lead_candidates = np.flatnonzero(frags.active[:n_prev])
+    if len(lead_candidates):
+        leading_frag = lead_candidates[np.argmax(frags.length[lead_candidates])]
+        leading_frag_length    = frags.length[leading_frag]
+        leading_frag_height    = frags.h[leading_frag]
+        leading_frag_vel       = frags.v[leading_frag]
+        leading_frag_dyn_press = frags.dyn_press[leading_frag]
+    else:
+        leading_frag_length    = None
+        leading_frag_height    = None
+        leading_frag_vel       = None
+        leading_frag_dyn_press = None
+
+    ### Compute the wake profile ###
+    
+    # If the specific wake heights are given, check if the current height is below the next wake height
+    if (wake_heights_queue is not None) and (leading_frag_height is not None):
+
+        # If there are any heights left in the queue
+        if len(wake_heights_queue):
+            
+            # If the current height is below the next wake height, compute the wake
+            if leading_frag_height <= wake_heights_queue[0]:
+                compute_wake = True
+                
+                # Pop all heights that are above the current height (including the one we just passed)
+                while len(wake_heights_queue) and (leading_frag_height <= wake_heights_queue[0]):
+                    wake_heights_queue.pop(0)
+
+            else:
+                compute_wake = False
+        
+        else:
+            compute_wake = False
+
+
+    if compute_wake and (leading_frag_length is not None):
+
+        # Evaluate the Gaussian from +3 sigma in front of the leading fragment to behind
+        front_len = leading_frag_length + 3*const.wake_psf[0]
+        back_len = leading_frag_length - const.wake_extension
+
+        length_array = np.linspace(back_len, front_len, 500) - leading_frag_length
+
+        # Take only those lengths inside the wake window
+        wake_frags = lead_candidates[(frags.length[lead_candidates] > back_len) \
+            & (frags.length[lead_candidates] < front_len)]
+        frag_list = [frags.toFragment(i, const) for i in wake_frags]
+
+        # Store evaluated wake
+        wake = Wake(const, frag_list, leading_frag_length, length_array)
+
+    else:
+        wake = None
+
+    ### ###
+
+    # Compute the total mass of all active fragments
+    active_mass = frags.m[:frags.n][frags.active[:frags.n]]
+    if len(active_mass):
+        mass_total_active = np.sum(active_mass)
+    else:
+        mass_total_active = 0.0
+
+    # Increment the running time
+    const.total_time += const.dt
+
+    # Weigh the tau by luminosity
+    if luminosity_total > 0:
+        tau_total /= luminosity_total
+    else:
+        tau_total = 0
+
+    if luminosity_eroded > 0:
+        tau_eroded /= luminosity_eroded
+    else:
+        tau_eroded = 0
+
+    return frags, const, luminosity_total, luminosity_main, luminosity_eroded, electron_density_total, \
+        tau_total, tau_main, tau_eroded, brightest_height, brightest_length, brightest_vel, \
+        leading_frag_height, leading_frag_length, leading_frag_vel, leading_frag_dyn_press, \
+        mass_total_active, main_mass, main_height, main_length, main_vel, main_dyn_press, wake
+
+
+def runSimulationArrays(const, compute_wake=False, compaction_ratio=0.5, terminate=None):
+    """ Run the ablation simulation with fragments stored as a structure of arrays. The results are the same 
+        as the ones of runSimulation, but all fragments are advanced together in every time step, which is 
+        much faster when the erosion produces many grains. Complex fragmentation is not supported, 
+        runSimulation is used in that case.
+
+    Arguments:
+        const: [Constants]
+
+    Keyword arguments:
+        compute_wake: [bool] If True, the wake profile will be computed. False by default.
+        compaction_ratio: [float] Dead fragments are removed from the arrays when their fraction exceeds
+            this value. 0.5 by default.
+        terminate: [callable] Termination predicate, see runSimulation. None by default.
+
+    Return:
+        (frag_main, results_list, wake_results): Same as runSimulation.
+    """
+
+    # Complex fragmentation modifies the fragments in ways which are not supported by the array engine
+    if const.fragmentation_on:
+        return runSimulation(const, compute_wake=compute_wake, terminate=terminate)
+
+    # Ensure that the grain mass min is smaller than the grain mass max
+    if const.erosion_mass_min > const.erosion_mass_max:
+        const.erosion_mass_min, const.erosion_mass_max = const.erosion_mass_max, const.erosion_mass_min
+
+
+    # Init the main fragment
+    frag = Fragment()
+    frag.init(const, const.m_init, const.rho, const.v_init, const.sigma, const.gamma, const.zenith_angle, \
+        const.erosion_mass_index, const.erosion_mass_min, const.erosion_mass_max)
+    frag.main = True
+    
+    # Erode the main fragment
+    frag.erosion_enabled = True
+
+    # Disrupt the main fragment
+    frag.disruption_enabled = True
+
+    frags = FragmentArrays()
+    frags.appendFragment(frag)
+
+
+    # Reset simulation parameters
+    const.total_time = 0
+    const.n_active = 1
+    const.total_fragments = 1
+    const.main_bottom_ht = const.h_init
+    const.abort_reason = None
+
+
+    # Check that the grain density is larger than the bulk density, and if not, set the grain density
+    #   to be the same as the bulk density
+    if const.rho > const.rho_grain:
+        const.rho_grain = const.rho
+
+
+    # If the wake heights are given, sort them by height descending
+    wake_heights_queue = None
+    if (const.wake_heights is not None) and compute_wake:
+        wake_heights_queue = sorted(const.wake_heights, reverse=True)
+
+    # Get the atmosphere density lookup table
+    dens_table = atmDensityTable(const)
+
+
+    # Run the simulation until all fragments stop ablating
+    results_list = []
+    wake_results = []
+    while const.n_active > 0:
+
+        # Ablate the fragments
+        frags, const, luminosity_total, luminosity_main, luminosity_eroded, electron_density_total, \
+            tau_total, tau_main, tau_eroded, brightest_height, brightest_length, brightest_vel, \
+            leading_frag_height, leading_frag_length, leading_frag_vel, leading_frag_dyn_press, \
+            mass_total_active, main_mass, main_height, main_length, main_vel, main_dyn_press, \
+            wake = ablateAllArrays(frags, const, compute_wake=compute_wake, \
+                wake_heights_queue=wake_heights_queue, dens_table=dens_table)
+        
+        # Track the bottom height of the main fragment
+        if main_height > 0:
+            const.main_bottom_ht = min(main_height, const.main_bottom_ht)
+
+        # Store wake estimation results
+        wake_results.append(wake)
+
+        # Stack results list
+        results_list.append([const.total_time, luminosity_total, luminosity_main, luminosity_eroded, \
+            electron_density_total, tau_total, tau_main, tau_eroded, brightest_height, brightest_length, \
+            brightest_vel, leading_frag_height, leading_frag_length, leading_frag_vel, \
+            leading_frag_dyn_press, mass_total_active, main_mass, main_height, main_length, main_vel, \
+            main_dyn_press])
+
+        # Stop the simulation if it can't match the observations
+        if terminate is not None:
+            const.abort_reason = terminate(results_list[-1], const.n_active)
+            if const.abort_reason is not None:
+                break
+
+        # Remove dead fragments when there are too many of them
+        if frags.n - np.count_nonzero(frags.active[:frags.n]) > compaction_ratio*frags.n:
+            frags.compact()
+
+
+    # Find the main fragment and return it with results
+    frag_main = None
+    main_indices = np.flatnonzero(frags.main[:frags.n])
+    if len(main_indices):
+        frag_main = frags.toFragment(main_indices[0], const)
+
+    # Reset all fragment lists for entries
+    for frag_entry in const.fragmentation_entries:
+        frag_entry.fragments = []
+
+
+    return frag_main, results_list, wake_results
+
+
+def runSimulationCompiled(const, compute_wake=False, terminate=None):
+    """ Run the ablation simulation with the compiled simulation kernel. The whole time loop runs in C, 
+        which is an order of magnitude faster than runSimulation. The results are the same to within the 
+        floating point rounding, but they are returned as an array instead of a list. The wake and complex 
+        fragmentation are not supported by the kernel, runSimulationArrays is used in those cases (and if 
+        the kernel is not available). If const.adaptive_step is True, the kernel adapts the time step and 
+        resamples the results to const.dt.
+
+    Arguments:
+        const: [Constants]
+
+    Keyword arguments:
+        compute_wake: [bool] If True, the wake profile will be computed. False by default.
+        terminate: [callable] Termination predicate, see runSimulation. It is called with a row of the 
+            results array. None by default.
+
+    Return:
+        (frag_main, results_list, wake_results): Same as runSimulation, except that results_list is an 
+            (n_steps, 21) ndarray and wake_results contains only None values.
+    """
+
+    if compute_wake or const.fragmentation_on or (SimulationKernelCy is None):
+        return runSimulationArrays(const, compute_wake=compute_wake, terminate=terminate)
+
+    # Ensure that the grain mass min is smaller than the grain mass max
+    if const.erosion_mass_min > const.erosion_mass_max:
+        const.erosion_mass_min, const.erosion_mass_max = const.erosion_mass_max, const.erosion_mass_min
+
+    # Check that the grain density is larger than the bulk density, and if not, set the grain density
+    #   to be the same as the bulk density
+    if const.rho > const.rho_grain:
+        const.rho_grain = const.rho
+
+
+    # Init the kernel, the recorded parameters are kept between runs as in runSimulation
+    kernel = SimulationKernelCy(ConstantsCy(const, dens_table=atmDensityTable(const)))
+    kernel.erosion_beg_vel = const.erosion_beg_vel
+    kernel.erosion_beg_mass = const.erosion_beg_mass
+    kernel.erosion_beg_dyn_press = const.erosion_beg_dyn_press
+    kernel.mass_at_erosion_change = const.mass_at_erosion_change
+    kernel.disruption_height = const.disruption_height
+    kernel.main_mass_exhaustion_ht = const.main_mass_exhaustion_ht
+
+    # Run the simulation until all fragments stop ablating (older constants might not have the adaptive
+    #   step parameters)
+    if getattr(const, 'adaptive_step', False):
+        results = kernel.run(adaptive=True, tol=const.adaptive_step_tol, \
+            max_factor=const.adaptive_step_max_factor, terminate=terminate)
+    else:
+        results = kernel.run(terminate=terminate)
+
+
+    # Copy the simulation parameters back to the constants
+    const.total_time = kernel.total_time
+    const.n_active = kernel.n_active
+    const.total_fragments = kernel.total_fragments
+    const.main_bottom_ht = kernel.main_bottom_ht
+    const.erosion_beg_vel = kernel.erosion_beg_vel
+    const.erosion_beg_mass = kernel.erosion_beg_mass
+    const.erosion_beg_dyn_press = kernel.erosion_beg_dyn_press
+    const.mass_at_erosion_change = kernel.mass_at_erosion_change
+    const.disruption_height = kernel.disruption_height
+    const.main_mass_exhaustion_ht = kernel.main_mass_exhaustion_ht
+    const.abort_reason = kernel.abort_reason
+
+
+    # The main fragment is always the first one, as it is never removed from the arrays
+    frag_main = Fragment()
+    frag_main.const = const
+    frag_main.zenith_angle = const.zenith_angle
+    for name, value in kernel.fr.state(0).items():
+        setattr(frag_main, name, value)
+
+    # Reset all fragment lists for entries
+    for frag_entry in const.fragmentation_entries:
+        frag_entry.fragments = []
+
+
+    return frag_main, results, [None]*len(results)
+
+
 def energyReceivedBeforeErosion(const, lam=1.0):
     """ Compute the energy the meteoroid receive prior to erosion, assuming no major mass loss occured. 
     
@@ -1,3 +1,4 @@
+# cython: cpow=True
 """ Fast cython functions for the MetSimErosion module. """
 
 
@@ -6,7 +7,7 @@ cimport cython
 
 import numpy as np
 cimport numpy as np
-from libc.math cimport sqrt, M_PI, M_PI_2, atan2, tanh, log, exp, log10
+from libc.math cimport sqrt, M_PI, M_PI_2, atan2, tanh, log, exp, log10, cos, sin, fabs, floor, NAN, INFINITY
 
 
 # Define cython types for numpy arrays
@@ -14,269 +15,288 @@ FLOAT_TYPE = np.float64
 ctypedef np.float64_t FLOAT_TYPE_t
 
 
-### ATTEMPTED TO CONVERT THESE CLASSES TO CYTHON, BUT THERE ARE STILL ERRORS AND THE EXECUTION IS NOT ANY 
-### FASTER
-
-# @cython.auto_pickle(True)
-# cdef class ConstantsCy:
-#     cdef double dt, total_time, m_kill, v_kill, h_kill, h_init, P_0m
-#     cdef double wake_psf, wake_extension
-#     cdef double rho, m_init, v_init, shape_factor, sigma, zenith_angle, gamma, rho_grain
-#     cdef double erosion_height_start, erosion_coeff, erosion_height_change, erosion_coeff_change, \
-#         erosion_mass_index, erosion_mass_min, erosion_mass_max
-#     cdef double compressive_strength, disruption_height, disruption_erosion_coeff, disruption_mass_index, \
-#         disruption_mass_min_ratio, disruption_mass_max_ratio, disruption_mass_grain_ratio
-#     cdef int n_active, total_fragments
-#     cdef FLOAT_TYPE_t[:] dens_co
-#     cdef bint erosion_on, disruption_on
-    
-
-#     def __init__(self):
-#         """ Constant parameters for the ablation modelling. """
-
-#         ### Simulation parameters ###
-
-#         # Time step
-#         self.dt = 0.005
-
-#         # Time elapsed since the beginning
-#         self.total_time = 0
-
-#         # Number of active fragments
-#         self.n_active = 0
-
-#         # Minimum possible mass for ablation (kg)
-#         self.m_kill = 1e-14
-
-#         # Minimum ablation velocity (m/s)
-#         self.v_kill = 3000
-
-#         # Minimum height (m)
-#         self.h_kill = 60000
-
-#         # Initial meteoroid height (m)
-#         self.h_init = 180000
-
-#         # Power of a 0 magnitude meteor
-#         self.P_0m = 840
-
-#         # Atmosphere density coefficients
-#         self.dens_co = np.array([-9.02726494,
-#                         0.108986696,
-#                         -0.0005189,
-#                         -2.0646e-5,
-#                         1.93881e-7,
-#                         -4.7231e-10])
+# Earth acceleration in m/s^2 on the surface (same as G0 in MetSimErosion)
+cdef double G0_CY = 9.81
 
 
-#         self.total_fragments = 0
+### ATMOSPHERE DENSITY LOOKUP TABLE ###
+### Evaluating the density polynomial takes 7 powers per call and it is done for every fragment at every time
+### step. The table stores the natural log of the polynomial density on a regular height grid, so a density 
+### lookup is a linear interpolation and a single exp. Heights outside of the table use the polynomial.
 
-#         ### ###
+cdef class AtmDensityTableCy:
+    cdef public double ht_min, ht_max, ht_step
+    cdef double ht_step_inv
+    cdef Py_ssize_t n
+    cdef public FLOAT_TYPE_t[:] log_dens
+    cdef public FLOAT_TYPE_t[:] dens_co
 
+    def __init__(self, dens_co, double ht_min, double ht_max, double ht_step):
+        """ Tabulate the atmosphere density polynomial.
 
-#         ### Wake parameters ###
+        Arguments:
+            dens_co: [ndarray] Array of 7th order poly coeffs (see atmDensityPoly).
+            ht_min: [double] Bottom height of the table (m).
+            ht_max: [double] Top height of the table (m).
+            ht_step: [double] Height step of the table (m).
+        """
 
-#         # PSF stddev (m)
-#         self.wake_psf = 3.0
+        self.dens_co = np.array(dens_co, dtype=FLOAT_TYPE)
 
-#         # Wake extension from the leading fragment (m)
-#         self.wake_extension = 200
+        self.n = int(np.ceil((ht_max - ht_min)/ht_step)) + 1
+        self.ht_min = ht_min
+        self.ht_step = ht_step
+        self.ht_step_inv = 1.0/ht_step
+        self.ht_max = ht_min + (self.n - 1)*ht_step
 
-#         ### ###
+        # Evaluate the polynomial (log10 of the density) on the grid and convert to the natural log
+        ht_arr = (ht_min + ht_step*np.arange(self.n))/1e6
+        log_dens = np.zeros(self.n, dtype=FLOAT_TYPE)
+        for i in range(7):
+            log_dens += self.dens_co[i]*ht_arr**i
 
+        self.log_dens = log_dens*np.log(10)
 
 
-#         ### Main meteoroid properties ###
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    @cython.cdivision(True)
+    cdef double densityC(self, double ht):
+        """ Same as density, but can be called directly from C. """
 
-#         # Meteoroid bulk density (kg/m^3)
-#         self.rho = 1000
+        cdef double x, frac
+        cdef Py_ssize_t i
 
-#         # Initial meteoroid mass (kg)
-#         self.m_init = 2e-5
+        x = (ht - self.ht_min)*self.ht_step_inv
 
-#         # Initial meteoroid veocity (m/s)
-#         self.v_init = 23570
+        # Use the polynomial outside of the table
+        if (x < 0) or (x >= self.n - 1):
+            return atmDensityPolyScalar(ht, self.dens_co)
 
-#         # Shape factor (1.21 is sphere)
-#         self.shape_factor = 1.21
+        i = <Py_ssize_t>x
+        frac = x - i
 
-#         # Main fragment ablation coefficient
-#         self.sigma = 0.023/1e6
+        return exp(self.log_dens[i] + frac*(self.log_dens[i + 1] - self.log_dens[i]))
 
-#         # Zenith angle (radians)
-#         self.zenith_angle = np.radians(45)
 
-#         # Drag coefficient
-#         self.gamma = 1.0
+    cpdef double density(self, double ht):
+        """ Calculates the atmospheric density in kg/m^3.
 
-#         # Grain bulk density (kg/m^3)
-#         self.rho_grain = 3000
+        Arguments:
+            ht: [double] Height in meters.
 
-#         ### ###
+        Return:
+            [double] Atmosphere density at height h (kg/m^3)
 
+        """
 
-#         ### Erosion properties ###
+        return self.densityC(ht)
 
-#         # Toggle erosion on/off
-#         self.erosion_on = True
-
-        
-#         # Height at which the erosion starts (meters)
-#         self.erosion_height_start = 102000
-
-#         # Erosion coefficient (s^2/m^2)
-#         self.erosion_coeff = 0.33/1e6
-
-        
-#         # Height at which the erosion coefficient changes (meters)
-#         self.erosion_height_change = 90000
-
-#         # Erosion coefficient after the change (s^2/m^2)
-#         self.erosion_coeff_change = 0.33/1e6
 
 
-#         # Grain mass distribution index
-#         self.erosion_mass_index = 2.5
+### COMPILED SIMULATION KERNEL ###
+### ConstantsCy holds a typed copy of the simulation parameters from a Constants instance, FragmentArraysCy 
+### stores all fragments as a structure of arrays (the same layout as FragmentArrays in MetSimErosion), and 
+### SimulationKernelCy runs the whole simulation (time loop, ablation, erosion and disruption) in C. Only
+### the wake and complex fragmentation are not supported, runSimulationCompiled in MetSimErosion falls back to
+### the Python implementation in those cases.
 
-#         # Mass range for grains (kg)
-#         self.erosion_mass_min = 1.0e-11
-#         self.erosion_mass_max = 5.0e-10
+cdef class ConstantsCy:
+    cdef public double dt, m_kill, v_kill, h_kill, len_kill, h_init, r_earth, zenith_angle, lum_eff, mu
+    cdef public double rho, m_init, v_init, shape_factor, sigma, gamma, rho_grain
+    cdef public double erosion_bins_per_10mass, erosion_height_start, erosion_coeff, erosion_height_change, \
+        erosion_coeff_change, erosion_rho_change, erosion_sigma_change, erosion_mass_index, erosion_mass_min, \
+        erosion_mass_max
+    cdef public double compressive_strength, disruption_erosion_coeff, disruption_mass_index, \
+        disruption_mass_min_ratio, disruption_mass_max_ratio, disruption_mass_grain_ratio
+    cdef public int lum_eff_type
+    cdef public bint erosion_on, disruption_on, gamma_distribution, show_individual_lcs
+    cdef public FLOAT_TYPE_t[:] dens_co
+    cdef public AtmDensityTableCy dens_table
 
-#         ###
+    def __init__(self, const_py, dens_table=None):
+        """ Typed copy of the simulation parameters.
 
+        Arguments:
+            const_py: [Constants] Constants instance from MetSimErosion.
 
-#         ### Disruption properties ###
+        Keyword arguments:
+            dens_table: [AtmDensityTableCy] Atmosphere density lookup table made from const_py.dens_co. None
+                by default, in which case the density polynomial is evaluated directly.
+        """
 
-#         # Toggle disruption on/off
-#         self.disruption_on = True
+        ### Simulation parameters ###
 
-#         # Meteoroid compressive strength (Pa)
-#         self.compressive_strength = 2000
+        self.dt = const_py.dt
+        self.m_kill = const_py.m_kill
+        self.v_kill = const_py.v_kill
+        self.h_kill = const_py.h_kill
+        self.len_kill = const_py.len_kill
+        self.h_init = const_py.h_init
+        self.r_earth = const_py.r_earth
+        self.dens_co = np.array(const_py.dens_co, dtype=FLOAT_TYPE)
+        self.dens_table = dens_table
 
-#         # Height of disruption (will be assigned when the disruption occures)
-#         self.disruption_height = -1
+        ### ###
 
-#         # Erosion coefficient to use after disruption
-#         self.disruption_erosion_coeff = self.erosion_coeff
 
-#         # Disruption mass distribution index
-#         self.disruption_mass_index = 2.0
+        ### Main meteoroid properties ###
 
+        self.rho = const_py.rho
+        self.m_init = const_py.m_init
+        self.v_init = const_py.v_init
+        self.shape_factor = const_py.shape_factor
+        self.sigma = const_py.sigma
+        self.zenith_angle = const_py.zenith_angle
+        self.gamma = const_py.gamma
+        self.rho_grain = const_py.rho_grain
+        self.lum_eff_type = const_py.lum_eff_type
+        self.lum_eff = const_py.lum_eff
+        self.mu = const_py.mu
 
-#         # Mass ratio for disrupted fragments as the ratio of the disrupted mass
-#         self.disruption_mass_min_ratio = 1.0/100
-#         self.disruption_mass_max_ratio = 10.0/100
+        ### ###
 
-#         # Ratio of mass that will disrupt into grains
-#         self.disruption_mass_grain_ratio = 0.25
 
-#         ### ###
+        ### Erosion properties ###
 
+        self.erosion_on = const_py.erosion_on
+        self.erosion_bins_per_10mass = const_py.erosion_bins_per_10mass
+        self.erosion_height_start = const_py.erosion_height_start
+        self.erosion_coeff = const_py.erosion_coeff
+        self.erosion_height_change = const_py.erosion_height_change
+        self.erosion_coeff_change = const_py.erosion_coeff_change
+        self.erosion_rho_change = const_py.erosion_rho_change
+        self.erosion_sigma_change = const_py.erosion_sigma_change
+        self.erosion_mass_index = const_py.erosion_mass_index
+        self.erosion_mass_min = const_py.erosion_mass_min
+        self.erosion_mass_max = const_py.erosion_mass_max
+        self.gamma_distribution = const_py.erosion_grain_distribution == 'gamma'
 
-#     ### These two functions enable the object to be pickled
-#     ### More info: https://stackoverflow.com/questions/43760919/save-cython-extension-by-pickle
-#     ### Be careful when returning numpy arrays, .base needs to be added (e.g. see self.dens_co)
+        ### ###
 
-#     def __getstate__(self):
-#         return self.dt, self.total_time, self.n_active, self.m_kill, self.v_kill, self.h_kill, self.h_init, \
-#         self.P_0m, self.dens_co.base, self.total_fragments, self.wake_psf, self.wake_extension, self.rho, \
-#         self.m_init, self.v_init, self.shape_factor, self.sigma, self.zenith_angle, self.gamma, \
-#         self.rho_grain, self.erosion_on, self.erosion_height_start, self.erosion_coeff, \
-#         self.erosion_height_change, self.erosion_coeff_change, self.erosion_mass_index, \
-#         self.erosion_mass_min, self.erosion_mass_max, self.disruption_on, self.compressive_strength, \
-#         self.disruption_height, self.disruption_erosion_coeff, self.disruption_mass_index, \
-#         self.disruption_mass_min_ratio, self.disruption_mass_max_ratio, self.disruption_mass_grain_ratio
 
+        ### Disruption properties ###
 
-#     def __setstate__(self, x):
-#         self.dt, self.total_time, self.n_active, self.m_kill, self.v_kill, self.h_kill, self.h_init, \
-#         self.P_0m, self.dens_co, self.total_fragments, self.wake_psf, self.wake_extension, self.rho, \
-#         self.m_init, self.v_init, self.shape_factor, self.sigma, self.zenith_angle, self.gamma, \
-#         self.rho_grain, self.erosion_on, self.erosion_height_start, self.erosion_coeff, \
-#         self.erosion_height_change, self.erosion_coeff_change, self.erosion_mass_index, \
-#         self.erosion_mass_min, self.erosion_mass_max, self.disruption_on, self.compressive_strength, \
-#         self.disruption_height, self.disruption_erosion_coeff, self.disruption_mass_index, \
-#         self.disruption_mass_min_ratio, self.disruption_mass_max_ratio, self.disruption_mass_grain_ratio = x
+        self.disruption_on = const_py.disruption_on
+        self.compressive_strength = const_py.compressive_strength
+        self.disruption_erosion_coeff = const_py.disruption_erosion_coeff
+        self.disruption_mass_index = const_py.disruption_mass_index
+        self.disruption_mass_min_ratio = const_py.disruption_mass_min_ratio
+        self.disruption_mass_max_ratio = const_py.disruption_mass_max_ratio
+        self.disruption_mass_grain_ratio = const_py.disruption_mass_grain_ratio
 
-#     ### ###
+        ### ###
 
+        self.show_individual_lcs = const_py.fragmentation_show_individual_lcs
 
-# # Create a class that Python can access and has a __dict__
-# class Constants(ConstantsCy):
-#     pass
 
 
+# Names and types of per-fragment arrays in FragmentArraysCy
+FRAGMENT_FIELDS = [(name, FLOAT_TYPE) for name in ['K', 'm_init', 'm', 'rho', 'sigma', 'gamma', 'v', 'vv', 
+    'vh', 'h', 'h_grav_drop_total', 'length', 'lum', 'q', 'dyn_press', 'erosion_coeff', 'erosion_mass_index',
+    'erosion_mass_min', 'erosion_mass_max']] \
+    + [(name, np.int64) for name in ['id', 'n_grains']] \
+    + [(name, np.uint8) for name in ['erosion_enabled', 'disruption_enabled', 'active', 'main', 'grain']]
+
+
+cdef class FragmentArraysCy:
+    cdef public Py_ssize_t n, capacity
+    cdef public FLOAT_TYPE_t[:] K, m_init, m, rho, sigma, gamma, v, vv, vh, h, h_grav_drop_total, length, lum, \
+        q, dyn_press, erosion_coeff, erosion_mass_index, erosion_mass_min, erosion_mass_max
+    cdef public np.int64_t[:] id, n_grains
+    cdef public np.uint8_t[:] erosion_enabled, disruption_enabled, active, main, grain
+
+    def __init__(self, Py_ssize_t capacity=256):
+        """ Structure-of-arrays fragment container used by the compiled kernel. See FragmentArrays in 
+            MetSimErosion for the Python version.
+        """
 
-# cdef class FragmentCy:
-#     cdef public:
-#         int id, n_grains
-#         double K, m, rho, v, vv, vh, length, lum, erosion_coeff
-#         bint erosion_enabled, disruption_enabled, active, main
+        self.n = 0
+        self.capacity = capacity
 
-#     def __init__(self):
+        for name, dtype in FRAGMENT_FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
 
-#         self.id = 0
 
-#         # Shape-density coeff
-#         self.K = 0
+    cpdef void reserve(self, Py_ssize_t n_new):
+        """ Make sure there is space for n_new more fragments. """
 
-#         # Mass (kg)
-#         self.m = 0
+        cdef Py_ssize_t capacity
 
-#         # Density (kg/m^3)
-#         self.rho = 0
+        if self.n + n_new <= self.capacity:
+            return
 
-#         # Velocity (m/s)
-#         self.v = 0
+        # Grow the arrays geometrically to keep the appends cheap
+        capacity = max(2*self.capacity, self.n + n_new)
 
-#         # Velocity components (vertical and horizontal)
-#         self.vv = 0
-#         self.vh = 0
+        for name, dtype in FRAGMENT_FIELDS:
+            arr_new = np.zeros(capacity, dtype=dtype)
+            arr_new[:self.n] = np.asarray(getattr(self, name))[:self.n]
+            setattr(self, name, arr_new)
 
-#         # Length along the trajectory
-#         self.length = 0
+        self.capacity = capacity
 
-#         # Luminous intensity (Watts)
-#         self.lum = 0
 
-#         # Erosion coefficient value
-#         self.erosion_coeff = 0
+    cdef void copyFragment(self, Py_ssize_t dst, Py_ssize_t src):
+        """ Copy the state of one fragment to another slot. """
 
-#         self.erosion_enabled = False
+        self.K[dst] = self.K[src]
+        self.m_init[dst] = self.m_init[src]
+        self.m[dst] = self.m[src]
+        self.rho[dst] = self.rho[src]
+        self.sigma[dst] = self.sigma[src]
+        self.gamma[dst] = self.gamma[src]
+        self.v[dst] = self.v[src]
+        self.vv[dst] = self.vv[src]
+        self.vh[dst] = self.vh[src]
+        self.h[dst] = self.h[src]
+        self.h_grav_drop_total[dst] = self.h_grav_drop_total[src]
+        self.length[dst] = self.length[src]
+        self.lum[dst] = self.lum[src]
+        self.q[dst] = self.q[src]
+        self.dyn_press[dst] = self.dyn_press[src]
+        self.erosion_coeff[dst] = self.erosion_coeff[src]
+        self.erosion_mass_index[dst] = self.erosion_mass_index[src]
+        self.erosion_mass_min[dst] = self.erosion_mass_min[src]
+        self.erosion_mass_max[dst] = self.erosion_mass_max[src]
+        self.id[dst] = self.id[src]
+        self.n_grains[dst] = self.n_grains[src]
+        self.erosion_enabled[dst] = self.erosion_enabled[src]
+        self.disruption_enabled[dst] = self.disruption_enabled[src]
+        self.active[dst] = self.active[src]
+        self.main[dst] = self.main[src]
+        self.grain[dst] = self.grain[src]
 
-#         self.disruption_enabled = False
 
-#         self.active = False
-#         self.n_grains = 1
+    cpdef void compact(self):
+        """ Remove inactive fragments, keeping the order of the remaining ones and the main fragment. """
 
-#         # Indicate that this is the main fragment
-#         self.main = False
+        cdef Py_ssize_t i, n_keep = 0
 
+        for i in range(self.n):
+            if self.active[i] or self.main[i]:
+                if i != n_keep:
+                    self.copyFragment(n_keep, i)
+                n_keep += 1
 
-#     cpdef void init(self, ConstantsCy const, double m, double rho, double v_init, double zenith_angle):
+        self.n = n_keep
 
 
-#         self.m = m
-#         self.h = const.h_init
-#         self.rho = rho
-#         self.v = v_init
-#         self.zenith_angle = zenith_angle
+    def state(self, Py_ssize_t i):
+        """ Return the state of the fragment at the given index as a dictionary. """
 
-#         # Compute shape-density coeff
-#         self.K = const.gamma*const.shape_factor*self.rho**(-2/3.0)
-
-#         # Compute velocity components
-#         self.vv = -v_init*np.cos(zenith_angle)
-#         self.vh = v_init*np.sin(zenith_angle)
-
-#         self.active = True
-#         self.n_grains = 1
-
-
-
-# # Create a class that Python can access and has a __dict__
-# class Fragment(FragmentCy):
-#     pass
+        return {
+            'K': self.K[i], 'm_init': self.m_init[i], 'm': self.m[i], 'rho': self.rho[i], 
+            'sigma': self.sigma[i], 'gamma': self.gamma[i], 'v': self.v[i], 'vv': self.vv[i], 
+            'vh': self.vh[i], 'h': self.h[i], 'h_grav_drop_total': self.h_grav_drop_total[i], 
+            'length': self.length[i], 'lum': self.lum[i], 'q': self.q[i], 'dyn_press': self.dyn_press[i],
+            'erosion_coeff': self.erosion_coeff[i], 'erosion_mass_index': self.erosion_mass_index[i],
+            'erosion_mass_min': self.erosion_mass_min[i], 'erosion_mass_max': self.erosion_mass_max[i],
+            'id': self.id[i], 'n_grains': self.n_grains[i], 
+            'erosion_enabled': bool(self.erosion_enabled[i]), 
+            'disruption_enabled': bool(self.disruption_enabled[i]), 'active': bool(self.active[i]), 
+            'main': bool(self.main[i]), 'grain': bool(self.grain[i])
+            }
 
 
 
@@ -541,4 +561,1053 @@ cpdef atmDensityPoly(double ht, np.ndarray[FLOAT_TYPE_t, ndim=1] dens_co):
                + dens_co[4]*(ht/1e6)**4 
                + dens_co[5]*(ht/1e6)**5
                + dens_co[6]*(ht/1e6)**6
-               )
\ No newline at end of file
+               )
+
+
+### STRUCTURE-OF-ARRAYS VERSIONS OF THE ABOVE FUNCTIONS, USED BY ablateAllArrays IN MetSimErosion ###
+### The expressions are the same as in ablateAll so the results are identical to the per-fragment evaluation
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True) 
+cdef double atmDensityPolyScalar(double ht, FLOAT_TYPE_t[:] dens_co):
+    """ Same as atmDensityPoly, but can be called directly from C. """
+
+    return 10**(dens_co[0] 
+               + dens_co[1]*(ht/1e6) 
+               + dens_co[2]*(ht/1e6)**2 
+               + dens_co[3]*(ht/1e6)**3 
+               + dens_co[4]*(ht/1e6)**4 
+               + dens_co[5]*(ht/1e6)**5
+               + dens_co[6]*(ht/1e6)**6
+               )
+
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True) 
+def ablateStep_vect(double dt, double g0, double r_earth, double h_init, double cos_zc, int lum_eff_type, \
+    double lum_eff, double mu, FLOAT_TYPE_t[:] dens_co, FLOAT_TYPE_t[:] K, FLOAT_TYPE_t[:] sigma, \
+    FLOAT_TYPE_t[:] erosion_coeff, np.int64_t[:] n_grains, FLOAT_TYPE_t[:] m, FLOAT_TYPE_t[:] v, \
+    FLOAT_TYPE_t[:] vv, FLOAT_TYPE_t[:] vh, FLOAT_TYPE_t[:] h, FLOAT_TYPE_t[:] h_grav_drop_total, \
+    FLOAT_TYPE_t[:] length, FLOAT_TYPE_t[:] mass_loss_ablation, FLOAT_TYPE_t[:] mass_loss_erosion, \
+    FLOAT_TYPE_t[:] tau, FLOAT_TYPE_t[:] lum, FLOAT_TYPE_t[:] frag_lum, FLOAT_TYPE_t[:] frag_q, \
+    FLOAT_TYPE_t[:] dyn_press, AtmDensityTableCy dens_table=None):
+    """ Advance all given fragments by one time step using the 4th order Runge-Kutta method. The state 
+        arrays (m, v, vv, vh, h, h_grav_drop_total, length) are updated in place and the output arrays are
+        filled with the per-fragment results of the time step.
+
+    Arguments:
+        dt: [double] Time step (s).
+        g0: [double] Earth acceleration at the surface (m/s^2).
+        r_earth: [double] Earth radius (m).
+        h_init: [double] Initial height of the simulation (m).
+        cos_zc: [double] Cosine of the zenith angle at the beginning of the simulation.
+        lum_eff_type: [int] Luminous efficiency model, see luminousEfficiency.
+        lum_eff: [double] Value of the constant luminous efficiency (percent).
+        mu: [double] Mean mass of an atom (kg).
+        dens_co: [ndarray] Atmosphere density polynomial coefficients.
+        K: [ndarray] Shape-density coefficients (m^2/kg^(2/3)).
+        sigma: [ndarray] Ablation coefficients (s^2/m^2).
+        erosion_coeff: [ndarray] Erosion coefficients (s^2/m^2), 0 if the fragment is not eroding.
+        n_grains: [ndarray] Number of grains every fragment represents.
+        m, v, vv, vh, h, h_grav_drop_total, length: [ndarray] Fragment state, updated in place.
+        mass_loss_ablation, mass_loss_erosion, tau, lum, frag_lum, frag_q, dyn_press: [ndarray] Outputs:
+            mass loss due to ablation and erosion (kg), luminous efficiency, luminosity of a single grain 
+            and of all grains (W), electron line density of all grains, and dynamic pressure (Pa).
+
+    Keyword arguments:
+        dens_table: [AtmDensityTableCy] Atmosphere density lookup table made from dens_co. None by default,
+            in which case the density polynomial is evaluated directly.
+
+    """
+
+    cdef Py_ssize_t i
+    cdef double rho_atm, mass_loss_total, m_new, deceleration_total, gv, av, ah, h_grav_drop, q
+
+    for i in range(m.shape[0]):
+
+        # Get atmosphere density for the given height
+        if dens_table is not None:
+            rho_atm = dens_table.densityC(h[i])
+        else:
+            rho_atm = atmDensityPolyScalar(h[i], dens_co)
+
+        # Compute the mass loss of the fragment due to ablation and erosion
+        mass_loss_ablation[i] = massLossRK4(dt, K[i], sigma[i], m[i], rho_atm, v[i])
+
+        if erosion_coeff[i] > 0:
+            mass_loss_erosion[i] = massLossRK4(dt, K[i], erosion_coeff[i], m[i], rho_atm, v[i])
+        else:
+            mass_loss_erosion[i] = 0
+
+        mass_loss_total = mass_loss_ablation[i] + mass_loss_erosion[i]
+
+        # If the total mass after ablation in this step is below zero, ablate what's left of the whole mass
+        if (m[i] + mass_loss_total) < 0:
+            mass_loss_total = mass_loss_total + m[i]
+
+        m_new = m[i] + mass_loss_total
+
+        # Compute change in velocity
+        deceleration_total = decelerationRK4(dt, K[i], m[i], rho_atm, v[i])
+
+        # If the deceleration is negative (i.e. the fragment is accelerating), then stop the fragment
+        if deceleration_total > 0:
+            vv[i] = 0
+            vh[i] = 0
+            v[i] = 0
+            deceleration_total = 0
+
+        else:
+
+            # Compute g at given height
+            gv = g0/((1 + h[i]/r_earth)**2)
+
+            # Compute deceleration without the effects of gravity
+            av = -deceleration_total*vv[i]/v[i] + vh[i]*v[i]/(r_earth + h[i])
+            ah = -deceleration_total*vh[i]/v[i] - vv[i]*v[i]/(r_earth + h[i])
+
+            # Track the total drop due to gravity
+            h_grav_drop = 0.5*gv*dt**2
+            h_grav_drop_total[i] += h_grav_drop
+
+            # Update the velocity
+            vv[i] -= av*dt
+            vh[i] -= ah*dt
+            v[i] = sqrt(vh[i]**2 + vv[i]**2)
+
+            # Only allow the meteoroid to go down
+            if vv[i] > 0:
+                vv[i] = 0
+
+        # Update length along the track and the mass
+        length[i] += v[i]*dt
+        m[i] = m_new
+
+        # Compute the height taking the curvature of the Earth and the gravity drop into account
+        h[i] = sqrt((h_init + r_earth)**2 - 2*length[i]*cos_zc*(h_init + r_earth) + length[i]**2) - r_earth
+        h[i] -= h_grav_drop_total[i]
+
+        # Compute luminosity for one grain/fragment (with the deceleration term)
+        tau[i] = luminousEfficiency(lum_eff_type, lum_eff, v[i], m[i])
+        lum[i] = -tau[i]*((mass_loss_ablation[i]/dt*v[i]**2)/2 + m[i]*v[i]*deceleration_total)
+
+        # The electron line density of a stopped fragment cannot be computed, raise the same error as 
+        #   ablateAll does in that case
+        if v[i] == 0:
+            raise ZeroDivisionError("float division by zero")
+
+        # Compute the electron line density
+        q = -ionizationEfficiency(v[i])*(mass_loss_ablation[i]/dt)/(mu*v[i])
+
+        # Compute the luminosity and the electron line density of all grains
+        frag_lum[i] = lum[i]*n_grains[i]
+        frag_q[i] = q*n_grains[i]
+
+        # Compute aerodynamic loading on the grain (always assume Gamma = 1.0)
+        dyn_press[i] = 1.0*rho_atm*v[i]**2
+
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def brightestFragmentIndex(FLOAT_TYPE_t[:] frag_lum, FLOAT_TYPE_t[:] lum):
+    """ Find the brightest fragment using the same sequential comparison as in ablateAll, where the 
+        luminosity of all grains in the fragment is compared to the luminosity of a single grain of the 
+        previously found brightest fragment.
+
+    Arguments:
+        frag_lum: [ndarray] Luminosity of all grains represented by every fragment (W).
+        lum: [ndarray] Luminosity of a single grain in every fragment (W).
+
+    Return:
+        [int] Index of the brightest fragment, -1 if no fragment has a positive luminosity.
+    """
+
+    cdef Py_ssize_t i, brightest_index = -1
+    cdef double brightest_lum = 0.0
+
+    for i in range(frag_lum.shape[0]):
+        if frag_lum[i] > brightest_lum:
+            brightest_lum = lum[i]
+            brightest_index = i
+
+    return brightest_index
+
+
+
+cdef inline double atmDensityCy(ConstantsCy c, double ht):
+    """ Atmosphere density from the lookup table if available, otherwise from the polynomial. """
+
+    if c.dens_table is not None:
+        return c.dens_table.densityC(ht)
+
+    return atmDensityPolyScalar(ht, c.dens_co)
+
+
+
+@cython.cdivision(True) 
+cdef double erosionCoeffCy(ConstantsCy c, double h):
+    """ Return the erosion coeff for the given height, see getErosionCoeff in MetSimErosion. """
+
+    # Return the changed erosion coefficient
+    if c.erosion_height_change >= h:
+        return c.erosion_coeff_change
+
+    # Return the starting erosion coeff
+    elif c.erosion_height_start >= h:
+        return c.erosion_coeff
+
+    # If the height is above the erosion start height, return 0
+    else:
+        return 0
+
+
+
+cdef class SimulationKernelCy:
+    cdef ConstantsCy c
+    cdef public FragmentArraysCy fr
+    cdef FLOAT_TYPE_t[:] bin_mass, bin_width, bin_n_scaled
+    cdef np.int64_t[:] bin_count
+    cdef np.ndarray mass_buffer
+    cdef public long n_active, total_fragments
+    cdef public double total_time, main_bottom_ht
+    cdef public object erosion_beg_vel, erosion_beg_mass, erosion_beg_dyn_press, mass_at_erosion_change, \
+        disruption_height, main_mass_exhaustion_ht, abort_reason
+
+    def __init__(self, ConstantsCy c):
+        """ Compiled erosion model simulation. The physics is the same as in ablateAll in MetSimErosion, 
+            except that the wake and complex fragmentation are not supported.
+
+        Arguments:
+            c: [ConstantsCy] Simulation parameters.
+        """
+
+        self.c = c
+
+        # Allocate buffers for mass bins
+        self.allocateBins(64)
+
+
+        # Init the main fragment
+        self.fr = FragmentArraysCy()
+        self.fr.n = 1
+        self.fr.id[0] = 0
+        self.fr.m[0] = c.m_init
+        self.fr.m_init[0] = c.m_init
+        self.fr.h[0] = c.h_init
+        self.fr.rho[0] = c.rho
+        self.fr.v[0] = c.v_init
+        self.fr.sigma[0] = c.sigma
+        self.fr.gamma[0] = c.gamma
+        self.fr.K[0] = c.gamma*c.shape_factor*c.rho**(-2/3.0)
+        self.fr.erosion_mass_index[0] = c.erosion_mass_index
+        self.fr.erosion_mass_min[0] = c.erosion_mass_min
+        self.fr.erosion_mass_max[0] = c.erosion_mass_max
+        self.fr.vv[0] = -c.v_init*cos(c.zenith_angle)
+        self.fr.vh[0] = c.v_init*sin(c.zenith_angle)
+        self.fr.n_grains[0] = 1
+        self.fr.active[0] = True
+        self.fr.main[0] = True
+        self.fr.erosion_enabled[0] = True
+        self.fr.disruption_enabled[0] = True
+
+        self.mass_buffer = np.zeros(self.fr.capacity, dtype=FLOAT_TYPE)
+
+
+        # Reset simulation parameters
+        self.total_time = 0
+        self.n_active = 1
+        self.total_fragments = 1
+        self.main_bottom_ht = c.h_init
+
+        # Parameters recorded during the simulation (can be initialized from Constants by the caller)
+        self.erosion_beg_vel = None
+        self.erosion_beg_mass = None
+        self.erosion_beg_dyn_press = None
+        self.mass_at_erosion_change = None
+        self.disruption_height = None
+        self.main_mass_exhaustion_ht = None
+
+        # Reason why the simulation was stopped early
+        self.abort_reason = None
+
+
+    cdef void allocateBins(self, Py_ssize_t k):
+        """ Allocate buffers for k mass bins. """
+
+        self.bin_mass = np.zeros(k, dtype=FLOAT_TYPE)
+        self.bin_width = np.zeros(k, dtype=FLOAT_TYPE)
+        self.bin_n_scaled = np.zeros(k, dtype=FLOAT_TYPE)
+        self.bin_count = np.zeros(k, dtype=np.int64)
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    @cython.cdivision(True) 
+    cdef Py_ssize_t massBins(self, double eroded_mass, double mass_index, double mass_min, double mass_max) \
+        except -1:
+        """ Distribute the given mass into mass bins, see fragmentMassBins in MetSimErosion. The mass and the
+            number of grains of non-empty bins are stored in bin_mass and bin_count.
+
+        Return:
+            n_bins: [int] Number of non-empty bins.
+        """
+
+        cdef ConstantsCy c = self.c
+        cdef Py_ssize_t i, k, n_bins = 0
+        cdef double mass_bin_coeff, n0, m_grain, n_grains_bin, leftover_mass, log_range, m_mean, a, b
+        cdef double D_mean, s, grain_diameter, n_m_raw, dD_dm, mass_per_bin_sum, scaling
+        cdef double gamma_5_3 = 0.90274529295093375313996375552960671484470367431640625
+        cdef np.int64_t n_grains_bin_round
+
+        # Compute the mass bin coefficient
+        mass_bin_coeff = 10**(-1.0/c.erosion_bins_per_10mass)
+
+        # Compute the total number of mass bins across the specified mass range
+        k = <Py_ssize_t>(1 + log10(mass_min/mass_max)/log10(mass_bin_coeff))
+
+        if k > self.bin_mass.shape[0]:
+            self.allocateBins(k)
+
+        # Use the gamma distribution if specified (e.g. for iron meteoroids which spray droplets)
+        if c.gamma_distribution:
+
+            # Compute the mean mass
+            log_range = log(mass_max/mass_min)
+            if mass_index == 1.0:
+                m_mean = (mass_max - mass_min)/log_range
+
+            elif mass_index == 2.0:
+                m_mean = log_range/(1.0/mass_min - 1.0/mass_max)
+
+            else:
+                a = 2 - mass_index
+                b = 1 - mass_index
+                m_mean = ((mass_max**a - mass_min**a)/a)/((mass_max**b - mass_min**b)/b)
+
+            # Convert mean mass to mean diameter using the formula for spherical grains
+            D_mean = (6*m_mean/(M_PI*c.rho_grain))**(1.0/3)
+            s = (D_mean*gamma_5_3)**3
+
+            # Compute the number of grains in every bin from the size distribution
+            mass_per_bin_sum = 0
+            for i in range(k):
+
+                self.bin_mass[i] = mass_max*(mass_bin_coeff**i)
+                self.bin_width[i] = self.bin_mass[i]*(1 - mass_bin_coeff)
+
+                grain_diameter = (6*self.bin_mass[i]/(M_PI*c.rho_grain))**(1.0/3)
+                dD_dm = (1.0/3)*(6/(M_PI*c.rho_grain))**(1.0/3)*self.bin_mass[i]**(-2.0/3)
+                n_m_raw = (3*grain_diameter*grain_diameter/s)*exp(-grain_diameter**3/s)*fabs(dD_dm)
+
+                self.bin_n_scaled[i] = n_m_raw
+                mass_per_bin_sum += n_m_raw*self.bin_width[i]*self.bin_mass[i]
+
+            # Scale the number of grains in the bin to match the eroded mass
+            scaling = eroded_mass/mass_per_bin_sum
+            for i in range(k):
+                self.bin_n_scaled[i] = self.bin_n_scaled[i]*scaling
+
+        # Use the power-law mass distribution by default
+        else:
+            # Compute the number of the largest grains
+            if mass_index == 2:
+                n0 = eroded_mass/(mass_max*k)
+            else:
+                n0 = fabs((eroded_mass/mass_max)*(1 - mass_bin_coeff**(2 - mass_index)) \
+                    /(1 - mass_bin_coeff**((2 - mass_index)*k)))
+
+
+        # Go though every mass bin
+        leftover_mass = 0
+        for i in range(k):
+
+            if c.gamma_distribution:
+                m_grain = self.bin_mass[i]
+                n_grains_bin = self.bin_n_scaled[i]*self.bin_width[i] + leftover_mass/m_grain
+
+            else:
+                m_grain = mass_max*mass_bin_coeff**i
+                n_grains_bin = n0*(mass_max/m_grain)**(mass_index - 1) + leftover_mass/m_grain
+
+            n_grains_bin_round = <np.int64_t>floor(n_grains_bin)
+
+            # Compute the leftover mass
+            leftover_mass = (n_grains_bin - n_grains_bin_round)*m_grain
+
+            # Only keep bins with at least one grain (bins are written in place, n_bins <= i)
+            if n_grains_bin_round > 0:
+                self.bin_mass[n_bins] = m_grain
+                self.bin_count[n_bins] = n_grains_bin_round
+                n_bins += 1
+
+        return n_bins
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef int spawnChildren(self, Py_ssize_t parent, Py_ssize_t n_bins, bint keep_eroding, bint disruption) \
+        except -1:
+        """ Append daughter fragments of the given parent, one for every mass bin. """
+
+        cdef ConstantsCy c = self.c
+        cdef FragmentArraysCy fr = self.fr
+        cdef Py_ssize_t b, j
+
+        fr.reserve(n_bins)
+
+        for b in range(n_bins):
+
+            j = fr.n
+            fr.copyFragment(j, parent)
+
+            # Assign the number of grains this fragment stands for
+            fr.n_grains[j] *= self.bin_count[b]
+
+            # Assign the grain mass
+            fr.m[j] = self.bin_mass[b]
+            fr.m_init[j] = self.bin_mass[b]
+
+            fr.active[j] = True
+            fr.main[j] = False
+            fr.disruption_enabled[j] = False
+
+            # Indicate that the fragment is a grain
+            if (not keep_eroding) and (not disruption):
+                fr.grain[j] = True
+
+            # Set the erosion coefficient value (disable in grain, only larger fragments)
+            if keep_eroding:
+                fr.erosion_enabled[j] = True
+
+                if disruption:
+                    fr.erosion_coeff[j] = c.disruption_erosion_coeff
+                else:
+                    fr.erosion_coeff[j] = erosionCoeffCy(c, fr.h[parent])
+
+            else:
+                fr.rho[j] = c.rho_grain
+                fr.K[j] = fr.gamma[parent]*c.shape_factor*c.rho_grain**(-2/3.0)
+
+                fr.erosion_enabled[j] = False
+                fr.erosion_coeff[j] = 0
+
+            # Give every fragment a unique ID
+            fr.id[j] = self.total_fragments
+            self.total_fragments += 1
+
+            fr.n += 1
+
+        self.n_active += n_bins
+
+        return 0
+
+
+    cdef void killFragment(self, Py_ssize_t i):
+        """ Deactivate the given fragment and keep track of the stats. """
+
+        self.fr.active[i] = False
+        self.n_active -= 1
+
+        if self.fr.main[i]:
+            self.main_mass_exhaustion_ht = self.fr.h[i]
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    @cython.cdivision(True) 
+    cdef int step(self, FLOAT_TYPE_t[:] row, double dt) except -1:
+        """ Ablate all fragments for one time step of length dt and store the results in the given row, in the
+            same order as the results list of runSimulation.
+        """
+
+        cdef ConstantsCy c = self.c
+        cdef FragmentArraysCy fr = self.fr
+        cdef double cos_zc = cos(c.zenith_angle)
+        cdef Py_ssize_t i, j, n_prev, n_bins, first_child, leading_frag, n_mass
+        cdef double rho_atm, mass_loss_ablation, mass_loss_erosion, mass_loss_total, m_new, deceleration_total
+        cdef double gv, av, ah, h_grav_drop, tau, lum, q, dyn_press
+        cdef double mass_frag_disruption, fragments_total_mass, mass_grain_disruption
+        cdef double luminosity_total = 0.0, tau_total = 0.0, luminosity_main = 0.0, tau_main = 0.0
+        cdef double luminosity_eroded = 0.0, tau_eroded = 0.0, electron_density_total = 0.0
+        cdef double brightest_height = 0.0, brightest_length = 0.0, brightest_lum = 0.0, brightest_vel = 0.0
+        cdef double main_mass = 0.0, main_height = 0.0, main_length = 0.0, main_vel = 0.0
+        cdef double main_dyn_press = 0.0, mass_total_active
+        cdef FLOAT_TYPE_t[:] mass_buffer
+
+        # Only fragments which existed at the beginning of the step are ablated, children are appended
+        n_prev = fr.n
+
+        for i in range(n_prev):
+
+            # Skip the fragment if it's not active
+            if not fr.active[i]:
+                continue
+
+            # Get atmosphere density for the given height
+            rho_atm = atmDensityCy(c, fr.h[i])
+
+            # Compute the mass loss of the fragment due to ablation and erosion
+            mass_loss_ablation = massLossRK4(dt, fr.K[i], fr.sigma[i], fr.m[i], rho_atm, fr.v[i])
+
+            if fr.erosion_enabled[i] and (fr.erosion_coeff[i] > 0):
+                mass_loss_erosion = massLossRK4(dt, fr.K[i], fr.erosion_coeff[i], fr.m[i], rho_atm, fr.v[i])
+            else:
+                mass_loss_erosion = 0
+
+            mass_loss_total = mass_loss_ablation + mass_loss_erosion
+
+            # If the total mass after ablation in this step is below zero, ablate what's left of the whole mass
+            if (fr.m[i] + mass_loss_total) < 0:
+                mass_loss_total = mass_loss_total + fr.m[i]
+
+            m_new = fr.m[i] + mass_loss_total
+
+            # Compute change in velocity
+            deceleration_total = decelerationRK4(dt, fr.K[i], fr.m[i], rho_atm, fr.v[i])
+
+            # If the deceleration is negative (i.e. the fragment is accelerating), then stop the fragment
+            if deceleration_total > 0:
+                fr.vv[i] = 0
+                fr.vh[i] = 0
+                fr.v[i] = 0
+                deceleration_total = 0
+
+            else:
+
+                # Compute g at given height
+                gv = G0_CY/((1 + fr.h[i]/c.r_earth)**2)
+
+                # Compute deceleration without the effects of gravity
+                av = -deceleration_total*fr.vv[i]/fr.v[i] + fr.vh[i]*fr.v[i]/(c.r_earth + fr.h[i])
+                ah = -deceleration_total*fr.vh[i]/fr.v[i] - fr.vv[i]*fr.v[i]/(c.r_earth + fr.h[i])
+
+                # Track the total drop due to gravity (the drop accumulates per base step, so longer adaptive
+                #   steps give the same drop as the same number of base steps)
+                h_grav_drop = 0.5*gv*dt*c.dt
+                fr.h_grav_drop_total[i] += h_grav_drop
+
+                # Update the velocity
+                fr.vv[i] -= av*dt
+                fr.vh[i] -= ah*dt
+                fr.v[i] = sqrt(fr.vh[i]**2 + fr.vv[i]**2)
+
+                # Only allow the meteoroid to go down
+                if fr.vv[i] > 0:
+                    fr.vv[i] = 0
+
+            # Update length along the track and the mass
+            fr.length[i] += fr.v[i]*dt
+            fr.m[i] = m_new
+
+            # Compute the height taking the curvature of the Earth and the gravity drop into account
+            fr.h[i] = sqrt((c.h_init + c.r_earth)**2 - 2*fr.length[i]*cos_zc*(c.h_init + c.r_earth) \
+                + fr.length[i]**2) - c.r_earth
+            fr.h[i] -= fr.h_grav_drop_total[i]
+
+            # Compute luminosity for one grain/fragment (with the deceleration term)
+            tau = luminousEfficiency(c.lum_eff_type, c.lum_eff, fr.v[i], fr.m[i])
+            lum = -tau*((mass_loss_ablation/dt*fr.v[i]**2)/2 + fr.m[i]*fr.v[i]*deceleration_total)
+
+            # The electron line density of a stopped fragment cannot be computed, raise the same error as 
+            #   ablateAll does in that case
+            if fr.v[i] == 0:
+                raise ZeroDivisionError("float division by zero")
+
+            # Compute the electron line density
+            q = -ionizationEfficiency(fr.v[i])*(mass_loss_ablation/dt)/(c.mu*fr.v[i])
+
+            # Compute the luminosity and the electron line density of all grains
+            fr.lum[i] = lum*fr.n_grains[i]
+            fr.q[i] = q*fr.n_grains[i]
+
+            # Keep track of the totals across all fragments
+            luminosity_total += fr.lum[i]
+            electron_density_total += fr.q[i]
+            tau_total += tau*fr.lum[i]
+
+            # Compute aerodynamic loading on the grain (always assume Gamma = 1.0)
+            dyn_press = 1.0*rho_atm*fr.v[i]**2
+            fr.dyn_press[i] = dyn_press
+
+            # Keep track of the parameters of the main fragment
+            if fr.main[i]:
+                luminosity_main = fr.lum[i]
+                tau_main = tau
+                main_mass = fr.m[i]
+                main_height = fr.h[i]
+                main_length = fr.length[i]
+                main_vel = fr.v[i]
+                main_dyn_press = dyn_press
+
+            # If the fragment is done, stop ablating
+            if  (
+                (fr.m[i] <= c.m_kill) 
+                or (fr.v[i] < c.v_kill) 
+                or (fr.h[i] < c.h_kill) 
+                or (fr.lum[i] < 0)
+                or ((c.len_kill > 0) and (fr.length[i] > c.len_kill))
+                ):
+
+                self.killFragment(i)
+                continue
+
+            # Keep track of the brightest fragment
+            if fr.lum[i] > brightest_lum:
+                brightest_lum = lum
+                brightest_height = fr.h[i]
+                brightest_length = fr.length[i]
+                brightest_vel = fr.v[i]
+
+            # Keep track of luminosity of eroded and disrupted fragments
+            if (not fr.main[i]) and c.show_individual_lcs:
+                luminosity_eroded += fr.lum[i]
+                tau_eroded += tau*fr.lum[i]
+
+            # Check if the erosion should start, given the height
+            if (fr.h[i] < c.erosion_height_start) and fr.erosion_enabled[i] and c.erosion_on:
+
+                # Turn on the erosion of the fragment
+                fr.erosion_coeff[i] = erosionCoeffCy(c, fr.h[i])
+
+                # Update the main fragment physical parameters if it is changed after erosion coefficient 
+                #   change
+                if fr.main[i] and (c.erosion_height_change >= fr.h[i]):
+                    fr.rho[i] = c.erosion_rho_change
+                    fr.K[i] = fr.gamma[i]*c.shape_factor*fr.rho[i]**(-2/3.0)
+                    fr.sigma[i] = c.erosion_sigma_change
+
+            # Create grains for erosion-enabled fragments
+            if fr.erosion_enabled[i] and (fabs(mass_loss_erosion) > 0):
+
+                n_bins = self.massBins(fabs(mass_loss_erosion), fr.erosion_mass_index[i], \
+                    fr.erosion_mass_min[i], fr.erosion_mass_max[i])
+                self.spawnChildren(i, n_bins, False, False)
+
+                # Record physical parameters at the beginning of erosion for the main fragment
+                if fr.main[i]:
+                    if self.erosion_beg_vel is None:
+                        self.erosion_beg_vel = fr.v[i]
+                        self.erosion_beg_mass = fr.m[i]
+                        self.erosion_beg_dyn_press = dyn_press
+
+                    # Record the mass when erosion is changed
+                    elif (c.erosion_height_change >= fr.h[i]) and (self.mass_at_erosion_change is None):
+                        self.mass_at_erosion_change = fr.m[i]
+
+            # Disrupt the fragment if the dynamic pressure exceeds its strength
+            if fr.disruption_enabled[i] and c.disruption_on and (dyn_press > c.compressive_strength):
+
+                # Compute the mass that should be disrupted into fragments
+                mass_frag_disruption = fr.m[i]*(1 - c.disruption_mass_grain_ratio)
+
+                fragments_total_mass = 0
+                if mass_frag_disruption > 0:
+
+                    # Generate larger fragments, possibly assign them a separate erosion coefficient
+                    n_bins = self.massBins(mass_frag_disruption, c.disruption_mass_index, \
+                        c.disruption_mass_min_ratio*mass_frag_disruption, \
+                        c.disruption_mass_max_ratio*mass_frag_disruption)
+
+                    first_child = fr.n
+                    self.spawnChildren(i, n_bins, c.erosion_on, True)
+
+                    # Compute the mass that went into fragments
+                    for j in range(first_child, fr.n):
+                        fragments_total_mass += fr.n_grains[j]*fr.m[j]
+
+                    # Assign the height of disruption
+                    self.disruption_height = fr.h[i]
+
+                # Disrupt a portion of the leftover mass into grains
+                mass_grain_disruption = fr.m[i] - fragments_total_mass
+                if mass_grain_disruption > 0:
+
+                    n_bins = self.massBins(mass_grain_disruption, fr.erosion_mass_index[i], \
+                        fr.erosion_mass_min[i], fr.erosion_mass_max[i])
+                    self.spawnChildren(i, n_bins, False, False)
+
+                # Deactive the disrupted fragment
+                fr.m[i] = 0
+                self.killFragment(i)
+
+            # If the fragment is done, stop ablating
+            if fr.m[i] <= c.m_kill:
+                self.killFragment(i)
+
+
+        # Track the leading fragment (only fragments which existed at the beginning of the step)
+        leading_frag = -1
+        for i in range(n_prev):
+            if fr.active[i]:
+                if (leading_frag < 0) or (fr.length[i] > fr.length[leading_frag]):
+                    leading_frag = i
+
+        # Compute the total mass of all active fragments (use numpy to sum them in the same way as 
+        #   runSimulation does)
+        if self.mass_buffer.shape[0] < fr.n:
+            self.mass_buffer = np.zeros(fr.capacity, dtype=FLOAT_TYPE)
+
+        mass_buffer = self.mass_buffer
+        n_mass = 0
+        for i in range(fr.n):
+            if fr.active[i]:
+                mass_buffer[n_mass] = fr.m[i]
+                n_mass += 1
+
+        if n_mass > 0:
+            mass_total_active = np.add.reduce(self.mass_buffer[:n_mass])
+        else:
+            mass_total_active = 0.0
+
+        # Increment the running time
+        self.total_time += dt
+
+        # Weigh the tau by luminosity
+        if luminosity_total > 0:
+            tau_total /= luminosity_total
+        else:
+            tau_total = 0
+
+        if luminosity_eroded > 0:
+            tau_eroded /= luminosity_eroded
+        else:
+            tau_eroded = 0
+
+        # Track the bottom height of the main fragment
+        if main_height > 0:
+            self.main_bottom_ht = min(main_height, self.main_bottom_ht)
+
+
+        # Store the results
+        row[0] = self.total_time
+        row[1] = luminosity_total
+        row[2] = luminosity_main
+        row[3] = luminosity_eroded
+        row[4] = electron_density_total
+        row[5] = tau_total
+        row[6] = tau_main
+        row[7] = tau_eroded
+        row[8] = brightest_height
+        row[9] = brightest_length
+        row[10] = brightest_vel
+
+        if leading_frag >= 0:
+            row[11] = fr.h[leading_frag]
+            row[12] = fr.length[leading_frag]
+            row[13] = fr.v[leading_frag]
+            row[14] = fr.dyn_press[leading_frag]
+        else:
+            row[11] = row[12] = row[13] = row[14] = NAN
+
+        row[15] = mass_total_active
+        row[16] = main_mass
+        row[17] = main_height
+        row[18] = main_length
+        row[19] = main_vel
+        row[20] = main_dyn_press
+
+        return 0
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    @cython.cdivision(True) 
+    cdef double stepError(self, double dt):
+        """ Estimate the relative error in mass and velocity of a step of length dt by comparing it to two 
+            steps of half the length (step doubling). Only the main fragment and the fragments from disruption 
+            are checked. Grains ablate within a few base steps and their light curve can't be resolved with 
+            longer steps, so the error is infinite when there are any active grains. It is also infinite if 
+            a fragment would reach the kill limits during the step.
+
+        Return:
+            err: [double] The largest relative error across fragments.
+        """
+
+        cdef ConstantsCy c = self.c
+        cdef FragmentArraysCy fr = self.fr
+        cdef Py_ssize_t i
+        cdef double err = 0, erosion_coeff
+        cdef double[7] full, half
+
+        for i in range(fr.n):
+
+            if not fr.active[i]:
+                continue
+
+            if fr.grain[i]:
+                return INFINITY
+
+            if fr.erosion_enabled[i]:
+                erosion_coeff = fr.erosion_coeff[i]
+            else:
+                erosion_coeff = 0
+
+            # One full step
+            full[0] = fr.m[i]
+            full[1] = fr.vv[i]
+            full[2] = fr.vh[i]
+            full[3] = fr.v[i]
+            full[4] = fr.length[i]
+            full[5] = fr.h_grav_drop_total[i]
+            full[6] = fr.h[i]
+            half = full
+            trialStep(c, dt, fr.K[i], fr.sigma[i], erosion_coeff, full)
+
+            # The fragment would reach the kill limits during the step, so it has to be killed at the same 
+            #   base step as with a fixed step
+            if  (
+                (full[0] <= c.m_kill) 
+                or (full[3] < c.v_kill) 
+                or (full[6] < c.h_kill) 
+                or ((c.len_kill > 0) and (full[4] > c.len_kill))
+                ):
+
+                return INFINITY
+
+            # Two half steps
+            trialStep(c, dt/2, fr.K[i], fr.sigma[i], erosion_coeff, half)
+            trialStep(c, dt/2, fr.K[i], fr.sigma[i], erosion_coeff, half)
+
+            # Compare the mass and the velocity
+            err = max(err, fabs(full[0] - half[0])/max(half[0], c.m_kill))
+            err = max(err, fabs(full[3] - half[3])/max(half[3], c.v_kill))
+
+        return err
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef bint eventInStep(self, double dt):
+        """ Check if the erosion starts or changes, or a fragment is disrupted during a step of length dt,
+            or if the main fragment is gone. These events are resolved with the base time step so they happen
+            at the same time as in a simulation with a fixed step, and the leading and the brightest fragments
+            are picked among the remaining ones at every base step.
+        """
+
+        cdef ConstantsCy c = self.c
+        cdef FragmentArraysCy fr = self.fr
+        cdef Py_ssize_t i
+        cdef double h_next
+        cdef bint main_active = False
+
+        for i in range(fr.n):
+
+            if (not fr.active[i]) or fr.grain[i]:
+                continue
+
+            if fr.main[i]:
+                main_active = True
+
+            # Predict the height at the end of the step (the vertical velocity is negative)
+            h_next = fr.h[i] + fr.vv[i]*dt
+
+            if fr.erosion_enabled[i] and c.erosion_on:
+                if (fr.h[i] >= c.erosion_height_start) and (h_next < c.erosion_height_start):
+                    return True
+
+                if (fr.h[i] >= c.erosion_height_change) and (h_next < c.erosion_height_change):
+                    return True
+
+            if fr.disruption_enabled[i] and c.disruption_on:
+                if atmDensityCy(c, h_next)*fr.v[i]**2 > c.compressive_strength:
+                    return True
+
+        # The main fragment is gone
+        if not main_active:
+            return True
+
+        return False
+
+
+    def run(self, double compaction_ratio=0.5, bint adaptive=False, double tol=1e-6, int max_factor=16, \
+        terminate=None):
+        """ Run the simulation until all fragments stop ablating.
+
+        Keyword arguments:
+            compaction_ratio: [float] Dead fragments are removed from the arrays when their fraction exceeds
+                this value.
+            adaptive: [bool] If True, the time step is adapted to the changes in mass and velocity. The 
+                steps are power of two multiples of the base step (c.dt), and the results are resampled to 
+                the base step. False by default.
+            tol: [float] Largest allowed relative change in mass or velocity in one adaptive step, estimated 
+                by step doubling. 1e-6 by default.
+            max_factor: [int] The largest adaptive step as a multiple of the base step. 16 by default.
+            terminate: [callable] Called after every step as terminate(results_row, n_active). If it returns 
+                a reason, the simulation is stopped and the reason is stored in abort_reason. None by default.
+
+        Return:
+            results: [ndarray] Results of every time step, shape (n_steps, 21), with columns in the same order
+                as the results list of runSimulation. Missing values (e.g. no leading fragment) are NaN.
+        """
+
+        cdef Py_ssize_t i, n_rows = 0, n_dead, n_base = 0, factor = 1
+        cdef double err = 0
+        cdef np.ndarray[FLOAT_TYPE_t, ndim=2] results = np.zeros((1024, 21), dtype=FLOAT_TYPE)
+        cdef np.ndarray[np.int64_t, ndim=1] base_index = np.zeros(1024, dtype=np.int64)
+        cdef np.ndarray[np.int64_t, ndim=1] base_index_start = np.zeros(1024, dtype=np.int64)
+
+        while self.n_active > 0:
+
+            # Grow the results array if needed
+            if n_rows == results.shape[0]:
+                results = np.concatenate([results, np.zeros_like(results)])
+                base_index = np.concatenate([base_index, np.zeros_like(base_index)])
+                base_index_start = np.concatenate([base_index_start, np.zeros_like(base_index_start)])
+
+            if adaptive:
+
+                # Reduce the step until the error is within the tolerance
+                err = self.stepError(factor*self.c.dt)
+                while (factor > 1) and ((err > tol) or self.eventInStep(factor*self.c.dt)):
+                    factor //= 2
+                    err = self.stepError(factor*self.c.dt)
+
+            self.step(results[n_rows], factor*self.c.dt)
+            base_index_start[n_rows] = n_base + 1
+            n_base += factor
+            base_index[n_rows] = n_base
+            n_rows += 1
+
+            # Try a larger step next time if the error is small, but keep the steps aligned with the base 
+            #   time grid
+            if adaptive and (err < tol/4) and (2*factor <= max_factor) and (n_base%(2*factor) == 0):
+                factor *= 2
+
+            # Stop the simulation if it can't match the observations
+            if terminate is not None:
+                self.abort_reason = terminate(results[n_rows - 1], self.n_active)
+                if self.abort_reason is not None:
+                    break
+
+            # Remove dead fragments when there are too many of them
+            n_dead = 0
+            for i in range(self.fr.n):
+                if not self.fr.active[i]:
+                    n_dead += 1
+
+            if n_dead > compaction_ratio*self.fr.n:
+                self.fr.compact()
+
+        results = results[:n_rows]
+
+        # Resample the results of adaptive steps to the base time step
+        if adaptive and (n_rows > 0) and (n_base > n_rows):
+            results = resampleResults(results, base_index[:n_rows], base_index_start[:n_rows], n_base, \
+                self.c.dt)
+            self.total_time = results[-1, 0]
+
+        return results
+
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True) 
+cdef void trialStep(ConstantsCy c, double dt, double K, double sigma, double erosion_coeff, double[7] state):
+    """ Advance the state of one fragment by dt without any side effects, in the same way as the step of 
+        SimulationKernelCy. Used to estimate the error of adaptive steps.
+
+    Arguments:
+        c: [ConstantsCy] Simulation parameters.
+        dt: [double] Time step (s).
+        K: [double] Shape-density coefficient (m^2/kg^(2/3)).
+        sigma: [double] Ablation coefficient (s^2/m^2).
+        erosion_coeff: [double] Erosion coefficient (s^2/m^2), 0 if the fragment doesn't erode.
+        state: [double[7]] Mass, vertical velocity, horizontal velocity, velocity, length, total gravity drop
+            and height. Updated in place.
+    """
+
+    cdef double rho_atm, mass_loss_total, deceleration_total, gv, av, ah
+    cdef double m = state[0], vv = state[1], vh = state[2], v = state[3], length = state[4]
+    cdef double h_grav_drop_total = state[5], h = state[6]
+
+    # The fragment has stopped
+    if (v <= 0) or (m <= 0):
+        return
+
+    rho_atm = atmDensityCy(c, h)
+
+    # Compute the mass loss due to ablation and erosion
+    mass_loss_total = massLossRK4(dt, K, sigma, m, rho_atm, v)
+    if erosion_coeff > 0:
+        mass_loss_total += massLossRK4(dt, K, erosion_coeff, m, rho_atm, v)
+
+    # Compute change in velocity
+    deceleration_total = decelerationRK4(dt, K, m, rho_atm, v)
+
+    if deceleration_total > 0:
+        vv = vh = v = 0
+
+    else:
+        gv = G0_CY/((1 + h/c.r_earth)**2)
+
+        av = -deceleration_total*vv/v + vh*v/(c.r_earth + h)
+        ah = -deceleration_total*vh/v - vv*v/(c.r_earth + h)
+
+        h_grav_drop_total += 0.5*gv*dt*c.dt
+
+        vv -= av*dt
+        vh -= ah*dt
+        v = sqrt(vh**2 + vv**2)
+
+        if vv > 0:
+            vv = 0
+
+    length += v*dt
+
+    # Compute the height taking the curvature of the Earth and the gravity drop into account
+    h = sqrt((c.h_init + c.r_earth)**2 - 2*length*cos(c.zenith_angle)*(c.h_init + c.r_earth) + length**2) \
+        - c.r_earth
+    h -= h_grav_drop_total
+
+    state[0] = max(m + mass_loss_total, 0)
+    state[1] = vv
+    state[2] = vh
+    state[3] = v
+    state[4] = length
+    state[5] = h_grav_drop_total
+    state[6] = h
+
+
+
+def resampleResults(np.ndarray[FLOAT_TYPE_t, ndim=2] results, np.ndarray[np.int64_t, ndim=1] base_index, 
+    np.ndarray[np.int64_t, ndim=1] base_index_start, Py_ssize_t n_base, double dt):
+    """ Linearly interpolate the results of adaptive steps to every base time step.
+
+    The luminosity, the electron line density and the dynamic pressure are computed from the mass loss rate
+    and the air density at the beginning of the step. In a simulation with a fixed step they lag one base
+    step behind the state, so they are assigned to the first base step of every adaptive step.
+
+    Arguments:
+        results: [ndarray] Results of adaptive steps, shape (n_steps, 21).
+        base_index: [ndarray] The number of base steps at the end of every adaptive step.
+        base_index_start: [ndarray] The number of base steps at the beginning of every adaptive step, plus one.
+        n_base: [int] The total number of base steps.
+        dt: [float] Base time step (s).
+
+    Return:
+        results_resampled: [ndarray] Results at every base step, shape (n_base, 21).
+    """
+
+    cdef Py_ssize_t k
+    cdef np.ndarray[FLOAT_TYPE_t, ndim=2] results_resampled = np.zeros((n_base, results.shape[1]), \
+        dtype=FLOAT_TYPE)
+    cdef np.ndarray[np.int64_t, ndim=1] grid_index = np.arange(1, n_base + 1, dtype=np.int64)
+
+    # Accumulate the time in the same way as a fixed step simulation does
+    results_resampled[:, 0] = np.cumsum(np.full(n_base, dt))
+
+    for k in range(1, results.shape[1]):
+
+        # Luminosities, electron line density and dynamic pressures
+        if k in (1, 2, 3, 4, 14, 20):
+            results_resampled[:, k] = np.interp(grid_index, base_index_start, results[:, k])
+
+        else:
+            results_resampled[:, k] = np.interp(grid_index, base_index, results[:, k])
+
+    return results_resampled
@@ -113,16 +113,22 @@ class MeteorShower(object):
 
         samples = []
 
+        if jd_input is None:
+
+            # Sample the solar longitudes
+            la_sun_samples = sampleActivityModel(self.sol_slope, self.sol_max, n_samples=n_samples)
+
+            # Calculate the corresponding Julian dates for all drawn solar longitudes at once
+            jd_samples = solLon2jdJPL(self.year, self.month, la_sun_samples)
+
+
         # Generate radiant samples
         for i in range(n_samples):
 
             if jd_input is None:
 
-                # Sample the solar longitude
-                la_sun = sampleActivityModel(self.sol_slope, self.sol_max)[0]
-
-                # Calculate the corresponding Julian date for the drawn solar longitude
-                jd = solLon2jdJPL(self.year, self.month, la_sun)
+                la_sun = la_sun_samples[i]
+                jd = jd_samples[i]
 
             else:
 
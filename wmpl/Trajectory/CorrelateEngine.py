@@ -2,6 +2,8 @@
 
 from __future__ import print_function, division, absolute_import
 
+import collections
+import concurrent.futures
 import copy
 import datetime
 import json
@@ -13,6 +15,7 @@ import numpy as np
 
 from wmpl.Trajectory.Trajectory import ObservedPoints, PlaneIntersection, Trajectory, moveStateVector
 from wmpl.Utils.Earth import greatCircleDistance
+from wmpl.Utils.PyDomainParallelizer import resetSharedPools
 from wmpl.Utils.Math import vectNorm, vectMag, angleBetweenVectors, vectorFromPointDirectionAndAngle, \
     findClosestPoints, generateDatetimeBins, meanAngle, angleBetweenSphericalCoords
 from wmpl.Utils.ShowerAssociation import associateShowerTraj
@@ -24,6 +27,11 @@ from wmpl.Utils.TrajConversions import J2000_JD, geo2Cartesian, cartesian2Geo, r
 log = logging.getLogger("traj_correlator")
 
 
+# Heights above the ground (meters) at which the FOV overlap between stations is checked, ordered by the
+#   overlap probability for faster execution
+FOV_OVERLAP_HEIGHTS = [95000, 70000, 115000, 50000]
+
+
 def pickBestStations(obslist, max_stns):
     """
     Find the stations with the best statistics
@@ -184,6 +192,10 @@ class TrajectoryConstraints(object):
         if self.mc_cores < 2:
             self.mc_cores = 2
 
+        # Number of candidate trajectories solved in parallel. Every trajectory solver uses mc_cores processes
+        #   for its Monte Carlo runs, so traj_cores*mc_cores processes are used in total
+        self.traj_cores = 1
+
         # MC runs to run for error estimation
         self.error_mc_runs = 10
 
@@ -218,6 +230,58 @@ class TrajectoryConstraints(object):
 
 
 
+def plateparKey(pp):
+    """ Return a hashable key which identifies the pointing and the location of the given platepar. 
+        Platepars with the same key have the same FOV footprint.
+
+    Arguments:
+        pp: [Platepar] Platepar object.
+
+    Return:
+        [tuple]
+    """
+
+    return (str(pp.station_code), float(pp.lat), float(pp.lon), float(pp.elev), float(pp.RA_d), 
+        float(pp.dec_d), float(pp.JD), float(pp.fov_h), float(pp.fov_v))
+
+
+
+class FOVFootprint(object):
+    def __init__(self, pp, ref_jd, heights):
+        """ Geometry of the camera FOV, precomputed once so that it can be reused for all FOV overlap 
+            checks. The footprint consists of the station position and FOV centre direction in ECI 
+            coordinates, and points on the FOV centre line at the given heights above the ground.
+
+        Arguments:
+            pp: [Platepar] Platepar object.
+            ref_jd: [float] Reference Julian date used to compute ECI coordinates.
+            heights: [list] Heights above the ground (meters) at which the FOV footprint is computed.
+        """
+
+        # FOV diagonal
+        self.fov = np.radians(np.sqrt(pp.fov_v**2 + pp.fov_h**2))
+
+        self.lat, self.lon, self.elev = np.radians(pp.lat), np.radians(pp.lon), pp.elev
+
+        # Compute alt/az of the FOV centre
+        self.azim, self.alt = raDec2AltAz(np.radians(pp.RA_d), np.radians(pp.dec_d), pp.JD, self.lat, 
+            self.lon)
+
+        # Compute ECI coordinates of the station
+        self.stat_eci = np.array(geo2Cartesian(self.lat, self.lon, self.elev, ref_jd))
+
+        # Compute ECI vector of the FOV centre
+        ra, dec = altAz2RADec(self.azim, self.alt, ref_jd, self.lat, self.lon)
+        self.fov_eci = vectNorm(np.array(raDec2ECI(ra, dec)))
+
+        # Compute points in the middle of the FOV at given heights
+        self.fov_points = {}
+        for height_above_ground in heights:
+            self.fov_points[height_above_ground] = self.stat_eci + self.fov_eci*(height_above_ground 
+                - self.elev)/np.sin(self.alt)
+
+
+
 class TrajectoryCorrelator(object):
     def __init__(self, data_handle, traj_constraints, v_init_part, data_in_j2000=True, enableOSM=False):
         """ Correlates meteor trajectories using meteor data given to it through a data handle. A data handle
@@ -239,6 +303,37 @@ class TrajectoryCorrelator(object):
         # enable OS style ground maps if true
         self.enableOSM = enableOSM
 
+        # Cache of FOV footprints (keyed by plateparKey) and results of station pair checks (keyed by pairs
+        #   of platepar keys), so the geometry of recurring station pairs is only computed once per run
+        self.resetStationPairCache()
+
+
+    def resetStationPairCache(self):
+        """ Clear the cached FOV footprints and station pair checks. """
+
+        # Reference Julian date used to compute ECI coordinates of FOV footprints
+        self.fov_ref_jd = datetime2JD(datetime.datetime.now(datetime.timezone.utc))
+
+        self.fov_footprints = {}
+
+        # Distances between stations (km)
+        self.station_pair_dists = {}
+
+        # Results of FOV overlap checks
+        self.station_pair_overlaps = {}
+
+
+    def getFOVFootprint(self, pp):
+        """ Return the cached FOV footprint of the given platepar, computing it if it's not cached. """
+
+        key = plateparKey(pp)
+
+        if key not in self.fov_footprints:
+            self.fov_footprints[key] = FOVFootprint(pp, self.fov_ref_jd, FOV_OVERLAP_HEIGHTS)
+
+        return self.fov_footprints[key]
+
+
     def trajectoryRangeCheck(self, traj_reduced, platepar):
         """ Check that the trajectory is within the range limits. 
         
@@ -324,9 +419,14 @@ class TrajectoryCorrelator(object):
             tp: [Platepar] Test platepar.
         """
 
-        # Compute the distance between stations (km)
-        dist = greatCircleDistance(np.radians(rp.lat), np.radians(rp.lon), np.radians(tp.lat), 
-            np.radians(tp.lon))
+        pair_key = (plateparKey(rp), plateparKey(tp))
+
+        # Compute the distance between stations (km), only once per station pair
+        if pair_key not in self.station_pair_dists:
+            self.station_pair_dists[pair_key] = greatCircleDistance(np.radians(rp.lat), np.radians(rp.lon), 
+                np.radians(tp.lat), np.radians(tp.lon))
+
+        dist = self.station_pair_dists[pair_key]
 
         log.info("Distance between {:s} and {:s} = {:.1f} km".format(rp.station_code, tp.station_code, dist))
 
@@ -341,7 +441,8 @@ class TrajectoryCorrelator(object):
 
 
     def checkFOVOverlap(self, rp, tp):
-        """ Check if two stations have overlapping fields of view between heights of 50 to 115 km.
+        """ Check if two stations have overlapping fields of view between heights of 50 to 115 km. The 
+            result is cached for every station pair.
         
         Arguments:
             rp: [Platepar] Reference platepar.
@@ -351,41 +452,38 @@ class TrajectoryCorrelator(object):
             [bool] True if FOVs overlap, False otherwise.
         """
 
-        # Compute the FOV diagonals of both stations
-        reference_fov = np.radians(np.sqrt(rp.fov_v**2 + rp.fov_h**2))
-        test_fov = np.radians(np.sqrt(tp.fov_v**2 + tp.fov_h**2))
-
+        pair_key = (plateparKey(rp), plateparKey(tp))
 
-        lat1, lon1, elev1 = np.radians(rp.lat), np.radians(rp.lon), rp.elev
-        lat2, lon2, elev2 = np.radians(tp.lat), np.radians(tp.lon), tp.elev
+        if pair_key not in self.station_pair_overlaps:
+            self.station_pair_overlaps[pair_key] = self.checkFOVFootprintOverlap(self.getFOVFootprint(rp), 
+                self.getFOVFootprint(tp))
 
-        # Compute alt/az of the FOV centre
-        azim1, alt1 = raDec2AltAz(np.radians(rp.RA_d), np.radians(rp.dec_d), rp.JD, lat1, lon1)
-        azim2, alt2 = raDec2AltAz(np.radians(tp.RA_d), np.radians(tp.dec_d), tp.JD, lat2, lon2)
+        return self.station_pair_overlaps[pair_key]
 
 
-        # Use now as a reference time for FOV overlap check
-        ref_jd = datetime2JD(datetime.datetime.now(datetime.timezone.utc))
+    def checkFOVFootprintOverlap(self, ref_fp, test_fp):
+        """ Check if two FOV footprints overlap. 
+        
+        Arguments:
+            ref_fp: [FOVFootprint] Reference FOV footprint.
+            test_fp: [FOVFootprint] Test FOV footprint.
 
-        # Compute ECI coordinates of both stations
-        reference_stat_eci = np.array(geo2Cartesian(lat1, lon1, elev1, ref_jd))
-        test_stat_eci = np.array(geo2Cartesian(lat2, lon2, elev2, ref_jd))
+        Return:
+            [bool] True if FOVs overlap, False otherwise.
+        """
 
-        # Compute ECI vectors of the FOV centre
-        ra1, dec1 = altAz2RADec(azim1, alt1, ref_jd, lat1, lon1)
-        reference_fov_eci = vectNorm(np.array(raDec2ECI(ra1, dec1)))
-        ra2, dec2 = altAz2RADec(azim2, alt2, ref_jd, lat2, lon2)
-        test_fov_eci = vectNorm(np.array(raDec2ECI(ra2, dec2)))
+        reference_fov, test_fov = ref_fp.fov, test_fp.fov
+        reference_stat_eci, test_stat_eci = ref_fp.stat_eci, test_fp.stat_eci
+        reference_fov_eci, test_fov_eci = ref_fp.fov_eci, test_fp.fov_eci
 
-        # Compute ECI coordinates at different heights along the FOV line and check for FOV overlap
+        # Check for FOV overlap using the points at different heights along the FOV line
         # The checked heights are 50, 70, 95, and 115 km (ordered by overlap probability for faster 
         # execution)
-        for height_above_ground in [95000, 70000, 115000, 50000]:
+        for height_above_ground in FOV_OVERLAP_HEIGHTS:
 
-            # Compute points in the middle of FOVs of both stations at given heights
-            reference_fov_point = reference_stat_eci + reference_fov_eci*(height_above_ground 
-                - elev1)/np.sin(alt1)
-            test_fov_point = test_stat_eci + test_fov_eci*(height_above_ground - elev2)/np.sin(alt2)
+            # Points in the middle of FOVs of both stations at given heights
+            reference_fov_point = ref_fp.fov_points[height_above_ground]
+            test_fov_point = test_fp.fov_points[height_above_ground]
 
             # Check if the middles of the FOV are in the other camera's FOV
             if (angleBetweenVectors(reference_fov_eci, test_fov_point - reference_stat_eci) <= reference_fov/2) \
@@ -433,10 +531,10 @@ class TrajectoryCorrelator(object):
             ref_dt = met.reference_dt
             time_offset = 0
 
-        ra_data = np.array([np.radians(entry.ra) for entry in met.data])
-        dec_data = np.array([np.radians(entry.dec) for entry in met.data])
-        time_data = np.array([entry.time_rel + time_offset for entry in met.data])
-        mag_data = np.array([entry.mag for entry in met.data])
+        ra_data = np.radians(met.data.ra)
+        dec_data = np.radians(met.data.dec)
+        time_data = met.data.time_rel + time_offset
+        mag_data = np.array(met.data.mag)
 
         # If the data is in J2000, precess it to the epoch of date
         if self.data_in_j2000:
@@ -595,15 +693,16 @@ class TrajectoryCorrelator(object):
             v_init_part=self.v_init_part, monte_carlo=self.traj_constraints.run_mc, 
             mc_runs=mc_runs, mc_runs_max=2*mc_runs,
             show_plots=False, verbose=verbose, save_results=False, 
-            reject_n_sigma_outliers=2, mc_cores=self.traj_constraints.mc_cores, 
+            reject_n_sigma_outliers=2, mc_cores=self.traj_constraints.mc_cores, mc_shared_pool=True,
             geometric_uncert=self.traj_constraints.geometric_uncert, enable_OSM_plot=self.enableOSM)
 
         return traj
 
 
-    def solveTrajectory(self, traj, mc_runs, mcmode=0, matched_obs=None, orig_traj=None):
+    def fitTrajectory(self, traj, mc_runs, mcmode=0):
         """ Given an initialized Trajectory object with observation, run the solver and automatically
-            reject bad observations.
+            reject bad observations. The solution is not saved, but failed trajectories are added to the
+            list of failed trajectories.
 
         Arguments:
             traj: [Trajectory object]
@@ -611,12 +710,9 @@ class TrajectoryCorrelator(object):
 
         Keyword Arguments:
             mcmode: [int] whether to run both intersecting-planes and monte carlo (0), just IP (1) or just MC (2)
-            matched_obs [list] default none: list of new observations being used in the traj.
-            orig_traj [trajectory] default none: original trajectory being updated, required to delete the old data if new soln found. 
 
         Return:
-            successful: [bool] True if successfully solved
-            traj: [Trajectory]
+            traj: [Trajectory] Solved trajectory, or None if the solving failed.
 
         """
 
@@ -644,7 +740,7 @@ class TrajectoryCorrelator(object):
             except ValueError as e:
                 log.info("Error during trajectory estimation!")
                 print(e)
-                return False
+                return None
 
 
             # Reject bad observations until a stable set is found, but only if there are more than 2    
@@ -816,7 +912,7 @@ class TrajectoryCorrelator(object):
                     except ValueError as e:
                         log.info("Error during trajectory estimation!")
                         print(e)
-                        return False
+                        return None
 
 
                     # If the trajectory estimation failed, skip this trajectory
@@ -839,11 +935,11 @@ class TrajectoryCorrelator(object):
                 # Add the trajectory to the list of failed trajectories
                 self.dh.addTrajectory(traj, failed_jdt_ref=jdt_ref)
                 log.info("Trajectory skipped and added to fails!")
-                return False
+                return None
 
                 # # If the trajectory solutions was not done at any point, skip the trajectory completely
                 # if traj_best is None:
-                #     return False
+                #     return None
 
                 # # Otherwise, use the best trajectory solution until the solving failed
                 # else:
@@ -862,7 +958,7 @@ class TrajectoryCorrelator(object):
                     # Add the trajectory to the list of failed trajectories
                     self.dh.addTrajectory(traj_status, failed_jdt_ref=jdt_ref)
 
-                    return False
+                    return None
 
 
             # Use the best trajectory solution
@@ -952,7 +1048,7 @@ class TrajectoryCorrelator(object):
                     log.info("Error during trajectory estimation!")
                     print(e)
                     self.dh.cleanupPhase2TempPickle(save_traj)
-                    return False
+                    return None
 
 
                 # If the solve failed, stop
@@ -963,7 +1059,7 @@ class TrajectoryCorrelator(object):
                         self.dh.addTrajectory(traj, failed_jdt_ref=jdt_ref)
                     log.info('Trajectory failed to solve')
                     self.dh.cleanupPhase2TempPickle(save_traj)
-                    return False
+                    return None
 
 
                 traj = traj_status
@@ -976,7 +1072,7 @@ class TrajectoryCorrelator(object):
                         traj.orbit.v_avg/1000, self.traj_constraints.v_avg_max))
 
                     self.dh.cleanupPhase2TempPickle(save_traj)
-                    return False
+                    return None
 
 
                 # If one of the observations doesn't have an estimated height, skip this trajectory
@@ -984,14 +1080,14 @@ class TrajectoryCorrelator(object):
                     if (obs.rbeg_ele is None) and (not obs.ignore_station):
                         log.info("Heights from observations failed to be estimated!")
                         self.dh.cleanupPhase2TempPickle(save_traj)
-                        return False
+                        return None
 
 
                 # Check that the orbit could be computed
                 if traj.orbit.ra_g is None:
                     log.info("The orbit could not be computed!")
                     self.dh.cleanupPhase2TempPickle(save_traj)
-                    return False
+                    return None
 
                 # Set the trajectory fit as successful
                 successful_traj_fit = True
@@ -1016,41 +1112,205 @@ class TrajectoryCorrelator(object):
             else:
                 log.info("The orbit could not be computed!")
                 self.dh.cleanupPhase2TempPickle(save_traj)
-                return False
+                return None
 
 
 
-        # Save the trajectory if successful. 
-        if successful_traj_fit:
-            # restore the original traj_id so that the phase1 and phase 2 results use the same ID
-            if mcmode == 2:
-                traj.traj_id = saved_traj_id
-                traj.phase_1_only = False
+        if not successful_traj_fit:
+            log.info('unable to fit trajectory')
+            return None
+
+        # restore the original traj_id so that the phase1 and phase 2 results use the same ID
+        if mcmode == 2:
+            traj.traj_id = saved_traj_id
+            traj.phase_1_only = False
+
+        if mcmode == 1:
+            traj.phase_1_only = True
+
+        return traj
+
+
+
+    def saveTrajectory(self, traj, mcmode=0, matched_obs=None, orig_traj=None):
+        """ Save the successfully solved trajectory, add it to the database and mark the observations used in
+            it as paired.
+
+        Arguments:
+            traj: [Trajectory object] Trajectory solved by fitTrajectory.
+
+        Keyword Arguments:
+            mcmode: [int] whether to run both intersecting-planes and monte carlo (0), just IP (1) or just MC (2)
+            matched_obs [list] default none: list of new observations being used in the traj.
+            orig_traj [trajectory] default none: original trajectory being updated, required to delete the old data if new soln found. 
+
+        """
+
+        if orig_traj:
+            log.info(f"Removing the previous solution {os.path.dirname(orig_traj.traj_file_path)} ...")
+            self.dh.removeTrajectory(orig_traj)
+            traj.pre_mc_longname = os.path.split(self.dh.generateTrajOutputDirectoryPath(orig_traj, make_dirs=False))[-1] 
+
+        log.info('Saving trajectory....')
+
+        self.dh.saveTrajectoryResults(traj, self.traj_constraints.save_plots)
+        if mcmode != 2:
+            # we do not need to update the database for phase2 
+            log.info('Updating database....')
+            self.dh.addTrajectory(traj)
+
+        # Mark observations as paired in a trajectory if fit successful
+        if mcmode != 2 and matched_obs is not None: 
+            for _, met_obs_temp, _ in matched_obs:
+                self.dh.markObservationAsPaired(met_obs_temp)
+
+
+
+    def solveTrajectory(self, traj, mc_runs, mcmode=0, matched_obs=None, orig_traj=None):
+        """ Given an initialized Trajectory object with observation, run the solver and automatically
+            reject bad observations. Save the trajectory if it was successfully solved.
+
+        Arguments:
+            traj: [Trajectory object]
+            mc_runs: [int] Number of Monte Carlo runs.
+
+        Keyword Arguments:
+            mcmode: [int] whether to run both intersecting-planes and monte carlo (0), just IP (1) or just MC (2)
+            matched_obs [list] default none: list of new observations being used in the traj.
+            orig_traj [trajectory] default none: original trajectory being updated, required to delete the old data if new soln found. 
+
+        Return:
+            successful: [bool] True if successfully solved
+
+        """
+
+        traj = self.fitTrajectory(traj, mc_runs, mcmode=mcmode)
+
+        if traj is None:
+            return False
+
+        self.saveTrajectory(traj, mcmode=mcmode, matched_obs=matched_obs, orig_traj=orig_traj)
+
+        return True
+
+
+
+    def solveTrajectories(self, solve_jobs, mcmode=0):
+        """ Solve a list of candidate trajectories. If traj_cores in the trajectory constraints is larger than
+            1, the trajectories are fitted in parallel in a pool of worker processes, each running its Monte 
+            Carlo runs on mc_cores cores. The results are merged into the database and the paired 
+            observations one at a time in the order of the input list, so the output does not depend on the
+            order in which the workers finish.
+
+        Arguments:
+            solve_jobs: [iterable] (traj, mc_runs, matched_obs, orig_traj) entries, see solveTrajectory. The
+                entries are taken lazily, only when a solver is free to take them.
+
+        Keyword Arguments:
+            mcmode: [int] whether to run both intersecting-planes and monte carlo (0), just IP (1) or just MC (2)
+
+        Return:
+            [int] Number of successfully solved trajectories.
+        """
+
+        traj_cores = self.traj_constraints.traj_cores
+        if hasattr(solve_jobs, '__len__'):
+            traj_cores = min(traj_cores, len(solve_jobs))
+
+        # Solve one trajectory at a time
+        if traj_cores <= 1:
 
-            if mcmode == 1:
-                traj.phase_1_only = True
+            traj_solved_count = 0
+            for traj, mc_runs, matched_obs, orig_traj in solve_jobs:
+                traj_solved_count += int(self.solveTrajectory(traj, mc_runs, mcmode=mcmode, 
+                    matched_obs=matched_obs, orig_traj=orig_traj))
+
+            return traj_solved_count
+
+
+        log.info(f"Solving trajectories in {traj_cores} parallel processes...")
 
-            if orig_traj:
-                log.info(f"Removing the previous solution {os.path.dirname(orig_traj.traj_file_path)} ...")
-                self.dh.removeTrajectory(orig_traj)
-                traj.pre_mc_longname = os.path.split(self.dh.generateTrajOutputDirectoryPath(orig_traj, make_dirs=False))[-1] 
+        # Keep a few more jobs in flight than there are processes so the workers never wait
+        max_in_flight = 2*traj_cores
 
-            log.info('Saving trajectory....')
+        solve_jobs = iter(solve_jobs)
+        in_flight = collections.deque()
 
-            self.dh.saveTrajectoryResults(traj, self.traj_constraints.save_plots)
-            if mcmode != 2:
-                # we do not need to update the database for phase2 
-                log.info('Updating database....')
-                self.dh.addTrajectory(traj)
+        traj_solved_count = 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=traj_cores, initializer=_initSolverWorker, 
+            initargs=(self.traj_constraints, self.v_init_part, self.data_in_j2000, self.enableOSM, 
+                log.getEffectiveLevel())) as executor:
 
-            # Mark observations as paired in a trajectory if fit successful
-            if mcmode != 2 and matched_obs is not None: 
-                for _, met_obs_temp, _ in matched_obs:
-                    self.dh.markObservationAsPaired(met_obs_temp)
+            while True:
+
+                # Submit new jobs until enough of them are in flight
+                while len(in_flight) < max_in_flight:
+
+                    job = next(solve_jobs, None)
+                    if job is None:
+                        break
+
+                    traj, mc_runs, matched_obs, orig_traj = job
+                    in_flight.append((executor.submit(_fitTrajectoryWorker, traj, mc_runs, mcmode), 
+                        matched_obs, orig_traj))
+
+                if not in_flight:
+                    break
+
+                # Merge the results in the order of the candidates
+                future, matched_obs, orig_traj = in_flight.popleft()
+                traj, dh_calls, log_records = future.result()
+
+                # Write out the log of the worker
+                for record in log_records:
+                    log.handle(record)
+
+                # Replay the changes the solver made to the data handle (e.g. adding failed trajectories)
+                for method_name, args, kwargs in dh_calls:
+                    getattr(self.dh, method_name)(*args, **kwargs)
+
+                if traj is not None:
+                    self.saveTrajectory(traj, mcmode=mcmode, matched_obs=matched_obs, orig_traj=orig_traj)
+                    traj_solved_count += 1
+
+        return traj_solved_count
+
+
+
+    def mcPhaseSolveJob(self, traj):
+        """ Prepare the Monte Carlo phase solution of a trajectory solved in phase 1.
+
+        Arguments:
+            traj: [Trajectory] Phase 1 trajectory.
+
+        Return:
+            (traj, mc_runs, matched_obs, orig_traj): [tuple] Entry for solveTrajectories.
+        """
+
+        log.info("")
+        log.info("-----------------------")
+        log.info("")
+        log.info(f"Solving the trajectory {traj.traj_id}...")
+
+        # Decide the number of MC runs to use depending on the convergence angle
+        if np.degrees(max([entry.conv_angle for entry in traj.intersection_list])) < self.traj_constraints.low_qc_threshold:
+
+            mc_runs = self.traj_constraints.low_qc_mc_runs
         else:
-            log.info('unable to fit trajectory')
+            mc_runs = self.traj_constraints.error_mc_runs
+
+        ### ADJUST THE NUMBER OF MC RUNS FOR OPTIMAL USE OF CPU CORES ###
 
-        return successful_traj_fit
+        # Make sure that the number of MC runs is larger or equal to the number of processor cores
+        if mc_runs < self.traj_constraints.mc_cores:
+            mc_runs = int(self.traj_constraints.mc_cores)
+
+        # If the number of MC runs is not a multiple of CPU cores, increase it until it is
+        #   This will increase the number of MC runs while keeping the processing time the same
+        mc_runs = int(np.ceil(mc_runs/self.traj_constraints.mc_cores)*self.traj_constraints.mc_cores)
+
+        # The phase 1 solution is replaced by the new one
+        return traj, mc_runs, traj, traj
 
 
 
@@ -1071,6 +1331,9 @@ class TrajectoryCorrelator(object):
         else:
             mcmodestr = ' '
 
+        # Start with an empty cache of station pair checks
+        self.resetStationPairCache()
+
         if mcmode != 2:
             # Get unpaired observations, filter out observations with too little points and sort them by time
             unpaired_observations_all = self.dh.getUnpairedObservations()
@@ -1090,8 +1353,7 @@ class TrajectoryCorrelator(object):
                 met_obs.reference_dt = met_obs.reference_dt + datetime.timedelta(seconds=t_zero)
 
                 # Normalize all observation times so that the first time is t = 0 s
-                for i in range(len(met_obs.data)):
-                    met_obs.data[i].time_rel -= t_zero
+                met_obs.data.time_rel -= t_zero
 
 
             
@@ -1143,9 +1405,10 @@ class TrajectoryCorrelator(object):
                 log.info("")
 
 
-                # Select observations in the given time bin
+                # Select observations in the given time bin and index them by time for fast pairing
                 unpaired_observations = [met_obs for met_obs in unpaired_observations_all 
                     if (met_obs.reference_dt >= bin_beg) and (met_obs.reference_dt <= bin_end)]
+                unpaired_observations = self.dh.indexObservations(unpaired_observations)
 
                 log.info(f'Analysing {len(unpaired_observations)} observations...')
 
@@ -1540,19 +1803,27 @@ class TrajectoryCorrelator(object):
 
             log.info("")
             log.info("-----------------------")
-            log.info(f'SOLVING {len(candidate_trajectories)} TRAJECTORIES {mcmodestr}')
+            if mcmode == 2:
+                log.info(f'SOLVING QUEUED TRAJECTORIES {mcmodestr}')
+            else:
+                log.info(f'SOLVING {len(candidate_trajectories)} TRAJECTORIES {mcmodestr}')
             log.info("-----------------------")
             log.info("")
 
-            # Go through all candidate trajectories and compute the complete trajectory solution
-            for matched_observations in candidate_trajectories:
+            # mcmode is 2 and so we have trajectories that were solved in phase 1 to prepare for monte-carlo
+            #   solutions. They are taken from the job queue one at a time, as the solvers become free
+            if mcmode == 2:
+                solve_jobs = (self.mcPhaseSolveJob(traj) for traj in candidate_trajectories)
 
-                log.info("")
-                log.info("-----------------------")
+            # Go through all candidate trajectories and prepare the intersecting planes solutions
+            else:
 
+                solve_jobs = []
+                for matched_observations in candidate_trajectories:
+
+                    log.info("")
+                    log.info("-----------------------")
 
-                # if mcmode is not 2, prepare to calculate the intersecting planes solutions
-                if mcmode != 2:
                     # Find unique station counts
                     station_counts = np.unique([entry[1].station_code for entry in matched_observations], 
                         return_counts=True)
@@ -1688,40 +1959,13 @@ class TrajectoryCorrelator(object):
                         continue
 
                     # pass in matched_observations here so that solveTrajectory can mark them paired if they're used
-                    result = self.solveTrajectory(traj, mc_runs, mcmode=mcmode, matched_obs=matched_observations)
-                    traj_solved_count += int(result)
-
-                    # end of if mcmode != 2
-                else:
-                    # mcmode is 2 and so we have a list of trajectories that were solved in phase 1
-                    # to prepare for monte-carlo solutions
-
-                    traj = matched_observations
-                    log.info("")
-                    log.info(f"Solving the trajectory {traj.traj_id}...")
-
-                    # Decide the number of MC runs to use depending on the convergence angle
-                    if np.degrees(max([entry.conv_angle for entry in matched_observations.intersection_list])) < self.traj_constraints.low_qc_threshold:
-
-                        mc_runs = self.traj_constraints.low_qc_mc_runs
-                    else:
-                        mc_runs = self.traj_constraints.error_mc_runs
-
-                    ### ADJUST THE NUMBER OF MC RUNS FOR OPTIMAL USE OF CPU CORES ###
+                    solve_jobs.append((traj, mc_runs, matched_observations, None))
 
-                    # Make sure that the number of MC runs is larger or equal to the number of processor cores
-                    if mc_runs < self.traj_constraints.mc_cores:
-                        mc_runs = int(self.traj_constraints.mc_cores)
+                # end of "for matched_observations in candidate_trajectories"
 
-                    # If the number of MC runs is not a multiple of CPU cores, increase it until it is
-                    #   This will increase the number of MC runs while keeping the processing time the same
-                    mc_runs = int(np.ceil(mc_runs/self.traj_constraints.mc_cores)*self.traj_constraints.mc_cores)
+            # Compute the complete trajectory solutions, in parallel if enabled
+            traj_solved_count += self.solveTrajectories(solve_jobs, mcmode=mcmode)
 
-                    # pass in matched_observations here so that solveTrajectory can mark them paired if they're used
-                    result = self.solveTrajectory(traj, mc_runs, mcmode=mcmode, matched_obs=matched_observations, orig_traj=traj)
-                    traj_solved_count += int(result)
-
-            # end of "for matched_observations in candidate_trajectories"
             outcomes = [traj_solved_count]
 
             # Finish the correlation run (update the database with new values)
@@ -1732,3 +1976,89 @@ class TrajectoryCorrelator(object):
             log.info("-----------------")
             log.info("SOLVING RUN DONE!")
             log.info("-----------------")
+
+
+
+
+class _DeferredDataHandle(object):
+    def __init__(self):
+        """ Stand-in for the data handle in trajectory solver worker processes. The calls which change the 
+            database or the files on disk are only recorded, and they are replayed on the real data handle by 
+            the parent process.
+        """
+
+        # List of (method name, args, kwargs) entries
+        self.calls = []
+
+
+    def addTrajectory(self, traj, failed_jdt_ref=None):
+        self.calls.append(("addTrajectory", (traj,), {"failed_jdt_ref": failed_jdt_ref}))
+
+
+    def cleanupPhase2TempPickle(self, traj, success=False):
+        self.calls.append(("cleanupPhase2TempPickle", (traj,), {"success": success}))
+
+
+
+class _LogRecordList(logging.Handler):
+    def __init__(self):
+        """ Logging handler which keeps the log records of a trajectory solver worker process, so they can
+            be written out by the parent process together with the results.
+        """
+
+        logging.Handler.__init__(self)
+
+        self.records = []
+
+
+    def emit(self, record):
+
+        # Format the message so the record can be pickled
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+
+        self.records.append(record)
+
+
+
+# State of the trajectory solver worker processes
+_solver_worker = {}
+
+
+def _initSolverWorker(traj_constraints, v_init_part, data_in_j2000, enableOSM, log_level):
+    """ Internal function. Initializes a worker process of the parallel trajectory solver. """
+
+    # Do not use the Monte Carlo pools inherited from the parent process
+    resetSharedPools()
+
+    # Collect the log so the parent can write it out in the order of the candidates
+    log_handler = _LogRecordList()
+    log.handlers = [log_handler]
+    log.propagate = False
+    log.setLevel(log_level)
+
+    _solver_worker["log_handler"] = log_handler
+    _solver_worker["correlator"] = TrajectoryCorrelator(_DeferredDataHandle(), traj_constraints, v_init_part, 
+        data_in_j2000=data_in_j2000, enableOSM=enableOSM)
+
+
+def _fitTrajectoryWorker(traj, mc_runs, mcmode):
+    """ Internal function. Fit one candidate trajectory in a worker process.
+
+    Return:
+        (traj, dh_calls, log_records):
+            - traj: [Trajectory] Solved trajectory, or None if the solving failed.
+            - dh_calls: [list] Recorded calls to the data handle, see _DeferredDataHandle.
+            - log_records: [list] Log records of the solver.
+    """
+
+    tc = _solver_worker["correlator"]
+    log_handler = _solver_worker["log_handler"]
+
+    tc.dh = _DeferredDataHandle()
+    log_handler.records = []
+
+    traj = tc.fitTrajectory(traj, mc_runs, mcmode=mcmode)
+
+    return traj, tc.dh.calls, log_handler.records
@@ -17,17 +17,25 @@ import multiprocessing
 import logging
 import logging.handlers
 import glob
+import sqlite3
+import threading
+import tempfile
+import collections.abc
+import concurrent.futures
 import pandas as pd
 from dateutil.relativedelta import relativedelta
 import numpy as np
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
 
 from wmpl.Formats.CAMS import loadFTPDetectInfo
 from wmpl.Trajectory.CorrelateEngine import TrajectoryCorrelator, TrajectoryConstraints
+from wmpl.Trajectory.MCJobQueue import openMCJobQueue, MC_LEASE_TIME, MC_QUEUE_PRIORITIES
 from wmpl.Utils.Math import generateDatetimeBins
 from wmpl.Utils.OSTools import mkdirP
 from wmpl.Utils.Pickling import loadPickle, savePickle
 from wmpl.Utils.TrajConversions import datetime2JD, jd2Date
-from wmpl.Utils.remoteDataHandling import collectRemoteTrajectories, moveRemoteTrajectories, uploadTrajToRemote
+from wmpl.Utils.remoteDataHandling import collectRemoteTrajectories, moveRemoteTrajectories, getRemoteUploadQueue
 
 ### CONSTANTS ###
 
@@ -37,9 +45,25 @@ OUTPUT_TRAJ_DIR = "trajectories"
 # Name of json file with the list of processed directories
 JSON_DB_NAME = "processed_trajectories.json"
 
+# Name of the SQLite database file with the list of processed directories
+SQLITE_DB_NAME = "processed_trajectories.db"
+
 # Auto run frequency (hours)
 AUTO_RUN_FREQUENCY = 6
 
+# Time without new files after which a data folder is processed in the incremental mode (seconds)
+WATCH_SETTLE_TIME = 120
+
+# Directory (inside the database directory) with the cache of parsed observations
+OBS_CACHE_DIR = "obs_cache"
+
+# Version of the parsed observation cache format, cache files with a different version are reparsed
+OBS_CACHE_VERSION = 1
+
+# Margin added to the time range of the new observations in the incremental mode, on top of the maximum time
+#   offset between stations (seconds)
+WATCH_TIME_MARGIN = 60
+
 ### ###
 
 log = logging.getLogger("traj_correlator")
@@ -356,6 +380,430 @@ class DatabaseJSON(object):
 
 
 
+    def getTrajectories(self, jd_beg, jd_end, failed=False):
+        """ Return a list of trajectories with the reference Julian date between the given Julian dates. 
+
+        Arguments:
+            jd_beg: [float] First Julian date.
+            jd_end: [float] Last Julian date.
+
+        Keyword arguments:
+            failed: [bool] Return failed trajectories instead of the successful ones. False by default.
+
+        Return:
+            [list] A list of TrajectoryReduced objects.
+        """
+
+        if failed:
+            traj_dict = self.failed_trajectories
+        else:
+            traj_dict = self.trajectories
+
+        return [traj_dict[key] for key in traj_dict 
+            if (traj_dict[key].jdt_ref >= jd_beg) and (traj_dict[key].jdt_ref <= jd_end)]
+
+
+    def removeTrajectory(self, traj_reduced, keepFolder=False):
+        """ Remove the trajectory from the data base and disk. """
+
+        # Remove the trajectory data base entry
+        if traj_reduced.jdt_ref in self.trajectories:
+            del self.trajectories[traj_reduced.jdt_ref]
+
+        # Remove the trajectory folder on the disk
+        if not keepFolder and os.path.isfile(traj_reduced.traj_file_path):
+            traj_dir = os.path.dirname(traj_reduced.traj_file_path)
+            shutil.rmtree(traj_dir, ignore_errors=True)
+            if os.path.isfile(traj_reduced.traj_file_path):
+                log.info(f'unable to remove {traj_dir}')
+
+
+
+class _SQLiteTrajectoryTable(collections.abc.MutableMapping):
+    def __init__(self, db, failed):
+        """ Dictionary-like view of the trajectories in the SQLite database. Keys are reference Julian dates
+            and values are TrajectoryReduced objects. Note that the returned objects are copies, changing them
+            does not change the database.
+
+        Arguments:
+            db: [DatabaseSQLite] Database object.
+            failed: [bool] Whether this is a table of failed trajectories.
+        """
+
+        self.db = db
+        self.failed = int(failed)
+
+
+    def __getitem__(self, jdt_ref):
+
+        row = self.db.conn.execute("SELECT data FROM trajectories WHERE failed = ? AND jdt_ref = ?", 
+            (self.failed, float(jdt_ref))).fetchone()
+
+        if row is None:
+            raise KeyError(jdt_ref)
+
+        return TrajectoryReduced(None, json_dict=json.loads(row[0]))
+
+
+    def __setitem__(self, jdt_ref, traj_reduced):
+
+        self.db.conn.execute("INSERT OR REPLACE INTO trajectories (failed, jdt_ref, traj_id, data) "
+            "VALUES (?, ?, ?, ?)", (self.failed, float(jdt_ref), getattr(traj_reduced, 'traj_id', None), 
+                json.dumps(traj_reduced.__dict__, default=lambda o: o.__dict__)))
+
+
+    def __delitem__(self, jdt_ref):
+
+        cur = self.db.conn.execute("DELETE FROM trajectories WHERE failed = ? AND jdt_ref = ?", 
+            (self.failed, float(jdt_ref)))
+
+        if cur.rowcount == 0:
+            raise KeyError(jdt_ref)
+
+
+    def __contains__(self, jdt_ref):
+
+        return self.db.conn.execute("SELECT 1 FROM trajectories WHERE failed = ? AND jdt_ref = ?", 
+            (self.failed, float(jdt_ref))).fetchone() is not None
+
+
+    def __iter__(self):
+
+        # Fetch all keys first so the table can be modified during iteration
+        rows = self.db.conn.execute("SELECT jdt_ref FROM trajectories WHERE failed = ? ORDER BY jdt_ref", 
+            (self.failed,)).fetchall()
+
+        return iter([row[0] for row in rows])
+
+
+    def __len__(self):
+
+        return self.db.conn.execute("SELECT COUNT(*) FROM trajectories WHERE failed = ?", 
+            (self.failed,)).fetchone()[0]
+
+
+    def inRange(self, jd_beg, jd_end):
+        """ Return a list of TrajectoryReduced objects between the given Julian dates, using the index. """
+
+        rows = self.db.conn.execute("SELECT data FROM trajectories WHERE failed = ? AND jdt_ref >= ? "
+            "AND jdt_ref <= ? ORDER BY jdt_ref", (self.failed, float(jd_beg), float(jd_end))).fetchall()
+
+        return [TrajectoryReduced(None, json_dict=json.loads(row[0])) for row in rows]
+
+
+    def setTrajID(self, jdt_ref, traj_id):
+        """ Update the trajectory ID of the given trajectory. """
+
+        traj_reduced = self[jdt_ref]
+        traj_reduced.traj_id = traj_id
+        self[jdt_ref] = traj_reduced
+
+
+
+class _SQLiteStationList(object):
+    def __init__(self, db, table, column, station):
+        """ List-like view of the entries of one station in a (station, value) table of the SQLite 
+            database.
+
+        Arguments:
+            db: [DatabaseSQLite] Database object.
+            table: [str] Name of the table.
+            column: [str] Name of the value column.
+            station: [str] Station code.
+        """
+
+        self.db = db
+        self.table = table
+        self.column = column
+        self.station = station
+
+
+    def __contains__(self, value):
+
+        return self.db.conn.execute("SELECT 1 FROM {:s} WHERE station = ? AND {:s} = ?".format(self.table, 
+            self.column), (self.station, value)).fetchone() is not None
+
+
+    def __iter__(self):
+
+        rows = self.db.conn.execute("SELECT {:s} FROM {:s} WHERE station = ? ORDER BY rowid".format(
+            self.column, self.table), (self.station,)).fetchall()
+
+        return iter([row[0] for row in rows])
+
+
+    def __len__(self):
+
+        return self.db.conn.execute("SELECT COUNT(*) FROM {:s} WHERE station = ?".format(self.table), 
+            (self.station,)).fetchone()[0]
+
+
+    def append(self, value):
+
+        self.db.conn.execute("INSERT OR IGNORE INTO {:s} (station, {:s}) VALUES (?, ?)".format(self.table, 
+            self.column), (self.station, value))
+
+
+    def remove(self, value):
+
+        cur = self.db.conn.execute("DELETE FROM {:s} WHERE station = ? AND {:s} = ?".format(self.table, 
+            self.column), (self.station, value))
+
+        if cur.rowcount == 0:
+            raise ValueError("{:s} not in the list".format(str(value)))
+
+
+
+class _SQLiteStationTable(collections.abc.Mapping):
+    def __init__(self, db, table, column, station_table=None):
+        """ Dictionary-like view of a (station, value) table of the SQLite database. Keys are station codes
+            and values are list-like views of the station's entries.
+
+        Arguments:
+            db: [DatabaseSQLite] Database object.
+            table: [str] Name of the table.
+            column: [str] Name of the value column.
+
+        Keyword arguments:
+            station_table: [str] Name of the table with the list of stations. If given, a station is in the
+                table even when it doesn't have any entries. None by default, in which case the list of 
+                stations is the list of stations which have entries.
+        """
+
+        self.db = db
+        self.table = table
+        self.column = column
+        self.station_table = station_table
+
+
+    def _stationTable(self):
+        if self.station_table is None:
+            return self.table
+        return self.station_table
+
+
+    def __getitem__(self, station):
+
+        if station not in self:
+            raise KeyError(station)
+
+        return _SQLiteStationList(self.db, self.table, self.column, station)
+
+
+    def __setitem__(self, station, values):
+        """ Add the station and replace all its entries with the given ones. """
+
+        if self.station_table is not None:
+            self.db.conn.execute("INSERT OR IGNORE INTO {:s} (station) VALUES (?)".format(self.station_table), 
+                (station,))
+
+        self.db.conn.execute("DELETE FROM {:s} WHERE station = ?".format(self.table), (station,))
+        self.db.conn.executemany("INSERT OR IGNORE INTO {:s} (station, {:s}) VALUES (?, ?)".format(
+            self.table, self.column), [(station, value) for value in values])
+
+
+    def __contains__(self, station):
+
+        return self.db.conn.execute("SELECT 1 FROM {:s} WHERE station = ? LIMIT 1".format(
+            self._stationTable()), (station,)).fetchone() is not None
+
+
+    def __iter__(self):
+
+        rows = self.db.conn.execute("SELECT DISTINCT station FROM {:s} ORDER BY station".format(
+            self._stationTable())).fetchall()
+
+        return iter([row[0] for row in rows])
+
+
+    def __len__(self):
+
+        return self.db.conn.execute("SELECT COUNT(DISTINCT station) FROM {:s}".format(
+            self._stationTable())).fetchone()[0]
+
+
+
+class DatabaseSQLite(object):
+    def __init__(self, db_file_path, verbose=False):
+        """ Trajectory database stored in an SQLite file. It has the same interface as DatabaseJSON, but
+            changes are written incrementally in transactions which are committed on save(), instead of
+            rewriting the whole file. The tables are indexed by the reference Julian date, trajectory ID,
+            station code and observation ID.
+
+        Arguments:
+            db_file_path: [str] Path to the SQLite database file.
+
+        Keyword arguments:
+            verbose: [bool] Verbose logging. False by default.
+        """
+
+        self.db_file_path = db_file_path
+        self.verbose = verbose
+
+        self.conn = None
+        self.load(verbose=verbose)
+
+
+    def load(self, verbose=False):
+        """ Open the database file and create the tables if they don't exist. """
+
+        self.verbose = verbose
+
+        self.conn = sqlite3.connect(self.db_file_path)
+
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS processed_stations (station TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS processed_dirs (station TEXT NOT NULL, rel_proc_path TEXT NOT NULL, 
+                PRIMARY KEY (station, rel_proc_path));
+            CREATE TABLE IF NOT EXISTS paired_obs (station TEXT NOT NULL, obs_id TEXT NOT NULL, 
+                PRIMARY KEY (station, obs_id));
+            CREATE INDEX IF NOT EXISTS paired_obs_id ON paired_obs (obs_id);
+            CREATE TABLE IF NOT EXISTS trajectories (failed INTEGER NOT NULL, jdt_ref REAL NOT NULL, 
+                traj_id TEXT, data TEXT NOT NULL, PRIMARY KEY (failed, jdt_ref));
+            CREATE INDEX IF NOT EXISTS trajectories_jdt_ref ON trajectories (jdt_ref);
+            CREATE INDEX IF NOT EXISTS trajectories_traj_id ON trajectories (traj_id);
+            """)
+        self.conn.commit()
+
+        # Dictionary-like views of the tables, with the same structure as in DatabaseJSON
+        self.processed_dirs = _SQLiteStationTable(self, "processed_dirs", "rel_proc_path", 
+            station_table="processed_stations")
+        self.paired_obs = _SQLiteStationTable(self, "paired_obs", "obs_id")
+        self.trajectories = _SQLiteTrajectoryTable(self, failed=False)
+        self.failed_trajectories = _SQLiteTrajectoryTable(self, failed=True)
+
+
+    def save(self):
+        """ Commit all changes to the database. """
+
+        try:
+            self.conn.commit()
+
+        except Exception as e:
+            log.warning('unable to save the database')
+            log.warning(e)
+
+
+    def close(self):
+        """ Commit all changes and close the database. """
+
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+
+    def __getstate__(self):
+
+        # Commit the changes, the connection is reopened after unpickling
+        if self.conn is not None:
+            self.conn.commit()
+
+        return {'db_file_path': self.db_file_path, 'verbose': self.verbose}
+
+
+    def __setstate__(self, state):
+
+        self.db_file_path = state['db_file_path']
+        self.load(verbose=state['verbose'])
+
+
+    def addProcessedDir(self, station_name, rel_proc_path):
+        """ Add the processed directory to the list. """
+
+        if station_name in self.processed_dirs:
+            self.processed_dirs[station_name].append(rel_proc_path)
+
+
+    def addPairedObservation(self, met_obs):
+        """ Mark the given meteor observation as paired in a trajectory. """
+
+        self.conn.execute("INSERT OR IGNORE INTO paired_obs (station, obs_id) VALUES (?, ?)", 
+            (met_obs.station_code, met_obs.id))
+
+
+    def checkObsIfPaired(self, met_obs):
+        """ Check if the given observation has been paired to a trajectory or not. """
+
+        return self.conn.execute("SELECT 1 FROM paired_obs WHERE station = ? AND obs_id = ?", 
+            (met_obs.station_code, met_obs.id)).fetchone() is not None
+
+
+    def checkTrajIfFailed(self, traj):
+        """ Check if the given trajectory has been computed with the same observations and has failed to be
+            computed before.
+
+        """
+
+        # Check if the reference time is in the list of failed trajectories
+        if traj.jdt_ref in self.failed_trajectories:
+
+            # Get the failed trajectory object
+            failed_traj = self.failed_trajectories[traj.jdt_ref]
+
+            # Check if the same observations participate in the failed trajectory as in the trajectory that
+            #   is being tested
+            for obs in traj.observations:
+                
+                if not ((obs.station_id in failed_traj.participating_stations) or (obs.station_id in failed_traj.ignored_stations)):
+                    return False
+
+            # If the same stations were used, the trajectory estimation failed before
+            return True
+
+
+        return False
+
+
+    def addTrajectory(self, traj_file_path, traj_obj=None, failed=False):
+        """ Add a computed trajectory to the list. See DatabaseJSON.addTrajectory for details. """
+
+        # Load the trajectory from disk
+        if traj_obj is None:
+
+            # Init the reduced trajectory object
+            traj_reduced = TrajectoryReduced(traj_file_path)
+
+            if not hasattr(traj_reduced, "jdt_ref"):
+                return None
+
+            if self.verbose:
+                log.info(f' loaded {traj_file_path}, traj_id {getattr(traj_reduced, "traj_id", None)}')
+
+        else:
+            # Use the provided trajectory object
+            traj_reduced = traj_obj
+            if self.verbose:
+                log.info(f' loaded {traj_obj.traj_file_path}, '
+                f'traj_id {getattr(traj_reduced, "traj_id", None)}')
+
+
+        # Choose to which table the trajectory will be added
+        if failed:
+            traj_dict = self.failed_trajectories
+
+        else:
+            traj_dict = self.trajectories
+
+
+        # Add the trajectory to the list (key is the reference JD), or only update the ID if it exists
+        if traj_reduced.jdt_ref not in traj_dict:
+            traj_dict[traj_reduced.jdt_ref] = traj_reduced
+        else:
+            traj_dict.setTrajID(traj_reduced.jdt_ref, getattr(traj_reduced, 'traj_id', None))
+
+
+    def getTrajectories(self, jd_beg, jd_end, failed=False):
+        """ Return a list of trajectories with the reference Julian date between the given Julian dates. See
+            DatabaseJSON.getTrajectories for details.
+        """
+
+        if failed:
+            return self.failed_trajectories.inRange(jd_beg, jd_end)
+
+        return self.trajectories.inRange(jd_beg, jd_end)
+
+
     def removeTrajectory(self, traj_reduced, keepFolder=False):
         """ Remove the trajectory from the data base and disk. """
 
@@ -372,9 +820,92 @@ class DatabaseJSON(object):
 
 
 
+def migrateJSONDatabase(json_db_file_path, sqlite_db_file_path, verbose=False):
+    """ Copy the contents of a JSON trajectory database into an SQLite database.
+
+    Arguments:
+        json_db_file_path: [str] Path to the existing JSON database.
+        sqlite_db_file_path: [str] Path to the SQLite database. It will be created if it doesn't exist.
+
+    Keyword arguments:
+        verbose: [bool] Verbose logging. False by default.
+
+    Return:
+        [DatabaseSQLite] The SQLite database.
+    """
+
+    json_db = DatabaseJSON(json_db_file_path, verbose=verbose)
+    sqlite_db = DatabaseSQLite(sqlite_db_file_path, verbose=verbose)
+
+    log.info("Migrating {:s} to {:s}...".format(json_db_file_path, sqlite_db_file_path))
+
+    # Insert everything in one transaction
+    with sqlite_db.conn:
+
+        for station in json_db.processed_dirs:
+            sqlite_db.processed_dirs[station] = json_db.processed_dirs[station]
+
+        sqlite_db.conn.executemany("INSERT OR IGNORE INTO paired_obs (station, obs_id) VALUES (?, ?)", 
+            [(station, obs_id) for station in json_db.paired_obs for obs_id in json_db.paired_obs[station]])
+
+        for failed, traj_dict in [(0, json_db.trajectories), (1, json_db.failed_trajectories)]:
+            sqlite_db.conn.executemany("INSERT OR REPLACE INTO trajectories (failed, jdt_ref, traj_id, data) "
+                "VALUES (?, ?, ?, ?)", [(failed, float(jdt_ref), getattr(traj_dict[jdt_ref], 'traj_id', None), 
+                    json.dumps(traj_dict[jdt_ref].__dict__, default=lambda o: o.__dict__)) 
+                    for jdt_ref in traj_dict])
+
+    log.info("   ... migrated {:d} trajectories and {:d} failed trajectories".format(
+        len(sqlite_db.trajectories), len(sqlite_db.failed_trajectories)))
+
+    return sqlite_db
+
+
+
+# Fields of the meteor picks (one row per pick). Equatorial coordinates are J2000, the horizontal ones have
+#   the azimuth +E of due N, all angles are in degrees
+METEOR_POINT_DTYPE = np.dtype([("frame", np.float64), ("time_rel", np.float64), ("x", np.float64), 
+    ("y", np.float64), ("ra", np.float64), ("dec", np.float64), ("azim", np.float64), ("alt", np.float64), 
+    ("mag", np.float64)])
+
+
+def initMeteorPoints(frame, time_rel, x, y, ra, dec, azim, alt, mag):
+    """ Init the container of meteor picks, a record array with METEOR_POINT_DTYPE fields. Columns can be 
+        accessed as attributes (e.g. data.x), and every row as a record with the same attributes 
+        (e.g. data[0].time_rel).
+
+    Return:
+        [np.recarray] Meteor picks.
+    """
+
+    data = np.zeros(len(frame), dtype=METEOR_POINT_DTYPE)
+
+    data["frame"] = frame
+    data["time_rel"] = time_rel
+    data["x"] = x
+    data["y"] = y
+    data["ra"] = ra
+    data["dec"] = dec
+    data["azim"] = azim
+    data["alt"] = alt
+    data["mag"] = mag
+
+    return data.view(np.recarray)
+
+
+
+def meteorPointsFromList(points):
+    """ Convert a list of MeteorPointRMS objects to the container of meteor picks (see initMeteorPoints). """
+
+    return initMeteorPoints(*[[getattr(point, name) for point in points] for name in METEOR_POINT_DTYPE.names])
+
+
+
 class MeteorPointRMS(object):
     def __init__(self, frame, time_rel, x, y, ra, dec, azim, alt, mag):
-        """ Container for individual meteor picks. """
+        """ Container for individual meteor picks. The picks are now stored in a record array (see 
+            initMeteorPoints), this class is kept for external code and for observations pickled by older 
+            versions. A list of these objects can be passed to MeteorObsRMS, it is converted to a record array.
+        """
 
         # Frame number since the beginning of the FF file
         self.frame = frame
@@ -409,7 +940,8 @@ class MeteorObsRMS(object):
                 station_code: [str] RMS station code.
                 reference_dt: [datetime] Datetime when the relative time is t = 0.
                 platepar: [Platepar object] RMS calibration plate for the given observations.
-                data: [list] A list of MeteorPointRMS objects.
+                data: [np.recarray] Meteor picks, see initMeteorPoints. A list of MeteorPointRMS objects is 
+                    converted to a record array.
                 rel_proc_path: [str] Path to the folder with the nighly observations for this meteor.
 
             Keyword arguments:
@@ -420,6 +952,10 @@ class MeteorObsRMS(object):
 
         self.reference_dt = reference_dt
         self.platepar = platepar
+
+        if not isinstance(data, np.recarray):
+            data = meteorPointsFromList(data)
+
         self.data = data
 
         # Path to the directory with data
@@ -432,8 +968,7 @@ class MeteorObsRMS(object):
         self.processed = False 
 
         # Mean datetime of the observation
-        self.mean_dt = self.reference_dt + datetime.timedelta(seconds=np.mean([entry.time_rel 
-            for entry in self.data]))
+        self.mean_dt = self.reference_dt + datetime.timedelta(seconds=float(np.mean(self.data.time_rel)))
 
         
         ### Estimate if the meteor begins and ends inside the FOV ###
@@ -502,11 +1037,193 @@ class MeteorObsRMS(object):
 
         # Generate a unique observation ID, the format is: STATIONID_YYYYMMDD-HHMMSS.us_CHECKSUM
         #  where CHECKSUM is the last four digits of the sum of all observation image X cordinates
-        checksum = int(np.sum([entry.x for entry in self.data]) % 10000)
+        checksum = int(np.sum(self.data.x) % 10000)
         self.id = "{:s}_{:s}_{:04d}".format(self.station_code, self.mean_dt.strftime("%Y%m%d-%H%M%S.%f"), 
             checksum)
 
 
+    def __setstate__(self, state):
+
+        # Observations pickled by older versions store the picks as a list of MeteorPointRMS objects
+        if ("data" in state) and not isinstance(state["data"], np.recarray):
+            state["data"] = meteorPointsFromList(state["data"])
+
+        self.__dict__.update(state)
+
+
+
+class ObservationTimeIndex(object):
+    def __init__(self, observations, country_groups=None):
+        """ Time-indexed store of meteor observations used for pairing. Observations are sorted by their
+            mean time so that all observations in a time window can be found with a binary search, and paired
+            observations can be removed without rebuilding the index. Iterating over the index returns the
+            observations which were not removed, in the original order.
+
+        Arguments:
+            observations: [list] A list of MeteorObsRMS objects.
+
+        Keyword arguments:
+            country_groups: [list] A list of lists of country codes (first two letters of the station code)
+                which are allowed to be paired together. None by default, in which case all stations can be 
+                paired.
+        """
+
+        self.observations = list(observations)
+
+        if country_groups is None:
+            country_groups = []
+
+        self.country_groups = country_groups
+
+        n_obs = len(self.observations)
+
+        # Position of every observation in the list, keyed by the object ID
+        self.positions = {id(met_obs): i for i, met_obs in enumerate(self.observations)}
+
+        # Flags indicating which observations were not removed
+        self.active = np.ones(n_obs, dtype=bool)
+        self.n_active = n_obs
+
+
+        # Mean Julian dates of observations
+        self.mean_jd = np.array([datetime2JD(met_obs.mean_dt) for met_obs in self.observations], 
+            dtype=np.float64)
+
+        # Mean times in seconds relative to the first observation (used for exact time comparisons)
+        if n_obs:
+            self.ref_dt = self.observations[0].mean_dt
+        else:
+            self.ref_dt = None
+
+        self.mean_time = np.array([(met_obs.mean_dt - self.ref_dt).total_seconds() 
+            for met_obs in self.observations], dtype=np.float64)
+
+        # Station codes
+        self.station_codes = np.array([str(met_obs.station_code) for met_obs in self.observations], 
+            dtype=object)
+
+        # Index of the first country group the station is in (-1 if it's not in any)
+        self.country_group_indices = np.array([self.countryGroupIndex(station_code) 
+            for station_code in self.station_codes], dtype=np.int64)
+
+        # Matrix indicating which observations are in which country group (n_groups x n_obs)
+        self.country_group_members = np.zeros((len(self.country_groups), n_obs), dtype=bool)
+        for i, group in enumerate(self.country_groups):
+            self.country_group_members[i] = [station_code[:2] in group for station_code in self.station_codes]
+
+
+        # Order of observations sorted by the mean time and sorted times used for the binary search
+        self.time_order = np.argsort(self.mean_time, kind='stable')
+        self.sorted_time = self.mean_time[self.time_order]
+
+
+    def __len__(self):
+        return self.n_active
+
+
+    def __iter__(self):
+        for i, met_obs in enumerate(self.observations):
+            if self.active[i]:
+                yield met_obs
+
+
+    def __contains__(self, met_obs):
+        i = self.positions.get(id(met_obs))
+        return (i is not None) and bool(self.active[i])
+
+
+    def countryGroupIndex(self, station_code):
+        """ Return the index of the first country group the station is in, or -1 if it's not in any group. """
+
+        for i, group in enumerate(self.country_groups):
+            if station_code[:2] in group:
+                return i
+
+        return -1
+
+
+    def remove(self, met_obs):
+        """ Remove the given observation from the index (e.g. after it was paired). 
+        
+        Arguments:
+            met_obs: [MeteorObsRMS] Observation to remove.
+        """
+
+        i = self.positions.get(id(met_obs))
+
+        if (i is None) or (not self.active[i]):
+            raise ValueError("The observation is not in the index!")
+
+        self.active[i] = False
+        self.n_active -= 1
+
+
+    def timeWindow(self, dt, max_toffset):
+        """ Find all active observations within the given time window.
+
+        Arguments:
+            dt: [datetime] Centre of the time window.
+            max_toffset: [float] Half-width of the time window (seconds).
+
+        Return:
+            [ndarray] Indices of observations within the window, in the original order.
+        """
+
+        if self.ref_dt is None:
+            return np.array([], dtype=np.int64)
+
+        t = (dt - self.ref_dt).total_seconds()
+
+        # Find the window with a binary search
+        i_beg = np.searchsorted(self.sorted_time, t - max_toffset, side='left')
+        i_end = np.searchsorted(self.sorted_time, t + max_toffset, side='right')
+
+        candidates = self.time_order[i_beg:i_end]
+
+        # Apply the exact time check and remove observations which are not active anymore
+        candidates = candidates[self.active[candidates] 
+            & (np.abs(self.mean_time[candidates] - t) <= max_toffset)]
+
+        return np.sort(candidates)
+
+
+    def findTimePairs(self, met_obs, max_toffset):
+        """ Find observations from other stations in the same country group which are close in time to the
+            given observation. See RMSDataHandle.findTimePairs for details.
+        """
+
+        candidates = self.timeWindow(met_obs.mean_dt, max_toffset)
+
+        # Take only observations from different stations
+        candidates = candidates[self.station_codes[candidates] != met_obs.station_code]
+
+        # Check that the stations are in the same region / group of countries
+        group_index = self.countryGroupIndex(met_obs.station_code)
+        if group_index >= 0:
+            candidates = candidates[self.country_group_members[group_index, candidates]]
+
+        return [self.observations[i] for i in candidates]
+
+
+    def getTrajTimePairs(self, traj_mid_dt, ref_station_code, excluded_stations, max_toffset):
+        """ Find observations which are close in time to a trajectory. See RMSDataHandle.getTrajTimePairs
+            for details.
+        """
+
+        candidates = self.timeWindow(traj_mid_dt, max_toffset)
+
+        # Check that the stations are in the same region / group of countries as the reference station
+        if len(self.country_groups):
+            ref_in_group = np.array([ref_station_code[:2] in group for group in self.country_groups] 
+                + [True])
+            candidates = candidates[ref_in_group[self.country_group_indices[candidates]]]
+
+        # Skip all stations that are already participating in the trajectory solution
+        candidates = candidates[~np.isin(self.station_codes[candidates], list(excluded_stations))]
+
+        return [self.observations[i] for i in candidates]
+
+
 
 class PlateparDummy:
     def __init__(self, **entries):
@@ -516,8 +1233,201 @@ class PlateparDummy:
 
 
 
+def initMeteorObs(station_code, ftpdetectinfo_path, platepars_recalibrated_dict):
+    """ Init meteor observations from the FTPdetectinfo file and recalibrated platepars. """
+
+    # Load station coordinates
+    if len(list(platepars_recalibrated_dict.keys())):
+        
+        pp_dict = platepars_recalibrated_dict[list(platepars_recalibrated_dict.keys())[0]]
+        pp = PlateparDummy(**pp_dict)
+        stations_dict = {station_code: [np.radians(pp.lat), np.radians(pp.lon), pp.elev]}
+
+        # Load the FTPdetectinfo file
+        meteor_list = loadFTPDetectInfo(ftpdetectinfo_path, stations_dict, join_broken_meteors=False)
+
+    else:
+        meteor_list = []
+
+
+    return meteor_list
+
+
+
+def findDataFiles(proc_path):
+    """ Find the FTPdetectinfo file and the recalibrated platepars in the given data folder. 
+    
+    Return:
+        (ftpdetectinfo_name, platepar_recalibrated_name): [tuple of str] File names, None if not found.
+    """
+
+    ftpdetectinfo_name = None
+    platepar_recalibrated_name = None
+
+    for name in os.listdir(proc_path):
+            
+        # Find FTPdetectinfo
+        if name.startswith("FTPdetectinfo") and name.endswith('.txt') and \
+                ("backup" not in name) and ("uncalibrated" not in name) and ("unfiltered" not in name):
+            ftpdetectinfo_name = name
+            continue
+
+        if name == "platepars_all_recalibrated.json":
+            platepar_recalibrated_name = name
+
+    return ftpdetectinfo_name, platepar_recalibrated_name
+
+
+
+def parseObservationFolder(station_code, proc_path, cache_path=None):
+    """ Load the meteor observations from a data folder into columnar arrays. The parsed data is cached in a
+        NumPy file, which is reused until the FTPdetectinfo or the platepar file changes.
+
+    Arguments:
+        station_code: [str] RMS station code.
+        proc_path: [str] Path to the data folder.
+
+    Keyword arguments:
+        cache_path: [str] Path to the cache file. None by default, in which case no cache is used.
+
+    Return:
+        [dict] None if the data files are missing, otherwise:
+            - picks: [ndarray] Meteor picks of all observations, with METEOR_POINT_DTYPE fields.
+            - obs_len: [ndarray] Number of picks of every observation.
+            - jdt_ref: [ndarray] Reference Julian date of every observation.
+            - ff_name: [ndarray] FF file name of every observation.
+            - platepars: [dict] Recalibrated platepar dictionaries, keyed by the FF file name.
+            - messages: [list] Log messages about the skipped observations.
+    """
+
+    ftpdetectinfo_name, platepar_recalibrated_name = findDataFiles(proc_path)
+
+    if (ftpdetectinfo_name is None) or (platepar_recalibrated_name is None):
+        return None
+
+    # The modification time and the size of the data files identify the cached data
+    source = [ftpdetectinfo_name, platepar_recalibrated_name]
+    source_stat = []
+    for name in source:
+        stat = os.stat(os.path.join(proc_path, name))
+        source_stat.append([stat.st_mtime_ns, stat.st_size])
+
+    source_stat = np.array(source_stat, dtype=np.int64)
+
+
+    # Load the cached data if it's up to date
+    if (cache_path is not None) and os.path.isfile(cache_path):
+
+        try:
+            with np.load(cache_path) as cache:
+
+                if (int(cache["version"]) == OBS_CACHE_VERSION) and (cache["source"].tolist() == source) \
+                        and np.array_equal(cache["source_stat"], source_stat):
+
+                    return {
+                        "picks": cache["picks"],
+                        "obs_len": cache["obs_len"],
+                        "jdt_ref": cache["jdt_ref"],
+                        "ff_name": cache["ff_name"],
+                        "platepars": json.loads(str(cache["platepars"])),
+                        "messages": cache["messages"].tolist()
+                        }
+
+        except (OSError, ValueError, KeyError):
+            pass
+
+
+    # Load the recalibrated platepars, skip the folder if they can't be loaded
+    try:
+        with open(os.path.join(proc_path, platepar_recalibrated_name)) as f:
+            platepars_recalibrated_dict = json.load(f)
+    except:
+        return None
+
+    # Load the FTPdetectinfo file
+    cams_met_obs_list = initMeteorObs(station_code, os.path.join(proc_path, ftpdetectinfo_name), 
+        platepars_recalibrated_dict)
+
+    picks = []
+    obs_len = []
+    jdt_ref = []
+    ff_names = []
+    platepars = {}
+    messages = []
+    for cams_met_obs in cams_met_obs_list:
+
+        # Get the platepar
+        if cams_met_obs.ff_name in platepars_recalibrated_dict:
+            pp_dict = platepars_recalibrated_dict[cams_met_obs.ff_name]
+        else:
+            messages.append("    Skipping {:s}, not found in platepar dict".format(cams_met_obs.ff_name))
+            continue
+
+        # Skip observations which weren't recalibrated
+        if not pp_dict.get("auto_recalibrated", True):
+            messages.append("    Skipping {:s}, not recalibrated!".format(cams_met_obs.ff_name))
+            continue
+
+        picks.append(initMeteorPoints(cams_met_obs.frames, cams_met_obs.time_data, cams_met_obs.x_data,
+            cams_met_obs.y_data, np.degrees(cams_met_obs.ra_data), np.degrees(cams_met_obs.dec_data), 
+            np.degrees(cams_met_obs.azim_data), np.degrees(cams_met_obs.elev_data), cams_met_obs.mag_data))
+
+        obs_len.append(len(picks[-1]))
+        jdt_ref.append(cams_met_obs.jdt_ref)
+        ff_names.append(cams_met_obs.ff_name)
+        platepars[cams_met_obs.ff_name] = pp_dict
+
+
+    data = {
+        "picks": np.concatenate(picks) if picks else np.zeros(0, dtype=METEOR_POINT_DTYPE),
+        "obs_len": np.array(obs_len, dtype=np.int64),
+        "jdt_ref": np.array(jdt_ref, dtype=np.float64),
+        "ff_name": np.array(ff_names, dtype=str),
+        "platepars": platepars,
+        "messages": messages
+        }
+
+
+    # Save the cache, write to a unique temporary file first so an interrupted write doesn't leave a broken 
+    #   cache and processes sharing the cache don't overwrite each other's files
+    if cache_path is not None:
+
+        cache_path_tmp = None
+        try:
+            mkdirP(os.path.dirname(cache_path))
+
+            fd, cache_path_tmp = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, version=OBS_CACHE_VERSION, source=np.array(source), source_stat=source_stat,
+                    picks=data["picks"], obs_len=data["obs_len"], jdt_ref=data["jdt_ref"], 
+                    ff_name=data["ff_name"], platepars=json.dumps(platepars), 
+                    messages=np.array(messages, dtype=str))
+
+            os.replace(cache_path_tmp, cache_path)
+
+        except OSError as e:
+            messages.append("    Could not save the observation cache {:s}: {:s}".format(cache_path, str(e)))
+
+            if (cache_path_tmp is not None) and os.path.isfile(cache_path_tmp):
+                os.remove(cache_path_tmp)
+
+
+    return data
+
+
+
+def _parseStationFolders(station_code, folders):
+    """ Parse a list of (proc_path, cache_path) data folders of one station. Used by the process pool. """
+
+    return [parseObservationFolder(station_code, proc_path, cache_path=cache_path) 
+        for proc_path, cache_path in folders]
+
+
+
 class RMSDataHandle(object):
-    def __init__(self, dir_path, dt_range=None, db_dir=None, output_dir=None, mcmode=0, max_trajs=1000, remotehost=None, verbose=False):
+    def __init__(self, dir_path, dt_range=None, db_dir=None, output_dir=None, mcmode=0, max_trajs=1000, remotehost=None, verbose=False, 
+            sqlite_db=False, mc_queue_backend="file", mc_lease_time=MC_LEASE_TIME, mc_priority="brightness",
+            load_cores=1, obs_cache=True):
         """ Handles data interfacing between the trajectory correlator and RMS data files on disk. 
     
         Arguments:
@@ -531,8 +1441,22 @@ class RMSDataHandle(object):
             output_dir: [str] Path to the directory where the output files will be saved. None by default, in
                 which case the output files will be saved in the dir_path.
             max_trajs: [int] maximum number of phase1 trajectories to load at a time when adding uncertainties. Improves throughput.
+            sqlite_db: [bool] Store the trajectory database in an SQLite file instead of a JSON file. If the 
+                SQLite database doesn't exist but the JSON one does, it will be migrated. False by default.
+            mc_queue_backend: [str] Backend of the queue of phase 1 trajectories waiting for the Monte Carlo
+                phase, "file" or "sqlite". "file" by default.
+            mc_lease_time: [float] Time in seconds after which a phase 1 trajectory claimed for the Monte Carlo
+                phase is put back into the queue if it was not solved (e.g. if the worker crashed).
+            mc_priority: [str] Order in which the phase 1 trajectories are taken from the queue: "brightness"
+                (brightest first, default), "stations" (most stations first) or "time" (oldest first).
+            load_cores: [int] Number of processes used to parse the data folders, split by station. 1 by 
+                default.
+            obs_cache: [bool] Cache the parsed observations of every data folder in the database directory, so
+                that the unchanged folders are not parsed again. True by default.
         """
 
+        self.sqlite_db = sqlite_db
+
         self.mc_mode = mcmode
 
         self.dir_path = dir_path
@@ -563,18 +1487,36 @@ class RMSDataHandle(object):
         self.phase1_dir = os.path.join(self.output_dir, 'phase1')
 
         # create the directory for phase1 simple trajectories, if needed
+        self.mc_queue = None
         if self.mc_mode > 0:
             mkdirP(os.path.join(self.phase1_dir, 'processed'))
             self.purgePhase1ProcessedData(os.path.join(self.phase1_dir, 'processed'))
 
+            # Queue of phase1 trajectories waiting for the Monte Carlo phase
+            self.mc_queue = openMCJobQueue(self.phase1_dir, backend=mc_queue_backend, 
+                lease_time=mc_lease_time, priority=mc_priority)
+
+            # Keep renewing the leases of the claimed trajectories while they are being solved, so long 
+            #   solutions are not taken over by other workers
+            if self.mc_mode == 2:
+                self.mc_queue.startHeartbeat()
+
         self.remotehost = remotehost
+        self.mc_lease_time = mc_lease_time
 
         self.verbose = verbose
 
+        self.load_cores = load_cores
+
+        # Directory with the cache of parsed observations
+        self.obs_cache_dir = None
+        if obs_cache:
+            self.obs_cache_dir = os.path.join(self.db_dir, OBS_CACHE_DIR)
+
         ############################
 
         # Load database of processed folders
-        database_path = os.path.join(self.db_dir, JSON_DB_NAME)
+        database_path = self.databasePath()
         log.info("")
         # move any remotely calculated pickles to their target locations
         if os.path.isdir(os.path.join(self.output_dir, 'remoteuploads')):
@@ -582,7 +1524,7 @@ class RMSDataHandle(object):
 
         if mcmode != 2:
             log.info("Loading database: {:s}".format(database_path))
-            self.db = DatabaseJSON(database_path, verbose=self.verbose)
+            self.db = self.openDatabase(database_path)
             log.info('Archiving older entries....')
             try:
                 self.archiveOldRecords(older_than=3)
@@ -599,10 +1541,14 @@ class RMSDataHandle(object):
             self.processing_list = self.findUnprocessedFolders(station_list)
             log.info("   ... done!")
 
+            # Remove the cached observations which won't be used anymore
+            self.pruneObservationCache()
+
         else:
             # retrieve pickles from a remote host, if configured
+            #   (one at a time, more are pulled in iterPhase1Trajectories when the local queue runs out)
             if self.remotehost is not None:
-                collectRemoteTrajectories(remotehost, max_trajs, self.phase1_dir)
+                collectRemoteTrajectories(remotehost, self.phase1_dir, lease_time=mc_lease_time)
 
             # reload the phase1 trajectories
             dt_beg, dt_end = self.loadPhase1Trajectories(max_trajs=max_trajs)
@@ -633,6 +1579,34 @@ class RMSDataHandle(object):
         ### ###
 
 
+    def databasePath(self, prefix=''):
+        """ Return the path to the trajectory database file. 
+
+        Keyword arguments:
+            prefix: [str] Prefix added to the file name (e.g. for archive databases).
+        """
+
+        if self.sqlite_db:
+            return os.path.join(self.db_dir, prefix + SQLITE_DB_NAME)
+
+        return os.path.join(self.db_dir, prefix + JSON_DB_NAME)
+
+
+    def openDatabase(self, database_path):
+        """ Open the trajectory database with the configured backend. An existing JSON database is migrated
+            to SQLite if the SQLite backend is used and the SQLite file doesn't exist yet.
+        """
+
+        if not self.sqlite_db:
+            return DatabaseJSON(database_path, verbose=self.verbose)
+
+        json_database_path = database_path[:-len(SQLITE_DB_NAME)] + JSON_DB_NAME
+        if (not os.path.exists(database_path)) and os.path.exists(json_database_path):
+            return migrateJSONDatabase(json_database_path, database_path, verbose=self.verbose)
+
+        return DatabaseSQLite(database_path, verbose=self.verbose)
+
+
     def purgePhase1ProcessedData(self, dir_path):
         """ Purge old phase1 processed data if it is older than 90 days. """
 
@@ -683,8 +1657,8 @@ class RMSDataHandle(object):
         archdate = datetime.datetime.now(datetime.timezone.utc) - relativedelta(months=older_than)
         archdate_jd = datetime2JD(archdate)
 
-        arch_db_path = os.path.join(self.db_dir, f'{archdate.strftime("%Y%m")}_{JSON_DB_NAME}')
-        archdb = DatabaseJSON(arch_db_path, verbose=self.verbose)
+        arch_db_path = self.databasePath(prefix=f'{archdate.strftime("%Y%m")}_')
+        archdb = self.openDatabase(arch_db_path)
         log.info(f'Archiving db records to {arch_db_path}...')
 
         for traj in [t for t in self.db.trajectories if t < archdate_jd]:
@@ -735,6 +1709,42 @@ class RMSDataHandle(object):
 
 
 
+    def processingListEntry(self, station_name, night_name):
+        """ Return the entry of the processing list for the given data folder.
+
+        Arguments:
+            station_name: [str] Station code.
+            night_name: [str] Name of the data folder in the station directory.
+
+        Return:
+            [list] [station_name, night_path_rel, night_path, night_dt], or None if the folder should not be
+                processed.
+        """
+
+        # Add the station name to the database if it doesn't exist
+        if station_name not in self.db.processed_dirs:
+            self.db.processed_dirs[station_name] = []
+
+        # Extract the date and time of directory, if possible
+        try:
+            night_dt = datetime.datetime.strptime("_".join(night_name.split("_")[1:3]), 
+                "%Y%m%d_%H%M%S").replace(tzinfo=datetime.timezone.utc)
+        except:
+            log.info(f'Could not parse the date of the night dir: {night_name}')
+            return None
+
+        if self.dt_range is not None:
+            # skip folders more than a day older the requested date range
+            if night_dt < (self.dt_range[0]+ datetime.timedelta(days=-1)).replace(tzinfo=datetime.timezone.utc):
+                return None
+
+        night_path = os.path.join(self.dir_path, station_name, night_name)
+        night_path_rel = os.path.join(station_name, night_name)
+
+        return [station_name, night_path_rel, night_path, night_dt]
+
+
+
     def findUnprocessedFolders(self, station_list):
         """ Go through directories and find folders with unprocessed data. """
 
@@ -747,34 +1757,18 @@ class RMSDataHandle(object):
 
             station_path = os.path.join(self.dir_path, station_name)
 
-            # Add the station name to the database if it doesn't exist
-            if station_name not in self.db.processed_dirs:
-                self.db.processed_dirs[station_name] = []
-
             # Go through all directories in stations
             for night_name in os.listdir(station_path):
 
-                # Extract the date and time of directory, if possible
-                try:
-                    night_dt = datetime.datetime.strptime("_".join(night_name.split("_")[1:3]), 
-                        "%Y%m%d_%H%M%S").replace(tzinfo=datetime.timezone.utc)
-                except:
-                    log.info(f'Could not parse the date of the night dir: {night_name}')
-                    night_dt = None
+                entry = self.processingListEntry(station_name, night_name)
+                if entry is None:
                     continue
-                if self.dt_range is not None:
-                    # skip folders more than a day older the requested date range
-                    if night_dt < (self.dt_range[0]+ datetime.timedelta(days=-1)).replace(tzinfo=datetime.timezone.utc):
-                        continue
-
-                night_path = os.path.join(station_path, night_name)
-                night_path_rel = os.path.join(station_name, night_name)
 
                 # # If the night path is not in the processed list, add it to the processing list
                 # if night_path_rel not in self.db.processed_dirs[station_name]:
                 #     processing_list.append([station_name, night_path_rel, night_path, night_dt])
 
-                processing_list.append([station_name, night_path_rel, night_path, night_dt])
+                processing_list.append(entry)
 
                 # else:
                 #     skipped_dirs += 1
@@ -787,34 +1781,11 @@ class RMSDataHandle(object):
 
 
 
-    def initMeteorObs(self, station_code, ftpdetectinfo_path, platepars_recalibrated_dict):
-        """ Init meteor observations from the FTPdetectinfo file and recalibrated platepars. """
-
-        # Load station coordinates
-        if len(list(platepars_recalibrated_dict.keys())):
-            
-            pp_dict = platepars_recalibrated_dict[list(platepars_recalibrated_dict.keys())[0]]
-            pp = PlateparDummy(**pp_dict)
-            stations_dict = {station_code: [np.radians(pp.lat), np.radians(pp.lon), pp.elev]}
-
-            # Load the FTPdetectinfo file
-            meteor_list = loadFTPDetectInfo(ftpdetectinfo_path, stations_dict, join_broken_meteors=False)
-
-        else:
-            meteor_list = []
-
-
-        return meteor_list
-
-
-
     def loadUnpairedObservations(self, processing_list, dt_range=None):
         """ Load unpaired meteor observations, i.e. observations that are not a part of any trajectory. """
 
-        # Go through folders for processing
-        unpaired_met_obs_list = []
-        prev_station = None
-        station_count = 1
+        # Select the folders to load
+        folders = []
         for station_code, rel_proc_path, proc_path, night_dt in processing_list:
 
             # Check that the night datetime is within the given range of times, if the range is given
@@ -825,42 +1796,28 @@ class RMSDataHandle(object):
                 if (night_dt < dt_beg) or (night_dt > dt_end):
                     continue
 
-
-
-            ftpdetectinfo_name = None
-            platepar_recalibrated_name = None
-
             # Skip files, only take directories
             if os.path.isfile(proc_path):
                 continue
 
-            log.info("")
-            log.info("Processing station: " + station_code)
+            folders.append([station_code, rel_proc_path, proc_path])
 
-            # Find FTPdetectinfo and platepar files
-            for name in os.listdir(proc_path):
-                    
-                # Find FTPdetectinfo
-                if name.startswith("FTPdetectinfo") and name.endswith('.txt') and \
-                        ("backup" not in name) and ("uncalibrated" not in name) and ("unfiltered" not in name):
-                    ftpdetectinfo_name = name
-                    continue
 
-                if name == "platepars_all_recalibrated.json":
+        # Parse the folders, split by station
+        folder_data = self.parseObservationFolders(folders)
 
-                    try:
-                        # Try loading the recalibrated platepars
-                        with open(os.path.join(proc_path, name)) as f:
-                            platepars_recalibrated_dict = json.load(f)                            
-                            platepar_recalibrated_name = name
-                            continue
-
-                    except:
-                        pass
-    
+
+        # Go through folders for processing
+        unpaired_met_obs_list = []
+        prev_station = None
+        station_count = 1
+        for (station_code, rel_proc_path, proc_path), data in zip(folders, folder_data):
+
+            log.info("")
+            log.info("Processing station: " + station_code)
 
             # Skip these observations if no data files were found inside
-            if (ftpdetectinfo_name is None) or (platepar_recalibrated_name is None):
+            if data is None:
                 log.info("  Skipping {:s} due to missing data files...".format(rel_proc_path))
 
                 # Add the folder to the list of processed folders
@@ -877,57 +1834,26 @@ class RMSDataHandle(object):
                 self.saveDatabase()
 
 
-            # Load platepars
-            with open(os.path.join(proc_path, platepar_recalibrated_name)) as f:
-                platepars_recalibrated_dict = json.load(f)
-
-            # If all files exist, init the meteor container object
-            cams_met_obs_list = self.initMeteorObs(station_code, os.path.join(proc_path, 
-                ftpdetectinfo_name), platepars_recalibrated_dict)
+            for message in data["messages"]:
+                log.info(message)
 
             # Format the observation object to the one required by the trajectory correlator
             added_count = 0
-            for cams_met_obs in cams_met_obs_list:
-
-                # Get the platepar
-                if cams_met_obs.ff_name in platepars_recalibrated_dict:
-                    pp_dict = platepars_recalibrated_dict[cams_met_obs.ff_name]
-                else:
-                    log.info("    Skipping {:s}, not found in platepar dict".format(cams_met_obs.ff_name))
-                    continue
-
-                pp = PlateparDummy(**pp_dict)
-
-
-                # Skip observations which weren't recalibrated
-                if hasattr(pp, "auto_recalibrated"):
-                    if not pp.auto_recalibrated:
-                        log.info("    Skipping {:s}, not recalibrated!".format(cams_met_obs.ff_name))
-                        continue
-
-
-                # Init meteor data
-                meteor_data = []
-                for entry in zip(cams_met_obs.frames, cams_met_obs.time_data, cams_met_obs.x_data,
-                        cams_met_obs.y_data, cams_met_obs.azim_data, cams_met_obs.elev_data, 
-                        cams_met_obs.ra_data, cams_met_obs.dec_data, cams_met_obs.mag_data):
-
-                    frame, time_rel, x, y, azim, alt, ra, dec, mag = entry
-
-                    met_point = MeteorPointRMS(frame, time_rel, x, y, np.degrees(ra), np.degrees(dec), 
-                        np.degrees(azim), np.degrees(alt), mag)
+            obs_picks = np.split(data["picks"], np.cumsum(data["obs_len"])[:-1])
+            for picks, jdt_ref, ff_name in zip(obs_picks, data["jdt_ref"], data["ff_name"]):
 
-                    meteor_data.append(met_point)
+                ff_name = str(ff_name)
 
+                pp = PlateparDummy(**data["platepars"][ff_name])
 
                 # Init the new meteor observation object
                 met_obs = MeteorObsRMS(
                     station_code, 
-                    jd2Date(cams_met_obs.jdt_ref, dt_obj=True, tzinfo=datetime.timezone.utc), 
+                    jd2Date(float(jdt_ref), dt_obj=True, tzinfo=datetime.timezone.utc), 
                     pp,
-                    meteor_data, 
+                    picks.view(np.recarray), 
                     rel_proc_path, 
-                    ff_name=cams_met_obs.ff_name)
+                    ff_name=ff_name)
 
                 # Skip bad observations
                 if met_obs.bad_data:
@@ -949,8 +1875,148 @@ class RMSDataHandle(object):
         self.saveDatabase()
 
         return unpaired_met_obs_list
+
+
+    def pruneObservationCache(self, stale_tmp_age=3600):
+        """ Remove the cached observations of data folders which were deleted, which are marked as processed
+            or which are more than a day outside the time range of the data handle. Temporary files left 
+            behind by interrupted writes are removed as well.
+
+        Keyword arguments:
+            stale_tmp_age: [float] Age in seconds after which temporary files are removed. 1 hour by default.
+        """
+
+        if (self.obs_cache_dir is None) or (not os.path.isdir(self.obs_cache_dir)):
+            return
+
+        removed_count = 0
+        for station_name in os.listdir(self.obs_cache_dir):
+
+            station_cache_dir = os.path.join(self.obs_cache_dir, station_name)
+            if not os.path.isdir(station_cache_dir):
+                continue
+
+            for file_name in os.listdir(station_cache_dir):
+
+                cache_path = os.path.join(station_cache_dir, file_name)
+
+                try:
+
+                    # Remove the temporary files of interrupted writes
+                    if file_name.endswith(".tmp"):
+                        if time.time() - os.path.getmtime(cache_path) > stale_tmp_age:
+                            os.remove(cache_path)
+                        continue
+
+                    if not file_name.endswith(".npz"):
+                        continue
+
+                    night_name = file_name[:-len(".npz")]
+                    rel_proc_path = os.path.join(station_name, night_name)
+
+                    remove = (not os.path.isdir(os.path.join(self.dir_path, rel_proc_path))) \
+                        or (rel_proc_path in self.db.processed_dirs.get(station_name, []))
+
+                    # Check that the folder is within the time range
+                    if (not remove) and (self.dt_range is not None):
+
+                        try:
+                            night_dt = datetime.datetime.strptime("_".join(night_name.split("_")[1:3]), 
+                                "%Y%m%d_%H%M%S").replace(tzinfo=datetime.timezone.utc)
+
+                            remove = (night_dt < self.dt_range[0] - datetime.timedelta(days=1)) \
+                                or (night_dt > self.dt_range[1] + datetime.timedelta(days=1))
+
+                        except ValueError:
+                            remove = True
+
+                    if remove:
+                        os.remove(cache_path)
+                        removed_count += 1
+
+                # The file might have been removed by another process sharing the cache
+                except OSError:
+                    pass
+
+        if removed_count:
+            log.info("Removed {:d} unused cached observation files".format(removed_count))
+
+
+    def parseObservationFolders(self, folders):
+        """ Parse the given data folders, in parallel by station if more than one core is used. 
+
+        Arguments:
+            folders: [list] A list of [station_code, rel_proc_path, proc_path] entries.
+
+        Return:
+            [list] Parsed data of every folder in the same order, see parseObservationFolder.
+        """
+
+        # Group the folders by station, keeping the order of the folders of every station
+        station_folders = collections.OrderedDict()
+        for station_code, rel_proc_path, proc_path in folders:
+
+            cache_path = None
+            if self.obs_cache_dir is not None:
+                cache_path = os.path.join(self.obs_cache_dir, rel_proc_path + ".npz")
+
+            station_folders.setdefault(station_code, []).append([proc_path, cache_path])
+
+
+        # Parse the folders in parallel if there are multiple stations
+        if (self.load_cores > 1) and (len(station_folders) > 1):
+
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=min(self.load_cores, len(station_folders))) as executor:
+
+                station_data = list(executor.map(_parseStationFolders, station_folders.keys(), 
+                    station_folders.values()))
+
+        else:
+            station_data = [_parseStationFolders(station_code, station_folders[station_code]) 
+                for station_code in station_folders]
+
+
+        # Return the data in the order of the given folders
+        station_data = dict(zip(station_folders.keys(), [iter(data) for data in station_data]))
+
+        return [next(station_data[station_code]) for station_code, _, _ in folders]
     
 
+    def loadNewObservations(self, night_dirs):
+        """ Load the unpaired observations from the given data folders and add them to the list of unpaired
+            observations. Observations which are already in the list are skipped. Used by the incremental mode.
+
+        Arguments:
+            night_dirs: [list] A list of (station_name, night_name) data folders.
+
+        Return:
+            [list] A list of new MeteorObsRMS objects.
+        """
+
+        processing_list = [self.processingListEntry(station_name, night_name) 
+            for station_name, night_name in night_dirs]
+        processing_list = [entry for entry in processing_list if entry is not None]
+
+        known_ids = set(met_obs.id for met_obs in self.unpaired_observations)
+
+        new_observations = [met_obs for met_obs in self.loadUnpairedObservations(processing_list) 
+            if met_obs.id not in known_ids]
+
+        self.unpaired_observations += new_observations
+
+        return new_observations
+
+
+    def pruneUnpairedObservations(self, dt_beg):
+        """ Remove the observations which were paired or which are older than the given time from the list of
+            unpaired observations. Used by the incremental mode.
+        """
+
+        self.unpaired_observations = [met_obs for met_obs in self.unpaired_observations 
+            if (met_obs.reference_dt >= dt_beg) and (not self.db.checkObsIfPaired(met_obs))]
+
+
     def yearMonthDayDirInDtRange(self, dir_name):
         """ Given a directory name which is either YYYY, YYYYMM or YYYYMMDD, check if it is in the given 
             datetime range. 
@@ -1070,30 +2136,35 @@ class RMSDataHandle(object):
             return False
 
 
-    def removeDeletedTrajectories(self):
+    def removeDeletedTrajectories(self, dt_range=None):
         """ Purge the database of any trajectories that no longer exist on disk.
             These can arise because the monte-carlo stage may update the data. 
+
+        Keyword arguments:
+            dt_range: [list of datetimes] Range of trajectory times to check. None by default, in which case 
+                self.dt_range is used.
         """
 
         if not os.path.isdir(self.output_dir):
             return 
         if self.db is None:
             return 
+
+        if dt_range is None:
+            dt_range = self.dt_range
         
         log.info("  Removing deleted trajectories from: " + self.output_dir)
-        if self.dt_range is not None:
+        if dt_range is not None:
             log.info("  Datetime range: {:s} - {:s}".format(
-                self.dt_range[0].strftime("%Y-%m-%d %H:%M:%S"), 
-                self.dt_range[1].strftime("%Y-%m-%d %H:%M:%S")))
+                dt_range[0].strftime("%Y-%m-%d %H:%M:%S"), 
+                dt_range[1].strftime("%Y-%m-%d %H:%M:%S")))
             
-        jdt_start = datetime2JD(self.dt_range[0]) 
-        jdt_end = datetime2JD(self.dt_range[1])
+        jdt_start = datetime2JD(dt_range[0]) 
+        jdt_end = datetime2JD(dt_range[1])
 
         trajs_to_remove = []
 
-        keys = [k for k in self.db.trajectories.keys() if k >= jdt_start and k <= jdt_end]
-        for trajkey in keys:
-            traj_reduced = self.db.trajectories[trajkey]
+        for traj_reduced in self.db.getTrajectories(jdt_start, jdt_end):
             # Update the trajectory path to make sure we're working with the correct filesystem
             traj_path = self.generateTrajOutputDirectoryPath(traj_reduced)
             traj_file_name = os.path.split(traj_reduced.traj_file_path)[1]
@@ -1205,9 +2276,7 @@ class RMSDataHandle(object):
         """ Returns a list of computed trajectories between the Julian dates.
         """
 
-        return [self.db.trajectories[key] for key in self.db.trajectories 
-            if (self.db.trajectories[key].jdt_ref >= jd_beg) 
-                and (self.db.trajectories[key].jdt_ref <= jd_end)]
+        return self.db.getTrajectories(jd_beg, jd_end)
                 
 
     def removeDuplicateTrajectories(self, dt_range):
@@ -1286,6 +2355,19 @@ class RMSDataHandle(object):
         return self.unpaired_observations
 
 
+    def indexObservations(self, observations):
+        """ Return a time-indexed store of the given observations which can be used for fast pairing. 
+            
+        Arguments:
+            observations: [list] A list of MeteorObsRMS objects.
+
+        Return:
+            [ObservationTimeIndex]
+        """
+
+        return ObservationTimeIndex(observations, country_groups=self.country_groups)
+
+
     def countryFilter(self, station_code1, station_code2):
         """ Only pair observations if they are in proximity to a given country. """
 
@@ -1308,8 +2390,9 @@ class RMSDataHandle(object):
 
         Arguments:
             met_obs: [MeteorObsRMS] Object containing a meteor observation.
-            unpaired_observations: [list] A list of MeteorObsRMS objects which will be paired in time with
-                the given object.
+            unpaired_observations: [list or ObservationTimeIndex] A list of MeteorObsRMS objects which will 
+                be paired in time with the given object. If an ObservationTimeIndex is given (see 
+                indexObservations), a binary search is used instead of scanning all observations.
             max_toffset: [float] Maximum offset in time (seconds) for pairing.
 
         Return:
@@ -1317,6 +2400,10 @@ class RMSDataHandle(object):
                 met_obs.
         """
 
+        if isinstance(unpaired_observations, ObservationTimeIndex):
+            return unpaired_observations.findTimePairs(met_obs, max_toffset)
+
+
         found_pairs = []
 
         # Go through all meteors from other stations
@@ -1347,6 +2434,11 @@ class RMSDataHandle(object):
         traj_mid_dt = jd2Date((traj_reduced.rbeg_jd + traj_reduced.rend_jd)/2, dt_obj=True, 
                               tzinfo=datetime.timezone.utc)
 
+        if isinstance(unpaired_observations, ObservationTimeIndex):
+            return unpaired_observations.getTrajTimePairs(traj_mid_dt, 
+                (traj_reduced.participating_stations + traj_reduced.ignored_stations)[0], 
+                traj_reduced.participating_stations + traj_reduced.ignored_stations, max_toffset)
+
         # Go through all unpaired observations
         for met_obs in unpaired_observations:
 
@@ -1440,15 +2532,18 @@ class RMSDataHandle(object):
 
         if self.mc_mode == 1:
             savePickle(traj, self.phase1_dir, traj.pre_mc_longname + '_trajectory.pickle')
+
+            # Queue the trajectory for the Monte Carlo phase
+            self.mc_queue.put(traj.pre_mc_longname + '_trajectory.pickle', traj=traj)
         elif self.mc_mode == 2:
             # we save this in MC mode the MC phase may alter the trajectory details and if later on 
             # we're including additional observations we need to use the most recent version of the trajectory
             savePickle(traj, os.path.join(self.phase1_dir, 'processed'), traj.pre_mc_longname + '_trajectory.pickle')
 
+            # Upload the solution in the background, so the solver doesn't wait on the network
             if self.remotehost is not None:
-                log.info('saving to remote host')
-                uploadTrajToRemote(remotehost, traj.file_name + '_trajectory.pickle', output_dir)
-                log.info(' ...done')
+                log.info('queueing upload to remote host')
+                getRemoteUploadQueue(self.remotehost).submit(traj.file_name + '_trajectory.pickle', output_dir)
 
         # Save the plots
         if save_plots:
@@ -1540,11 +2635,13 @@ class RMSDataHandle(object):
         if self.mc_mode != 2:
             return 
         fldr_name = os.path.split(self.generateTrajOutputDirectoryPath(traj, make_dirs=False))[-1] 
-        pick = os.path.join(self.phase1_dir, fldr_name + '_trajectory.pickle_processing')
-        if os.path.isfile(pick):
-            os.remove(pick)
-        else:
-            log.warning(f'unable to find _processing file {pick}')
+
+        # Remove the job from the queue. If the lease was lost, the job is now processed by another worker
+        if not self.mc_queue.complete(fldr_name + '_trajectory.pickle'):
+            return
+
+        self.mc_queue.logProgress()
+
         if not success:
             # save the pickle in case we get new data later and can solve it
             savePickle(traj, os.path.join(self.phase1_dir, 'processed'), fldr_name + '_trajectory.pickle')
@@ -1606,61 +2703,95 @@ class RMSDataHandle(object):
 
     def loadPhase1Trajectories(self, max_trajs=1000):
         """
-        Load trajectories calculated by the intersecting-planes phase 1. These trajectories
-        do not include uncertainties which are calculated in the Monte-Carlo phase 2
+        Prepare loading the trajectories calculated by the intersecting-planes phase 1. These trajectories
+        do not include uncertainties which are calculated in the Monte-Carlo phase 2. The trajectories are
+        claimed from the MC job queue one at a time while iterating over self.phase1Trajectories, so several
+        workers can share the queue.
 
         keyword arguments:
         maxtrajs: [int] maximum number of trajectories to load in each pass, to avoid taking too long per pass.
 
 
         returns:
-        dt_beg, dt_end: [datetime] The earliest and latest date/time of the loaded trajectories. Used later to set the 
+        dt_beg, dt_end: [datetime] The earliest and latest date/time of the queued trajectories. Used later to set the 
                                     number of time buckets to process data in. 
 
         """
-        pickles = glob.glob1(self.phase1_dir, "*_trajectory.pickle")
-        pickles.sort()
-        pickles = pickles[:max_trajs]
-        self.phase1Trajectories = []
+
+        # Put the trajectories left behind by crashed workers back into the queue
+        self.mc_queue.requeueExpired()
+
+        pickles = self.mc_queue.pending()
+        self.mc_queue.logProgress()
+
+        self.phase1Trajectories = self.iterPhase1Trajectories(max_trajs=max_trajs)
         if len(pickles) == 0:
             return None, None
+
+        pickles.sort()
         dt_beg = datetime.datetime.strptime(pickles[0][:15], '%Y%m%d_%H%M%S').replace(tzinfo=datetime.timezone.utc)
         dt_end = datetime.datetime.strptime(pickles[-1][:15], '%Y%m%d_%H%M%S').replace(tzinfo=datetime.timezone.utc)
-        for pick in pickles:
+
+        return dt_beg, dt_end
+
+
+    def iterPhase1Trajectories(self, max_trajs=1000):
+        """ Claim phase 1 trajectories from the MC job queue one at a time and load them. If a remote host is
+            used, a new trajectory is pulled from it whenever the local queue is empty.
+
+        keyword arguments:
+        maxtrajs: [int] maximum number of trajectories to load in this pass.
+
+        yields:
+        traj: [Trajectory] Phase 1 trajectory.
+        """
+
+        skipped = set()
+        loaded = 0
+        while loaded < max_trajs:
+
+            pick = self.mc_queue.claim(exclude=skipped)
+
+            # Pull the next trajectory from the remote host when the local queue is empty
+            if (pick is None) and (self.remotehost is not None):
+                if collectRemoteTrajectories(self.remotehost, self.phase1_dir, lease_time=self.mc_lease_time):
+                    pick = self.mc_queue.claim(exclude=skipped)
+
+            if pick is None:
+                break
+
             # Try loading a full trajectory
             try:
-                traj = loadPickle(self.phase1_dir, pick)
-
-                traj_dir = self.generateTrajOutputDirectoryPath(traj, make_dirs=False)
-                # Add the filepath if not present so we can remove updated trajectories
-                if not hasattr(traj, 'traj_file_path'):
-                    # stored filename includes the millisecs and countries, to help make it unique
-                    # so we need to chop that off again to set up the true pickle name
-                    real_pick_name = pick[:15] + '_trajectory.pickle'
-                    traj.traj_file_path = os.path.join(traj_dir, real_pick_name)
-
-                if not hasattr(traj, 'longname'):
-                    traj.longname = os.path.split(traj_dir)[-1]
-
-                if not hasattr(traj, 'pre_mc_longname'):
-                    traj.pre_mc_longname = os.path.split(traj_dir)[-1]
-
-                # Check if the traj object as fixed time offsets
-                if not hasattr(traj, 'fixed_time_offsets'):
-                    traj.fixed_time_offsets = {}
-
-                # now we've loaded the phase 1 solution, move it to prevent accidental reprocessing
-                procfile = os.path.join(self.phase1_dir, pick + '_processing')
-                if os.path.isfile(procfile):
-                    os.remove(procfile)
-                os.rename(os.path.join(self.phase1_dir, pick), procfile)
-
-                self.phase1Trajectories.append(traj)
-                log.info(f'loaded {traj.traj_id}')
+                traj = loadPickle(self.phase1_dir, pick + '_processing')
             except Exception:
                 # if the file couldn't be read, then skip it for now - we'll get it in the next pass
                 log.info(f'File {pick} skipped for now')
-        return dt_beg, dt_end
+                self.mc_queue.release(pick)
+                skipped.add(pick)
+                continue
+
+            traj_dir = self.generateTrajOutputDirectoryPath(traj, make_dirs=False)
+            # Add the filepath if not present so we can remove updated trajectories
+            if not hasattr(traj, 'traj_file_path'):
+                # stored filename includes the millisecs and countries, to help make it unique
+                # so we need to chop that off again to set up the true pickle name
+                real_pick_name = pick[:15] + '_trajectory.pickle'
+                traj.traj_file_path = os.path.join(traj_dir, real_pick_name)
+
+            if not hasattr(traj, 'longname'):
+                traj.longname = os.path.split(traj_dir)[-1]
+
+            if not hasattr(traj, 'pre_mc_longname'):
+                traj.pre_mc_longname = os.path.split(traj_dir)[-1]
+
+            # Check if the traj object as fixed time offsets
+            if not hasattr(traj, 'fixed_time_offsets'):
+                traj.fixed_time_offsets = {}
+
+            loaded += 1
+            log.info(f'loaded {traj.traj_id}')
+
+            yield traj
 
 
     def saveDatabase(self):
@@ -1688,6 +2819,163 @@ class RMSDataHandle(object):
 
 
 
+
+class DataDirMonitor(FileSystemEventHandler):
+    def __init__(self, dir_path):
+        """ Watches the root data directory for new or changed data folders (STATION/NIGHT_DIR), i.e. 
+            FTPdetectinfo and recalibrated platepar files. Folders are reported once no new files arrived in 
+            them for a while, so that all files of the folder are in place.
+
+        Arguments:
+            dir_path: [str] Path to the root data directory.
+        """
+
+        FileSystemEventHandler.__init__(self)
+
+        self.dir_path = os.path.abspath(dir_path)
+
+        # Time of the last event in every changed folder, keyed by (station_name, night_name)
+        self.changed_dirs = {}
+        self.lock = threading.Lock()
+
+
+    def recordPath(self, path, is_directory):
+        """ Record the data folder of the given path if the path is a data file or a data folder. """
+
+        parts = os.path.relpath(os.path.abspath(path), self.dir_path).split(os.sep)
+
+        # Only take the station directories
+        if not re.match("^[A-Z]{2}[A-Z0-9]{4}$", parts[0]):
+            return
+
+        # Data folders (e.g. moved into place as a whole)
+        if is_directory:
+            if len(parts) != 2:
+                return
+
+        # Data files
+        else:
+
+            if len(parts) != 3:
+                return
+
+            name = parts[2]
+            if not ((name.startswith("FTPdetectinfo") and name.endswith(".txt")) 
+                    or (name == "platepars_all_recalibrated.json")):
+                return
+
+        with self.lock:
+            self.changed_dirs[(parts[0], parts[1])] = time.time()
+
+
+    def on_created(self, event):
+        self.recordPath(event.src_path, event.is_directory)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.recordPath(event.src_path, event.is_directory)
+
+    def on_moved(self, event):
+        self.recordPath(event.dest_path, event.is_directory)
+
+
+    def popSettled(self, settle_time):
+        """ Return the changed data folders without new events in the last settle_time seconds and remove
+            them from the list of changed folders.
+
+        Return:
+            [list] A list of (station_name, night_name) entries.
+        """
+
+        with self.lock:
+
+            settled = sorted([night_dir for night_dir, event_time in self.changed_dirs.items() 
+                if time.time() - event_time > settle_time])
+
+            for night_dir in settled:
+                del self.changed_dirs[night_dir]
+
+        return settled
+
+
+
+def correlateIncrementally(dh, trajectory_constraints, v_init_part, window_days, 
+        settle_time=WATCH_SETTLE_TIME, mcmode=0, enableOSM=False):
+    """ Watch the data directory and correlate new observations as soon as their data folders arrive, 
+        without rescanning all folders. Only the new folders are loaded, and the new observations are 
+        correlated in the time range around them together with the unpaired observations and the 
+        trajectories already kept by the data handle. Runs until interrupted.
+
+    Arguments:
+        dh: [RMSDataHandle] Data handle with the database loaded. Its list of unpaired observations is used as
+            the initial set of observations kept for pairing.
+        trajectory_constraints: [TrajectoryConstraints]
+        v_init_part: [float] Part of the meteor used for the initial velocity estimation.
+        window_days: [float] Unpaired observations older than this number of days are dropped.
+
+    Keyword arguments:
+        settle_time: [float] Time without new files after which a data folder is processed (seconds).
+        mcmode: [int] 0 (intersecting planes and Monte Carlo) or 1 (intersecting planes only).
+        enableOSM: [bool] Enable OSM based ground plots.
+    """
+
+    monitor = DataDirMonitor(dh.dir_path)
+    observer = Observer()
+    observer.schedule(monitor, dh.dir_path, recursive=True)
+    observer.start()
+
+    tc = TrajectoryCorrelator(dh, trajectory_constraints, v_init_part, data_in_j2000=True, enableOSM=enableOSM)
+
+    log.info("")
+    log.info(f"Watching {dh.dir_path} for new data, keeping {len(dh.unpaired_observations)} unpaired observations...")
+
+    try:
+
+        while True:
+
+            time.sleep(1)
+
+            night_dirs = monitor.popSettled(settle_time)
+            if not night_dirs:
+                continue
+
+            t1 = datetime.datetime.now(datetime.timezone.utc)
+
+            log.info("")
+            log.info("NEW DATA FOLDERS:")
+            for station_name, night_name in night_dirs:
+                log.info(f"  {station_name}/{night_name}")
+
+            new_observations = dh.loadNewObservations(night_dirs)
+            if not new_observations:
+                log.info("No new observations.")
+                continue
+
+            # Time range affected by the new observations, extended by the maximum time offset between 
+            #   stations so the observations from other stations which were kept can be paired with them
+            margin = datetime.timedelta(seconds=trajectory_constraints.max_toffset + WATCH_TIME_MARGIN)
+            dt_beg = min([met_obs.reference_dt for met_obs in new_observations]) - margin
+            dt_end = max([met_obs.reference_dt for met_obs in new_observations]) + margin
+
+            # Refresh the existing trajectories in the affected time range. The time range of the data handle is
+            #   not changed, as it limits which data folders are accepted
+            dh.removeDeletedTrajectories(dt_range=[dt_beg, dt_end])
+            dh.loadComputedTrajectories(os.path.join(dh.output_dir, OUTPUT_TRAJ_DIR), dt_range=[dt_beg, dt_end])
+
+            tc.run(event_time_range=[dt_beg, dt_end], bin_time_range=[dt_beg, dt_end], mcmode=mcmode)
+
+            # Keep only the unpaired observations within the time window
+            dh.pruneUnpairedObservations(t1 - datetime.timedelta(days=window_days))
+
+            log.info(f"Keeping {len(dh.unpaired_observations)} unpaired observations.")
+            log.info("Incremental run time: {:s}".format(str(datetime.datetime.now(datetime.timezone.utc) - t1)))
+
+    finally:
+        observer.stop()
+        observer.join()
+
+
+
 if __name__ == "__main__":
 
     # Set matplotlib for headless running
@@ -1760,6 +3048,9 @@ contain data folders. Data folders should have FTPdetectinfo files together with
     arg_parser.add_argument("--cpucores", type=int, default=-1,
         help="Number of CPU codes to use for computation. -1 to use all cores minus one (default).",)
 
+    arg_parser.add_argument("--trajcores", type=int, default=1,
+        help="Number of candidate trajectories solved in parallel. The CPU cores are split between them, so every trajectory uses CPUCORES/TRAJCORES cores for its Monte Carlo runs. 1 by default (one trajectory at a time).",)
+
     arg_parser.add_argument('-o', '--enableOSM', 
         help="Enable OSM based groung plots. Internet connection required.", action="store_true")     
 
@@ -1781,14 +3072,33 @@ contain data folders. Data folders should have FTPdetectinfo files together with
     arg_parser.add_argument('--maxtrajs', '--maxtrajs', type=int, default=None,
         help="Max number of trajectories to reload in each pass when doing the Monte-Carlo phase")
     
+    arg_parser.add_argument('-w', '--watch', metavar='SETTLE_TIME', type=float, default=None, 
+        const=WATCH_SETTLE_TIME, nargs='?',
+        help="""Incremental mode, use together with --auto. After the first run, watch the data directory and correlate the observations from new data folders as soon as they arrive, instead of periodically rescanning all data. A folder is processed once no new files arrived in it for SETTLE_TIME seconds ({:d} by default). Not used with --mcmode 2.""".format(WATCH_SETTLE_TIME))
+
     arg_parser.add_argument('--autofreq', '--autofreq', type=int, default=360,
         help="Minutes to wait between runs in auto-mode")
     
+    arg_parser.add_argument('--mcqueue', type=str, default="file", choices=["file", "sqlite"],
+        help="Backend of the queue of phase1 trajectories waiting for the Monte Carlo phase (mcmode 2). Default is 'file'.")
+
+    arg_parser.add_argument('--mcleasetime', type=float, default=MC_LEASE_TIME/3600,
+        help="Hours after which a phase1 trajectory claimed by a Monte Carlo worker is put back into the queue if it is not solved. Default is {:.0f} hours.".format(MC_LEASE_TIME/3600))
+
+    arg_parser.add_argument('--mcpriority', type=str, default="brightness", choices=MC_QUEUE_PRIORITIES,
+        help="Order in which the Monte Carlo phase takes the phase1 trajectories: brightest first (brightness, default), most stations first (stations) or oldest first (time).")
+
     arg_parser.add_argument('--remotehost', '--remotehost', type=str, default=None,
         help="Remote host to collect and return MC phase solutions to. Supports internet-distributed processing.")
     
     arg_parser.add_argument('--verbose', '--verbose', help='Verbose logging.', default=False, action="store_true")
 
+    arg_parser.add_argument('--sqlitedb', help="Store the trajectory database in an SQLite file instead of a JSON file. An existing JSON database is migrated on the first run.", 
+        default=False, action="store_true")
+
+    arg_parser.add_argument('--noobscache', help="Do not cache the parsed observations. By default, the observations parsed from every data folder are cached in the database directory and reused until the FTPdetectinfo or platepar file changes.", 
+        default=False, action="store_true")
+
     # Parse the command line arguments
     cml_args = arg_parser.parse_args()
 
@@ -1839,6 +3149,15 @@ contain data folders. Data folders should have FTPdetectinfo files together with
     else:
         log.info("Auto running trajectory estimation every {:.1f} hours using the last {:.1f} days of data...".format(AUTO_RUN_FREQUENCY, cml_args.auto))
 
+    # The incremental mode is only used in auto mode, and not for the Monte Carlo phase
+    watch_settle_time = cml_args.watch
+    if watch_settle_time is not None:
+        if (cml_args.auto is None) or (cml_args.mcmode == 2):
+            log.info('watch only applicable together with auto and not in mcmode 2')
+            watch_settle_time = None
+        else:
+            log.info("After the first run, new data folders will be processed incrementally.")
+
     # Set max stations to use in a solution, minimum 2.
     # The best N will be chosen. -1 means use all. 
     if cml_args.maxstations is not None:
@@ -1890,8 +3209,16 @@ contain data folders. Data folders should have FTPdetectinfo files together with
     cpu_cores = cml_args.cpucores
     if (cpu_cores < 1) or (cpu_cores > multiprocessing.cpu_count()):
         cpu_cores = multiprocessing.cpu_count()
-    trajectory_constraints.mc_cores = cpu_cores
+
+    # Split the CPU cores between the trajectories solved in parallel and their Monte Carlo runs
+    traj_cores = min(max(cml_args.trajcores, 1), cpu_cores)
+    trajectory_constraints.traj_cores = traj_cores
+    trajectory_constraints.mc_cores = max(cpu_cores//traj_cores, 1)
+
     log.info("Running using {:d} CPU cores.".format(cpu_cores))
+    if traj_cores > 1:
+        log.info("Solving {:d} trajectories in parallel, {:d} Monte Carlo cores each.".format(traj_cores, 
+            trajectory_constraints.mc_cores))
 
     # Run processing. If the auto run more is not on, the loop will break after one run
     previous_start_time = None
@@ -1945,11 +3272,21 @@ contain data folders. Data folders should have FTPdetectinfo files together with
                 dt_end = datetime.datetime.now().replace(tzinfo=datetime.timezone.utc)
                 event_time_range = [dt_beg, dt_end]
 
+        # Unpaired observations from all time bins, kept for the incremental mode
+        watch_observations = []
+
+        # Retry the uploads to the remote host which failed in the previous pass
+        if remotehost is not None:
+            getRemoteUploadQueue(remotehost).requeueGivenUp()
+
         # Init the data handle
         dh = RMSDataHandle(
             cml_args.dir_path, dt_range=event_time_range, 
             db_dir=cml_args.dbdir, output_dir=cml_args.outdir,
-            mcmode=cml_args.mcmode, max_trajs=max_trajs, remotehost=remotehost, verbose=cml_args.verbose)
+            mcmode=cml_args.mcmode, max_trajs=max_trajs, remotehost=remotehost, verbose=cml_args.verbose, 
+            sqlite_db=cml_args.sqlitedb, mc_queue_backend=cml_args.mcqueue, 
+            mc_lease_time=cml_args.mcleasetime*3600, mc_priority=cml_args.mcpriority, 
+            load_cores=cpu_cores, obs_cache=not cml_args.noobscache)
         
         # If there is nothing to process, stop, unless we're in mcmode 2 (processing_list is not used in this case)
         if not dh.processing_list and cml_args.mcmode < 2:
@@ -2022,6 +3359,7 @@ contain data folders. Data folders should have FTPdetectinfo files together with
                     if cml_args.mcmode != 2:
                         dh.unpaired_observations = dh.loadUnpairedObservations(dh.processing_list, 
                             dt_range=(bin_beg, bin_end))
+                        watch_observations += dh.unpaired_observations
 
                     # refresh list of calculated trajectories from disk
                     dh.removeDeletedTrajectories()
@@ -2036,6 +3374,15 @@ contain data folders. Data folders should have FTPdetectinfo files together with
             else:
                 # there were no datasets to process
                 log.info('no data to process yet')
+
+            # Wait for the background uploads of the MC solutions to the remote host, but don't block the next
+            #   pass if the remote host is not reachable
+            if remotehost is not None:
+                log.info('Waiting for the uploads to the remote host to finish...')
+                upload_queue = getRemoteUploadQueue(remotehost)
+                if not upload_queue.flush(timeout=upload_queue.flushTimeout()):
+                    log.warning(f'{upload_queue.pending} uploads to the remote host are still pending, '
+                        'continuing')
             
             log.info("Total run time: {:s}".format(str(datetime.datetime.now(datetime.timezone.utc) - t1)))
 
@@ -2046,6 +3393,18 @@ contain data folders. Data folders should have FTPdetectinfo files together with
         if cml_args.auto is None:
             break
 
+        # In the incremental mode, keep the observations which were not paired in the first run and only 
+        #   process new data from now on
+        elif watch_settle_time is not None:
+
+            dh.unpaired_observations = watch_observations
+            dh.pruneUnpairedObservations(t1 - datetime.timedelta(days=cml_args.auto))
+
+            correlateIncrementally(dh, trajectory_constraints, cml_args.velpart, cml_args.auto, 
+                settle_time=watch_settle_time, mcmode=cml_args.mcmode, enableOSM=cml_args.enableOSM)
+
+            break
+
         else:
 
             # Otherwise wait to run AUTO_RUN_FREQUENCY hours after the beginning
@@ -0,0 +1,884 @@
+""" Queue of phase 1 trajectories waiting for the Monte Carlo uncertainty phase (mcmode 2 of the correlator).
+
+Every job is a phase 1 trajectory pickle in the queue directory (the phase1 directory of the correlator
+output). A worker claims one job at a time by renaming the pickle to *_processing. The claim is a lease: the
+modification time of the *_processing file is set to the time when the lease expires, and jobs with expired
+leases (e.g. left behind by crashed workers) are put back into the queue. Many workers on one or several
+machines sharing the directory can pull jobs from the same queue.
+
+Every claim has a lease token (the worker ID and the claim time), written to a *_processing.lease file next to
+the claimed pickle. A worker can only renew, release or complete the jobs whose lease token is still its own,
+so a slow worker which lost its lease to another worker cannot remove the job from under it. Workers renew
+their leases periodically while they are alive (see MCJobQueue.startHeartbeat), so long solutions are not
+taken over as long as the worker is running.
+
+Two backends are available:
+    - "file" - the state of the queue is kept only in the file names and times, and the job metadata used for
+        prioritization is stored next to the pickles.
+    - "sqlite" - the state of the queue and the job metadata are kept in an SQLite database in the queue
+        directory, the pickles are still claimed by renaming them.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import abc
+import glob
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+log = logging.getLogger("traj_correlator")
+
+
+# Default lease time of a claimed job (seconds), after which the job is put back into the queue
+MC_LEASE_TIME = 6*3600
+
+# Suffix of the job files
+MC_JOB_SUFFIX = "_trajectory.pickle"
+
+# Suffix added to the claimed job files
+MC_CLAIMED_SUFFIX = "_processing"
+
+# Suffix of the files with the lease tokens, added to the claimed job file names
+MC_LEASE_SUFFIX = ".lease"
+
+# Name of the SQLite database of the job queue
+MC_QUEUE_DB_NAME = "mc_jobs.db"
+
+# Orders in which the jobs are taken from the queue
+MC_QUEUE_PRIORITIES = ["brightness", "stations", "time"]
+
+
+
+def mcJobMetadata(traj):
+    """ Compute the metadata of the phase 1 trajectory used to prioritize its Monte Carlo job.
+
+    Arguments:
+        traj: [Trajectory] Phase 1 trajectory.
+
+    Return:
+        [dict]
+            - peak_mag: [float] Peak absolute magnitude of the meteor, None if not available.
+            - n_stations: [int] Number of stations used in the solution.
+    """
+
+    used_obs = [obs for obs in traj.observations if not obs.ignore_station]
+
+    # Find the peak absolute magnitude among the used points
+    peak_mag = None
+    for obs in used_obs:
+
+        if obs.absolute_magnitudes is None:
+            continue
+
+        mags = [mag for mag, ignored in zip(obs.absolute_magnitudes, obs.ignore_list)
+            if (mag is not None) and (not ignored)]
+
+        if len(mags):
+            obs_peak_mag = float(np.min(mags))
+            if (peak_mag is None) or (obs_peak_mag < peak_mag):
+                peak_mag = obs_peak_mag
+
+    return {"peak_mag": peak_mag, "n_stations": len(used_obs)}
+
+
+
+def _priorityKey(job_id, metadata, priority):
+    """ Internal function. Sort key of a job, jobs with smaller keys are taken from the queue first. """
+
+    if metadata is None:
+        metadata = {}
+
+    peak_mag = metadata.get("peak_mag")
+    n_stations = metadata.get("n_stations")
+
+    # Brightest meteors first
+    if priority == "brightness":
+        return (peak_mag is None, peak_mag if peak_mag is not None else 0.0, job_id)
+
+    # Meteors observed from the most stations first
+    elif priority == "stations":
+        return (n_stations is None, -n_stations if n_stations is not None else 0, job_id)
+
+    # Oldest meteors first (the job IDs start with the time of the meteor)
+    return (job_id,)
+
+
+
+class MCJobQueue(abc.ABC):
+    def __init__(self, queue_dir, lease_time=MC_LEASE_TIME, priority="brightness"):
+        """ Base class of the Monte Carlo job queue backends. It implements the claiming and the leases of the
+            job files, which are common to all backends. The backends implement the abstract methods put, 
+            claim, release, complete, requeueExpired, pending and progress.
+
+        Arguments:
+            queue_dir: [str] Path to the directory with the phase 1 trajectory pickles.
+
+        Keyword arguments:
+            lease_time: [float] Time in seconds after which the claimed job is put back into the queue if it
+                is not completed. 6 hours by default.
+            priority: [str] Order in which the jobs are taken from the queue, see MC_QUEUE_PRIORITIES.
+                "brightness" by default.
+        """
+
+        if priority not in MC_QUEUE_PRIORITIES:
+            raise ValueError("Unknown MC job priority: {:s}".format(str(priority)))
+
+        self.queue_dir = queue_dir
+        self.lease_time = lease_time
+        self.priority = priority
+
+        # Identifier of this worker, stored with the leases
+        self.owner = "{:s}:{:d}".format(socket.gethostname(), os.getpid())
+
+        # Lease tokens of the jobs claimed by this worker, keyed by the job ID
+        self.leases = {}
+
+        # Number of jobs completed by this worker
+        self.done_count = 0
+
+        # The leases are renewed from the heartbeat thread
+        self.lock = threading.RLock()
+        self.heartbeat_thread = None
+        self.heartbeat_stop = threading.Event()
+
+
+    def jobPath(self, job_id, claimed=False):
+        """ Return the path to the job file.
+
+        Arguments:
+            job_id: [str] Job ID, i.e. the name of the phase 1 trajectory pickle.
+
+        Keyword arguments:
+            claimed: [bool] Return the path of the claimed job file. False by default.
+        """
+
+        if claimed:
+            return os.path.join(self.queue_dir, job_id + MC_CLAIMED_SUFFIX)
+
+        return os.path.join(self.queue_dir, job_id)
+
+
+    def queuedJobFiles(self):
+        """ Return the list of IDs of all jobs which have a pickle waiting in the queue directory. """
+
+        return glob.glob1(self.queue_dir, "*" + MC_JOB_SUFFIX)
+
+
+    def claimedJobFiles(self):
+        """ Return a list of (job ID, lease expiry time) of all claimed job files in the queue directory. """
+
+        claimed = []
+        for file_name in glob.glob1(self.queue_dir, "*" + MC_JOB_SUFFIX + MC_CLAIMED_SUFFIX):
+
+            try:
+                lease_expiry = os.path.getmtime(os.path.join(self.queue_dir, file_name))
+            except OSError:
+                continue
+
+            claimed.append((file_name[:-len(MC_CLAIMED_SUFFIX)], lease_expiry))
+
+        return claimed
+
+
+    def leasePath(self, job_id):
+        """ Return the path to the file with the lease token of the claimed job. """
+
+        return self.jobPath(job_id, claimed=True) + MC_LEASE_SUFFIX
+
+
+    def readLeaseToken(self, job_id):
+        """ Return the lease token of the claimed job, None if the job is not claimed through the queue. """
+
+        try:
+            with open(self.leasePath(job_id)) as f:
+                return f.read().strip()
+
+        except OSError:
+            return None
+
+
+    def ownsLease(self, job_id):
+        """ Check that the job is still claimed by this worker, i.e. that its lease was not taken over by 
+            another worker after it expired.
+        """
+
+        token = self.leases.get(job_id)
+
+        return (token is not None) and os.path.isfile(self.jobPath(job_id, claimed=True)) \
+            and (self.readLeaseToken(job_id) == token)
+
+
+    def leaseFile(self, job_id, claimed=False):
+        """ Atomically claim the job file by renaming it. The modification time of the claimed file is set to
+            the lease expiry time, and a new lease token is written next to it.
+
+        Arguments:
+            job_id: [str] Job ID.
+
+        Keyword arguments:
+            claimed: [bool] The job file is already claimed and its lease expired, take the lease over. False
+                by default.
+
+        Return:
+            [float] Lease expiry time, or None if the job was taken by another worker in the meantime.
+        """
+
+        lease_expiry = time.time() + self.lease_time
+
+        # Token of this lease, the worker ID and the claim time
+        token = "{:s}:{:d}".format(self.owner, time.time_ns())
+
+        try:
+
+            if claimed:
+                os.utime(self.jobPath(job_id, claimed=True), (time.time(), lease_expiry))
+
+            else:
+
+                # Set the lease time before renaming, so the claimed file is never seen as expired. Only one
+                #   worker can succeed renaming the file
+                os.utime(self.jobPath(job_id), (time.time(), lease_expiry))
+                os.rename(self.jobPath(job_id), self.jobPath(job_id, claimed=True))
+
+            # Write the lease token atomically, so other workers never read a partial token
+            tmp_path = self.leasePath(job_id) + ".{:d}.tmp".format(os.getpid())
+            with open(tmp_path, 'w') as f:
+                f.write(token)
+
+            os.replace(tmp_path, self.leasePath(job_id))
+
+        except OSError:
+            return None
+
+        with self.lock:
+            self.leases[job_id] = token
+
+        return lease_expiry
+
+
+    def renewFile(self, job_id):
+        """ Extend the lease of the claimed job file if it is still owned by this worker.
+
+        Return:
+            [float] New lease expiry time, or None if the lease was lost.
+        """
+
+        if not self.ownsLease(job_id):
+            return None
+
+        lease_expiry = time.time() + self.lease_time
+
+        try:
+            os.utime(self.jobPath(job_id, claimed=True), (time.time(), lease_expiry))
+        except OSError:
+            return None
+
+        return lease_expiry
+
+
+    def checkLease(self, job_id, action):
+        """ Check that the job is still claimed by this worker before the given action is done, and forget 
+            the lease if it isn't.
+
+        Return:
+            [bool] True if the lease is owned by this worker.
+        """
+
+        if self.ownsLease(job_id):
+            return True
+
+        log.warning(f'Not {action} {job_id}, its lease is not held by this worker')
+
+        with self.lock:
+            self.leases.pop(job_id, None)
+
+        return False
+
+
+    def unleaseFile(self, job_id):
+        """ Put the claimed job file back into the queue. If a newer version of the job was queued in the
+            meantime, the claimed file is removed.
+
+        Return:
+            [bool] True if the file was put back.
+        """
+
+        with self.lock:
+            self.leases.pop(job_id, None)
+
+        try:
+
+            if os.path.isfile(self.jobPath(job_id)):
+                os.remove(self.jobPath(job_id, claimed=True))
+                put_back = False
+
+            else:
+                os.rename(self.jobPath(job_id, claimed=True), self.jobPath(job_id))
+                put_back = True
+
+        except OSError:
+            return False
+
+        finally:
+            self.removeLeaseFile(job_id)
+
+        return put_back
+
+
+    def removeLeaseFile(self, job_id):
+        """ Remove the lease token of the job. """
+
+        try:
+            os.remove(self.leasePath(job_id))
+        except OSError:
+            pass
+
+
+    def removeFile(self, job_id):
+        """ Remove the claimed job file. """
+
+        with self.lock:
+            self.leases.pop(job_id, None)
+
+        claimed_path = self.jobPath(job_id, claimed=True)
+
+        if os.path.isfile(claimed_path):
+            os.remove(claimed_path)
+        else:
+            log.warning(f'unable to find _processing file {claimed_path}')
+
+        self.removeLeaseFile(job_id)
+
+
+    def renew(self, job_id):
+        """ Extend the lease of a job claimed by this worker.
+
+        Return:
+            [bool] True if the lease was renewed, False if it was lost to another worker.
+        """
+
+        with self.lock:
+            return self.renewFile(job_id) is not None
+
+
+    def renewAll(self):
+        """ Renew the leases of all jobs claimed by this worker. Leases which were lost are forgotten. """
+
+        with self.lock:
+
+            for job_id in list(self.leases):
+
+                if not self.renew(job_id):
+                    log.warning(f'Lost the lease of {job_id}')
+                    self.leases.pop(job_id, None)
+
+
+    def startHeartbeat(self, interval=None):
+        """ Start a background thread which renews the leases of the claimed jobs while this worker is alive.
+
+        Keyword arguments:
+            interval: [float] Time between the renewals (seconds). None by default, in which case a quarter of
+                the lease time is used.
+        """
+
+        if self.heartbeat_thread is not None:
+            return
+
+        if interval is None:
+            interval = max(self.lease_time/4, 1)
+
+        def _heartbeat():
+            while not self.heartbeat_stop.wait(interval):
+                try:
+                    self.renewAll()
+                except Exception as e:
+                    log.warning(f'Renewing the MC job leases failed: {e}')
+
+        self.heartbeat_stop.clear()
+        self.heartbeat_thread = threading.Thread(target=_heartbeat, name="mc-lease-heartbeat", daemon=True)
+        self.heartbeat_thread.start()
+
+
+    def stopHeartbeat(self):
+        """ Stop the lease renewal thread. """
+
+        if self.heartbeat_thread is None:
+            return
+
+        self.heartbeat_stop.set()
+        self.heartbeat_thread.join()
+        self.heartbeat_thread = None
+
+
+    @abc.abstractmethod
+    def put(self, job_id, traj=None):
+        """ Add the job to the queue. The pickle of the job must already be saved in the queue directory.
+
+        Arguments:
+            job_id: [str] Job ID, i.e. the name of the phase 1 trajectory pickle.
+
+        Keyword arguments:
+            traj: [Trajectory] Phase 1 trajectory, used to compute the job priority. None by default.
+        """
+
+
+    @abc.abstractmethod
+    def claim(self, exclude=None):
+        """ Claim the next job from the queue.
+
+        Keyword arguments:
+            exclude: [set] IDs of jobs which should not be claimed. None by default.
+
+        Return:
+            [str] ID of the claimed job, or None if the queue is empty. The job pickle is at
+                jobPath(job_id, claimed=True).
+        """
+
+
+    @abc.abstractmethod
+    def release(self, job_id):
+        """ Put the claimed job back into the queue without completing it. Nothing is done if the lease of the
+            job is no longer held by this worker.
+
+        Return:
+            [bool] True if the job was released.
+        """
+
+
+    @abc.abstractmethod
+    def complete(self, job_id):
+        """ Mark the claimed job as done and remove its file from the queue. Nothing is done if the lease of 
+            the job is no longer held by this worker, as the job is then processed by another worker.
+
+        Return:
+            [bool] True if the job was completed.
+        """
+
+
+    @abc.abstractmethod
+    def requeueExpired(self):
+        """ Put the jobs with expired leases back into the queue.
+
+        Return:
+            [int] Number of jobs put back into the queue.
+        """
+
+
+    @abc.abstractmethod
+    def pending(self):
+        """ Return the list of IDs of jobs waiting in the queue, in the order in which they will be claimed.
+        """
+
+
+    @abc.abstractmethod
+    def progress(self):
+        """ Return the state of the queue.
+
+        Return:
+            [dict] Number of queued jobs ("queued"), claimed jobs ("leased") and jobs completed by this
+                worker ("done").
+        """
+
+
+    def logProgress(self):
+        """ Log the state of the queue. """
+
+        progress = self.progress()
+        log.info("MC queue: {:d} queued, {:d} in progress, {:d} done by this worker".format(
+            progress["queued"], progress["leased"], progress["done"]))
+
+
+    def close(self):
+        """ Close the queue. """
+
+        self.stopHeartbeat()
+
+
+
+class FileMCJobQueue(MCJobQueue):
+    def __init__(self, queue_dir, lease_time=MC_LEASE_TIME, priority="brightness"):
+        """ Monte Carlo job queue which keeps its state only in the queue directory. The job metadata is
+            stored in a JSON file next to every job pickle. See MCJobQueue for the arguments.
+        """
+
+        MCJobQueue.__init__(self, queue_dir, lease_time=lease_time, priority=priority)
+
+        # Cache of the job metadata, it doesn't change while the job is queued
+        self.metadata_cache = {}
+
+
+    def metadataPath(self, job_id):
+        """ Return the path to the metadata file of the job. """
+
+        return os.path.join(self.queue_dir, job_id + ".json")
+
+
+    def loadMetadata(self, job_id):
+        """ Load the metadata of the job, None if it's not available. """
+
+        if job_id not in self.metadata_cache:
+
+            try:
+                with open(self.metadataPath(job_id)) as f:
+                    self.metadata_cache[job_id] = json.load(f)
+
+            except (OSError, ValueError):
+                return None
+
+        return self.metadata_cache[job_id]
+
+
+    def put(self, job_id, traj=None):
+
+        self.metadata_cache.pop(job_id, None)
+
+        if traj is None:
+            return
+
+        # Write the metadata atomically, so other workers never read a partial file
+        metadata_path = self.metadataPath(job_id)
+        tmp_path = metadata_path + ".{:d}.tmp".format(os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(mcJobMetadata(traj), f)
+
+        os.replace(tmp_path, metadata_path)
+
+
+    def pending(self):
+
+        job_ids = self.queuedJobFiles()
+
+        return sorted(job_ids, key=lambda job_id: _priorityKey(job_id, self.loadMetadata(job_id),
+            self.priority))
+
+
+    def claim(self, exclude=None):
+
+        if exclude is None:
+            exclude = set()
+
+        for job_id in self.pending():
+
+            if job_id in exclude:
+                continue
+
+            if self.leaseFile(job_id) is not None:
+                return job_id
+
+        return None
+
+
+    def release(self, job_id):
+
+        with self.lock:
+
+            if not self.checkLease(job_id, "releasing"):
+                return False
+
+            self.unleaseFile(job_id)
+
+        return True
+
+
+    def complete(self, job_id):
+
+        with self.lock:
+
+            if not self.checkLease(job_id, "completing"):
+                return False
+
+            self.removeFile(job_id)
+
+        # Only remove the metadata if a new version of the job was not queued in the meantime
+        if not os.path.isfile(self.jobPath(job_id)):
+            if os.path.isfile(self.metadataPath(job_id)):
+                os.remove(self.metadataPath(job_id))
+
+        self.metadata_cache.pop(job_id, None)
+
+        self.done_count += 1
+
+        return True
+
+
+    def requeueExpired(self):
+
+        requeued = 0
+        for job_id, lease_expiry in self.claimedJobFiles():
+
+            if lease_expiry < time.time():
+
+                if self.unleaseFile(job_id):
+                    log.info(f'Lease of {job_id} expired, putting it back into the queue')
+                    requeued += 1
+
+        return requeued
+
+
+    def progress(self):
+
+        return {"queued": len(self.queuedJobFiles()), "leased": len(self.claimedJobFiles()),
+            "done": self.done_count}
+
+
+
+class SQLiteMCJobQueue(MCJobQueue):
+    def __init__(self, queue_dir, lease_time=MC_LEASE_TIME, priority="brightness"):
+        """ Monte Carlo job queue which keeps its state and the job metadata in an SQLite database in the
+            queue directory. Pickles which appear in the queue directory without being added through put()
+            (e.g. copied by hand) are added to the queue automatically. See MCJobQueue for the arguments.
+        """
+
+        MCJobQueue.__init__(self, queue_dir, lease_time=lease_time, priority=priority)
+
+        self.db_file_path = os.path.join(queue_dir, MC_QUEUE_DB_NAME)
+
+        # Transactions are handled explicitly, so claiming is atomic between processes. The connection is
+        #   shared with the heartbeat thread, all access is done under self.lock
+        self.conn = sqlite3.connect(self.db_file_path, timeout=60, isolation_level=None, 
+            check_same_thread=False)
+
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS mc_jobs (job_id TEXT PRIMARY KEY, state TEXT NOT NULL, peak_mag REAL,
+                n_stations INTEGER, owner TEXT, lease_expiry REAL, attempts INTEGER NOT NULL DEFAULT 0,
+                lease_token TEXT);
+            CREATE INDEX IF NOT EXISTS mc_jobs_state ON mc_jobs (state);
+            """)
+
+        # Add the lease token to the queues created without it
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(mc_jobs)")]
+        if "lease_token" not in columns:
+            self.conn.execute("ALTER TABLE mc_jobs ADD COLUMN lease_token TEXT")
+
+
+    def orderBy(self):
+        """ Return the SQL ORDER BY clause for the queue priority. """
+
+        if self.priority == "brightness":
+            return "ORDER BY peak_mag IS NULL, peak_mag, job_id"
+
+        elif self.priority == "stations":
+            return "ORDER BY n_stations IS NULL, n_stations DESC, job_id"
+
+        return "ORDER BY job_id"
+
+
+    def syncFiles(self):
+        """ Add the pickles in the queue directory which are not in the database to the queue. """
+
+        known = set(row[0] for row in self.conn.execute("SELECT job_id FROM mc_jobs WHERE state != 'done'"))
+
+        new_jobs = [job_id for job_id in self.queuedJobFiles() if job_id not in known]
+
+        if new_jobs:
+            self.conn.executemany("INSERT OR REPLACE INTO mc_jobs (job_id, state) VALUES (?, 'queued')",
+                [(job_id,) for job_id in new_jobs])
+
+
+    def put(self, job_id, traj=None):
+
+        metadata = mcJobMetadata(traj) if traj is not None else {}
+
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO mc_jobs (job_id, state, peak_mag, n_stations) "
+                "VALUES (?, 'queued', ?, ?)", (job_id, metadata.get("peak_mag"), metadata.get("n_stations")))
+
+
+    def pending(self):
+
+        with self.lock:
+
+            self.syncFiles()
+
+            return [row[0] for row in self.conn.execute(
+                "SELECT job_id FROM mc_jobs WHERE state = 'queued' " + self.orderBy())]
+
+
+    def claim(self, exclude=None):
+
+        if exclude is None:
+            exclude = set()
+
+        with self.lock:
+
+            self.syncFiles()
+
+            self.conn.execute("BEGIN IMMEDIATE")
+
+            try:
+
+                rows = self.conn.execute("SELECT job_id, state FROM mc_jobs WHERE state = 'queued' "
+                    "OR (state = 'leased' AND lease_expiry < ?) " + self.orderBy(), (time.time(),)).fetchall()
+
+                for job_id, state in rows:
+
+                    if job_id in exclude:
+                        continue
+
+                    # Claim the waiting pickle
+                    if os.path.isfile(self.jobPath(job_id)):
+                        lease_expiry = self.leaseFile(job_id)
+
+                    # Take over the expired claim of another worker. If the job file was claimed outside the
+                    #   queue (e.g. by a remote worker), keep its lease
+                    elif os.path.isfile(self.jobPath(job_id, claimed=True)):
+
+                        lease_expiry = os.path.getmtime(self.jobPath(job_id, claimed=True))
+                        if lease_expiry >= time.time():
+                            self.conn.execute("UPDATE mc_jobs SET state = 'leased', lease_expiry = ? "
+                                "WHERE job_id = ?", (lease_expiry, job_id))
+                            continue
+
+                        lease_expiry = self.leaseFile(job_id, claimed=True)
+
+                    # The job file is gone, the job was completed outside the queue
+                    else:
+                        self.conn.execute("UPDATE mc_jobs SET state = 'done' WHERE job_id = ?", (job_id,))
+                        continue
+
+
+                    if lease_expiry is None:
+                        continue
+
+                    self.conn.execute("UPDATE mc_jobs SET state = 'leased', owner = ?, lease_expiry = ?, "
+                        "lease_token = ?, attempts = attempts + 1 WHERE job_id = ?", 
+                        (self.owner, lease_expiry, self.leases[job_id], job_id))
+
+                    self.conn.execute("COMMIT")
+
+                    return job_id
+
+                self.conn.execute("COMMIT")
+
+            except:
+                self.conn.execute("ROLLBACK")
+                raise
+
+            return None
+
+
+    def release(self, job_id):
+
+        with self.lock:
+
+            token = self.leases.get(job_id)
+            if not self.checkLease(job_id, "releasing"):
+                return False
+
+            self.unleaseFile(job_id)
+
+            self.conn.execute("UPDATE mc_jobs SET state = 'queued', owner = NULL, lease_expiry = NULL, "
+                "lease_token = NULL WHERE job_id = ? AND lease_token = ?", (job_id, token))
+
+        return True
+
+
+    def complete(self, job_id):
+
+        with self.lock:
+
+            token = self.leases.get(job_id)
+            if not self.checkLease(job_id, "completing"):
+                return False
+
+            self.removeFile(job_id)
+
+            # Put the job back into the queue if a new version of it was queued in the meantime
+            state = "queued" if os.path.isfile(self.jobPath(job_id)) else "done"
+
+            self.conn.execute("UPDATE mc_jobs SET state = ?, owner = NULL, lease_expiry = NULL, "
+                "lease_token = NULL WHERE job_id = ? AND lease_token = ?", (state, job_id, token))
+
+            self.done_count += 1
+
+        return True
+
+
+    def renew(self, job_id):
+
+        with self.lock:
+
+            token = self.leases.get(job_id)
+
+            lease_expiry = self.renewFile(job_id)
+            if lease_expiry is None:
+                return False
+
+            self.conn.execute("UPDATE mc_jobs SET lease_expiry = ? WHERE job_id = ? AND lease_token = ?", 
+                (lease_expiry, job_id, token))
+
+        return True
+
+
+    def requeueExpired(self):
+
+        requeued = 0
+
+        with self.lock:
+
+            for job_id, lease_expiry in self.claimedJobFiles():
+
+                if lease_expiry < time.time():
+
+                    if self.unleaseFile(job_id):
+                        log.info(f'Lease of {job_id} expired, putting it back into the queue')
+                        requeued += 1
+
+                    self.conn.execute("UPDATE mc_jobs SET state = 'queued', owner = NULL, lease_expiry = NULL, "
+                        "lease_token = NULL WHERE job_id = ?", (job_id,))
+
+        return requeued
+
+
+    def progress(self):
+
+        with self.lock:
+
+            self.syncFiles()
+
+            counts = dict(self.conn.execute("SELECT state, COUNT(*) FROM mc_jobs GROUP BY state").fetchall())
+
+        return {"queued": counts.get("queued", 0), "leased": counts.get("leased", 0),
+            "done": self.done_count}
+
+
+    def close(self):
+
+        self.stopHeartbeat()
+
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+
+def openMCJobQueue(queue_dir, backend="file", lease_time=MC_LEASE_TIME, priority="brightness"):
+    """ Open the Monte Carlo job queue with the given backend.
+
+    Arguments:
+        queue_dir: [str] Path to the directory with the phase 1 trajectory pickles.
+
+    Keyword arguments:
+        backend: [str] "file" or "sqlite". "file" by default.
+        lease_time: [float] Lease time of claimed jobs (seconds).
+        priority: [str] Order in which the jobs are taken from the queue, see MC_QUEUE_PRIORITIES.
+
+    Return:
+        [MCJobQueue]
+    """
+
+    if backend == "file":
+        return FileMCJobQueue(queue_dir, lease_time=lease_time, priority=priority)
+
+    elif backend == "sqlite":
+        return SQLiteMCJobQueue(queue_dir, lease_time=lease_time, priority=priority)
+
+    raise ValueError("Unknown MC job queue backend: {:s}".format(str(backend)))
@@ -7,11 +7,8 @@ import argparse
 
 import numpy as np
 
-from jplephem.spk import SPK
-
 import wmpl
-from wmpl.Config import config
-from wmpl.Utils.Earth import calcEarthRectangularCoordJPL
+from wmpl.Utils.Earth import calcEarthRectangularCoordJPL, loadJPLEphem
 from wmpl.Utils.ShowerAssociation import associateShower
 from wmpl.Utils.SolarLongitude import jd2SolLonJPL
 from wmpl.Utils.TrajConversions import J2000_JD, J2000_OBLIQUITY, AU, SUN_MU, SUN_MASS, G, SIDEREAL_YEAR, \
@@ -407,8 +404,8 @@ def calcOrbitalElements(jd_ref, ra_g, dec_g, v_g, eci_ref):
     L_g, B_g = raDec2Ecliptic(J2000_JD.days, ra_g, dec_g)
 
 
-    # Load the JPL ephemerids data
-    jpl_ephem_data = SPK.open(config.jpl_ephem_file)
+    # Load the JPL ephemerids data (the file is opened only once per process)
+    jpl_ephem_data = loadJPLEphem()
     
     # Get the position of the Earth (km) and its velocity (km/s) at the given Julian date (J2000 epoch)
     # The position is given in the ecliptic coordinates, origin of the coordinate system is in the centre
@@ -47,8 +47,8 @@ except ImportError:
 
 import wmpl
 from wmpl.Trajectory.Orbit import calcOrbit
-from wmpl.Utils.Math import vectNorm, vectMag, meanAngle, findClosestPoints, RMSD, \
-    angleBetweenSphericalCoords, angleBetweenVectors, lineFunc, normalizeAngleWrap, confidenceInterval
+from wmpl.Utils.Math import vectNorm, vectMag, meanAngle, findClosestPoints, findClosestPoints_vect, \
+    RMSD, angleBetweenSphericalCoords, angleBetweenVectors, lineFunc, normalizeAngleWrap, confidenceInterval
 from wmpl.Utils.Misc import valueFormat
 from wmpl.Utils.OSTools import mkdirP
 from wmpl.Utils.Pickling import savePickle
@@ -58,7 +58,7 @@ from wmpl.Utils.PlotCelestial import CelestialPlot
 from wmpl.Utils.PlotMap import GroundMap
 from wmpl.Utils.TrajConversions import EARTH, G, ecef2ENU, enu2ECEF, geo2Cartesian, geo2Cartesian_vect, \
     cartesian2Geo, altAz2RADec_vect, raDec2AltAz, raDec2AltAz_vect, raDec2ECI, eci2RaDec, jd2Date, datetime2JD
-from wmpl.Utils.PyDomainParallelizer import parallelComputeGenerator
+from wmpl.Utils.PyDomainParallelizer import parallelComputeGenerator, getSharedPool
 
 
 # Text size of image legends
@@ -849,6 +849,169 @@ def minimizeAngleCost(params, observations, weights=None, gravity=False, gravity
 
 
 
+class LoSMeasurementArrays(object):
+    def __init__(self, observations, weights=None):
+        """ Pack all lines of sight which are used in the LoS angle minimization into contiguous arrays, so
+            the cost function can be evaluated for all points at once. The arrays should be rebuilt every
+            time the observations, their ignore flags or the weights change.
+
+        Arguments:
+            observations: [list] A list of ObservedPoints objects which are containing meteor observations.
+
+        Keyword arguments:
+            weights: [list] A list of statistical weights for every station. None by default, in which case
+                unity weights will be used for all stations which are not ignored.
+
+        """
+
+        # If the weights were not given, use 1 for every weight. Set weights for stations that are not used
+        #   to 0
+        if weights is None:
+            weights = [1.0 if (obs.ignore_station == False) else 0 for obs in observations]
+
+        # Make sure there are weights larger than 0
+        if sum(weights) <= 0:
+            weights = [1.0 if (obs.ignore_station == False) else 0 for obs in observations]
+
+        weights = np.array(weights, dtype=np.float64)
+
+
+        # Find the earliest point in time
+        self.t0 = min([obs.time_data[0] for obs in observations])
+
+
+        meas_list = []
+        stat_list = []
+        time_list = []
+        weight_list = []
+
+        # Take all points which are not ignored
+        for i, obs in enumerate(observations):
+
+            used = np.array(obs.ignore_list) == 0
+
+            meas_list.append(np.array(obs.meas_eci_los, dtype=np.float64).reshape(-1, 3)[used])
+            stat_list.append(np.array(obs.stat_eci_los, dtype=np.float64).reshape(-1, 3)[used])
+            time_list.append(np.array(obs.time_data, dtype=np.float64)[used])
+            weight_list.append(np.zeros(np.count_nonzero(used)) + weights[i])
+
+
+        # Lines of sight of all used points and the positions of stations at the time of observation
+        self.meas_eci = np.ascontiguousarray(np.concatenate(meas_list))
+        self.stat_eci = np.ascontiguousarray(np.concatenate(stat_list))
+
+        # Times relative to the earliest point
+        self.t_rel = np.concatenate(time_list) - self.t0
+
+        # Per point weights
+        self.weights = np.concatenate(weight_list)
+        self.weights_sum = 1e-10 + np.sum(self.weights)
+
+
+        # First lines of sight of every non-ignored station, used to move the state vector to the beginning
+        #   of the trajectory
+        nonignored_observations = [obs for obs in observations if not obs.ignore_station]
+        self.first_meas_eci = np.array([obs.meas_eci_los[0] for obs in nonignored_observations],
+            dtype=np.float64).reshape(-1, 3)
+        self.first_stat_eci = np.array([obs.stat_eci_los[0] for obs in nonignored_observations],
+            dtype=np.float64).reshape(-1, 3)
+
+
+    def moveStateVector(self, state_vect, radiant_eci):
+        """ Vectorized version of moveStateVector, using the first points of all non-ignored stations.
+
+        Arguments:
+            state_vect: [ndarray] (x, y, z) ECI coordinates of the initial state vector (meters).
+            radiant_eci: [ndarray] (x, y, z) components of the radiant direction vector.
+
+        Return:
+            rad_cpa_beg: [ndarray] (x, y, z) ECI coordinates of the beginning point of the trajectory.
+        """
+
+        # Calculate closest points of approach of the first points on the trajectory across all stations
+        _, rad_cpa, _ = findClosestPoints_vect(self.first_stat_eci, self.first_meas_eci, state_vect,
+            radiant_eci)
+
+        # Compute angular distances from the first points to the radiant
+        rad_cpa_norm = rad_cpa/np.linalg.norm(rad_cpa, axis=1)[:, np.newaxis]
+        rad_ang_dist = np.arccos(np.dot(rad_cpa_norm, radiant_eci)/vectMag(radiant_eci))
+
+        # Choose the state vector as the point of initial observation closest to the radiant
+        return np.ascontiguousarray(rad_cpa[np.argmin(rad_ang_dist)])
+
+
+
+def angleSumMeasurements2Line_vect(los_arrays, state_vect, radiant_eci, gravity=False, gravity_factor=1.0,
+    v0z=None):
+    """ Vectorized version of angleSumMeasurements2Line. Computes the same cost function, but evaluates all
+        lines of sight at once.
+
+    Arguments:
+        los_arrays: [LoSMeasurementArrays] Packed lines of sight, times and weights of all used points.
+        state_vect: [3 element ndarray] Estimated position of the initial state vector in ECI coordinates.
+        radiant_eci: [3 element ndarray] Unit 3D vector of the radiant in ECI coordinates.
+
+    Keyword arguments:
+        gravity: [bool] If True, the gravity drop will be taken into account.
+        gravity_factor: [float] Factor by which the gravity correction will be multiplied. 1.0 by default.
+        v0z: [float] Initial vertical velocity of the meteor. If None, 0.0 will be used.
+
+    Return:
+        angle_sum: [float] Sum of angles between the estimated trajectory line and individual lines of sight.
+
+    """
+
+    # Make sure that the radiant vector is a contigous array for faster calculations
+    radiant_eci = np.ascontiguousarray(radiant_eci, dtype=np.float64)
+
+    # Move the state vector to the beginning of the trajectory
+    state_vect = los_arrays.moveStateVector(state_vect, radiant_eci)
+
+    # Get the ECI coordinates of the projections of the measurement lines of sight on the radiant line
+    _, rad_cpa, _ = findClosestPoints_vect(los_arrays.stat_eci, los_arrays.meas_eci, state_vect, radiant_eci)
+
+
+    # Take the gravity drop into account
+    if gravity:
+
+        # Compute the model point modified due to gravity, assuming zero vertical velocity
+        if v0z is None:
+            v0z = 0.0
+
+        # Get the magnitude of the radiant vector, if the magnitude is 0, set it to 1 to avoid a division by
+        #   zero issue
+        rad_cpa_mag = np.linalg.norm(rad_cpa, axis=1)
+        rad_cpa_mag[rad_cpa_mag == 0] = 1.0
+
+        rad_cpa_grav = applyGravityDrop_vect(rad_cpa, los_arrays.t_rel, rad_cpa_mag, gravity_factor, v0z)
+        _, rad_cpa, _ = findClosestPoints_vect(los_arrays.stat_eci, los_arrays.meas_eci, rad_cpa_grav,
+            radiant_eci)
+
+
+    # Calculate the unit vectors pointing from the stations to the points on the trajectory
+    station_rays = rad_cpa - los_arrays.stat_eci
+    station_rays /= np.linalg.norm(station_rays, axis=1)[:, np.newaxis]
+
+    # Calculate the angles between the observed LoS as seen from the station and the radiant line
+    cosangles = np.einsum('ij,ij->i', los_arrays.meas_eci, station_rays)
+
+    # Make sure the cosine is within limits and calculate the angle
+    angle_sum = np.sum(los_arrays.weights*np.arccos(np.clip(cosangles, -1, 1)))
+
+    return angle_sum/los_arrays.weights_sum
+
+
+
+def minimizeAngleCost_vect(params, los_arrays, gravity=False, gravity_factor=1.0, v0z=None):
+    """ A helper function for minimization of angle deviations, using packed lines of sight. """
+
+    state_vect, radiant_eci = np.hsplit(params, 2)
+
+    return angleSumMeasurements2Line_vect(los_arrays, state_vect, radiant_eci, gravity=gravity, \
+        gravity_factor=gravity_factor, v0z=v0z)
+
+
+
 
 def calcSpatialResidual(jdt_ref, jd, state_vect, radiant_eci, stat, meas, gravity=False, gravity_factor=1.0, 
                         v0z=None):
@@ -968,7 +1131,131 @@ def calcSpatialResidual(jdt_ref, jd, state_vect, radiant_eci, stat, meas, gravit
     # Looking along the trajectory (radiant behind you, you're on top of the trajectory), 
     # positive residuals are upwards
     vres = np.dot(p, vz_eci)
-                                                    
+
+    return hres, vres
+
+
+
+def calcSpatialResidual_vect(jdt_ref, jd, state_vect, radiant_eci, stat, meas, gravity=False,
+    gravity_factor=1.0, v0z=None):
+    """ Vectorized version of calcSpatialResidual. Calculate horizontal and vertical residuals from the
+        radiant line for all given observed points at once.
+
+        The local reference frames are the same as in calcSpatialResidual, but they are constructed directly
+        from the local sidereal time of the point on the trajectory (which is its right ascension), instead of
+        converting the point to geographical coordinates and back.
+
+    Arguments:
+        jdt_ref: [float] Reference Julian date.
+        jd: [ndarray] Julian dates of the points.
+        state_vect: [3 element ndarray] ECI position of the state vector.
+        radiant_eci: [3 element ndarray] radiant direction vector in ECI.
+        stat: [Nx3 ndarray] positions of the station in ECI.
+        meas: [Nx3 ndarray] lines of sight from the station, in ECI.
+
+    Keyword arguments:
+        gravity: [bool] Apply the correction for Earth's gravity.
+        gravity_factor: [float] Factor by which the gravity correction will be multiplied. 1.0 by default.
+        v0z: [float] Initial vertical velocity of the meteor. If None, 0.0 will be used.
+
+    Return:
+        (hres, vres): [tuple of ndarrays] residuals in horitontal and vertical direction from the radiant line
+
+    """
+
+    jd = np.array(jd, dtype=np.float64).ravel()
+    stat = np.array(stat, dtype=np.float64).reshape(-1, 3)
+    meas = np.array(meas, dtype=np.float64).reshape(-1, 3)
+
+    if len(jd) == 0:
+        return np.array([]), np.array([])
+
+    meas = meas/np.linalg.norm(meas, axis=1)[:, np.newaxis]
+
+    # Calculate closest points of approach (observed line of sight to radiant line) from the state vector
+    obs_cpa, rad_cpa, _ = findClosestPoints_vect(stat, meas, state_vect, radiant_eci)
+
+    # Apply the gravity drop
+    if gravity:
+
+        # Compute the relative time
+        t_rel = 86400*(jd - jdt_ref)
+
+        # Correct the points on the trajectory for gravity
+        if v0z is None:
+            v0z = 0.0
+        rad_cpa_grav = applyGravityDrop_vect(rad_cpa, t_rel, np.linalg.norm(rad_cpa, axis=1),
+            gravity_factor, v0z)
+
+        # Recompute the closest points of approach from the gravity corrected points
+        obs_cpa, rad_cpa, _ = findClosestPoints_vect(stat, meas, rad_cpa_grav, radiant_eci)
+
+
+    # Vectors pointing from the points on the trajectory to the points on the lines of sight
+    p = obs_cpa - rad_cpa
+
+
+    # Calculate the geodetic latitudes and the local sidereal times of the points on the trajectory, used for
+    #   the local ENU reference frames (see ecef2LatLonAlt)
+    x, y, z = rad_cpa.T
+    ep = np.sqrt((EARTH.EQUATORIAL_RADIUS**2 - EARTH.POLAR_RADIUS**2)/(EARTH.POLAR_RADIUS**2))
+    p_xy = np.sqrt(x**2 + y**2)
+    theta = np.arctan2(z*EARTH.EQUATORIAL_RADIUS, p_xy*EARTH.POLAR_RADIUS)
+    lat = np.arctan2(z + (ep**2)*EARTH.POLAR_RADIUS*np.sin(theta)**3, \
+        p_xy - (EARTH.E**2)*EARTH.EQUATORIAL_RADIUS*np.cos(theta)**3)
+    lst = np.arctan2(y, x)%(2*np.pi)
+
+    sin_lat = np.sin(lat)
+    cos_lat = np.cos(lat)
+
+
+    # Derive radiant azim/elev (see raDec2AltAz)
+    rad_ra, rad_dec = eci2RaDec(radiant_eci)
+    ha = (lst - rad_ra + np.pi)%(2*np.pi) - np.pi
+    azimx = np.pi + np.arctan2(np.sin(ha), np.cos(ha)*sin_lat - np.tan(rad_dec)*cos_lat)
+    sin_elev = sin_lat*np.sin(rad_dec) + cos_lat*np.cos(rad_dec)*np.cos(ha)
+    sin_elev = (sin_elev + 1)%2 - 1
+    elevx = np.arcsin(sin_elev)
+
+    # If radiant elevation is in the zenith, set reference frame x-axis to zero degrees azimuth (North)
+    azimx[np.abs(np.pi/2.0 - elevx) <= 10e-13] = 0
+
+    # If looking at the radiant azimy will be on your left along the horizon
+    azimy = (azimx - np.pi/2.0)%(2*np.pi)
+    elevy = np.zeros_like(azimy)
+
+    # If looking towards the radiant, azim z is behind you
+    azimz = (azimx + np.pi)%(2*np.pi)
+    elevz = (np.pi/2.0) - elevx
+
+
+    def _altAz2ECI(azim, elev):
+        """ Convert local azimuths and elevations of the frame axes to ECI unit vectors (see
+            altAz2RADec and raDec2ECI).
+        """
+
+        ha = np.arctan2(-np.sin(azim), np.tan(elev)*cos_lat - np.cos(azim)*sin_lat)
+        ra = (lst - ha)%(2*np.pi)
+        dec = np.arcsin(sin_lat*np.sin(elev) + cos_lat*np.cos(elev)*np.cos(azim))
+
+        return np.column_stack(raDec2ECI(ra, dec))
+
+
+    # Create unit vectors of the local reference frames in ECI coordinates
+    hx_eci = _altAz2ECI(azimx, elevx)
+    hy_eci = _altAz2ECI(azimy, elevy)
+    vz_eci = _altAz2ECI(azimz, elevz)
+
+    #  Calculate dot products to resolve p into its components
+    ehx = np.einsum('ij,ij->i', p, hx_eci)
+    ehy = np.einsum('ij,ij->i', p, hy_eci)
+
+    # Calculate horizontal residuals (see calcSpatialResidual for the explanation of signs)
+    hres = np.sign(ehy)*np.hypot(ehx, ehy)
+
+    # Calculate vertical residuals
+    vres = np.einsum('ij,ij->i', p, vz_eci)
+
     return hres, vres
 
 
@@ -1929,6 +2216,214 @@ def trajNoiseGenerator(traj, noise_sigma):
 
 
 
+class MCObservationBundle(object):
+    def __init__(self, traj, noise_sigma):
+        """ Compact, read-only container with everything a Monte Carlo worker needs to generate and solve
+            noisy trajectories. It is sent to every worker only once, and the workers only receive a run
+            number and a random seed for every Monte Carlo run.
+
+        Arguments:
+            traj: [Trajectory] Solved trajectory on which the Monte Carlo runs will be performed.
+            noise_sigma: [float] Standard deviations of noise to add to the data.
+
+        """
+
+        self.noise_sigma = noise_sigma
+
+        # Copy of the trajectory with the observations and the bulky results removed, used as a template for
+        #   the MC trajectories (the settings are taken from it)
+        traj_template = copy.copy(traj)
+        traj_template.observations = []
+        traj_template.intersection_list = None
+        traj_template.uncertainties = None
+        traj_template.uncertanties = None
+        if hasattr(traj_template, 'obs_noisy'):
+            del traj_template.obs_noisy
+
+        self.traj_template = copy.deepcopy(traj_template)
+
+        # Original noise-free observations
+        self.observations = copy.deepcopy(traj.observations)
+
+
+        # Per-station arrays used for noise generation
+        self.jd_data = []
+        self.meas_eci_los = []
+        self.sigma = []
+
+        for obs in traj.observations:
+
+            self.jd_data.append(np.array(obs.JD_data, dtype=np.float64))
+            self.meas_eci_los.append(np.array(obs.meas_eci_los, dtype=np.float64).reshape(-1, 3))
+
+            # Compute noise level to add to observations
+            sigma = noise_sigma*np.abs(obs.ang_res_std)
+
+            # Make sure sigma is positive, if not set it to 1 degree
+            if (sigma < 0) or np.isnan(sigma):
+                sigma = np.radians(1)
+
+            self.sigma.append(sigma)
+
+
+
+class MCResult(object):
+    def __init__(self, run_id, seed, traj):
+        """ Compact record of a Monte Carlo run, returned by the workers instead of the full Trajectory
+            object. Contains all parameters needed to filter the runs and compute the uncertainties. The full
+            trajectory can be reconstructed from the seed using solveMCBundle.
+
+        Arguments:
+            run_id: [int] Number of the Monte Carlo run.
+            seed: [int] Random seed used to generate the noise.
+            traj: [Trajectory] Solved Monte Carlo trajectory.
+
+        """
+
+        self.run_id = run_id
+        self.seed = seed
+
+        self.los_mini_status = traj.los_mini_status
+        self.timing_res = traj.timing_res
+
+        # State vector and radiant
+        self.state_vect_mini = traj.state_vect_mini
+        self.radiant_eci_mini = traj.radiant_eci_mini
+        self.radiant_eq_mini = traj.radiant_eq_mini
+
+        # Velocities
+        self.v_init = traj.v_init
+        self.v_avg = traj.v_avg
+
+        # Beginning, ending and lowest points
+        self.rbeg_lat, self.rbeg_lon = traj.rbeg_lat, traj.rbeg_lon
+        self.rbeg_ele, self.rbeg_ele_wgs84 = traj.rbeg_ele, traj.rbeg_ele_wgs84
+        self.rend_lat, self.rend_lon = traj.rend_lat, traj.rend_lon
+        self.rend_ele, self.rend_ele_wgs84 = traj.rend_ele, traj.rend_ele_wgs84
+        self.htmin_lat, self.htmin_lon = traj.htmin_lat, traj.htmin_lon
+        self.htmin_ele, self.htmin_ele_wgs84 = traj.htmin_ele, traj.htmin_ele_wgs84
+
+        # Radiant and orbital elements
+        self.orbit = traj.orbit
+
+
+
+def mcNoiseTrajectory(bundle, seed):
+    """ Generate a trajectory object with noise-added observations from the given observation bundle. This
+        is the equivalent of one step of trajNoiseGenerator, but the noise is fully determined by the seed.
+
+    Arguments:
+        bundle: [MCObservationBundle] Observations and settings of the original trajectory.
+        seed: [int] Random seed used to generate the noise.
+
+    Return:
+        traj_mc: [Trajectory] Trajectory object with added noise.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    # Make a copy of the template trajectory object
+    traj_mc = copy.deepcopy(bundle.traj_template)
+
+    # Set the measurement type to alt/az
+    traj_mc.meastype = 2
+
+    # Reinitialize the observations with points sampled using a Gaussian kernel
+    for obs, jd_data, rhat, sigma in zip(bundle.observations, bundle.jd_data, bundle.meas_eci_los, \
+        bundle.sigma):
+
+        # Unit vectors pointing from the station to the meteor observation points in ECI coordinates
+        rhat = rhat/np.linalg.norm(rhat, axis=1)[:, np.newaxis]
+
+        # Add noise to simulated coordinates (taken over from Gural solver source)
+        zhat = np.array([0.0, 0.0, 1.0])
+        uhat = np.cross(rhat, zhat)
+        uhat /= np.linalg.norm(uhat, axis=1)[:, np.newaxis]
+        vhat = np.cross(uhat, rhat)
+        vhat /= np.linalg.norm(vhat, axis=1)[:, np.newaxis]
+
+        meas_eci_noise = rhat + rng.normal(0, sigma, size=(len(rhat), 1))*uhat \
+            + rng.normal(0, sigma, size=(len(rhat), 1))*vhat
+
+        # Normalize to unit vectors
+        meas_eci_noise /= np.linalg.norm(meas_eci_noise, axis=1)[:, np.newaxis]
+
+        # Calculate RA, Dec for the given points
+        ra = np.arctan2(meas_eci_noise[:, 1], meas_eci_noise[:, 0])%(2*np.pi)
+        dec = np.arcsin(meas_eci_noise[:, 2])
+
+        # Calculate azimuth and altitude of these direction vectors
+        azim_noise, elev_noise = raDec2AltAz_vect(ra, dec, jd_data, obs.lat, obs.lon)
+
+        # Fill in the new trajectory object - the time is assumed to be absolute
+        traj_mc.infillTrajectory(azim_noise, elev_noise, obs.time_data, obs.lat, obs.lon, \
+            obs.ele, station_id=obs.station_id, excluded_time=obs.excluded_time, \
+            ignore_list=obs.ignore_list, magnitudes=obs.magnitudes, fov_beg=obs.fov_beg, \
+            fov_end=obs.fov_end, obs_id=obs.obs_id, comment=obs.comment)
+
+
+    # Do not show plots or perform additional optimizations
+    traj_mc.verbose = False
+    traj_mc.estimate_timing_vel = True
+    traj_mc.filter_picks = False
+    traj_mc.show_plots = False
+    traj_mc.save_results = False
+
+    return traj_mc
+
+
+
+def solveMCBundle(bundle, seed):
+    """ Generate a noisy trajectory from the observation bundle and solve it.
+
+    Arguments:
+        bundle: [MCObservationBundle] Observations and settings of the original trajectory.
+        seed: [int] Random seed used to generate the noise.
+
+    Return:
+        traj_mc: [Trajectory] Solved Monte Carlo trajectory.
+    """
+
+    traj_mc = mcNoiseTrajectory(bundle, seed)
+
+    # The solver modifies the original observations, so a local copy needs to be used for every run
+    traj_mc.run(_mc_run=True, _orig_obs=copy.deepcopy(bundle.observations))
+
+    return traj_mc
+
+
+
+def mcSeedGenerator(base_seed):
+    """ Generate inputs for _MCTrajSolveCompact - run numbers and random seeds derived from the base seed.
+
+    Arguments:
+        base_seed: [int] Base random seed of all Monte Carlo runs.
+
+    Yields:
+        [counter, seed]: Number of the MC run and its random seed.
+    """
+
+    counter = 0
+
+    while True:
+
+        yield [counter, int(np.random.SeedSequence([base_seed, counter]).generate_state(1)[0])]
+
+        counter += 1
+
+
+# Observation bundle used by the Monte Carlo worker processes, set by _initMCWorker
+_MC_BUNDLE = None
+
+def _initMCWorker(bundle):
+    """ Internal function. Stores the observation bundle in the worker process. """
+
+    global _MC_BUNDLE
+
+    _MC_BUNDLE = bundle
+
+
+
 def checkMCTrajectories(mc_results, timing_res=np.inf, geometric_uncert=False):
     """ Filter out MC computed trajectories and only return successful ones. 
     
@@ -1958,8 +2453,8 @@ def checkMCTrajectories(mc_results, timing_res=np.inf, geometric_uncert=False):
     mc_results = [mc_traj for mc_traj in mc_results if mc_traj.los_mini_status == True]
 
     # Reject those solutions for which the orbit could not be calculated
-    mc_results = [mc_traj for mc_traj in mc_results if (mc_traj.orbit.ra_g is not None) \
-        and (mc_traj.orbit.dec_g is not None)]
+    mc_results = [mc_traj for mc_traj in mc_results if (mc_traj.orbit is not None) \
+        and (mc_traj.orbit.ra_g is not None) and (mc_traj.orbit.dec_g is not None)]
 
     print("{:d} successful MC runs done...".format(len(mc_results)))
 
@@ -1992,8 +2487,32 @@ def _MCTrajSolve(params):
 
 
 
+def _MCTrajSolveCompact(params):
+    """ Internal function. Does a Monte Carlo run using the observation bundle stored in the worker process
+        by _initMCWorker. Used as a function for parallelization.
+
+    Arguments:
+        params: [list]
+            - i: [int] Number of MC run to be printed out.
+            - seed: [int] Random seed used to generate the noise.
+
+    Return:
+        [MCResult] Compact record of the MC solution.
+
+    """
+
+    i, seed = params
+
+    print('Run No.', i + 1)
+
+    traj = solveMCBundle(_MC_BUNDLE, seed)
+
+    return MCResult(i, seed, traj)
+
+
+
 def monteCarloTrajectory(traj, mc_runs=None, mc_pick_multiplier=1, noise_sigma=1, geometric_uncert=False, \
-    plot_results=True, mc_cores=None, max_runs=None):
+    plot_results=True, mc_cores=None, max_runs=None, compact=True, pool=None):
     """ Estimates uncertanty in the trajectory solution by doing Monte Carlo runs. The MC runs are done 
         in parallel on all available computer cores.
 
@@ -2016,6 +2535,12 @@ def monteCarloTrajectory(traj, mc_runs=None, mc_pick_multiplier=1, noise_sigma=1
         mc_cores: [int] Number of CPU cores to use for Monte Carlo parallel procesing. None by default,
             which means that all available cores will be used.
         max_runs: [int] Maximum number of runs. None by default, which will limit the runs to 10x req_num.
+        compact: [bool] If True (default), the observations are sent to every worker process only once and 
+            the workers return compact MCResult records instead of full trajectories. Only the best 
+            trajectory is reconstructed in full. If False, a full copy of the trajectory is sent to and 
+            returned from the workers for every run.
+        pool: [PersistentPool] A persistent pool of worker processes to use. None by default, in which case
+            a new pool with mc_cores processes is started.
     """
 
 
@@ -2038,14 +2563,29 @@ def monteCarloTrajectory(traj, mc_runs=None, mc_pick_multiplier=1, noise_sigma=1
     print("Doing", mc_runs, "successful Monte Carlo runs...")
 
 
-    # Init the trajectory noise generator
-    traj_generator = trajNoiseGenerator(traj, noise_sigma)
+    if compact:
+
+        # Pack the observations which will be sent to every worker only once
+        mc_bundle = MCObservationBundle(traj, noise_sigma)
+
+        # Init the generator of random seeds, the noise is generated in the workers
+        traj_generator = mcSeedGenerator(np.random.randint(0, 2**31 - 1))
+        worker_func = _MCTrajSolveCompact
+        pool_kwargs = {"initializer": _initMCWorker, "initargs": (mc_bundle,)}
+
+    else:
+
+        # Init the trajectory noise generator
+        traj_generator = trajNoiseGenerator(traj, noise_sigma)
+        worker_func = _MCTrajSolve
+        pool_kwargs = {}
 
     
     # Run the MC solutions
     results_check_kwagrs = {"timing_res": traj.timing_res, "geometric_uncert": geometric_uncert}
-    mc_results = parallelComputeGenerator(traj_generator, _MCTrajSolve, checkMCTrajectories, mc_runs, \
-        results_check_kwagrs=results_check_kwagrs, n_proc=mc_cores, max_runs=max_runs)
+    mc_results = parallelComputeGenerator(traj_generator, worker_func, checkMCTrajectories, mc_runs, \
+        results_check_kwagrs=results_check_kwagrs, n_proc=mc_cores, max_runs=max_runs, pool=pool, \
+        **pool_kwargs)
 
 
     # If there are no MC runs which were successful, recompute using geometric uncertainties
@@ -2055,8 +2595,9 @@ def monteCarloTrajectory(traj, mc_runs=None, mc_pick_multiplier=1, noise_sigma=1
         # Run the MC solutions
         geometric_uncert = True
         results_check_kwagrs["geometric_uncert"] = geometric_uncert
-        mc_results = parallelComputeGenerator(traj_generator, _MCTrajSolve, checkMCTrajectories, mc_runs, \
-            results_check_kwagrs=results_check_kwagrs, n_proc=mc_cores, max_runs=max_runs)
+        mc_results = parallelComputeGenerator(traj_generator, worker_func, checkMCTrajectories, mc_runs, \
+            results_check_kwagrs=results_check_kwagrs, n_proc=mc_cores, max_runs=max_runs, pool=pool, \
+            **pool_kwargs)
 
 
     # Add the original trajectory in the Monte Carlo results, if it is the one which has the best length match
@@ -2080,6 +2621,10 @@ def monteCarloTrajectory(traj, mc_runs=None, mc_pick_multiplier=1, noise_sigma=1
     # Choose the best trajectory
     traj_best = mc_results[best_traj_ind]
 
+    # Reconstruct the full best trajectory from its random seed if only a compact record was returned
+    if isinstance(traj_best, MCResult):
+        traj_best = solveMCBundle(mc_bundle, traj_best.seed)
+
     # Assign geometric uncertainty flag, if it was changed
     traj_best.geometric_uncert = geometric_uncert
 
@@ -2392,6 +2937,56 @@ def applyGravityDrop(eci_coord, t, r0, gravity_factor, vz):
 
 
 
+def applyGravityDrop_vect(eci_coords, t, r0, gravity_factor, vz):
+    """ Vectorized version of applyGravityDrop. Applies the gravity drop to many points at once.
+
+    Arguments:
+        eci_coords: [Nx3 ndarray] (x, y, z) ECI coordinates of the meteor at the given times t (meters).
+        t: [ndarray] Times of meteor since the beginning of the trajectory.
+        r0: [ndarray] Distances from the centre of the Earth used to compute the gravitational acceleration.
+        gravity_factor: [float] Factor by which the gravity drop will be multiplied.
+        vz: [float] Vertical component of the meteor's velocity.
+
+    Return:
+        [Nx3 ndarray] ECI coordinates corrected for the gravity drop.
+
+    """
+
+    # Define the mass of the Earth
+    earth_mass = 5.9722e24 # kg
+
+    # Determing the sign of the initial time
+    time_sign = np.sign(t)
+
+    # Make sure r0 is not 0
+    r0 = np.where(r0 == 0, 1e-10, r0)
+
+    # The derived drop function does not work for small vz's, thus the classical drop function is used
+    if abs(vz) < 100:
+
+        # Calculate gravitational acceleration at given ECI coordinates
+        g = G*earth_mass/r0**2
+
+        # Calculate the amount of gravity drop from a straight trajectory
+        drop = time_sign*(1.0/2)*g*t**2
+
+    else:
+
+        # Compute the denominator and make sure it's not 0
+        denominator = r0 + vz*t
+        denominator = np.where(denominator == 0, 1e-10, denominator)
+
+        # Compute the drop using a drop model with a constant vertical velocity
+        drop = time_sign*(G*earth_mass/vz**2)*(r0/denominator + np.log(denominator/r0) - 1)
+
+
+    # Apply gravity drop to ECI coordinates
+    eci_mag = np.linalg.norm(eci_coords, axis=1)
+
+    return eci_coords - (gravity_factor*drop/eci_mag)[:, np.newaxis]*eci_coords
+
+
+
 def generateTrajectoryID(traj):
     """ Given trajectory parameters, generate a unique trajectory ID. 
     
@@ -2451,7 +3046,8 @@ class Trajectory(object):
         mc_noise_std=1.0, geometric_uncert=False, filter_picks=True, calc_orbit=True, show_plots=True, \
         show_jacchia=False, save_results=True, gravity_correction=True, gravity_factor=1.0, \
         plot_all_spatial_residuals=False, plot_file_type='png', traj_id=None, reject_n_sigma_outliers=3, 
-        mc_cores=None, fixed_times=None, mc_runs_max=None, enable_OSM_plot=False):
+        mc_cores=None, fixed_times=None, mc_runs_max=None, enable_OSM_plot=False, mc_compact=True, \
+        mc_shared_pool=False):
         """ Init the Ceplecha trajectory solver.
 
         Arguments:
@@ -2512,6 +3108,12 @@ class Trajectory(object):
             mc_runs_max: [int] Maximum number of Monte Carlo runs. None by default, which will limit the runs
                 to 10x req_num.
             enable_OSM_plot: [bool] plot the ground track using OS maps as well as the default 
+            mc_compact: [bool] Send the observations to the Monte Carlo workers only once and return compact
+                results from them, instead of copying the whole trajectory object for every run. True by
+                default.
+            mc_shared_pool: [bool] Run the Monte Carlo runs on a persistent pool of worker processes which is
+                shared by all trajectories solved in this process, instead of starting new processes for every
+                trajectory. False by default.
 
         """
 
@@ -2641,6 +3243,12 @@ class Trajectory(object):
         # Number of CPU cores to be used for MC
         self.mc_cores = mc_cores
 
+        # Use compact Monte Carlo worker inputs and outputs
+        self.mc_compact = mc_compact
+
+        # Reuse a persistent pool of Monte Carlo worker processes
+        self.mc_shared_pool = mc_shared_pool
+
         ######################################################################################################
 
 
@@ -2956,24 +3564,10 @@ class Trajectory(object):
         # Go though observations from all stations
         for obs in observations:
 
-            # Init empty lists for residuals
-            obs.h_residuals = []
-            obs.v_residuals = []
-
-            # Go through all individual position measurement from each site
-            for t, jd, stat, meas in zip(obs.time_data, obs.JD_data, obs.stat_eci_los, obs.meas_eci_los):
-
-                # Calculate horizontal and vertical residuals
-                hres, vres = calcSpatialResidual(self.jdt_ref, jd, state_vect, radiant_eci, stat, meas, \
-                    gravity=self.gravity_correction, gravity_factor=self.gravity_factor, v0z=self.v0z)
-
-                # Add residuals to the residual list
-                obs.h_residuals.append(hres)
-                obs.v_residuals.append(vres)
-
-            # Convert residual lists to numpy arrays
-            obs.h_residuals = np.array(obs.h_residuals)
-            obs.v_residuals = np.array(obs.v_residuals)
+            # Calculate horizontal and vertical residuals of all points from each site at once
+            obs.h_residuals, obs.v_residuals = calcSpatialResidual_vect(self.jdt_ref, obs.JD_data, \
+                state_vect, radiant_eci, obs.stat_eci_los, obs.meas_eci_los, \
+                gravity=self.gravity_correction, gravity_factor=self.gravity_factor, v0z=self.v0z)
 
             # Calculate RMSD of both residuals
             obs.h_res_rms = RMSD(obs.h_residuals[obs.ignore_list == 0])
@@ -6283,9 +6877,13 @@ class Trajectory(object):
         ### LEAST SQUARES SOLUTION ###
         ######################################################################################################
 
+        # Pack all lines of sight used in the minimization into arrays, so the cost function does not have
+        #   to loop over individual points
+        los_arrays = LoSMeasurementArrays(self.observations, weights=weights)
+
         # Calculate the initial sum and angles deviating from the radiant line
-        angle_sum = angleSumMeasurements2Line(self.observations, self.state_vect, \
-             self.best_conv_inter.radiant_eci, weights=weights, \
+        angle_sum = angleSumMeasurements2Line_vect(los_arrays, self.state_vect, \
+             self.best_conv_inter.radiant_eci, \
              gravity=(_rerun_timing and self.gravity_correction), gravity_factor=self.gravity_factor, 
              v0z=self.v0z
              )
@@ -6299,7 +6897,7 @@ class Trajectory(object):
 
         # Perform the minimization of angle deviations. The gravity will only be compansated for after the
         #   initial estimate of timing differences
-        minimize_solution = scipy.optimize.minimize(minimizeAngleCost, p0, args=(self.observations, weights, 
+        minimize_solution = scipy.optimize.minimize(minimizeAngleCost_vect, p0, args=(los_arrays, 
             (_rerun_timing and self.gravity_correction), self.gravity_factor, self.v0z), method="Nelder-Mead")
 
         # NOTE
@@ -6327,8 +6925,8 @@ class Trajectory(object):
 
             print('BOUNDS:', bounds)
             print('p0:', p0)
-            minimize_solution = scipy.optimize.minimize(minimizeAngleCost, p0, args=(self.observations, \
-                weights, (_rerun_timing and self.gravity_correction), self.gravity_factor, self.v0z), 
+            minimize_solution = scipy.optimize.minimize(minimizeAngleCost_vect, p0, args=(los_arrays, \
+                (_rerun_timing and self.gravity_correction), self.gravity_factor, self.v0z), 
                 bounds=bounds, method='SLSQP')
 
 
@@ -6714,7 +7312,9 @@ class Trajectory(object):
             traj_best, uncertainties = monteCarloTrajectory(self, mc_runs=self.mc_runs, \
                 mc_pick_multiplier=self.mc_pick_multiplier, noise_sigma=self.mc_noise_std, \
                 geometric_uncert=self.geometric_uncert, plot_results=self.save_results, \
-                mc_cores=self.mc_cores, max_runs=self.mc_runs_max)
+                mc_cores=self.mc_cores, max_runs=self.mc_runs_max, \
+                compact=getattr(self, 'mc_compact', True), \
+                pool=(getSharedPool(self.mc_cores) if getattr(self, 'mc_shared_pool', False) else None))
 
 
             ### Save uncertainties to the trajectory object ###
@@ -2,9 +2,12 @@
 
 from __future__ import print_function, division, absolute_import
 
+import math
+import os
+import tempfile
+
 import numpy as np
 import matplotlib.pyplot as plt
-import scipy.optimize
 
 from wmpl.PythonNRLMSISE00.nrlmsise_00_header import *
 from wmpl.PythonNRLMSISE00.nrlmsise_00 import *
@@ -70,7 +73,28 @@ def atmDensPoly(ht, dens_co):
 
 
 
-def fitAtmPoly(lat, lon, height_min, height_max, jd):
+def fitAtmPolyLog(height_arr, atm_densities_log):
+    """ Fit the 7th order density polynomial (see atmDensPoly) on the given log10 densities. The polynomial is
+        linear in the coefficients, so the least squares solution is computed directly.
+
+    Arguments:
+        height_arr: [ndarray] Heights in meters.
+        atm_densities_log: [ndarray] Log10 of the atmosphere mass densities (kg/m^3).
+
+    Return:
+        dens_co: [ndarray] Coeffs for the 7th order polynomial.
+    """
+
+    # Heights are scaled to megameters the same way as in atmDensPoly
+    design_matrix = np.vander(np.array(height_arr)/1e6, 7, increasing=True)
+
+    dens_co, _, _, _ = np.linalg.lstsq(design_matrix, atm_densities_log, rcond=None)
+
+    return dens_co
+
+
+
+def fitAtmPoly(lat, lon, height_min, height_max, jd, cache_dir=None):
     """ Fits a 7th order polynomial on the atmosphere mass density profile at the given location, time, and 
         for the given height range.
 
@@ -81,44 +105,195 @@ def fitAtmPoly(lat, lon, height_min, height_max, jd):
         height_max: [float] Maximum height in meters. E.g. 120000 or 180000 are good values.
         jd: [float] Julian date.
 
+    Keyword arguments:
+        cache_dir: [str] If given, the density profile is taken from a cached AtmosphereModel table in this
+            directory (see AtmosphereModel for the precision of the cached tables). None by default.
+
     Return:
         dens_co: [list] Coeffs for the 7th order polynomial.
     """
 
+    # Use the cached density table
+    if cache_dir is not None:
+        atm_model = AtmosphereModel(lat, lon, jd, height_min=min(height_min, AtmosphereModel.HEIGHT_MIN), \
+            height_max=max(height_max, AtmosphereModel.HEIGHT_MAX), cache_dir=cache_dir)
+
+        return atm_model.fitPoly(height_min, height_max)
+
+
     # Generate a height array
     height_arr = np.linspace(height_min, height_max, 200)
 
     # Get atmosphere densities from NRLMSISE-00 (use log values for the fit)
-    atm_densities = np.array([getAtmDensity(lat, lon, ht, jd) for ht in height_arr])
+    atm_densities = getAtmDensityBatch(lat, lon, height_arr, jd)
     atm_densities_log = np.log10(atm_densities)
 
-
-    def atmDensPolyLog(height_arr, *dens_co):
-        return np.log10(atmDensPoly(height_arr, dens_co))
-
     # Fit the 7th order polynomial
-    dens_co, _ = scipy.optimize.curve_fit(atmDensPolyLog, height_arr, atm_densities_log, \
-        p0=np.zeros(7), maxfev=10000)
+    dens_co = fitAtmPolyLog(height_arr, atm_densities_log)
 
     return dens_co
 
 
+
+class AtmosphereModel(object):
     
+    # Default height range of the table (m)
+    HEIGHT_MIN = 20000
+    HEIGHT_MAX = 200000
+
+    def __init__(self, lat, lon, jd, height_min=None, height_max=None, height_step=500, cache_dir=None, 
+        jd_resolution=1.0, latlon_resolution=0.01):
+        """ NRLMSISE-00 atmosphere mass density at one location and time, tabulated once as log10 densities on
+            a regular height grid. Densities are interpolated in the table and the table can be used to fit
+            the density polynomial used by the simulations (see fitPoly).
+
+        If the cache directory is given, the tables are stored on disk and reused, keyed by the location and 
+        the day. To make the cached tables independent of the order of calls, the location is rounded to
+        latlon_resolution and the time to jd_resolution, and the table is computed at the rounded values. 
+        Note that this ignores the change of the density with the local time during the day, use a smaller
+        jd_resolution (e.g. 1/24) if this is important.
+
+        Arguments:
+            lat: [float] Latitude in radians.
+            lon: [float] Longitude in radians.
+            jd: [float] Julian date.
+
+        Keyword arguments:
+            height_min: [float] Bottom of the table (m). HEIGHT_MIN by default.
+            height_max: [float] Top of the table (m). HEIGHT_MAX by default.
+            height_step: [float] Height step of the table (m). 500 by default.
+            cache_dir: [str] Directory with cached tables. None by default, in which case nothing is cached
+                and the exact location and time are used.
+            jd_resolution: [float] Time resolution of cached tables (days). 1.0 by default.
+            latlon_resolution: [float] Resolution of the location of cached tables (degrees). 0.01 by 
+                default.
+        """
+
+        if height_min is None:
+            height_min = self.HEIGHT_MIN
+
+        if height_max is None:
+            height_max = self.HEIGHT_MAX
+
+        # Round the location and time of cached tables
+        if cache_dir is not None:
+            lat = np.radians(latlon_resolution*round(np.degrees(lat)/latlon_resolution))
+            lon = np.radians(latlon_resolution*round(np.degrees(lon)/latlon_resolution))
+            jd = jd_resolution*(math.floor(jd/jd_resolution) + 0.5)
+
+        self.lat = lat
+        self.lon = lon
+        self.jd = jd
+
+        self.heights = np.arange(height_min, height_max + height_step/2, height_step)
+
+        self.cache_dir = cache_dir
+
+
+        self.log_dens = None
+
+        # Load the cached table
+        if cache_dir is not None:
+            self.log_dens = self.loadCache()
+
+        # Compute the table
+        if self.log_dens is None:
+            self.log_dens = np.log10(getAtmDensityBatch(self.lat, self.lon, self.heights, self.jd))
+
+            if cache_dir is not None:
+                self.saveCache()
+
+
+    def cacheFilePath(self):
+        """ Path of the cached table, the name is made from the location, time and the height grid. """
+
+        file_name = "atm_dens_{:+.4f}_{:+.4f}_{:.5f}_{:d}_{:d}_{:d}.npy".format(np.degrees(self.lat), \
+            np.degrees(self.lon), self.jd, int(self.heights[0]), int(self.heights[-1]), len(self.heights))
+
+        return os.path.join(self.cache_dir, file_name)
+
+
+    def loadCache(self):
+        """ Load the table from the cache. Returns None if it's not cached. """
+
+        file_path = self.cacheFilePath()
+
+        if not os.path.isfile(file_path):
+            return None
+
+        try:
+            log_dens = np.load(file_path)
+        except (OSError, ValueError):
+            return None
+
+        if len(log_dens) != len(self.heights):
+            return None
+
+        return log_dens
+
+
+    def saveCache(self):
+        """ Save the table to the cache. """
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Write to a temporary file first so other processes never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, self.log_dens)
+
+        os.replace(tmp_path, self.cacheFilePath())
+
+
+    def density(self, ht):
+        """ Atmosphere mass density at the given height(s) in kg/m^3, interpolated in the table.
+
+        Arguments:
+            ht: [float or ndarray] Height above sea level (m).
+
+        Return:
+            atm_dens: [float or ndarray] Atmosphere mass density (kg/m^3).
+        """
+
+        return 10**np.interp(ht, self.heights, self.log_dens)
+
+
+    def fitPoly(self, height_min, height_max, n_points=200):
+        """ Fit the 7th order density polynomial on the table in the given height range (see fitAtmPoly).
+
+        Arguments:
+            height_min: [float] Minimum height in meters.
+            height_max: [float] Maximum height in meters.
+
+        Keyword arguments:
+            n_points: [int] Number of heights used for the fit. 200 by default.
+
+        Return:
+            dens_co: [ndarray] Coeffs for the 7th order polynomial.
+        """
+
+        height_arr = np.linspace(height_min, height_max, n_points)
+
+        return fitAtmPolyLog(height_arr, np.interp(height_arr, self.heights, self.log_dens))
 
 
-def getAtmDensity(lat, lon, height, jd):
-    """ For the given heights, returns the atmospheric density from NRLMSISE-00 model. 
+    
+
+
+def nrlmsiseInput(lat, lon, jd):
+    """ Prepare the NRLMSISE-00 inputs for the given location and time. Only the altitude in the returned 
+        input has to be set before evaluating the model.
     
     More info: https://github.com/magnific0/nrlmsise-00/blob/master/nrlmsise-00.h
 
     Arguments:
         lat: [float] Latitude in radians.
         lon: [float] Longitude in radians.
-        height: [float] Height in meters.
         jd: [float] Julian date.
 
     Return:
-        [float] Atmosphere density in kg/m^3.
+        (inp, flags): [tuple] NRLMSISE-00 input and flags.
 
     """
 
@@ -152,9 +327,6 @@ def getAtmDensity(lat, lon, height, jd):
     # Seconds in a day
     inp.sec = sec
 
-    # Altitude in kilometers
-    inp.alt = height/1000.0
-
     # Geodetic latitude (deg)
     inp.g_lat = np.degrees(lat)
 
@@ -205,6 +377,30 @@ def getAtmDensity(lat, lon, height, jd):
     for i in range(7):
         aph.a[i] = 100
 
+    return inp, flags
+
+
+
+def getAtmDensity(lat, lon, height, jd):
+    """ For the given heights, returns the atmospheric density from NRLMSISE-00 model. 
+    
+    More info: https://github.com/magnific0/nrlmsise-00/blob/master/nrlmsise-00.h
+
+    Arguments:
+        lat: [float] Latitude in radians.
+        lon: [float] Longitude in radians.
+        height: [float] Height in meters.
+        jd: [float] Julian date.
+
+    Return:
+        [float] Atmosphere density in kg/m^3.
+
+    """
+
+    inp, flags = nrlmsiseInput(lat, lon, jd)
+
+    # Altitude in kilometers
+    inp.alt = height/1000.0
 
     # Init the output array
     # OUTPUT VARIABLES:
@@ -233,6 +429,41 @@ def getAtmDensity(lat, lon, height, jd):
 
 
 
+def getAtmDensityBatch(lat, lon, heights, jd):
+    """ For the given heights, returns the atmospheric densities from NRLMSISE-00 model. The model inputs 
+        which don't depend on height are only computed once.
+
+    Arguments:
+        lat: [float] Latitude in radians.
+        lon: [float] Longitude in radians.
+        heights: [ndarray] Heights in meters.
+        jd: [float] Julian date.
+
+    Return:
+        [ndarray] Atmosphere densities in kg/m^3.
+
+    """
+
+    inp, flags = nrlmsiseInput(lat, lon, jd)
+
+    atm_densities = np.zeros(len(heights))
+
+    for i, height in enumerate(heights):
+
+        # Altitude in kilometers
+        inp.alt = height/1000.0
+
+        # Evaluate the atmosphere with the given parameters
+        out = nrlmsise_output()
+        gtd7(inp, flags, out)
+
+        # Get the total mass density
+        atm_densities[i] = out.d[5]
+
+    return atm_densities
+
+
+
 getAtmDensity_vect = np.vectorize(getAtmDensity, excluded=['jd'])
 
 
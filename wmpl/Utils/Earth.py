@@ -3,15 +3,55 @@
 from __future__ import print_function, division, absolute_import
 
 import os
+import threading
 import numpy as np
 import math
 from jplephem.spk import SPK
 
 import wmpl.Utils.TrajConversions
+from wmpl.Config import config
 from wmpl.Utils.Math import rotateVector
 
 
 
+# Opened JPL ephemeris files, keyed by the process ID and the file path. Every process opens its own handle,
+#   so the handles are never shared between forked processes
+_jpl_ephem_cache = {}
+_jpl_ephem_lock = threading.Lock()
+
+
+def loadJPLEphem(jpl_ephem_file=None):
+    """ Return the opened JPL ephemeris file. The file is opened only once per process and the handle is 
+        reused by all subsequent calls.
+
+    Keyword arguments:
+        jpl_ephem_file: [str] Path to the SPK file. None by default, in which case the file given in the
+            config will be used.
+
+    Return:
+        [SPK] SPK file opened with the jplephem library.
+    """
+
+    if jpl_ephem_file is None:
+        jpl_ephem_file = config.jpl_ephem_file
+
+    key = (os.getpid(), os.path.abspath(jpl_ephem_file))
+
+    with _jpl_ephem_lock:
+
+        if key not in _jpl_ephem_cache:
+
+            # Forget the handles inherited from the parent process
+            for cached_key in list(_jpl_ephem_cache.keys()):
+                if cached_key[0] != key[0]:
+                    del _jpl_ephem_cache[cached_key]
+
+            _jpl_ephem_cache[key] = SPK.open(jpl_ephem_file)
+
+        return _jpl_ephem_cache[key]
+
+
+
 class VSOP87:
 
     def __init__(self, file_name):
@@ -21,6 +61,13 @@ class VSOP87:
         # List of fitted parameters
         self.fit_list = []
 
+        # Contiguous coefficient arrays (one element per periodic term)
+        self.p = None
+        self.q = None
+        self.A = None
+        self.B = None
+        self.C = None
+
         self.loadVSOP87()
 
 
@@ -52,6 +99,20 @@ class VSOP87:
                 self.fit_list.append([p, q, A, B, C])
 
 
+        # Store the terms into contiguous arrays so all terms can be evaluated at once
+        fit_arr = np.array(self.fit_list, dtype=np.float64).reshape(-1, 5)
+
+        self.p = np.ascontiguousarray(fit_arr[:, 0].astype(np.int64))
+        self.q = np.ascontiguousarray(fit_arr[:, 1].astype(np.int64))
+        self.A = np.ascontiguousarray(fit_arr[:, 2])
+        self.B = np.ascontiguousarray(fit_arr[:, 3])
+        self.C = np.ascontiguousarray(fit_arr[:, 4])
+
+        # Matrix which sums the terms into the (L, B, r) coordinates
+        self.coord_M = np.zeros((len(self.p), 3))
+        self.coord_M[np.arange(len(self.p)), self.p] = 1.0
+
+
 
 
 def calcEarthEclipticCoordVSOP(jd, vsop_data):
@@ -61,72 +122,80 @@ def calcEarthEclipticCoordVSOP(jd, vsop_data):
         epoch of date.
 
     Arguments:
-        jd: [float] Julian date
+        jd: [float or ndarray] Julian date, or an array of Julian dates
         vsop_data: [VSOP87 object] loaded VSOP87 data
 
     Return:
-        L, B, r_au: [tuple of floats]
+        L, B, r_au: [tuple of floats or ndarrays]
             L - ecliptic longitude in radians
             B - ecliptic latitude in radians
             r_au - distante from the Earth to the Sun in AU
     """
 
-    T = (jd - wmpl.Utils.TrajConversions.J2000_JD.days)/365250.0
-
-    pos = np.zeros(3)
-    P = np.zeros(6)
+    T = (np.asarray(jd, dtype=np.float64) - wmpl.Utils.TrajConversions.J2000_JD.days)/365250.0
 
-    # Init term degrees
-    for n in range(6):
-        P[n] = T**n
+    # Evaluate all periodic terms for all times at once (the time is along the first axis) and sum the terms
+    #   into the coordinates. The dates are processed in chunks to limit the size of the (dates x terms) matrix
+    T_flat = T.ravel()
+    pos = np.empty((len(T_flat), 3))
+    chunk_size = 1024
+    for i in range(0, len(T_flat), chunk_size):
 
-    # Calculate coordinates
-    for fit in vsop_data.fit_list:
-
-        p, q, A, B, C = fit
-
-        pos[p] += P[q]*A*np.cos(B + C*T)
+        T_col = T_flat[i:i + chunk_size].reshape(-1, 1)
+        terms = vsop_data.A*(T_col**vsop_data.q)*np.cos(vsop_data.B + vsop_data.C*T_col)
 
+        pos[i:i + chunk_size] = np.dot(terms, vsop_data.coord_M)
 
     # Unpack calculated values
-    L, B, r_au = pos
+    L, B, r_au = np.moveaxis(pos.reshape(T.shape + (3,)), -1, 0)
 
     # Wrap the ecliptic longitude to 2 pi
     L = L%(2*np.pi)
 
+    # Return floats for scalar inputs
+    if T.ndim == 0:
+        L, B, r_au = float(L), float(B), float(r_au)
+
 
     return L, B, r_au
 
 
 
 
-def calcEarthRectangularCoordJPL(jd, jpl_data, sun_centre_origin=False):
+def calcEarthRectangularCoordJPL(jd, jpl_data=None, sun_centre_origin=False):
     """ Calculate the ecliptic rectangular coordinates of the Earth at the given Julian date. Epoch is J2000,
         the returned units are in kilometers. The coordinate are calculated using DE430 ephemerids. The
         centre of the coordinate system is the Solar system barycentre, unless otherwise specified.
 
     Arguments:
-        jd: [float] Julian date
-        jpl_data: [?] SPK loaded with jplephem library
+        jd: [float or ndarray] Julian date. If an array is given, all dates are evaluated at once.
 
     Keyword arguments:
+        jpl_data: [SPK] SPK loaded with jplephem library. None by default, in which case the cached 
+            ephemeris file from the config will be used (see loadJPLEphem).
         sun_centre_origin: [bool] If True, the origin of the coordinate system will be in the Sun centre. 
             If False (default), the origin will be in the Solar system barycentre.
 
     Return:
         position, velocity: [tuple of ndarrays] position and velocity of Earth in kilometers and km/s, in 
-            ecliptic rectangular cordinates, in J2000.0 epoch.
+            ecliptic rectangular cordinates, in J2000.0 epoch. If an array of Julian dates is given, the
+            arrays have the shape (N, 3).
 
     """
 
+    if jpl_data is None:
+        jpl_data = loadJPLEphem()
+
+    jd_arr = np.asarray(jd, dtype=np.float64)
+
     # Calculate the position and the velocity of the Earth-Moon barycentre system with respect to the Solar System Barycentre
-    position_bary, velocity_bary = jpl_data[0, 3].compute_and_differentiate(jd)
+    position_bary, velocity_bary = jpl_data[0, 3].compute_and_differentiate(jd_arr)
 
     # Calculate the position of the Sun with respect to the Solar System Barycentre
-    position_sun, velocity_sun = jpl_data[0, 10].compute_and_differentiate(jd)
+    position_sun, velocity_sun = jpl_data[0, 10].compute_and_differentiate(jd_arr)
 
     # Calculate the position and the velocity of the Earth with respect to the Earth-Moon barycentre
-    position_earth, velocity_earth = jpl_data[3, 399].compute_and_differentiate(jd)
+    position_earth, velocity_earth = jpl_data[3, 399].compute_and_differentiate(jd_arr)
 
 
     # Origin in the centre of mass of the Sun
@@ -149,17 +218,37 @@ def calcEarthRectangularCoordJPL(jd, jpl_data, sun_centre_origin=False):
         velocity = (velocity_bary + velocity_earth)/86400.0
 
 
-    # Rotate the position to the ecliptic reference frame (from the Earth equator reference frame)
-    position = rotateVector(position, np.array([1.0, 0.0, 0.0]), -wmpl.Utils.TrajConversions.J2000_OBLIQUITY)
+    # Rotate the position and the velocity to the ecliptic reference frame (from the Earth equator reference
+    #   frame)
+    rot_M = _eclipticRotationMatrix()
+    position = np.dot(rot_M, position)
+    velocity = np.dot(rot_M, velocity)
 
-    # Rotate the velocity vector to the ecliptic reference frame (from the Earth equator reference frame)
-    velocity = rotateVector(velocity, np.array([1.0, 0.0, 0.0]), -wmpl.Utils.TrajConversions.J2000_OBLIQUITY)
+    # Return arrays of (x, y, z) vectors if multiple dates were given
+    if jd_arr.ndim > 0:
+        position = position.T
+        velocity = velocity.T
 
     # Return the position and the velocity of the Earth with respect to the Sun
     return position, velocity
 
 
 
+_ecliptic_rot_M = None
+
+def _eclipticRotationMatrix():
+    """ Internal function. Return the matrix rotating the equatorial J2000 frame to the ecliptic frame. """
+
+    global _ecliptic_rot_M
+
+    if _ecliptic_rot_M is None:
+        _ecliptic_rot_M = rotateVector(np.eye(3), np.array([1.0, 0.0, 0.0]), \
+            -wmpl.Utils.TrajConversions.J2000_OBLIQUITY)
+
+    return _ecliptic_rot_M
+
+
+
 
 def calcNutationComponents(jd_dyn):
     """ Calculate Earth's nutation components from the given Julian date.
@@ -481,6 +481,65 @@ def findClosestPoints(P, u, Q, v):
     return S, T, d
 
 
+def findClosestPoints_vect(P, u, Q, v):
+    """Vectorized version of findClosestPoints. Calculates closest points of approach between many pairs
+        of lines at once.
+
+    Arguments:
+        P: [Nx3 ndarray] position coordinates of the 1st observers
+        u: [Nx3 ndarray] 1st observers' direction vectors
+        Q: [3 element vector or Nx3 ndarray] position coordinates of the 2nd observer(s)
+        v: [3 element vector or Nx3 ndarray] 2nd observer's direction vector(s)
+
+    Return:
+        S: [Nx3 ndarray] points on the 1st observers' LoS closest to the 2nd observers' LoS
+        T: [Nx3 ndarray] points on the 2nd observers' LoS closest to the 1st observers' LoS
+        d: [ndarray] distances between S and T
+
+    """
+
+    P = np.atleast_2d(P)
+    u = np.atleast_2d(u)
+    Q = np.atleast_2d(Q)
+    v = np.atleast_2d(v)
+
+    # Calculate the difference in position between the observers
+    w = P - Q
+
+    # Calculate cosines of angles between various vectors
+    a = np.einsum('ij,ij->i', u, u)
+    b = np.einsum('ij,ij->i', u, np.broadcast_to(v, u.shape))
+    c = np.einsum('ij,ij->i', v, v)
+    d = np.einsum('ij,ij->i', u, w)
+    e = np.einsum('ij,ij->i', np.broadcast_to(v, w.shape), w)
+
+    # Calculate the denominator
+    denom = a*c - b**2
+
+    # Lines which are parallel cannot have closest points computed, return infinities for them as
+    # findClosestPoints does
+    parallel = np.abs(denom) < 1e-10
+    denom = np.where(parallel, 1.0, denom)
+
+    sc = (b*e - c*d)/denom
+    tc = (a*e - b*d)/denom
+
+    # Points on the 1st observers' lines of sight closest to the LoS of the 2nd observers
+    S = P + u*sc[:, np.newaxis]
+
+    # Points on the 2nd observers' lines of sight closest to the LoS of the 1st observers
+    T = Q + v*tc[:, np.newaxis]
+
+    # Calculate the distance between S and T
+    dist = np.linalg.norm(S - T, axis=1)
+
+    S[parallel] = np.inf
+    T[parallel] = np.inf
+    dist[parallel] = np.inf
+
+    return S, T, dist
+
+
 def lineAndSphereIntersections(centre, radius, origin, direction):
     """Finds intersections between a sphere of given radius and coordiantes of the centre and a line
         defined by an origin and a direction vector.
@@ -1,16 +1,228 @@
 from __future__ import print_function
 
+import atexit
 import multiprocessing
+import os
+import pickle
+import queue
+import tempfile
+import uuid
 
 from contextlib import closing
 
 
 
+class _CancelledTask(object):
+    """ Marker returned by the persistent pool workers for tasks which were cancelled before they started. """
+    pass
+
+
+# State of the worker processes of persistent pools
+_worker_state = {"generation": None, "context_id": None}
+
+
+def _initPersistentWorker(generation):
+    """ Internal function. Initializes the worker process of a persistent pool. """
+
+    _worker_state["generation"] = generation
+    _worker_state["context_id"] = None
+
+
+def _persistentPoolTask(params):
+    """ Internal function. Runs one task in the worker of a persistent pool.
+
+    Arguments:
+        params: [tuple]
+            - generation: [int] Generation of the task. If the pool generation was changed since the task was 
+                submitted, the task was cancelled and it is skipped.
+            - context: [tuple] (context_id, context_path, initializer) or None. If given, the initializer is
+                run with the arguments pickled in the given file, once per worker for every new context.
+            - workerFunc: [function] Worker function.
+            - args: Arguments for the worker function.
+
+    Return:
+        Result of the worker function, or a _CancelledTask instance if the task was cancelled.
+    """
+
+    generation, context, workerFunc, args = params
+
+    # Skip tasks which were cancelled
+    if (_worker_state["generation"] is not None) and (_worker_state["generation"].value != generation):
+        return _CancelledTask()
+
+    # Initialize the worker with the context of this computation, if it was not already
+    if context is not None:
+
+        context_id, context_path, initializer = context
+
+        if _worker_state["context_id"] != context_id:
+
+            with open(context_path, 'rb') as f:
+                initargs = pickle.load(f)
+
+            initializer(*initargs)
+
+            _worker_state["context_id"] = context_id
+
+
+    return workerFunc(args)
+
+
+
+class PersistentPool(object):
+    def __init__(self, n_proc=None):
+        """ A long-lived pool of worker processes which can be reused for many parallel computations, so the
+            processes are not started for every computation. The processes are started on first use.
+
+        Keyword arguments:
+            n_proc: [int] Number of processes to use. None by default, in which case all available processors
+                will be used.
+
+        """
+
+        # If the number of processes was not given, use all available CPUs
+        if (n_proc is None) or (n_proc == -1):
+            n_proc = multiprocessing.cpu_count()
+
+        self.n_proc = n_proc
+
+        self._pool = None
+
+        # Generation counter shared with the workers, it is incremented to cancel all queued tasks
+        self.generation = None
+
+
+    @property
+    def pool(self):
+        """ Return the underlying multiprocessing pool, start it if it's not running. """
+
+        if self._pool is None:
+            self.generation = multiprocessing.Value('i', 0)
+            self._pool = multiprocessing.Pool(processes=self.n_proc, initializer=_initPersistentWorker, 
+                initargs=(self.generation,))
+
+        return self._pool
+
+
+    def cancelPending(self):
+        """ Cancel all tasks which were submitted but have not started yet. Tasks which are already running
+            will finish, but their results will be discarded.
+
+        Return:
+            [int] New generation of tasks.
+        """
+
+        if self.generation is None:
+            return 0
+
+        with self.generation.get_lock():
+            self.generation.value += 1
+
+        return self.generation.value
+
+
+    def submit(self, workerFunc, args, callback=None, error_callback=None, context=None):
+        """ Submit a task to the pool.
+
+        Arguments:
+            workerFunc: [function] Worker function, it will be called with args as the only argument.
+            args: Arguments for the worker function.
+
+        Keyword arguments:
+            callback: [function] Function called with the result when the task is done. None by default.
+            error_callback: [function] Function called with the exception if the task failed. None by 
+                default.
+            context: [tuple] (context_id, context_path, initializer) for initializing the worker. None by
+                default.
+
+        Return:
+            [AsyncResult]
+        """
+
+        pool = self.pool
+
+        return pool.apply_async(_persistentPoolTask, ((self.generation.value, context, workerFunc, args),),
+            callback=callback, error_callback=error_callback)
+
+
+    def close(self):
+        """ Stop all worker processes. """
+
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self.generation = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def __getstate__(self):
+        # Pools cannot be pickled, only their settings
+        return {"n_proc": self.n_proc, "_pool": None, "generation": None}
+
+
+
+# Persistent pools shared within the process, one per number of processes
+_shared_pools = {}
+
+def getSharedPool(n_proc=None):
+    """ Return a persistent pool shared by all callers in this process which ask for the same number of
+        processes. The pool is created on the first call and closed when the program exits.
+
+    Keyword arguments:
+        n_proc: [int] Number of processes to use. None by default, in which case all available processors
+            will be used.
+
+    Return:
+        [PersistentPool]
+    """
+
+    if (n_proc is None) or (n_proc == -1):
+        n_proc = multiprocessing.cpu_count()
+
+    if n_proc not in _shared_pools:
+        _shared_pools[n_proc] = PersistentPool(n_proc)
+
+    return _shared_pools[n_proc]
+
+
+def closeSharedPools():
+    """ Close all shared persistent pools. """
+
+    for pool in _shared_pools.values():
+        pool.close()
+
+    _shared_pools.clear()
+
+
+def resetSharedPools():
+    """ Forget the shared persistent pools without closing them. Used in child processes which inherited
+        the pools of the parent process, as the workers of those pools belong to the parent.
+    """
+
+    _shared_pools.clear()
+
+
+atexit.register(closeSharedPools)
+
+
+
 def parallelComputeGenerator(generator, workerFunc, resultsCheckFunc, req_num, n_proc=None, 
-    results_check_kwagrs=None, max_runs=None):
+    results_check_kwagrs=None, max_runs=None, initializer=None, initargs=(), pool=None):
     """ Given a generator which generates inputs for the workerFunc function, generate and process results 
         until req_num number of results satisfies the resultsCheckFunc function.
 
+        The results are collected as soon as individual runs are done and a new run is started immediately,
+        so all processes are kept busy until enough good results are found. The remaining runs are then
+        cancelled.
+
     Arguments:
         generator: [generator] Generator function which creates inputs for the workerFunc. It should
             return a list of arguments that will be fed into the workerFunc.
@@ -22,20 +234,20 @@ def parallelComputeGenerator(generator, workerFunc, resultsCheckFunc, req_num, n
 
     Keyword arguments:
         n_proc: [int] Number of processes to use. None by default, in which case all available processors
-            will be used.
+            will be used. Ignored if the pool is given.
         results_check_kwargs: [dict] Keyword arguments for resultsCheckFunc. None by default.
         max_runs: [int] Maximum number of runs. None by default, which will limit the runs to 10x req_num.
+        initializer: [function] Function called once in every worker process when it starts. Can be used
+            to send large data which is common to all inputs to the workers only once. None by default.
+        initargs: [tuple] Arguments for the initializer function.
+        pool: [PersistentPool] A persistent pool which will be used for the computation. None by default,
+            in which case a new pool is created and closed at the end.
 
     Return:
-        [list] A list of results.
+        [list] A list of results, ordered by the order in which the inputs were generated.
     """
 
 
-    # If the number of processes was not given, use all available CPUs
-    if (n_proc is None) or (n_proc == -1):
-        n_proc = multiprocessing.cpu_count()
-
-
     if results_check_kwagrs is None:
         results_check_kwagrs = {}
 
@@ -44,55 +256,117 @@ def parallelComputeGenerator(generator, workerFunc, resultsCheckFunc, req_num, n
         max_runs = 10*req_num
 
 
-    # Init the pool
-    with multiprocessing.Pool(processes=n_proc) as pool:
+    # Init a temporary pool which is closed at the end
+    close_pool = pool is None
+    if close_pool:
+        pool = PersistentPool(n_proc)
 
-        results = []
 
-        total_runs = 0
+    context = None
+    context_path = None
 
-        # Generate an initial input list
-        input_list = [next(generator) for i in range(req_num)]
+    try:
 
-        # Run the initial list
-        results = pool.map(workerFunc, input_list)
+        # Store the initializer arguments to a file which the workers will read once
+        if initializer is not None:
 
-        total_runs += len(input_list)
-            
-        # Only take good results
-        results = resultsCheckFunc(results, **results_check_kwagrs)
+            context_fd, context_path = tempfile.mkstemp(suffix='.pickle', prefix='wmpl_pool_')
+            with os.fdopen(context_fd, 'wb') as f:
+                pickle.dump(initargs, f, protocol=pickle.HIGHEST_PROTOCOL)
 
+            context = (uuid.uuid4().hex, context_path, initializer)
 
-        # If there are None, do not continue, as there is obviously a problem
-        if len(results) == 0:
-            print("No successful results after the initial run!")
-            return results
 
+        # Start a fresh generation of tasks
+        pool.cancelPending()
 
-        # Run the processing until a required number of good values is returned
-        while len(results) < req_num:
+        # Queue to which the results are pushed as they are done
+        results_queue = queue.Queue()
 
-            # Generate an input for processing
-            input_list = [next(generator) for i in range(n_proc)]
+        def _submit(run_index):
+            pool.submit(workerFunc, next(generator), context=context, \
+                callback=lambda result, run_index=run_index: results_queue.put((run_index, result, False)), \
+                error_callback=lambda err, run_index=run_index: results_queue.put((run_index, err, True)))
 
-            # Map the inputs
-            results_temp = pool.map(workerFunc, input_list)
 
-            total_runs += len(input_list)
+        # Keep the queue of the pool a bit longer than the number of processes so the workers never wait
+        max_in_flight = min(max_runs, max(req_num, 2*pool.n_proc))
 
-            # Only take good results
-            results += resultsCheckFunc(results_temp, **results_check_kwagrs)
+        results = []
+        total_runs = 0
+        done_runs = 0
+        generator_done = False
+
+        while True:
+
+            # Keep all processes busy until the maximum number of runs is reached
+            while (not generator_done) and (total_runs < max_runs) and (total_runs - done_runs < max_in_flight):
+
+                try:
+                    _submit(total_runs)
+                except StopIteration:
+                    generator_done = True
+                    break
 
-            # Check if the number of runs exceeded the maximum
-            if total_runs >= max_runs:
+                total_runs += 1
+
+
+            # Stop if there is nothing else to wait for
+            if done_runs >= total_runs:
                 print("Total runs exceeded! Stopping...")
                 break
 
-        # Make sure that there are no more results than needed
-        if len(results) > req_num:
-            results = results[:req_num]
 
-        return results
+            # Wait for the next result and take all others which are done
+            done_batch = [results_queue.get()]
+            while True:
+                try:
+                    done_batch.append(results_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            done_runs += len(done_batch)
+
+            # Only take good results
+            for run_index, result, failed in done_batch:
+
+                # Raise the errors from the workers
+                if failed:
+                    raise result
+
+                if not isinstance(result, _CancelledTask):
+                    if len(resultsCheckFunc([result], **results_check_kwagrs)):
+                        results.append((run_index, result))
+
+
+            # Stop when enough good results are collected
+            if len(results) >= req_num:
+                break
+
+            # If there are None after the number of required runs, do not continue, as there is obviously 
+            #   a problem
+            if (done_runs >= req_num) and (len(results) == 0):
+                print("No successful results after the initial run!")
+                break
+
+
+        # Cancel all remaining runs
+        pool.cancelPending()
+
+
+    finally:
+
+        if close_pool:
+            pool.close()
+
+        if context_path is not None:
+            os.remove(context_path)
+
+
+    # Sort the results by the order of the inputs and make sure that there are no more results than needed
+    results = [result for _, result in sorted(results, key=lambda x: x[0])][:req_num]
+
+    return results
 
 
 
@@ -103,7 +377,7 @@ def unpackDecorator(func):
     return dec
 
 
-def domainParallelizer(domain, function, cores=None, kwarg_dict=None):
+def domainParallelizer(domain, function, cores=None, kwarg_dict=None, pool=None):
     """ Runs N (cores) functions as separate processes with parameters given in the domain list.
 
     Arguments:
@@ -114,6 +388,8 @@ def domainParallelizer(domain, function, cores=None, kwarg_dict=None):
         cores: [int] Number of CPU cores, or number of parallel processes to run simultaneously. None by 
             default, in which case all available cores will be used.
         kwarg_dict: [dictionary] a dictionary of keyword arguments to be passed to the function, None by default
+        pool: [PersistentPool] A persistent pool which will be used instead of starting new processes. None 
+            by default.
 
     Return:
         results: [list] a list of function results
@@ -139,8 +415,17 @@ def domainParallelizer(domain, function, cores=None, kwarg_dict=None):
     results = []    
 
 
+    # Use the given persistent pool, do not close it at the end
+    if pool is not None:
+
+        job_list = [pool.pool.apply_async(function, args, kwarg_dict) for args in domain]
+
+        # Wait for all jobs to finish and extract the results
+        results = [job.get() for job in job_list]
+
+
     # Special case when running on only one core, run without multiprocessing
-    if cores == 1:
+    elif cores == 1:
         for args in domain:
             results.append(function(*args, **kwarg_dict))
 
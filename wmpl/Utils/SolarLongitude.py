@@ -5,12 +5,8 @@ from __future__ import print_function, division, absolute_import
 import datetime
 
 import numpy as np
-import scipy.optimize
 
-from jplephem.spk import SPK
-
-from wmpl.Config import config
-from wmpl.Utils.Earth import calcEarthRectangularCoordJPL
+from wmpl.Utils.Earth import calcEarthRectangularCoordJPL, loadJPLEphem
 from wmpl.Utils.TrajConversions import date2JD, jd2Date, datetime2JD
 
 
@@ -1219,43 +1215,99 @@ L5 = [
 
 
 
+def _vsopTermArrays():
+    """ Internal function. Stack the VSOP87 periodic terms into contiguous arrays. 
+
+    Return:
+        (A, B, C, power): [tuple of ndarrays] Amplitudes, phases, frequencies and the powers of time which 
+            multiply each term.
+    """
+
+    terms = [L0, L1, L2, L3, L4, L5]
+
+    coeffs = np.ascontiguousarray(np.vstack([np.array(L, dtype=np.float64) for L in terms]))
+    power = np.concatenate([np.full(len(L), i, dtype=np.int64) for i, L in enumerate(terms)])
+
+    return coeffs[:, 0].copy(), coeffs[:, 1].copy(), coeffs[:, 2].copy(), power
+
+
+# Contiguous VSOP87 coefficient arrays, initialized once on import
+VSOP_A, VSOP_B, VSOP_C, VSOP_POWER = _vsopTermArrays()
+
+# Maximum number of dates evaluated in one matrix expression
+VSOP_CHUNK_SIZE = 2048
+
+
+
 def jd2SolLonVSOP(jd):
     """ Convert the given Julian date to solar longitude using VSOP87, J2000.0 epoch.
 
     Source: From VSOP87B.ear, ftp://ftp.imcce.fr/pub/ephem/planets/vsop87/
 
     Arguments:
-        jd: [float] julian date
+        jd: [float or ndarray] julian date, or an array of Julian dates
 
     Return:
-        [float] solar longitude in radians, J2000.0 epoch
+        [float or ndarray] solar longitude in radians, J2000.0 epoch
 
     """
 
-    # Number of millennia since 2000
-    T = (jd - 2451545.0)/365250.0
-
-    terms = [L0, L1, L2, L3, L4, L5]
-    term_sizes = [len(L0), len(L1), len(L2), len(L3), len(L4), len(L5)]
+    jd = np.asarray(jd, dtype=np.float64)
 
-    # Calculate periodic terms
-    S = np.zeros(6)
-    for i, term_size in enumerate(term_sizes):
+    # Number of millennia since 2000
+    T = ((jd - 2451545.0)/365250.0).ravel()
 
-        L = terms[i]
-        S[i] = np.sum([L[p][0]*np.cos((L[p][1] + L[p][2]*T)%(2*np.pi)) for p in range(term_size)])
+    # Calculate all periodic terms at once, multiplied by the appropriate power of time, and sum them. The 
+    #   dates are processed in chunks to limit the size of the (dates x terms) matrix
+    L = np.empty_like(T)
+    for i in range(0, len(T), VSOP_CHUNK_SIZE):
 
+        T_chunk = T[i:i + VSOP_CHUNK_SIZE].reshape(-1, 1)
 
-    # Calculate the Solar longitude
-    L = np.pi
-    for i in range(6):
-        L += S[i]*(T**i)
+        L[i:i + VSOP_CHUNK_SIZE] = np.pi + np.sum(VSOP_A*(T_chunk**VSOP_POWER)\
+            *np.cos(VSOP_B + VSOP_C*T_chunk), axis=1)
 
     # Wrap the solar longitude to [0, 2pi] range
     L = L%(2*np.pi)
 
-    return L
+    # Return a float for scalar inputs
+    if jd.ndim == 0:
+        return float(L[0])
+
+    return L.reshape(jd.shape)
+
+
+
+
+# Steyaert (1991) periodic terms (amplitude in units of 1e-7 rad, phase in rad, frequency in rad/millennium)
+STEYAERT_A0 = np.array([334166, 3489, 350, 342, 314, 268, 234, 132, 127, 120, 99, 90, 86, 78, 75, 51, 49, 36, 
+    32, 28, 27, 24, 21, 21, 20, 16, 13, 13], dtype=np.float64)
+
+STEYAERT_B0 = np.array([4.669257, 4.6261, 2.744, 2.829, 3.628, 4.418, 6.135, 0.742, 2.037, 1.110, 5.233, 
+    2.045, 3.508, 1.179, 2.533, 4.58, 4.21, 2.92, 5.85, 1.90, 0.31, 0.34, 4.81, 1.87, 2.46, 0.83, 3.41, 1.08])
+
+STEYAERT_C0 = np.array([6283.07585, 12566.1517, 5753.385, 3.523, 77713.771, 7860.419, 3930.210, 11506.77, 
+    529.691, 1577.344, 5884.927, 26.298, 398.149, 5223.694, 5507.553, 18849.23, 775.52, 0.07, 11790.63, 
+    796.3, 10977.08, 5486.78, 2544.31, 5573.14, 6069.78, 213.3, 2942.46, 20.78])
 
+STEYAERT_A1 = np.array([20606, 430, 43], dtype=np.float64)
+STEYAERT_B1 = np.array([2.67823, 2.635, 1.59])
+STEYAERT_C1 = np.array([6283.07585, 12566.152, 3.52])
+
+STEYAERT_A2 = np.array([872, 29], dtype=np.float64)
+STEYAERT_B2 = np.array([1.073, 0.44])
+STEYAERT_C2 = np.array([6283.07585, 12566.15])
+
+STEYAERT_A3 = np.array([29], dtype=np.float64)
+STEYAERT_B3 = np.array([5.84])
+STEYAERT_C3 = np.array([6283.07585])
+
+# Stacked Steyaert terms with the power of time which multiplies each term
+STEYAERT_A = np.concatenate([STEYAERT_A0, STEYAERT_A1, STEYAERT_A2, STEYAERT_A3])
+STEYAERT_B = np.concatenate([STEYAERT_B0, STEYAERT_B1, STEYAERT_B2, STEYAERT_B3])
+STEYAERT_C = np.concatenate([STEYAERT_C0, STEYAERT_C1, STEYAERT_C2, STEYAERT_C3])
+STEYAERT_POWER = np.concatenate([np.full(len(A), i, dtype=np.int64) for i, A in \
+    enumerate([STEYAERT_A0, STEYAERT_A1, STEYAERT_A2, STEYAERT_A3])])
 
 
 
@@ -1266,58 +1318,38 @@ def jd2SolLonSteyaert(jd):
         Meteor Organization, 19, 31-34.
 
     Arguments:
-        jd: [float] julian date
+        jd: [float or ndarray] julian date, or an array of Julian dates
 
     Return:
-        [float] solar longitude in radians, J2000.0 epoch
+        [float or ndarray] solar longitude in radians, J2000.0 epoch
 
     """
 
-    # Define time constants
-    A0 = [334166, 3489, 350, 342, 314, 268, 234, 132, 127, 120, 99, 90, 86, 78, 75, 51, 49, 36, 32, 28, 27, 
-        24, 21, 21, 20, 16, 13, 13]
-
-    B0 = [4.669257, 4.6261, 2.744, 2.829, 3.628, 4.418, 6.135, 0.742, 2.037, 1.110, 5.233, 2.045, 3.508, 
-        1.179, 2.533, 4.58, 4.21, 2.92, 5.85, 1.90, 0.31, 0.34, 4.81, 1.87, 2.46, 0.83, 3.41, 1.08]
-
-    C0 = [6283.07585, 12566.1517, 5753.385, 3.523, 77713.771, 7860.419, 3930.210, 11506.77, 529.691, 1577.344, 
-        5884.927, 26.298, 398.149, 5223.694, 5507.553, 18849.23, 775.52, 0.07, 11790.63, 796.3, 10977.08, 
-        5486.78, 2544.31, 5573.14, 6069.78, 213.3, 2942.46, 20.78]
-
-    A1 = [20606, 430, 43]
-    B1 = [2.67823, 2.635, 1.59]
-    C1 = [6283.07585, 12566.152, 3.52]
-
-    A2 = [872, 29]
-    B2 = [1.073, 0.44]
-    C2 = [6283.07585, 12566.15]
-
-    A3 = 29
-    B3 = 5.84
-    C3 = 6283.07585
+    jd = np.asarray(jd, dtype=np.float64)
 
     # Number of millennia since 2000
-    T = (jd - 2451545.0)/365250.0
+    T = ((jd - 2451545.0)/365250.0).reshape(-1, 1)
 
     # Mean solar longitude
-    L0 = 4.8950627 + 6283.07585*T - 0.0000099*T**2
+    L0 = 4.8950627 + 6283.07585*T[:, 0] - 0.0000099*T[:, 0]**2
 
     # Wrap L0 to [0, 2pi] range
     L0 = L0%(2*np.pi)
 
-    # Periodical terms
-    S0 = np.sum([A0[i]*np.cos((B0[i] + C0[i]*T)%(2*np.pi)) for i in range(28)])
-    S1 = np.sum([A1[i]*np.cos((B1[i] + C1[i]*T)%(2*np.pi)) for i in range(3)])
-    S2 = np.sum([A2[i]*np.cos((B2[i] + C2[i]*T)%(2*np.pi)) for i in range(2)])
-    S3 = A3*np.cos((B3 + C3*T)%(2*np.pi))
+    # Periodical terms, multiplied by the appropriate power of time
+    S = np.sum(STEYAERT_A*(T**STEYAERT_POWER)*np.cos(STEYAERT_B + STEYAERT_C*T), axis=1)
 
     # Solar longitude of J2000.0
-    L = L0 + (S0 + S1*T + S2*T**2 + S3*T**3)*1e-7
+    L = L0 + S*1e-7
 
     # Bound to solar longitude to the [0, 2pi] range
     L = L%(2*np.pi)
 
-    return L
+    # Return a float for scalar inputs
+    if jd.ndim == 0:
+        return float(L[0])
+
+    return L.reshape(jd.shape)
 
 
 
@@ -1327,84 +1359,202 @@ def jd2SolLonJPL(jd):
     Source: From VSOP87B.ear, ftp://ftp.imcce.fr/pub/ephem/planets/vsop87/
 
     Arguments:
-        jd: [float] julian date
+        jd: [float or ndarray] julian date, or an array of Julian dates
 
     Return:
-        [float] solar longitude in radians, J2000.0 epoch
+        [float or ndarray] solar longitude in radians, J2000.0 epoch
 
     """
 
-    # Load the JPL ephemerids data
-    jpl_ephem_data = SPK.open(config.jpl_ephem_file)
+    # Load the JPL ephemerids data (the file is opened only once per process)
+    jpl_ephem_data = loadJPLEphem()
 
     # Get the position of the Earth (km) and its velocity (km/s) at the given Julian date (J2000 epoch),
     # relative to the centre of mass of the Sun
     earth_pos, earth_vel = calcEarthRectangularCoordJPL(jd, jpl_ephem_data, sun_centre_origin=True)
 
     # Calculate the solar longitude
-    la_sun = np.arctan2(earth_pos[1], earth_pos[0]) + np.pi
+    la_sun = np.arctan2(earth_pos[..., 1], earth_pos[..., 0]) + np.pi
     la_sun = la_sun%(2*np.pi)
 
     return la_sun
 
-jd2SolLonJPL_vect = np.vectorize(jd2SolLonJPL)
 
+def jd2SolLonJPL_vect(jd):
+    """ Vectorized version of jd2SolLonJPL. All Julian dates are evaluated in a single ephemeris call. """
 
-def _solLon2jd(solFunc, year, month, L):
-    """ Internal function. Numerically calculates the Julian date from the given solar longitude with the
-        given method. The inverse precision is around 0.5 milliseconds.
+    jd = np.asarray(jd, dtype=np.float64)
+
+    return jd2SolLonJPL(jd.ravel()).reshape(jd.shape)
 
-        Because the solar longitudes around Dec 31 and Jan 1 can be ambigous, the month also has to be given.
+
+def _solLonRateVSOP(jd):
+    """ Internal function. Calculate the rate of change of the VSOP87 solar longitude by analytically 
+        differentiating the VSOP87 series.
 
     Arguments:
-        solFunc: [function] Function which calculates solar longitudes from Julian dates.
-        year: [int] Year of the event.
-        month: [int] Month of the event.
-        L: [float] Solar longitude (radians), J2000 epoch.
+        jd: [ndarray] Julian dates.
 
     Return:
-        JD: [float] Julian date.
+        [ndarray] Rate of change of the solar longitude (radians per day).
+    """
+
+    jd = np.asarray(jd, dtype=np.float64)
+
+    # Number of millennia since 2000
+    T = ((jd - 2451545.0)/365250.0).reshape(-1, 1)
+
+    arg = VSOP_B + VSOP_C*T
+
+    # d/dT (A*T^n*cos(B + C*T)) = A*(n*T^(n - 1)*cos(B + C*T) - C*T^n*sin(B + C*T))
+    dL_dT = np.sum(VSOP_A*(VSOP_POWER*(T**np.maximum(VSOP_POWER - 1, 0))*np.cos(arg) \
+        - VSOP_C*(T**VSOP_POWER)*np.sin(arg)), axis=1)
+
+    return (dL_dT/365250.0).reshape(jd.shape)
+
+
+
+def _solLonRateSteyaert(jd):
+    """ Internal function. Calculate the rate of change of the Steyaert solar longitude by analytically 
+        differentiating the Steyaert series.
 
+    Arguments:
+        jd: [ndarray] Julian dates.
+
+    Return:
+        [ndarray] Rate of change of the solar longitude (radians per day).
+    """
+
+    jd = np.asarray(jd, dtype=np.float64)
+
+    # Number of millennia since 2000
+    T = ((jd - 2451545.0)/365250.0).reshape(-1, 1)
+
+    arg = STEYAERT_B + STEYAERT_C*T
+
+    # Derivative of the mean solar longitude
+    dL0_dT = 6283.07585 - 2*0.0000099*T[:, 0]
+
+    # Derivative of the periodical terms
+    dS_dT = np.sum(STEYAERT_A*(STEYAERT_POWER*(T**np.maximum(STEYAERT_POWER - 1, 0))*np.cos(arg) \
+        - STEYAERT_C*(T**STEYAERT_POWER)*np.sin(arg)), axis=1)
+
+    return ((dL0_dT + dS_dT*1e-7)/365250.0).reshape(jd.shape)
+
+
+
+def _solLonRateJPL(jd):
+    """ Internal function. Calculate the rate of change of the JPL solar longitude from the velocity of the 
+        Earth.
+
+    Arguments:
+        jd: [ndarray] Julian dates.
+
+    Return:
+        [ndarray] Rate of change of the solar longitude (radians per day).
+    """
+
+    jd = np.asarray(jd, dtype=np.float64)
+
+    earth_pos, earth_vel = calcEarthRectangularCoordJPL(jd, loadJPLEphem(), sun_centre_origin=True)
+
+    x, y = earth_pos[..., 0], earth_pos[..., 1]
+    vx, vy = earth_vel[..., 0], earth_vel[..., 1]
+
+    # Angular velocity in the ecliptic plane, converted from rad/s to rad/day
+    return 86400.0*(x*vy - y*vx)/(x**2 + y**2)
+
+
+
+# Mean rate of change of the solar longitude (radians per day), used as the initial guess
+SOL_LON_MEAN_RATE = 2*np.pi/365.2422
+
+# Analytical derivatives of the forward solar longitude functions
+SOL_LON_RATE_FUNCS = {
+    jd2SolLonVSOP: _solLonRateVSOP,
+    jd2SolLonSteyaert: _solLonRateSteyaert,
+    jd2SolLonJPL: _solLonRateJPL
+}
+
+
+def _monthMiddleJD(year, month):
+    """ Internal function. Calculate the Julian dates of the middle of the given months. 
+    
+    Arguments:
+        year: [ndarray] Years.
+        month: [ndarray] Months.
+
+    Return:
+        [ndarray] Julian dates of the 15th day of the month, 00:00 UT.
     """
 
-    def _previousMonth(year, month):
-        """ Internal function. Calculates the previous month. """
+    jd_mid = np.empty(year.shape, dtype=np.float64)
+
+    # Only compute the Julian date once per unique month
+    year_month = np.stack([year.ravel(), month.ravel()], axis=1).astype(np.int64)
+    unique_ym, inverse = np.unique(year_month, axis=0, return_inverse=True)
+    unique_jd = np.array([date2JD(y, m, 15, 0, 0, 0) for y, m in unique_ym])
+
+    jd_mid.ravel()[:] = unique_jd[inverse.ravel()]
+
+    return jd_mid
 
-        dt = datetime.datetime(year, month, 1, 0, 0, 0)
 
-        # Get some day in the next month
-        next_month = dt.replace(day=1) - datetime.timedelta(days=4)
 
-        return next_month.year, next_month.month
+def _solLon2jd(solFunc, year, month, L, tol=1e-9, max_iter=20):
+    """ Internal function. Numerically calculates the Julian date from the given solar longitude with the
+        given method. Newton's method on the analytical derivative of the solar longitude is used, and all
+        given solar longitudes are inverted at once. The inverse precision is around 0.1 milliseconds.
+
+        Because the solar longitudes around Dec 31 and Jan 1 can be ambigous, the month also has to be given.
+
+    Arguments:
+        solFunc: [function] Function which calculates solar longitudes from Julian dates.
+        year: [int or ndarray] Year of the event.
+        month: [int or ndarray] Month of the event.
+        L: [float or ndarray] Solar longitude (radians), J2000 epoch.
+
+    Keyword arguments:
+        tol: [float] Convergence tolerance in days. 1e-9 by default.
+        max_iter: [int] Maximum number of Newton iterations. 20 by default.
+
+    Return:
+        JD: [float or ndarray] Julian date. An array is returned if any of the inputs is an array.
+
+    """
+
+    scalar_input = np.ndim(year) == 0 and np.ndim(month) == 0 and np.ndim(L) == 0
 
+    year, month, L = np.broadcast_arrays(np.asarray(year), np.asarray(month), \
+        np.asarray(L, dtype=np.float64))
 
-    def _nextMonth(year, month):
-        """ Internal function. Calculates the next month. """
+    if L.size == 0:
+        return np.zeros(L.shape)
 
-        dt = datetime.datetime(year, month, 1, 0, 0, 0)
+    # Use the mean rate of solar longitude if the function has no known analytical derivative
+    rateFunc = SOL_LON_RATE_FUNCS.get(solFunc, lambda jd: np.full(np.shape(jd), SOL_LON_MEAN_RATE))
 
-        # Get some day in the next month
-        next_month = dt.replace(day=28) + datetime.timedelta(days=4)
+    # Start in the middle of the given month and jump to the nearest date with the given solar longitude
+    jd = _monthMiddleJD(year, month).ravel()
+    L = L.ravel()
 
-        return next_month.year, next_month.month
+    for _ in range(max_iter):
 
+        # Difference between the target and the current solar longitude, wrapped to [-pi, pi)
+        sol_diff = (L - solFunc(jd) + np.pi)%(2*np.pi) - np.pi
 
-    # Calculate the upper and lower bounds for the Julian date using the given year
-    prev_year, prev_month = _previousMonth(year, month)
-    jd_min = date2JD(prev_year, prev_month, 1, 0, 0, 0)
+        # Newton step
+        jd_step = sol_diff/rateFunc(jd)
+        jd = jd + jd_step
 
-    next_year, next_month = _nextMonth(year, month)
-    jd_max = date2JD(next_year, next_month, 28, 23, 59, 59)
+        if np.max(np.abs(jd_step)) < tol:
+            break
 
-    # Function which returns the difference between the given JD and solar longitude that is being matched
-    sol_res_func = lambda jd, sol_lon: (np.sin(sol_lon) - np.sin(solFunc(jd)))**2 + (np.cos(sol_lon) \
-        - np.cos(solFunc(jd)))**2
 
-    # Find the Julian date corresponding to the given solar longitude
-    res = scipy.optimize.minimize(sol_res_func, x0=[(jd_min + jd_max)/2], args=(L), \
-        bounds=[(jd_min, jd_max)], tol=1e-13)
+    if scalar_input:
+        return float(jd[0])
 
-    return res.x[0]
+    return jd.reshape(year.shape)
 
 
 
@@ -1412,12 +1562,13 @@ def solLon2jdVSOP(*args):
     """ Convert the given solar longitude (J2000) to Julian date, J2000.0 epoch using VSOP84.
     
     Arguments:
-        year: [int] Year of the event.
-        month: [int] Month of the event.
-        L: [float] Solar longitude (radians), J2000 epoch.
+        year: [int or ndarray] Year of the event.
+        month: [int or ndarray] Month of the event.
+        L: [float or ndarray] Solar longitude (radians), J2000 epoch. Arrays of years, months and solar 
+            longitudes are broadcast against each other and converted at once.
 
     Return:
-        JD: [float] Julian date.
+        JD: [float or ndarray] Julian date.
 
     """
 
@@ -1429,12 +1580,13 @@ def solLon2jdSteyaert(*args):
     """ Convert the given solar longitude (J2000) to Julian date, J2000.0 epoch. Chris Steyaert method. 
     
     Arguments:
-        year: [int] Year of the event.
-        month: [int] Month of the event.
-        L: [float] Solar longitude (radians), J2000 epoch.
+        year: [int or ndarray] Year of the event.
+        month: [int or ndarray] Month of the event.
+        L: [float or ndarray] Solar longitude (radians), J2000 epoch. Arrays of years, months and solar 
+            longitudes are broadcast against each other and converted at once.
 
     Return:
-        JD: [float] Julian date.
+        JD: [float or ndarray] Julian date.
 
     """
 
@@ -1446,12 +1598,13 @@ def solLon2jdJPL(*args):
     """ Convert the given solar longitude (J2000) to Julian date, J2000.0 epoch using DE430 JPL ephemerids.
     
     Arguments:
-        year: [int] Year of the event.
-        month: [int] Month of the event.
-        L: [float] Solar longitude (radians), J2000 epoch.
+        year: [int or ndarray] Year of the event.
+        month: [int or ndarray] Month of the event.
+        L: [float or ndarray] Solar longitude (radians), J2000 epoch. Arrays of years, months and solar 
+            longitudes are broadcast against each other and converted at once.
 
     Return:
-        JD: [float] Julian date.
+        JD: [float or ndarray] Julian date.
 
     """
 
@@ -21,6 +21,10 @@
 # THE SOFTWARE.
 
 import os
+import time
+import queue
+import atexit
+import threading
 import paramiko
 import logging
 import glob
@@ -33,80 +37,599 @@ from wmpl.Utils.Pickling import loadPickle
 log = logging.getLogger("traj_correlator")
 
 
-def collectRemoteTrajectories(remotehost, max_trajs, output_dir):
+# Interval of the SSH keepalive packets which keep idle sessions open (seconds)
+SFTP_KEEPALIVE_INTERVAL = 30
+
+# Number of attempts of a remote operation. The session is reconnected between attempts
+SFTP_RETRIES = 3
+
+# Wait between the attempts to reconnect (seconds)
+SFTP_RETRY_DELAY = 5
+
+# Maximum number of trajectories uploaded in one batch
+UPLOAD_BATCH_SIZE = 50
+
+# Number of attempts to upload a trajectory in the background before giving up until the next pass
+UPLOAD_MAX_ATTEMPTS = 5
+
+# Number of phase 1 trajectories claimed from the remote host in one request. Workers pull more as they become
+#   free, so the work is spread evenly between them
+REMOTE_CLAIM_BATCH = 1
+
+# Suffix of partially transferred files, they are renamed to the final name when the transfer is verified
+PARTIAL_SUFFIX = '.part'
+
+
+
+class LocalSFTPClient(object):
+    def __init__(self):
+        """ Stand-in for paramiko.SFTPClient which works on the local file system. It is used for remote hosts
+            given as local:/path/to/dataroot, e.g. for testing or when the workers share a file system with
+            the main host.
+        """
+        pass
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def get(self, remotepath, localpath):
+        shutil.copyfile(remotepath, localpath)
+
+    def put(self, localpath, remotepath, confirm=True):
+        shutil.copyfile(localpath, remotepath)
+        return os.stat(remotepath)
+
+    def rename(self, oldpath, newpath):
+        if os.path.exists(newpath):
+            raise IOError("Destination file exists: {:s}".format(newpath))
+        os.rename(oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        os.replace(oldpath, newpath)
+
+    def utime(self, path, times):
+        os.utime(path, times)
+
+    def mkdir(self, path):
+        os.mkdir(path)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def close(self):
+        pass
+
+
+
+class SFTPSession(object):
+    def __init__(self, remotehost):
+        """ A persistent SFTP session to a remote host. The session is kept alive with SSH keepalive packets
+            and it is reconnected automatically if the connection drops. The remote operations are run one at
+            a time, so the session can be shared between threads.
+
+        Arguments:
+            remotehost: [str] user@host:port:/path/to/dataroot, user@host:/path/to/dataroot or 
+                local:/path/to/dataroot.
+        """
+
+        self.remotehost = remotehost
+
+        self.ftpcli = None
+        self.sshcli = None
+        self.remote_dir = None
+
+        self.lock = threading.RLock()
+
+
+    def isAlive(self):
+        """ Check if the session is connected. """
+
+        if self.ftpcli is None:
+            return False
+
+        # Local sessions have no SSH connection
+        if self.sshcli is None:
+            return True
+
+        transport = self.sshcli.get_transport()
+
+        return (transport is not None) and transport.is_active()
+
+
+    def connect(self):
+        """ (Re)connect to the remote host.
+
+        Return:
+            [bool] True if connected.
+        """
+
+        self.close()
+
+        ftpcli, remote_dir, sshcli = getSFTPConnection(self.remotehost)
+        if ftpcli is None:
+            return False
+
+        if sshcli is not None:
+            sshcli.get_transport().set_keepalive(SFTP_KEEPALIVE_INTERVAL)
+
+        self.ftpcli, self.remote_dir, self.sshcli = ftpcli, remote_dir, sshcli
+
+        return True
+
+
+    def run(self, func):
+        """ Run the remote operation, reconnecting if the connection is not alive or if it drops during the
+            operation.
+
+        Arguments:
+            func: [function] Function called with the SFTP client and the remote data directory.
+
+        Return:
+            Result of the function, or None if the remote host could not be reached.
+        """
+
+        with self.lock:
+
+            for attempt in range(SFTP_RETRIES):
+
+                if attempt > 0:
+                    time.sleep(SFTP_RETRY_DELAY)
+
+                if not self.isAlive():
+                    if not self.connect():
+                        continue
+
+                try:
+                    return func(self.ftpcli, self.remote_dir)
+
+                except (paramiko.SSHException, EOFError, OSError) as e:
+
+                    # Errors of the operation itself (e.g. a missing file) are not retried
+                    if self.isAlive() and not isinstance(e, (paramiko.SSHException, EOFError)):
+                        raise
+
+                    log.warning('connection to the remote host dropped, reconnecting...')
+                    log.info(e)
+                    self.close()
+
+            log.warning(f'unable to reach {self.remotehost} after {SFTP_RETRIES} attempts')
+
+            return None
+
+
+    def close(self):
+        """ Close the connection. """
+
+        with self.lock:
+
+            if self.ftpcli is not None:
+                try:
+                    self.ftpcli.close()
+                except Exception:
+                    pass
+
+            if self.sshcli is not None:
+                self.sshcli.close()
+
+            self.ftpcli = None
+            self.sshcli = None
+
+
+
+# Persistent sessions, one per remote host
+_sftp_sessions = {}
+
+def getSFTPSession(remotehost):
+    """ Return the persistent SFTP session to the given remote host. The session is created on the first call
+        and closed when the program exits.
+    """
+
+    if remotehost not in _sftp_sessions:
+        _sftp_sessions[remotehost] = SFTPSession(remotehost)
+
+    return _sftp_sessions[remotehost]
+
+
+
+def _remotePath(*args):
+    """ Join the remote path. NB: do NOT use os.path.join alone, as it will break on Windows. """
+
+    return os.path.join(*args).replace('\\','/')
+
+
+
+def _verifySize(ftpcli, remotepath, localpath):
+    """ Raise an IOError if the sizes of the remote and the local file differ. """
+
+    remote_size = ftpcli.stat(remotepath).st_size
+    local_size = os.path.getsize(localpath)
+
+    if remote_size != local_size:
+        raise IOError(f'size mismatch of {localpath}: {local_size} bytes local, {remote_size} bytes remote')
+
+
+
+def _renameRemote(ftpcli, oldpath, newpath):
+    """ Rename the remote file, replacing the existing file. """
+
+    try:
+        ftpcli.posix_rename(oldpath, newpath)
+
+    # The server does not support POSIX renames
+    except IOError:
+        try:
+            ftpcli.remove(newpath)
+        except IOError:
+            pass
+        ftpcli.rename(oldpath, newpath)
+
+
+
+def collectRemoteTrajectories(remotehost, output_dir, lease_time=6*3600, max_trajs=REMOTE_CLAIM_BATCH):
     """
     Collect trajectory pickles from a remote server for local phase2 (monte-carlo) processing
-    NB: do NOT use os.path.join here, as it will break on Windows
+
+    The remote pickles are claimed by renaming them to _processing, with the modification time set to 
+    the time when the claim expires (lease_time seconds from now), as in the MC job queue of the remote host.
+    Only a few trajectories are claimed per call (one by default), the worker calls this again when it runs
+    out of work. The claimed files are downloaded over the persistent session, and every download is 
+    verified by its size before it is moved to the final location.
+
+    Return:
+        [int] Number of downloaded trajectories.
     """
 
-    ftpcli, remote_dir, sshcli = getSFTPConnection(remotehost) 
-    if ftpcli is None:
-        return 
-    
-    remote_phase1_dir = os.path.join(remote_dir, 'phase1').replace('\\','/')
+    def _collect(ftpcli, remote_dir):
 
-    log.info(f'Looking in {remote_phase1_dir} on remote host for up to {max_trajs} trajectories')
+        remote_phase1_dir = _remotePath(remote_dir, 'phase1')
+
+        log.info(f'Looking in {remote_phase1_dir} on remote host for up to {max_trajs} trajectories')
 
-    try:
         files = ftpcli.listdir(remote_phase1_dir)
-        files = [f for f in files if '.pickle' in f and 'processing' not in f]
-        files = files[:max_trajs]
+        files = sorted([f for f in files if f.endswith('_trajectory.pickle')])
 
-        if len(files) == 0:
-            log.info('no data available at this time')
-            ftpcli.close()
-            sshcli.close()
-            return
-        
+        # Claim the batch of files. Files claimed by other workers in the meantime are skipped
+        claimed = []
         for trajfile in files:
-            fullname = os.path.join(remote_phase1_dir, trajfile).replace('\\','/')
+
+            if len(claimed) >= max_trajs:
+                break
+
+            fullname = _remotePath(remote_phase1_dir, trajfile)
+            try:
+                ftpcli.utime(fullname, (time.time(), time.time() + lease_time))
+                ftpcli.rename(fullname, f'{fullname}_processing')
+            except IOError:
+                continue
+
+            claimed.append(trajfile)
+
+        if len(claimed) == 0:
+            log.info('no data available at this time')
+            return 0
+
+        # Download the claimed files
+        downloaded = 0
+        for trajfile in claimed:
+
+            fullname = _remotePath(remote_phase1_dir, trajfile) + '_processing'
             localname = os.path.join(output_dir, trajfile)
-            ftpcli.get(fullname, localname)
-            ftpcli.rename(fullname, f'{fullname}_processing')
 
-        log.info(f'Obtained {len(files)} trajectories')
+            try:
+                ftpcli.get(fullname, localname + PARTIAL_SUFFIX)
+                _verifySize(ftpcli, fullname, localname + PARTIAL_SUFFIX)
+                os.replace(localname + PARTIAL_SUFFIX, localname)
+                downloaded += 1
+
+            except IOError as e:
+
+                # The claim expires on the remote host and the trajectory will be processed later
+                log.warning(f'Problem with download of {trajfile}')
+                log.info(e)
+                if os.path.isfile(localname + PARTIAL_SUFFIX):
+                    os.remove(localname + PARTIAL_SUFFIX)
+
+        log.info(f'Obtained {downloaded} trajectories')
+
+        return downloaded
 
 
+    try:
+        return getSFTPSession(remotehost).run(_collect)
+
     except Exception as e:
         log.warning('Problem with download')
         log.info(e)
 
-    ftpcli.close()
-    sshcli.close()
+    return 0
 
-    return 
 
 
-def uploadTrajToRemote(remotehost, trajfile, output_dir):
-    """
-    At the end of MC phase, upload the trajectory pickle and report to a remote host for integration
-    into the solved dataset
-    """
+def _uploadTrajFiles(ftpcli, remote_dir, uploads, done=None):
+    """ Upload a batch of trajectory pickles and reports over an open SFTP session. Every file is uploaded
+        under a temporary name, verified by its size and then renamed, so the remote host never sees partial
+        files. The report is uploaded before the pickle, as the pickle signals that the trajectory is done.
+
+    Arguments:
+        ftpcli: [SFTPClient]
+        remote_dir: [str] Remote data directory.
+        uploads: [list] A list of (trajfile, output_dir) entries.
 
-    ftpcli, remote_dir, sshcli = getSFTPConnection(remotehost) 
-    if ftpcli is None:
-        return 
+    Keyword arguments:
+        done: [list] List to which the finished entries are appended as they are uploaded, so the progress is 
+            known if the upload fails midway. None by default, in which case a new list is used.
 
-    remote_phase2_dir = os.path.join(remote_dir, 'remoteuploads').replace('\\','/')
+    Return:
+        [list] Entries which were uploaded or which cannot be uploaded (e.g. the local file is missing).
+    """
+
+    remote_phase2_dir = _remotePath(remote_dir, 'remoteuploads')
     try:
         ftpcli.mkdir(remote_phase2_dir)
     except Exception:
         pass
 
-    localname = os.path.join(output_dir, trajfile)
-    remotename = os.path.join(remote_phase2_dir, trajfile).replace('\\','/')
-    ftpcli.put(localname, remotename)
-    
-    localname = localname.replace('_trajectory.pickle', '_report.txt')
-    remotename = remotename.replace('_trajectory.pickle', '_report.txt')
-    if os.path.isfile(localname):
-        ftpcli.put(localname, remotename)
+    if done is None:
+        done = []
+
+    for trajfile, output_dir in uploads:
+
+        localname = os.path.join(output_dir, trajfile)
+        remotename = _remotePath(remote_phase2_dir, trajfile)
+
+        if not os.path.isfile(localname):
+            log.warning(f'unable to find {localname} for upload')
+            done.append((trajfile, output_dir))
+            continue
+
+        file_pairs = []
+        report_localname = localname.replace('_trajectory.pickle', '_report.txt')
+        if os.path.isfile(report_localname):
+            file_pairs.append((report_localname, remotename.replace('_trajectory.pickle', '_report.txt')))
+        file_pairs.append((localname, remotename))
+
+        for local_path, remote_path in file_pairs:
+            ftpcli.put(local_path, remote_path + PARTIAL_SUFFIX, confirm=True)
+            _verifySize(ftpcli, remote_path + PARTIAL_SUFFIX, local_path)
+            _renameRemote(ftpcli, remote_path + PARTIAL_SUFFIX, remote_path)
+
+        done.append((trajfile, output_dir))
+
+    return done
+
+
+
+def uploadTrajToRemote(remotehost, trajfile, output_dir):
+    """
+    At the end of MC phase, upload the trajectory pickle and report to a remote host for integration
+    into the solved dataset. The upload is done immediately over the persistent session, use 
+    getRemoteUploadQueue to upload in the background.
+    """
+
+    getSFTPSession(remotehost).run(lambda ftpcli, remote_dir: _uploadTrajFiles(ftpcli, remote_dir, 
+        [(trajfile, output_dir)]))
 
-    ftpcli.close()
-    sshcli.close()
     return
 
 
+
+class RemoteUploadQueue(object):
+    def __init__(self, remotehost):
+        """ Uploads trajectory pickles and reports to a remote host in a background thread, so the MC solver
+            doesn't wait on the network. The queued uploads are sent in batches over the persistent session. 
+            If the remote host is not reachable, the uploads are retried up to UPLOAD_MAX_ATTEMPTS times. 
+            Uploads which still fail are set aside (the local files are kept) until requeueGivenUp is called,
+            e.g. in the next pass of the correlator.
+
+        Arguments:
+            remotehost: [str] See SFTPSession.
+        """
+
+        self.session = getSFTPSession(remotehost)
+
+        self.jobs = queue.Queue()
+
+        # Uploads which are queued or being sent
+        self.pending = 0
+        self.pending_cond = threading.Condition()
+
+        # Number of failed attempts of every upload
+        self.attempts = {}
+
+        # Uploads which failed UPLOAD_MAX_ATTEMPTS times
+        self.given_up = []
+
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+
+    def submit(self, trajfile, output_dir):
+        """ Queue the upload of the trajectory pickle and report.
+
+        Arguments:
+            trajfile: [str] Name of the trajectory pickle.
+            output_dir: [str] Local directory with the pickle and the report.
+        """
+
+        with self.pending_cond:
+            self.pending += 1
+
+        self.jobs.put((trajfile, output_dir))
+
+
+    def _worker(self):
+        """ Internal function. Send the queued uploads in batches. """
+
+        while True:
+
+            # Wait for the first upload and take all others which are queued
+            batch = [self.jobs.get()]
+            while len(batch) < UPLOAD_BATCH_SIZE:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Send the uploads taken together with the stop marker before stopping the thread
+            stop = None in batch
+            batch = [entry for entry in batch if entry is not None]
+
+            if batch:
+                self._sendBatch(batch, retry=not stop)
+
+            if stop:
+                return
+
+
+    def _sendBatch(self, batch, retry=True):
+        """ Internal function. Upload the batch, put back the uploads which failed and set aside those which 
+            failed too many times.
+
+        Arguments:
+            batch: [list] A list of (trajfile, output_dir) entries.
+
+        Keyword arguments:
+            retry: [bool] Wait and put the failed uploads back into the queue. True by default.
+        """
+
+        # Entries are added to done as they are uploaded, so only the rest is sent again if the session fails
+        #   and is reconnected, or if the batch is retried later
+        done = []
+        try:
+            self.session.run(lambda ftpcli, remote_dir: _uploadTrajFiles(ftpcli, remote_dir, 
+                [entry for entry in batch if entry not in done], done=done))
+
+        except Exception as e:
+            log.warning('Problem with upload to the remote host')
+            log.info(e)
+
+        requeued = []
+        given_up = []
+        for entry in batch:
+
+            if entry in done:
+                self.attempts.pop(entry, None)
+                continue
+
+            self.attempts[entry] = self.attempts.get(entry, 0) + 1
+
+            if retry and (self.attempts[entry] < UPLOAD_MAX_ATTEMPTS):
+                requeued.append(entry)
+
+            else:
+                trajfile, output_dir = entry
+                log.warning(f'Giving up the upload of {trajfile} after {self.attempts[entry]} attempts, '
+                    f'the files are kept in {output_dir}')
+                self.attempts.pop(entry, None)
+                given_up.append(entry)
+
+        with self.pending_cond:
+            self.given_up += given_up
+            self.pending -= len(done) + len(given_up)
+            self.pending_cond.notify_all()
+
+        if done:
+            log.info(f'uploaded {len(done)} trajectories to the remote host')
+
+        # Wait before retrying the failed uploads
+        if requeued:
+            time.sleep(SFTP_RETRY_DELAY)
+
+            for entry in requeued:
+                self.jobs.put(entry)
+
+
+    def requeueGivenUp(self):
+        """ Put the uploads which failed too many times back into the queue.
+
+        Return:
+            [int] Number of uploads put back.
+        """
+
+        with self.pending_cond:
+            entries, self.given_up = self.given_up, []
+            self.pending += len(entries)
+
+        for entry in entries:
+            self.jobs.put(entry)
+
+        if entries:
+            log.info(f'retrying {len(entries)} uploads to the remote host which failed before')
+
+        return len(entries)
+
+
+    def flushTimeout(self):
+        """ Return the time in which the queued uploads should be sent or given up (seconds), taking into 
+            account the retries of every batch.
+        """
+
+        with self.pending_cond:
+            n_batches = max(1, (self.pending + UPLOAD_BATCH_SIZE - 1)//UPLOAD_BATCH_SIZE)
+
+        return n_batches*UPLOAD_MAX_ATTEMPTS*SFTP_RETRIES*2*SFTP_RETRY_DELAY
+
+
+    def flush(self, timeout=None):
+        """ Wait until all queued uploads are sent.
+
+        Keyword arguments:
+            timeout: [float] Maximum time to wait (seconds). None by default, which waits until done.
+
+        Return:
+            [bool] True if all uploads were sent.
+        """
+
+        with self.pending_cond:
+            return self.pending_cond.wait_for(lambda: self.pending == 0, timeout=timeout)
+
+
+    def close(self, timeout=None):
+        """ Send the queued uploads and stop the background thread. """
+
+        if not self.flush(timeout=timeout):
+            log.warning(f'{self.pending} uploads to the remote host were not sent')
+
+        self.jobs.put(None)
+        self.thread.join(timeout=SFTP_RETRY_DELAY)
+
+
+
+# Background upload queues, one per remote host
+_upload_queues = {}
+
+def getRemoteUploadQueue(remotehost):
+    """ Return the background upload queue of the given remote host. It's created on the first call, and the
+        remaining uploads are sent when the program exits.
+    """
+
+    if remotehost not in _upload_queues:
+        _upload_queues[remotehost] = RemoteUploadQueue(remotehost)
+
+    return _upload_queues[remotehost]
+
+
+
+def closeRemoteConnections(timeout=600):
+    """ Send the remaining background uploads and close all persistent sessions. """
+
+    for upload_queue in _upload_queues.values():
+        upload_queue.close(timeout=timeout)
+
+    _upload_queues.clear()
+
+    for session in _sftp_sessions.values():
+        session.close()
+
+    _sftp_sessions.clear()
+
+
+atexit.register(closeRemoteConnections)
+
+
 def moveRemoteTrajectories(output_dir):
     """
     Move remotely processed pickle files to their target location in the trajectories area,
@@ -133,6 +656,15 @@ def moveRemoteTrajectories(output_dir):
                 shutil.copyfile(processed_traj_file, dst)
                 os.remove(processed_traj_file)
 
+                # Remove the lease token of the MC job queue
+                if os.path.isfile(processed_traj_file + '.lease'):
+                    os.remove(processed_traj_file + '.lease')
+
+            # Remove the MC job queue metadata of the phase1 trajectory
+            metadata_file = os.path.join(output_dir, 'phase1', phase1_name + '_trajectory.pickle.json')
+            if os.path.isfile(metadata_file):
+                os.remove(metadata_file)
+
             phase2_name = traj.longname
             traj_dir = f'{output_dir}/trajectories/{phase2_name[:4]}/{phase2_name[:6]}/{phase2_name[:8]}/{phase2_name}'
             mkdirP(traj_dir)
@@ -155,6 +687,20 @@ def moveRemoteTrajectories(output_dir):
 
 
 def getSFTPConnection(remotehost):
+    """ Open a new SFTP connection to the remote host. Use getSFTPSession to reuse the connection.
+
+    Arguments:
+        remotehost: [str] user@host:port:/path/to/dataroot, user@host:/path/to/dataroot or 
+            local:/path/to/dataroot (local file system, no SSH).
+
+    Return:
+        (ftp_client, remote_data_dir, ssh_client): None for all if the connection failed. ssh_client is None
+            for local hosts.
+    """
+
+    # Local file system stand-in
+    if remotehost.startswith('local:'):
+        return LocalSFTPClient(), remotehost[len('local:'):], None
 
     hostdets = remotehost.split(':')
 